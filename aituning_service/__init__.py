@@ -1,5 +1,13 @@
 """AITuning backend package initializer."""
 
-from .app import create_app
-
 __all__ = ["create_app"]
+
+
+def __getattr__(name: str):
+    # Imported on first use so that ``python -m aituning_service.main`` and
+    # the benchmarks do not pay for Flask before they need it.
+    if name == "create_app":
+        from .app import create_app
+
+        return create_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
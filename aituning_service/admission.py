@@ -0,0 +1,266 @@
+"""
+Admission control for chat requests, in front of the Dify upstream.
+
+Each user token has a token bucket (``rate`` chats per second, ``burst``
+at once); a request over it is refused with 429. At most ``max_streams``
+upstream streams run at once in this process. When all are busy a request
+waits in a short queue, and freed slots go to the queued users in
+round-robin order, so one user's burst cannot starve everyone else. A
+request that finds the queue full, or is still queued after
+``queue_timeout``, is refused at once with 503. Every refusal carries a
+Retry-After estimate. ``max_streams=0`` or ``rate=0`` turns that part off.
+
+The same controller serves both modes: ``admit`` blocks a WSGI thread,
+``admit_async`` awaits on the event loop. Nothing here touches the daily
+quota; callers charge it only after a request has been admitted.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Union
+
+from .metrics import ADMISSION_QUEUE, ADMISSION_SLOTS, ADMISSION_WAIT, ADMISSIONS
+
+RATE_LIMITED_MESSAGE = "请求过于频繁，请稍后再试"
+BUSY_MESSAGE = "服务繁忙，请稍后再试"
+# Bounds for the Retry-After estimate, in seconds.
+_MIN_RETRY_AFTER = 1
+_MAX_RETRY_AFTER = 60
+
+
+@dataclass
+class Rejection:
+    """A refused request: 429 over the user's rate, 503 when shed."""
+
+    status: int
+    retry_after: int
+    outcome: str
+
+    @property
+    def body(self) -> Dict[str, Any]:
+        message = RATE_LIMITED_MESSAGE if self.status == 429 else BUSY_MESSAGE
+        return {"error": message, "retryAfter": self.retry_after}
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(self.retry_after)}
+
+
+class Ticket:
+    """
+    An admitted request's stream slot.
+
+    ``release`` is idempotent. Used as a context manager it releases on
+    exit, unless ``detach`` handed the release to whoever outlives the
+    block (a streamed WSGI response closes after the view returns).
+    """
+
+    __slots__ = ("_controller", "_acquired", "_released", "_detached")
+
+    def __init__(self, controller: Optional["AdmissionController"], acquired: float) -> None:
+        self._controller = controller
+        self._acquired = acquired
+        self._released = False
+        self._detached = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        if self._controller is not None:
+            self._controller._release(time.monotonic() - self._acquired)
+
+    def detach(self) -> Callable[[], None]:
+        self._detached = True
+        return self.release
+
+    def __enter__(self) -> "Ticket":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if not self._detached:
+            self.release()
+
+
+class _Waiter:
+    __slots__ = ("key", "enqueued", "granted", "wake")
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.enqueued = 0.0
+        self.granted = False
+        self.wake: Callable[[], None] = lambda: None
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_streams: int = 16,
+        queue_size: int = 8,
+        queue_timeout: float = 5.0,
+        max_queued_per_user: int = 2,
+        rate: float = 0.0,
+        burst: int = 3,
+        max_buckets: int = 10000,
+    ) -> None:
+        self.max_streams = max_streams
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.max_queued_per_user = max_queued_per_user
+        self.rate = rate
+        self.burst = burst
+        self._max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._active = 0
+        # Queued requests per user; the first key gets the next free slot, then moves to the end.
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._queued = 0
+        # user token -> [tokens, monotonic time of the last refill]; least recently used first.
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        # Moving average of how long a stream holds its slot, for Retry-After.
+        self._hold = 10.0
+
+    def admit(self, key: str) -> Union[Ticket, Rejection]:
+        """Admit ``key`` now, after queueing (blocking this thread), or refuse it."""
+        waiter = _Waiter(key)
+        event = threading.Event()
+        waiter.wake = event.set
+        outcome = self._enter(waiter)
+        if outcome is not waiter:
+            return outcome  # type: ignore[return-value]
+        event.wait(self.queue_timeout)
+        return self._settle(waiter)
+
+    async def admit_async(self, key: str) -> Union[Ticket, Rejection]:
+        """``admit`` for the event loop; a cancelled waiter leaves the queue."""
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future = loop.create_future()
+        waiter = _Waiter(key)
+        waiter.wake = lambda: loop.call_soon_threadsafe(_resolve, future)
+        outcome = self._enter(waiter)
+        if outcome is not waiter:
+            return outcome  # type: ignore[return-value]
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            settled = self._settle(waiter, "cancelled")
+            if isinstance(settled, Ticket):
+                settled.release()
+            raise
+        return self._settle(waiter)
+
+    def _enter(self, waiter: _Waiter) -> Union[Ticket, Rejection, _Waiter]:
+        key = waiter.key
+        with self._lock:
+            now = time.monotonic()
+            wait = self._token_wait(key, now)
+            if wait > 0:
+                return self._reject(429, wait, "rate_limited")
+            if self.max_streams <= 0:
+                self._take_token(key)
+                ADMISSIONS.labels("admitted").inc()
+                return Ticket(None, now)
+            if self._active < self.max_streams and not self._queues:
+                self._take_token(key)
+                self._active += 1
+                ADMISSION_SLOTS.set(self._active)
+                ADMISSIONS.labels("admitted").inc()
+                return Ticket(self, now)
+            queue = self._queues.get(key)
+            if self._queued >= self.queue_size or (queue is not None and len(queue) >= self.max_queued_per_user):
+                # Refused before taking a token: a shed request does not count against the user.
+                return self._reject(503, self._retry_estimate(), "shed")
+            self._take_token(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+            waiter.enqueued = now
+            queue.append(waiter)
+            self._queued += 1
+            ADMISSION_QUEUE.set(self._queued)
+            return waiter
+
+    def _settle(self, waiter: _Waiter, outcome: str = "timed_out") -> Union[Ticket, Rejection]:
+        """After the wait: the ticket if a slot was handed over, else leave the queue."""
+        with self._lock:
+            now = time.monotonic()
+            if waiter.granted:
+                ADMISSION_WAIT.observe(now - waiter.enqueued)
+                ADMISSIONS.labels("queued").inc()
+                return Ticket(self, now)
+            queue = self._queues.get(waiter.key)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[waiter.key]
+                ADMISSION_QUEUE.set(self._queued)
+            return self._reject(503, self._retry_estimate(), outcome)
+
+    def _release(self, held: float) -> None:
+        with self._lock:
+            self._hold += 0.2 * (held - self._hold)
+            waiter = self._next_waiter()
+            if waiter is None:
+                self._active -= 1
+                ADMISSION_SLOTS.set(self._active)
+            else:
+                # The slot passes straight to the waiter; the count is unchanged.
+                waiter.granted = True
+        if waiter is not None:
+            waiter.wake()
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        if not self._queues:
+            return None
+        key, queue = next(iter(self._queues.items()))
+        waiter = queue.popleft()
+        if queue:
+            self._queues.move_to_end(key)
+        else:
+            del self._queues[key]
+        self._queued -= 1
+        ADMISSION_QUEUE.set(self._queued)
+        return waiter
+
+    def _token_wait(self, key: str, now: float) -> float:
+        """Seconds until ``key`` has a token (0 if it has one); refills the bucket."""
+        if self.rate <= 0:
+            return 0.0
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self._max_buckets:
+                # The least recently used bucket is almost surely full again.
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        return 0.0 if bucket[0] >= 1.0 else (1.0 - bucket[0]) / self.rate
+
+    def _take_token(self, key: str) -> None:
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket[0] -= 1.0
+
+    def _retry_estimate(self) -> float:
+        # Time for the streams ahead of a newcomer to free enough slots.
+        return self._hold * (self._queued + 1) / max(1, self.max_streams)
+
+    def _reject(self, status: int, wait: float, outcome: str) -> Rejection:
+        ADMISSIONS.labels(outcome).inc()
+        retry_after = min(_MAX_RETRY_AFTER, max(_MIN_RETRY_AFTER, math.ceil(wait)))
+        return Rejection(status, retry_after, outcome)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,686 @@
+"""
+Asyncio serving mode for the AITuning backend.
+
+``create_async_app`` serves the same chat, products, usage, EQ, health and
+metrics routes as ``app.create_app`` on an aiohttp event loop, so an open
+Dify stream costs a coroutine instead of a WSGI worker thread. Run it with
+``python -m aituning_service.aio_app``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from . import metrics
+from .logs import REQUEST_ID, REQUEST_ID_HEADER, Payload, configure_logging, new_request_id
+from .admission import Rejection
+from .app import (
+    create_admission_controller,
+    create_answer_cache,
+    create_breaker,
+    create_compression_policy,
+    create_huihifi_hedger,
+    create_product_cache,
+    create_product_catalog,
+    create_traffic_capture,
+    create_upload_cache,
+    create_usage_repository,
+    health_report,
+)
+from .capture import TrafficCapture, route_name
+from .compression import COMPRESSIBLE_TYPES, STREAM_BOUNDARIES, CompressionPolicy, StreamWriter, negotiate
+from .config import ALLOWED_ORIGINS, Settings
+from .curve import CurveError, frequency_response_text
+from .routes.products import NDJSON_MIMETYPE, cache_bypassed, ndjson_chunk, ndjson_error, stream_limit
+from .security import check_origin
+from .services import (
+    DifyClientError,
+    DifyTimeoutError,
+    DifyUnavailableError,
+    HuiHiFiClient,
+    HuiHiFiClientError,
+    HuiHiFiCredentialsError,
+    HuiHiFiUnavailableError,
+)
+from .services.answer_cache import Event, answer_key, record_writes
+from .services.dify_async import AsyncDifyClient
+from .services.eq import EQ_AVAILABLE, FilterError, evaluate_request
+from .services.huihifi_async import AsyncHuiHiFiClient
+from .storage import UsageRepository, WriteBehindUsageRepository
+from .streaming import TagEventScanner, error_event, relay_passthrough_async
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+_CORS_ALLOW_HEADERS = "Content-Type, Authorization, X-Requested-With, X-Request-ID"
+_CORS_EXPOSE_HEADERS = "X-Request-ID, Retry-After"
+_SSE_HEADERS = {
+    "Content-Type": "text/event-stream; charset=utf-8",
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+}
+
+
+def _json(body: dict, status: int = 200, headers: Optional[dict] = None) -> web.Response:
+    return web.json_response(
+        body,
+        status=status,
+        headers=headers,
+        dumps=lambda value: json.dumps(value, ensure_ascii=False),
+    )
+
+
+def _apply_cors(request: web.Request, response: web.StreamResponse, allowed_origins: tuple) -> None:
+    # Mirror the Flask-CORS configuration used by the WSGI app.
+    origin = request.headers.get("Origin")
+    if origin in allowed_origins:
+        response.headers["Access-Control-Allow-Origin"] = origin
+        response.headers["Access-Control-Allow-Credentials"] = "true"
+        response.headers["Vary"] = "Origin"
+        if request.method == "OPTIONS":
+            response.headers["Access-Control-Allow-Headers"] = _CORS_ALLOW_HEADERS
+            response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        else:
+            response.headers["Access-Control-Expose-Headers"] = _CORS_EXPOSE_HEADERS
+
+
+def _origin_middleware(allowed_origins: tuple):
+    @web.middleware
+    async def middleware(request: web.Request, handler: Handler) -> web.StreamResponse:
+        if request.method == "OPTIONS":
+            response: web.StreamResponse = web.Response(status=200)
+        else:
+            rejection = check_origin(
+                request.method,
+                request.path,
+                request.headers.get("Origin"),
+                request.headers.get("Referer", ""),
+                allowed_origins,
+            )
+            if rejection is not None:
+                body, status = rejection
+                return _json(body, status)
+            response = await handler(request)
+
+        # Streaming responses are already prepared and got their headers in the handler.
+        if not response.prepared:
+            _apply_cors(request, response, allowed_origins)
+        return response
+
+    return middleware
+
+
+@web.middleware
+async def _request_id_middleware(request: web.Request, handler: Handler) -> web.StreamResponse:
+    """Run the request under an id, like ``logs.bind_flask``; the outermost middleware."""
+    request["request_id"] = new_request_id(request.headers.get(REQUEST_ID_HEADER))
+    token = REQUEST_ID.set(request["request_id"])
+    try:
+        return await handler(request)
+    finally:
+        REQUEST_ID.reset(token)
+
+
+async def _echo_request_id(request: web.Request, response: web.StreamResponse) -> None:
+    # on_response_prepare also reaches streamed responses, before their headers go out.
+    if "request_id" in request:
+        response.headers[REQUEST_ID_HEADER] = request["request_id"]
+
+
+@web.middleware
+async def _metrics_middleware(request: web.Request, handler: Handler) -> web.StreamResponse:
+    """Count and time requests like ``metrics.instrument_flask``; outside everything but the request id."""
+    metrics.HTTP_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as exc:
+        status = exc.status
+        raise
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+        route = request.match_info.route.resource
+        rule = route.canonical if route is not None else "unmatched"
+        metrics.observe_request(rule, request.method, status, time.perf_counter() - started)
+
+
+def _capture_middleware(capture: TrafficCapture):
+    """Capture requests like ``capture.capture_flask``; ``ms`` covers the whole handler, streams included."""
+
+    @web.middleware
+    async def middleware(request: web.Request, handler: Handler) -> web.StreamResponse:
+        route = route_name(request.path)
+        if route is None or not capture.sampled():
+            return await handler(request)
+        started = time.perf_counter()
+        response = await handler(request)
+        elapsed = time.perf_counter() - started
+        payload = None
+        if route != "usage" and request.body_exists:
+            try:
+                # The handler has read the body already; this decodes the cached bytes.
+                payload = await request.json()
+            except ValueError:
+                payload = None
+        if isinstance(response, web.Response) and isinstance(response.body, bytes):
+            response_bytes: Optional[int] = len(response.body)
+        else:
+            response_bytes = response.body_length if response.prepared else None
+        capture.record(
+            route,
+            response.status,
+            elapsed,
+            request.content_length,
+            response_bytes,
+            payload,
+            request.match_info.get("user_token") if route == "usage" else None,
+        )
+        return response
+
+    return middleware
+
+
+def _add_vary(response: web.StreamResponse, header: str) -> None:
+    vary = response.headers.get("Vary")
+    response.headers["Vary"] = f"{vary}, {header}" if vary else header
+
+
+def _compression_middleware(policy: CompressionPolicy):
+    """Compress whole JSON and text bodies like ``compression.compress_flask``; streams go through ``_open_stream``."""
+
+    @web.middleware
+    async def middleware(request: web.Request, handler: Handler) -> web.StreamResponse:
+        response = await handler(request)
+        if (
+            not isinstance(response, web.Response)
+            or response.prepared
+            or response.content_type not in COMPRESSIBLE_TYPES
+        ):
+            return response
+        _add_vary(response, "Accept-Encoding")
+        body = response.body
+        if (
+            request.method == "HEAD"
+            or response.status in (204, 304)
+            or "Content-Encoding" in response.headers
+            or not isinstance(body, bytes)
+            or len(body) < policy.min_size
+        ):
+            return response
+        encoding = negotiate(request.headers.get("Accept-Encoding"))
+        if encoding is not None:
+            response.body = policy.compress(body, encoding)
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+    return middleware
+
+
+async def _open_stream(
+    request: web.Request, response: web.StreamResponse, policy: Optional[CompressionPolicy]
+) -> StreamWriter:
+    """Prepare a streamed response, compressed when the client accepts it; write through the result."""
+    compressor = None
+    mimetype = response.content_type
+    if policy is not None and mimetype in STREAM_BOUNDARIES:
+        _add_vary(response, "Accept-Encoding")
+        encoding = negotiate(request.headers.get("Accept-Encoding"), stream=True)
+        if encoding is not None:
+            compressor = policy.stream_compressor(encoding, mimetype)
+            response.headers["Content-Encoding"] = encoding
+    await response.prepare(request)
+    return StreamWriter(response.write, compressor)
+
+
+async def _relay_lines(
+    content: aiohttp.StreamReader, write: Callable[[bytes], Awaitable[None]], tag_events: bool = False
+) -> None:
+    """Re-frame the upstream stream line by line, like ``streaming.relay_lines``."""
+    scanner = TagEventScanner() if tag_events else None
+    try:
+        async for raw_line in content:
+            line = raw_line.rstrip(b"\r\n")
+            if not line:
+                out = b"\n"
+            elif line.startswith(b"data: "):
+                out = line + b"\n\n"
+            else:
+                out = line + b"\n"
+            await write(scanner.scan(out) if scanner is not None else out)
+    except (ConnectionResetError, asyncio.CancelledError):
+        raise
+    except Exception as exc:  # pragma: no cover - defensive fallback
+        logger.error("流式响应转发失败: %s", exc)
+        await write(error_event(exc))
+
+
+class _UsageGate:
+    """Run quota operations without blocking the event loop on SQLite."""
+
+    def __init__(self, usage_repo: UsageRepository) -> None:
+        self.repo = usage_repo
+        # The write-behind and shared-memory backends never touch disk on the request path.
+        self._inline = isinstance(usage_repo, WriteBehindUsageRepository)
+
+    async def call(self, method: Callable, *args):
+        if self._inline:
+            return method(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+
+def create_async_app(settings: Optional[Settings] = None) -> web.Application:
+    settings = settings or Settings()
+    settings.validate()
+    configure_logging(settings)
+
+    usage_repo = create_usage_repository(settings)
+    usage_repo.init_database()
+    usage = _UsageGate(usage_repo)
+    admission = create_admission_controller(settings)
+    compression_policy = create_compression_policy(settings)
+    answer_cache = create_answer_cache(settings)
+    cache_variant = "tag-events" if settings.chat_tag_events else ""
+    allowed_origins = tuple(ALLOWED_ORIGINS)
+
+    dify_client = AsyncDifyClient(
+        settings.dify_base_url,
+        settings.dify_api_key,
+        connect_timeout=settings.dify_connect_timeout,
+        first_byte_timeout=settings.dify_first_byte_timeout,
+        read_timeout=settings.dify_read_timeout,
+        upload_timeout=settings.dify_upload_timeout,
+        upload_cache=create_upload_cache(settings),
+        breaker=create_breaker("dify", settings),
+    )
+    huihifi_sync = HuiHiFiClient(
+        base_url=settings.huihifi_api_base_url,
+        app_key=settings.huihifi_app_key,
+        secret_key=settings.huihifi_secret_key,
+        timeout=settings.huihifi_api_timeout,
+        max_page_size=settings.huihifi_max_page_size,
+        connect_timeout=settings.huihifi_connect_timeout,
+        max_retries=settings.huihifi_max_retries,
+        pool_size=settings.huihifi_pool_size,
+        page_concurrency=settings.huihifi_page_concurrency,
+        page_param=settings.huihifi_page_param,
+        breaker=create_breaker("huihifi", settings),
+        hedger=create_huihifi_hedger(settings),
+    )
+    huihifi_client = AsyncHuiHiFiClient(huihifi_sync)
+    # The TTL cache is thread-based, as in the WSGI app: lookups, and the upstream call on a miss,
+    # run in a worker thread through the wrapped synchronous client.
+    product_cache = create_product_cache(settings, huihifi_sync)
+    # The catalog syncs in its own thread; lookups are in-memory and safe on the loop.
+    product_catalog = create_product_catalog(settings, huihifi_sync)
+
+    def quota_exhausted() -> web.Response:
+        return _json({"error": "今日使用次数已达上限", "remaining": 0, "limit": usage_repo.daily_limit}, 429)
+
+    async def replay_answer(request: web.Request, user_token: str, events: List[Event]) -> web.StreamResponse:
+        ticket = await admission.admit_async(user_token)
+        if isinstance(ticket, Rejection):
+            return _json(ticket.body, ticket.status, headers=ticket.headers)
+        with ticket:
+            if settings.answer_cache_charge_quota and not await usage.call(usage_repo.try_consume, user_token):
+                return quota_exhausted()
+            response = web.StreamResponse(headers=dict(_SSE_HEADERS, **{"X-Cache": "HIT"}))
+            _apply_cors(request, response, allowed_origins)
+            writer = await _open_stream(request, response, compression_policy)
+            async for data in answer_cache.replay_async(events):
+                await writer.write(data)
+            await writer.finish()
+            await response.write_eof()
+            return response
+
+    async def chat(request: web.Request) -> web.StreamResponse:
+        started = time.perf_counter()
+        if not dify_client.is_configured:
+            return _json({"error": "AI服务未配置"}, 503)
+
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        data = data if isinstance(data, dict) else {}
+        user_token: Optional[str] = data.get("userToken")
+        message: Optional[str] = data.get("message")
+        current_filters: str = data.get("currentFilters", "")
+        curve_image_base64: Optional[str] = data.get("curveImageBase64")
+        conversation_id: Optional[str] = data.get("conversationId")
+        frequency_response = data.get("frequencyResponse")
+
+        if not user_token:
+            return _json({"error": "缺少用户token"}, 400)
+        if not message:
+            return _json({"error": "缺少消息内容"}, 400)
+
+        # About a millisecond for a few thousand points, so it runs on the loop.
+        curve_text: Optional[str] = None
+        if frequency_response is not None:
+            try:
+                curve_text = frequency_response_text(frequency_response, settings.chat_curve_points)
+            except CurveError as exc:
+                return _json({"error": str(exc)}, 400)
+            curve_image_base64 = None
+
+        cache_key: Optional[bytes] = None
+        if answer_cache is not None and not conversation_id:
+            cache_key = answer_key(message, current_filters, curve_image_base64, curve_text, cache_variant)
+            events = await asyncio.get_running_loop().run_in_executor(None, answer_cache.get, cache_key)
+            if events is not None:
+                return await replay_answer(request, user_token, events)
+
+        # As in the WSGI route: fail fast while Dify's breaker is open, admit, then spend upstream work and quota.
+        retry_after = dify_client.breaker.retry_after()
+        if retry_after:
+            unavailable = DifyUnavailableError(retry_after)
+            return _json(
+                {"error": str(unavailable), "retryAfter": retry_after}, 503, headers={"Retry-After": str(retry_after)}
+            )
+        ticket = await admission.admit_async(user_token)
+        if isinstance(ticket, Rejection):
+            return _json(ticket.body, ticket.status, headers=ticket.headers)
+
+        with ticket:
+            # Reuse an unchanged curve's file, otherwise upload while quota is charged.
+            cached_file_id: Optional[str] = None
+            upload: Optional[asyncio.Task] = None
+            if curve_image_base64:
+                cached_file_id = dify_client.cached_upload(curve_image_base64, user_token)
+                if cached_file_id is None:
+                    upload = asyncio.create_task(dify_client.upload_image(curve_image_base64, user_token))
+
+            if not await usage.call(usage_repo.try_consume, user_token):
+                if upload is not None:
+                    upload.cancel()
+                return quota_exhausted()
+
+            image_file_id = cached_file_id
+            if upload is not None:
+                image_file_id = await upload
+                if not image_file_id:
+                    await usage.call(usage_repo.release, user_token)
+                    return _json({"error": "图片上传失败"}, 500)
+
+            async def open_stream(file_id: Optional[str]) -> aiohttp.ClientResponse:
+                return await dify_client.stream_chat(
+                    query=message,
+                    current_filters=current_filters,
+                    user_token=user_token,
+                    conversation_id=conversation_id,
+                    image_file_id=file_id,
+                    frequency_response=curve_text,
+                )
+
+            try:
+                dify_response = await open_stream(image_file_id)
+                if cached_file_id and dify_response.status in (400, 404):
+                    logger.warning("缓存的 Dify 图片已失效，重新上传: %s", cached_file_id)
+                    dify_response.release()
+                    dify_client.forget_upload(curve_image_base64, user_token)
+                    image_file_id = await dify_client.upload_image(curve_image_base64, user_token)
+                    if not image_file_id:
+                        await usage.call(usage_repo.release, user_token)
+                        return _json({"error": "图片上传失败"}, 500)
+                    dify_response = await open_stream(image_file_id)
+            except RuntimeError as exc:
+                return _json({"error": str(exc)}, 503)
+            except DifyUnavailableError as exc:
+                await usage.call(usage_repo.release, user_token)
+                return _json(
+                    {"error": str(exc), "retryAfter": exc.retry_after}, 503, headers={"Retry-After": str(exc.retry_after)}
+                )
+            except DifyTimeoutError:
+                await usage.call(usage_repo.release, user_token)
+                return _json({"error": "AI服务响应超时"}, 504)
+            except DifyClientError as exc:
+                logger.error("Dify API调用失败: %s", exc)
+                await usage.call(usage_repo.release, user_token)
+                return _json({"error": "AI服务调用失败"}, 502)
+
+            async with dify_response:
+                if dify_response.status != 200:
+                    logger.error(
+                        "Dify API调用失败",
+                        extra={"status": dify_response.status, "body": Payload(await dify_response.text())},
+                    )
+                    return _json({"error": "AI服务调用失败"}, 500)
+
+                response = web.StreamResponse(headers=_SSE_HEADERS)
+                _apply_cors(request, response, allowed_origins)
+                writer = await _open_stream(request, response, compression_policy)
+                write = writer.write
+                recorder = answer_cache.recorder(cache_key) if cache_key is not None else None
+                if recorder is not None:
+                    write = record_writes(write, recorder)
+                if settings.chat_relay_mode == "lines":
+                    await _relay_lines(dify_response.content, write, settings.chat_tag_events)
+                else:
+                    await relay_passthrough_async(
+                        dify_response.content,
+                        write,
+                        heartbeat_interval=settings.chat_heartbeat_interval,
+                        started=started,
+                        tag_events=settings.chat_tag_events,
+                    )
+                await writer.finish()
+                await response.write_eof()
+                if recorder is not None:
+                    await asyncio.get_running_loop().run_in_executor(None, recorder.commit)
+                return response
+
+    async def search_products(request: web.Request) -> web.Response:
+        try:
+            payload = await request.json()
+        except ValueError:
+            payload = {}
+        payload = payload or {}
+        if not isinstance(payload, dict):
+            return _json({"code": 1000, "message": "请求体必须为 JSON 对象", "data": None}, 400)
+
+        keyword_raw = payload.get("keyword")
+        keyword = "" if keyword_raw is None else str(keyword_raw)
+
+        try:
+            page_size = int(payload.get("pageSize", 20))
+        except (TypeError, ValueError):
+            return _json({"code": 1000, "message": "pageSize 必须是整数", "data": None}, 400)
+
+        if page_size < 1 or page_size > huihifi_client.max_page_size:
+            return _json(
+                {"code": 1000, "message": f"pageSize 必须在 1 到 {huihifi_client.max_page_size} 之间", "data": None},
+                400,
+            )
+
+        bypass_cache = cache_bypassed(payload.get("noCache"), request.headers.get("Cache-Control", ""))
+        if product_catalog is not None and product_catalog.is_ready and not bypass_cache:
+            data = product_catalog.search_products(keyword.strip(), page_size)
+            return _json({"code": 0, "message": "success", "data": data}, headers={"X-Cache": "CATALOG"})
+
+        credentials_error = {"code": 1003, "message": "服务器配置错误: 未设置 HuiHiFi API 凭证", "data": None}
+        if not huihifi_client.is_configured:
+            return _json(credentials_error, 503)
+
+        try:
+            if product_cache is not None:
+                data, cache_status = await asyncio.to_thread(
+                    product_cache.search_products, keyword.strip(), page_size, bypass=bypass_cache
+                )
+            else:
+                data, cache_status = await huihifi_client.search_products(keyword.strip(), page_size), None
+            headers = {"X-Cache": cache_status} if cache_status else None
+            return _json({"code": 0, "message": "success", "data": data}, headers=headers)
+        except HuiHiFiCredentialsError as exc:
+            logger.error("HuiHiFi 凭证错误: %s", exc)
+            return _json(credentials_error, 503)
+        except HuiHiFiUnavailableError as exc:
+            return _json({"code": 1001, "message": str(exc), "data": None}, 503, {"Retry-After": str(exc.retry_after)})
+        except HuiHiFiClientError as exc:
+            logger.error("HuiHiFi API 调用失败: %s", exc)
+            return _json({"code": 1001, "message": str(exc), "data": None}, 502)
+        except Exception as exc:  # pragma: no cover - defensive
+            logger.exception("产品搜索接口内部错误")
+            return _json({"code": 1003, "message": f"服务器内部错误: {exc}", "data": None}, 500)
+
+    async def stream_products(request: web.Request) -> web.StreamResponse:
+        keyword = request.query.get("keyword", "").strip()
+        limit = stream_limit(request.query.get("limit"))
+        if limit is None:
+            return _json({"code": 1000, "message": "limit 必须是非负整数", "data": None}, 400)
+
+        bypass_cache = cache_bypassed(request.query.get("noCache"), request.headers.get("Cache-Control", ""))
+        if product_catalog is not None and product_catalog.is_ready and not bypass_cache:
+            products = product_catalog.search_products(keyword, limit or len(product_catalog))["products"]
+            return web.Response(
+                body=ndjson_chunk(products), content_type=NDJSON_MIMETYPE, headers={"X-Cache": "CATALOG"}
+            )
+
+        credentials_error = {"code": 1003, "message": "服务器配置错误: 未设置 HuiHiFi API 凭证", "data": None}
+        if not huihifi_client.is_configured:
+            return _json(credentials_error, 503)
+
+        # As in the WSGI route, the status waits for the first page.
+        pages = huihifi_client.iter_pages(keyword)
+        try:
+            try:
+                page = await pages.__anext__()
+            except StopAsyncIteration:
+                page = []
+            except HuiHiFiCredentialsError as exc:
+                logger.error("HuiHiFi 凭证错误: %s", exc)
+                return _json(credentials_error, 503)
+            except HuiHiFiUnavailableError as exc:
+                return _json(
+                    {"code": 1001, "message": str(exc), "data": None}, 503, {"Retry-After": str(exc.retry_after)}
+                )
+            except HuiHiFiClientError as exc:
+                logger.error("HuiHiFi API 调用失败: %s", exc)
+                return _json({"code": 1001, "message": str(exc), "data": None}, 502)
+
+            response = web.StreamResponse(headers={"Content-Type": NDJSON_MIMETYPE, "Cache-Control": "no-cache"})
+            _apply_cors(request, response, allowed_origins)
+            writer = await _open_stream(request, response, compression_policy)
+            remaining = limit or None
+            try:
+                while True:
+                    if remaining is not None:
+                        page = page[:remaining]
+                        remaining -= len(page)
+                    if page:
+                        await writer.write(ndjson_chunk(page))
+                    if remaining == 0:
+                        break
+                    try:
+                        page = await pages.__anext__()
+                    except StopAsyncIteration:
+                        break
+            except HuiHiFiClientError as exc:
+                logger.error("HuiHiFi 分页拉取中断: %s", exc)
+                await writer.write(ndjson_error(exc))
+            await writer.finish()
+            await response.write_eof()
+            return response
+        finally:
+            # Cancels the page fetches still in flight.
+            await pages.aclose()
+
+    async def product_cache_stats(request: web.Request) -> web.Response:
+        if product_cache is None:
+            return _json({"code": 0, "message": "success", "data": {"enabled": False}})
+        return _json({"code": 0, "message": "success", "data": {"enabled": True, **product_cache.stats()}})
+
+    async def get_usage(request: web.Request) -> web.Response:
+        user_token = request.match_info["user_token"]
+        try:
+            used = await usage.call(usage_repo.get_usage, user_token)
+            remaining = await usage.call(usage_repo.remaining_quota, user_token)
+            return _json({"used": used, "remaining": remaining, "limit": usage_repo.daily_limit})
+        except Exception as exc:  # pragma: no cover - defensive
+            return _json({"error": str(exc)}, 500)
+
+    async def eq_response(request: web.Request) -> web.Response:
+        if not EQ_AVAILABLE:
+            return _json({"error": "EQ 计算服务不可用 (未安装 numpy)"}, 503)
+        try:
+            payload = await request.json()
+        except ValueError:
+            payload = None
+
+        def evaluate() -> str:
+            return json.dumps(evaluate_request(payload), ensure_ascii=False)
+
+        # A large batch takes tens of milliseconds to compute and encode; keep it off the loop.
+        try:
+            body = await asyncio.get_running_loop().run_in_executor(None, evaluate)
+        except FilterError as exc:
+            return _json({"error": str(exc)}, 400)
+        return web.Response(text=body, content_type="application/json")
+
+    async def health_check(request: web.Request) -> web.Response:
+        body, status = health_report({"dify": dify_client.breaker, "huihifi": huihifi_client.breaker}, settings)
+        return _json(body, status)
+
+    async def metrics_endpoint(request: web.Request) -> web.Response:
+        return web.Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    async def on_startup(app: web.Application) -> None:
+        await dify_client.start()
+        await huihifi_client.start()
+
+    async def on_cleanup(app: web.Application) -> None:
+        await dify_client.close()
+        await huihifi_client.close()
+        if product_catalog is not None:
+            product_catalog.stop()
+        if isinstance(usage_repo, WriteBehindUsageRepository):
+            usage_repo.shutdown()
+
+    middlewares = [_request_id_middleware, _metrics_middleware]
+    capture = create_traffic_capture(settings)
+    if capture is not None:
+        middlewares.append(_capture_middleware(capture))
+    if compression_policy is not None:
+        middlewares.append(_compression_middleware(compression_policy))
+    middlewares.append(_origin_middleware(allowed_origins))
+    app = web.Application(middlewares=middlewares)
+    app.on_response_prepare.append(_echo_request_id)
+    app.router.add_post("/api/chat", chat)
+    app.router.add_post("/api/products/search", search_products)
+    app.router.add_get("/api/products/stream", stream_products)
+    app.router.add_get("/api/products/cache/stats", product_cache_stats)
+    app.router.add_get("/api/usage/{user_token}", get_usage)
+    app.router.add_post("/api/eq/response", eq_response)
+    app.router.add_get("/health", health_check)
+    app.router.add_get("/metrics", metrics_endpoint)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="以 asyncio 模式启动 HuiHiFi AI 后端")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5005)
+    args = parser.parse_args()
+
+    settings = Settings()
+    settings.validate()
+    configure_logging(settings)
+    logger.info("启动HuiHiFi AI后端服务 (asyncio)...")
+    web.run_app(create_async_app(settings), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,236 @@
 import logging
 from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
 
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify
 
+from . import logs, metrics
+from .admission import AdmissionController
+from .capture import TrafficCapture, capture_flask
+from .compression import CompressionPolicy, compress_flask
 from .config import ALLOWED_ORIGINS, Settings
-from .routes import create_chat_blueprint, create_products_blueprint, create_usage_blueprint
+from .resilience import CLOSED, CircuitBreaker, Hedger
+from .routes import create_chat_blueprint, create_eq_blueprint, create_products_blueprint, create_usage_blueprint
 from .security import apply_cors, create_origin_verifier
-from .services import DifyClient, HuiHiFiClient
-from .storage import UsageRepository
+from .services import AnswerCache, DifyClient, HuiHiFiClient, ProductCatalog, ProductSearchCache, UploadCache
+from .storage import SharedMemoryUsageRepository, UsageRepository, WriteBehindUsageRepository
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def create_app() -> Flask:
-    settings = Settings()
+def create_usage_repository(settings: Settings) -> UsageRepository:
+    if settings.usage_backend == "memory":
+        return WriteBehindUsageRepository(
+            settings.database_path,
+            settings.daily_limit,
+            flush_interval=settings.usage_flush_interval,
+            flush_threshold=settings.usage_flush_threshold,
+        )
+    if settings.usage_backend == "shared":
+        return SharedMemoryUsageRepository(
+            settings.database_path,
+            settings.daily_limit,
+            table_path=settings.usage_shared_table_path,
+            table_capacity=settings.usage_shared_table_slots,
+            flush_interval=settings.usage_flush_interval,
+            flush_threshold=settings.usage_flush_threshold,
+        )
+    return UsageRepository(settings.database_path, settings.daily_limit)
+
+
+def create_upload_cache(settings: Settings) -> Optional[UploadCache]:
+    if settings.dify_upload_cache_ttl <= 0:
+        return None
+    return UploadCache(ttl=settings.dify_upload_cache_ttl, max_entries=settings.dify_upload_cache_max_entries)
+
+
+def create_answer_cache(settings: Settings) -> Optional[AnswerCache]:
+    if not settings.answer_cache_path:
+        return None
+    cache = AnswerCache(
+        settings.answer_cache_path,
+        max_bytes=settings.answer_cache_max_bytes,
+        ttl=settings.answer_cache_ttl,
+        replay_speed=settings.answer_cache_replay_speed,
+    )
+    cache.init_database()
+    return cache
+
+
+def create_product_cache(settings: Settings, client: HuiHiFiClient) -> Optional[ProductSearchCache]:
+    if settings.product_cache_ttl <= 0:
+        return None
+    return ProductSearchCache(
+        client,
+        ttl=settings.product_cache_ttl,
+        stale_ttl=settings.product_cache_stale_ttl,
+        max_entries=settings.product_cache_max_entries,
+    )
+
+
+def create_product_catalog(settings: Settings, client: HuiHiFiClient) -> Optional[ProductCatalog]:
+    """The local catalog mirror, syncing in the background; None unless it can hold the whole listing."""
+    if not settings.product_catalog_path or not client.is_configured:
+        return None
+    if not client.page_param:
+        # Without paging the mirror would hold one page and answer every search from it.
+        logger.warning("未配置 HUIHIFI_PAGE_PARAM，无法完整同步产品目录，PRODUCT_CATALOG_PATH 将被忽略")
+        return None
+    catalog = ProductCatalog(
+        client,
+        settings.product_catalog_path,
+        full_sync_interval=settings.product_catalog_full_sync_interval,
+    )
+    catalog.start_background_refresh(settings.product_catalog_refresh_interval)
+    return catalog
+
+
+def create_admission_controller(settings: Settings) -> AdmissionController:
+    return AdmissionController(
+        max_streams=settings.admission_max_streams,
+        queue_size=settings.admission_queue_size,
+        queue_timeout=settings.admission_queue_timeout,
+        max_queued_per_user=settings.admission_max_queued_per_user,
+        rate=settings.admission_rate,
+        burst=settings.admission_burst,
+    )
+
+
+def create_traffic_capture(settings: Settings) -> Optional[TrafficCapture]:
+    if not settings.capture_path:
+        return None
+    return TrafficCapture(
+        settings.capture_path,
+        max_bytes=settings.capture_max_bytes,
+        backups=settings.capture_backups,
+        sample_rate=settings.capture_sample_rate,
+        salt=settings.capture_salt,
+    )
+
+
+def create_compression_policy(settings: Settings) -> Optional[CompressionPolicy]:
+    if not settings.compression_enabled:
+        return None
+    return CompressionPolicy(
+        min_size=settings.compression_min_size,
+        gzip_level=settings.compression_gzip_level,
+        brotli_quality=settings.compression_brotli_quality,
+    )
+
+
+def create_breaker(name: str, settings: Settings) -> CircuitBreaker:
+    return CircuitBreaker(
+        name, failure_threshold=settings.breaker_failure_threshold, reset_timeout=settings.breaker_reset_timeout
+    )
+
+
+def create_huihifi_hedger(settings: Settings) -> Optional[Hedger]:
+    if settings.huihifi_hedge_budget <= 0:
+        return None
+    return Hedger("huihifi", budget=settings.huihifi_hedge_budget)
+
+
+def health_report(breakers: Dict[str, CircuitBreaker], settings: Settings) -> Tuple[Dict[str, Any], int]:
+    """The /health body and status: degraded while any upstream breaker is not closed."""
+    upstreams = {name: breaker.snapshot() for name, breaker in breakers.items()}
+    degraded = any(upstream["state"] != CLOSED for upstream in upstreams.values())
+    body = {
+        "status": "degraded" if degraded else "healthy",
+        "timestamp": datetime.utcnow().isoformat(),
+        "service": "huihifi-ai-backend",
+        "upstreams": upstreams,
+    }
+    return body, 503 if degraded and settings.health_fail_when_degraded else 200
+
+
+def create_app(settings: Optional[Settings] = None) -> Flask:
+    settings = settings or Settings()
     settings.validate()
+    logs.configure_logging(settings)
 
     app = Flask(__name__)
+    logs.bind_flask(app)
     apply_cors(app, ALLOWED_ORIGINS)
+    metrics.instrument_flask(app)
+    capture = create_traffic_capture(settings)
+    if capture is not None:
+        capture_flask(app, capture)
+    compression = create_compression_policy(settings)
+    if compression is not None:
+        compress_flask(app, compression)
     app.before_request(create_origin_verifier(ALLOWED_ORIGINS))
 
-    usage_repo = UsageRepository(settings.database_path, settings.daily_limit)
+    usage_repo = create_usage_repository(settings)
     usage_repo.init_database()
 
-    dify_client = DifyClient(settings.dify_base_url, settings.dify_api_key)
+    dify_client = DifyClient(
+        settings.dify_base_url,
+        settings.dify_api_key,
+        connect_timeout=settings.dify_connect_timeout,
+        first_byte_timeout=settings.dify_first_byte_timeout,
+        read_timeout=settings.dify_read_timeout,
+        upload_timeout=settings.dify_upload_timeout,
+        pool_size=settings.dify_pool_size,
+        upload_cache=create_upload_cache(settings),
+        breaker=create_breaker("dify", settings),
+    )
     huihifi_client = HuiHiFiClient(
         base_url=settings.huihifi_api_base_url,
         app_key=settings.huihifi_app_key,
         secret_key=settings.huihifi_secret_key,
         timeout=settings.huihifi_api_timeout,
         max_page_size=settings.huihifi_max_page_size,
+        connect_timeout=settings.huihifi_connect_timeout,
+        max_retries=settings.huihifi_max_retries,
+        pool_size=settings.huihifi_pool_size,
+        page_concurrency=settings.huihifi_page_concurrency,
+        page_param=settings.huihifi_page_param,
+        breaker=create_breaker("huihifi", settings),
+        hedger=create_huihifi_hedger(settings),
     )
+    product_cache = create_product_cache(settings, huihifi_client)
+    product_catalog = create_product_catalog(settings, huihifi_client)
 
     api_prefix = "/api"
-    app.register_blueprint(create_chat_blueprint(dify_client, usage_repo), url_prefix=api_prefix)
-    app.register_blueprint(create_products_blueprint(huihifi_client), url_prefix=api_prefix)
+    app.register_blueprint(
+        create_chat_blueprint(
+            dify_client,
+            usage_repo,
+            create_admission_controller(settings),
+            relay_mode=settings.chat_relay_mode,
+            heartbeat_interval=settings.chat_heartbeat_interval,
+            curve_points=settings.chat_curve_points,
+            tag_events=settings.chat_tag_events,
+            answer_cache=create_answer_cache(settings),
+            answer_cache_charge_quota=settings.answer_cache_charge_quota,
+        ),
+        url_prefix=api_prefix,
+    )
+    app.register_blueprint(create_products_blueprint(huihifi_client, product_cache, product_catalog), url_prefix=api_prefix)
     app.register_blueprint(create_usage_blueprint(usage_repo), url_prefix=api_prefix)
+    app.register_blueprint(create_eq_blueprint(), url_prefix=api_prefix)
 
     @app.route("/health", methods=["GET"])
     def health_check():
-        return jsonify(
-            {
-                "status": "healthy",
-                "timestamp": datetime.utcnow().isoformat(),
-                "service": "huihifi-ai-backend",
-            }
-        )
+        body, status = health_report({"dify": dify_client.breaker, "huihifi": huihifi_client.breaker}, settings)
+        return jsonify(body), status
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_endpoint():
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
     return app
 
 
-app = create_app()
+def __getattr__(name: str) -> Flask:
+    # ``flask --app app`` and ``app:app`` still find a module-level app, but it
+    # is built on first use: importing the module opens no clients or database.
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
     logger.info("启动HuiHiFi AI后端服务...")
-    app.run(host="0.0.0.0", port=5005, debug=False)
+    create_app().run(host="0.0.0.0", port=5005, debug=False)
@@ -0,0 +1 @@
+"""Performance and durability benchmarks, run as ``python -m aituning_service.benchmarks.<name>``."""
@@ -0,0 +1,241 @@
+"""
+Behaviour and cost of chat admission control.
+
+Checks, as asserts: the per-user token bucket refuses with 429 and a
+Retry-After matching its refill; a full queue sheds with 503 at once; a
+queued request times out with 503; freed slots go to queued users in
+round-robin order (threaded and asyncio); and through the Flask route a
+shed chat neither charges quota nor reaches Dify.
+
+Then ``--users`` light users (one request at a time) share ``--slots``
+stream slots with one heavy user running ``--heavy`` request loops, each
+stream held ``--hold`` seconds, for ``--duration`` seconds: once with
+per-user queues, once with every request under one key (a plain FIFO
+queue). Reported per user class: admitted streams, sheds and queue waits.
+Last, the cost of an uncontended admit/release pair.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from ..admission import AdmissionController, Rejection, Ticket
+from ..app import create_app
+from ..config import Settings
+from .fakes import FakeDifyServer
+
+
+def _admit_in_thread(controller: AdmissionController, key: str, results: List[str]) -> threading.Thread:
+    def run() -> None:
+        outcome = controller.admit(key)
+        results.append(key if isinstance(outcome, Ticket) else f"{key}:{outcome.status}")
+        if isinstance(outcome, Ticket):
+            outcome.release()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_queued(controller: AdmissionController, count: int) -> None:
+    while controller._queued < count:
+        time.sleep(0.001)
+
+
+def check_bucket() -> None:
+    controller = AdmissionController(max_streams=0, rate=0.5, burst=3)
+    for _ in range(3):
+        ticket = controller.admit("user")
+        assert isinstance(ticket, Ticket)
+        ticket.release()
+    refused = controller.admit("user")
+    assert isinstance(refused, Rejection) and refused.status == 429, "超出速率的请求未被拒绝"
+    assert refused.retry_after == 2, f"Retry-After 应为 2 秒，实际 {refused.retry_after}"
+    assert isinstance(controller.admit("other"), Ticket), "速率限制影响了其他用户"
+
+
+def check_shed_and_timeout() -> None:
+    controller = AdmissionController(max_streams=1, queue_size=1, queue_timeout=0.2, rate=0)
+    held = controller.admit("a")
+    assert isinstance(held, Ticket)
+    results: List[str] = []
+    queued = _admit_in_thread(controller, "b", results)
+    _wait_queued(controller, 1)
+    began = time.perf_counter()
+    shed = controller.admit("c")
+    assert isinstance(shed, Rejection) and shed.status == 503 and shed.outcome == "shed", "队列已满时未立即拒绝"
+    assert time.perf_counter() - began < 0.05, "负载削减不够快"
+    queued.join()
+    assert results == ["b:503"], f"排队超时应返回 503，实际 {results}"
+    held.release()
+    assert controller._active == 0 and controller._queued == 0
+
+
+def check_round_robin() -> None:
+    controller = AdmissionController(max_streams=1, queue_size=16, queue_timeout=5, max_queued_per_user=8, rate=0)
+    held = controller.admit("heavy")
+    assert isinstance(held, Ticket)
+    order: List[str] = []
+    threads = []
+    for key in ["heavy"] * 4 + ["light-1", "light-2"]:
+        threads.append(_admit_in_thread(controller, key, order))
+        _wait_queued(controller, len(threads))
+    held.release()
+    for thread in threads:
+        thread.join()
+    expected = ["heavy", "light-1", "light-2", "heavy", "heavy", "heavy"]
+    assert order == expected, f"空闲槽位未按轮转分配: {order}"
+
+
+def check_round_robin_async() -> None:
+    async def run() -> List[str]:
+        controller = AdmissionController(max_streams=1, queue_size=16, queue_timeout=5, max_queued_per_user=8, rate=0)
+        held = await controller.admit_async("heavy")
+        assert isinstance(held, Ticket)
+        order: List[str] = []
+
+        async def one(key: str) -> None:
+            ticket = await controller.admit_async(key)
+            assert isinstance(ticket, Ticket)
+            order.append(key)
+            await asyncio.sleep(0)
+            ticket.release()
+
+        tasks = []
+        for key in ["heavy"] * 3 + ["light"]:
+            tasks.append(asyncio.create_task(one(key)))
+            await asyncio.sleep(0)
+        # A cancelled waiter must leave the queue without taking a slot.
+        doomed = asyncio.create_task(one("cancelled"))
+        await asyncio.sleep(0)
+        doomed.cancel()
+        held.release()
+        await asyncio.gather(*tasks)
+        assert controller._active == 0 and controller._queued == 0
+        return order
+
+    order = asyncio.run(run())
+    assert order == ["heavy", "light", "heavy", "heavy"], f"异步轮转顺序错误: {order}"
+
+
+def check_quota_after_admission() -> None:
+    with FakeDifyServer(latency=0.0, events=50, interval=0.05) as dify:
+        directory = tempfile.mkdtemp(prefix="admission-bench-")
+        settings = Settings(
+            dify_api_key="bench-dify-key",
+            dify_base_url=dify.base_url,
+            database_path=os.path.join(directory, "usage.db"),
+            usage_backend="sqlite",
+            product_cache_ttl=0,
+            product_catalog_path="",
+            admission_max_streams=1,
+            admission_queue_size=0,
+            admission_rate=0,
+        )
+        client = create_app(settings).test_client()
+        headers = {"Origin": "http://localhost:3000"}
+        first = client.post("/api/chat", json={"userToken": "first", "message": "hi"}, headers=headers, buffered=False)
+        assert first.status_code == 200
+        shed = client.post("/api/chat", json={"userToken": "second", "message": "hi"}, headers=headers)
+        assert shed.status_code == 503 and shed.headers.get("Retry-After"), "流槽位已满时应返回 503 与 Retry-After"
+        usage = client.get("/api/usage/second", headers=headers).get_json()
+        assert usage["used"] == 0, f"被拒绝的请求不应扣除配额: {usage}"
+        assert dify.peak_streams == 1, "被拒绝的请求不应到达 Dify"
+        first.close()
+        again = client.post("/api/chat", json={"userToken": "second", "message": "hi"}, headers=headers)
+        assert again.status_code == 200, "关闭流后槽位未释放"
+        again.close()
+
+
+def _contention(args: argparse.Namespace, fair: bool) -> Dict[str, Dict[str, List[float]]]:
+    controller = AdmissionController(
+        max_streams=args.slots,
+        queue_size=args.queue,
+        queue_timeout=args.queue_timeout,
+        max_queued_per_user=2 if fair else args.queue,
+        rate=0,
+    )
+    stats: Dict[str, Dict[str, List[float]]] = {
+        kind: {"admitted": [], "waits": [], "shed": []} for kind in ("heavy", "light")
+    }
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def loop(kind: str, key: str) -> None:
+        while time.perf_counter() < deadline:
+            began = time.perf_counter()
+            outcome = controller.admit(key if fair else "everyone")
+            waited = time.perf_counter() - began
+            if isinstance(outcome, Rejection):
+                with lock:
+                    stats[kind]["shed"].append(waited)
+                time.sleep(min(outcome.retry_after, 0.05))
+                continue
+            with lock:
+                stats[kind]["admitted"].append(1)
+                stats[kind]["waits"].append(waited)
+            time.sleep(args.hold)
+            outcome.release()
+
+    threads = [threading.Thread(target=loop, args=("heavy", "heavy")) for _ in range(args.heavy)]
+    threads += [threading.Thread(target=loop, args=("light", f"light-{n}")) for n in range(args.users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def _per_pair(runs: int) -> float:
+    controller = AdmissionController(max_streams=1024, rate=1000.0, burst=1_000_000)
+    began = time.perf_counter()
+    for _ in range(runs):
+        ticket = controller.admit("user")
+        ticket.release()  # type: ignore[union-attr]
+    return (time.perf_counter() - began) / runs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--queue", type=int, default=8)
+    parser.add_argument("--queue-timeout", type=float, default=2.0)
+    parser.add_argument("--heavy", type=int, default=16, help="request loops of the heavy user")
+    parser.add_argument("--users", type=int, default=4, help="light users, one loop each")
+    parser.add_argument("--hold", type=float, default=0.1, help="seconds each stream holds its slot")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--runs", type=int, default=100000)
+    args = parser.parse_args()
+
+    check_bucket()
+    check_shed_and_timeout()
+    check_round_robin()
+    check_round_robin_async()
+    check_quota_after_admission()
+    print("admission checks passed")
+
+    print(
+        f"{args.slots} slots, queue {args.queue}; 1 heavy user x{args.heavy} loops, "
+        f"{args.users} light users x1, hold {args.hold}s, {args.duration}s"
+    )
+    for fair in (True, False):
+        for kind, values in _contention(args, fair).items():
+            waits = sorted(values["waits"]) or [0.0]
+            p99 = waits[min(len(waits) - 1, int(len(waits) * 0.99))]
+            print(
+                f"{'round-robin' if fair else 'fifo':>11} {kind:>5}: admitted={len(values['admitted'])} "
+                f"shed={len(values['shed'])} wait_p50_ms={statistics.median(waits) * 1e3:.1f} "
+                f"wait_p99_ms={p99 * 1e3:.1f}"
+            )
+    print(f"uncontended admit+release: {_per_pair(args.runs) * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Replayed answers for identical first-turn chats, against a paced Dify stream.
+
+Checks, as asserts: only complete answers are stored, with Dify's
+conversation ids blanked; a repeated first turn is replayed (``X-Cache:
+HIT``) without reaching Dify, also once Dify is down, in both serving
+modes; turns with a ``conversationId``, other filters or another curve go
+to Dify; quota is charged for a replay only when configured; the store
+stays within its size by evicting the least recently replayed answers;
+and a replay at speed 1 lasts about as long as the recorded stream.
+
+Then ``--questions`` distinct first turns, each asked ``--repeats`` times,
+against a Dify whose ``--events`` answer chunks are ``--interval`` seconds
+apart after ``--latency`` seconds: Dify calls, time to first byte and to
+the end of the stream for misses and hits, and the stored bytes per answer.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from ..aio_app import create_async_app
+from ..app import create_app
+from ..config import Settings
+from ..metrics import CACHE_BYTES, CACHE_LOOKUPS
+from ..services import AnswerCache
+from ..services.answer_cache import answer_key
+from .fakes import FakeDifyServer, dify_sse_events
+
+HEADERS = {"Origin": "http://localhost:3000"}
+
+
+def _settings(directory: str, dify_url: str, **overrides: Any) -> Settings:
+    values: Dict[str, Any] = dict(
+        dify_api_key="bench-dify-key",
+        dify_base_url=dify_url,
+        database_path=os.path.join(directory, "usage.db"),
+        usage_backend="sqlite",
+        product_cache_ttl=0,
+        product_catalog_path="",
+        admission_rate=0,
+        answer_cache_path=os.path.join(directory, "answers.db"),
+        answer_cache_replay_speed=0,
+    )
+    values.update(overrides)
+    return Settings(**values)
+
+
+def _chat(message: str, user: str = "u", **extra: Any) -> Dict[str, Any]:
+    return dict({"userToken": user, "message": message, "currentFilters": "[]"}, **extra)
+
+
+def _answer(body: bytes) -> str:
+    answer = []
+    for line in body.decode("utf-8").splitlines():
+        if line.startswith("data: "):
+            payload = json.loads(line[6:])
+            answer.append(payload.get("answer", ""))
+    return "".join(answer)
+
+
+def check_recorder() -> None:
+    directory = tempfile.mkdtemp(prefix="answer-cache-bench-")
+    cache = AnswerCache(os.path.join(directory, "answers.db"), replay_speed=0)
+    cache.init_database()
+    events = dify_sse_events(5)
+
+    recorder = cache.recorder(b"complete")
+    # Chunks cut across events, as the passthrough relay reads them.
+    stream = b"".join(events)
+    for start in range(0, len(stream), 37):
+        recorder.feed(stream[start:start + 37])
+    assert recorder.commit(), "完整回答未被缓存"
+    replayed = b"".join(cache.replay(cache.get(b"complete")))
+    assert b"conv-bench" not in replayed and b'"conversation_id": ""' in replayed, "会话 id 未被清除"
+    assert _answer(replayed) == _answer(stream)
+
+    truncated = cache.recorder(b"truncated")
+    for event in events[:-1]:
+        truncated.feed(event)
+    assert not truncated.commit() and cache.get(b"truncated") is None, "缺少 message_end 的回答不应缓存"
+    failed = cache.recorder(b"failed")
+    for event in events[:-1] + [b'data: {"error": "boom"}\n\n']:
+        failed.feed(event)
+    assert not failed.commit(), "含错误事件的回答不应缓存"
+
+    assert answer_key("hi", "[]", None, None) != answer_key("hi", "[1]", None, None)
+    assert answer_key("hi", "[]", "aGk=", None) == answer_key("hi", "[]", "data:image/png;base64,aGk=", None)
+
+
+def check_eviction() -> None:
+    directory = tempfile.mkdtemp(prefix="answer-cache-bench-")
+    events = dify_sse_events(50, answers=[f"{n:04d}" * 8 for n in range(50)])
+    cache = AnswerCache(os.path.join(directory, "answers.db"), max_bytes=4096, replay_speed=0)
+    cache.init_database()
+    for n in range(20):
+        recorder = cache.recorder(str(n).encode())
+        for event in events:
+            recorder.feed(event)
+        recorder.commit()
+        if n == 0:
+            cache.get(b"0")  # keeps the first answer recently used
+        time.sleep(0.002)
+    assert CACHE_BYTES.labels("chat_answer").value <= 4096, "回答缓存超出大小上限"
+    assert cache.get(b"1") is None and cache.get(b"19") is not None, "应淘汰最久未回放的回答"
+
+
+def check_flask() -> None:
+    directory = tempfile.mkdtemp(prefix="answer-cache-bench-")
+    with FakeDifyServer(events=20) as dify:
+        client = create_app(_settings(directory, dify.base_url, daily_limit=3)).test_client()
+        # The answer is stored once its stream has been sent in full.
+        first = client.post("/api/chat", json=_chat("推荐一个调音"), headers=HEADERS).get_data()
+        second = client.post("/api/chat", json=_chat("推荐一个调音", user="v"), headers=HEADERS)
+        assert second.headers.get("X-Cache") == "HIT" and dify.requests == 1, "相同首轮提问未命中缓存"
+        assert _answer(second.data) == _answer(first)
+        assert client.get("/api/usage/v", headers=HEADERS).get_json()["used"] == 1, "命中默认应扣除配额"
+
+        for payload in (
+            _chat("推荐一个调音", conversationId="conv-1"),
+            _chat("推荐一个调音", user="v", currentFilters="[1]"),
+            _chat("推荐一个调音", user="w", frequencyResponse=[[100, 1], [1000, 2]]),
+        ):
+            client.post("/api/chat", json=payload, headers=HEADERS).get_data()
+        assert dify.requests == 4, f"不应命中缓存的请求未发往 Dify: {dify.requests}"
+
+        free = create_app(_settings(directory, dify.base_url, answer_cache_charge_quota=False)).test_client()
+        assert free.post("/api/chat", json=_chat("推荐一个调音", user="x"), headers=HEADERS).headers.get("X-Cache") == "HIT"
+        assert free.get("/api/usage/x", headers=HEADERS).get_json()["used"] == 0, "关闭计费后命中不应扣除配额"
+
+    # Dify is gone; the recorded answer is still replayed.
+    down = create_app(_settings(directory, "http://127.0.0.1:9/v1")).test_client()
+    replayed = down.post("/api/chat", json=_chat("推荐一个调音", user="y"), headers=HEADERS)
+    assert replayed.status_code == 200 and replayed.headers.get("X-Cache") == "HIT", "Dify 不可用时应回放缓存"
+
+
+def check_async() -> None:
+    async def run(dify_url: str) -> List[Any]:
+        directory = tempfile.mkdtemp(prefix="answer-cache-bench-")
+        async with TestClient(TestServer(create_async_app(_settings(directory, dify_url)))) as client:
+            first = await client.post("/api/chat", json=_chat("推荐一个调音"), headers=HEADERS)
+            first_body = await first.read()
+            second = await client.post("/api/chat", json=_chat("推荐一个调音", user="v"), headers=HEADERS)
+            return [first_body, second.headers.get("X-Cache"), await second.read()]
+
+    with FakeDifyServer(events=20) as dify:
+        first, hit, second = asyncio.run(run(dify.base_url))
+        assert hit == "HIT" and dify.requests == 1, "异步模式相同首轮提问未命中缓存"
+    assert _answer(second) == _answer(first)
+
+
+def check_pacing() -> None:
+    directory = tempfile.mkdtemp(prefix="answer-cache-bench-")
+    with FakeDifyServer(events=20, interval=0.02) as dify:
+        client = create_app(_settings(directory, dify.base_url, answer_cache_replay_speed=1)).test_client()
+        timings = []
+        for user in ("u", "v"):
+            began = time.perf_counter()
+            client.post("/api/chat", json=_chat("推荐一个调音", user=user), headers=HEADERS).get_data()
+            timings.append(time.perf_counter() - began)
+    recorded, replayed = timings
+    assert 0.7 * recorded < replayed < 1.3 * recorded, f"回放节奏与录制不符: {recorded:.3f}s / {replayed:.3f}s"
+
+
+def _timed(client: Any, payload: Dict[str, Any]) -> Dict[str, Any]:
+    began = time.perf_counter()
+    response = client.post("/api/chat", json=payload, headers=HEADERS, buffered=False)
+    chunks = iter(response.response)
+    next(chunks)
+    first = time.perf_counter() - began
+    for _ in chunks:
+        pass
+    response.close()
+    return {"hit": response.headers.get("X-Cache") == "HIT", "ttfb": first, "total": time.perf_counter() - began}
+
+
+def _summary(rows: List[Dict[str, Any]]) -> str:
+    if not rows:
+        return "-"
+    ttfb = statistics.median(row["ttfb"] for row in rows) * 1e3
+    total = statistics.median(row["total"] for row in rows) * 1e3
+    return f"{len(rows):4d} requests, median ttfb {ttfb:7.1f} ms, median stream {total:7.1f} ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--events", type=int, default=60)
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between answer chunks")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before Dify's first event")
+    parser.add_argument("--replay-speed", type=float, default=1.0)
+    args = parser.parse_args()
+
+    check_recorder()
+    check_eviction()
+    check_flask()
+    check_async()
+    check_pacing()
+    print("answer cache checks passed")
+
+    directory = tempfile.mkdtemp(prefix="answer-cache-bench-")
+    hits_before = CACHE_LOOKUPS.labels("chat_answer", "hits").value
+    rows: List[Dict[str, Any]] = []
+    with FakeDifyServer(latency=args.latency, events=args.events, interval=args.interval) as dify:
+        settings = _settings(
+            directory, dify.base_url, daily_limit=10 ** 6, answer_cache_replay_speed=args.replay_speed
+        )
+        client = create_app(settings).test_client()
+        for repeat in range(args.repeats):
+            for question in range(args.questions):
+                rows.append(_timed(client, _chat(f"问题 {question}", user=f"user-{repeat}")))
+        calls = dify.requests
+    total = args.questions * args.repeats
+    hits = CACHE_LOOKUPS.labels("chat_answer", "hits").value - hits_before
+    raw = sum(map(len, dify_sse_events(args.events)))
+    stored = CACHE_BYTES.labels("chat_answer").value / max(1, args.questions)
+    print(
+        f"{total} first turns ({args.questions} distinct x {args.repeats}); Dify: {args.latency * 1e3:.0f} ms to the "
+        f"first of {args.events} chunks, {args.interval * 1e3:.0f} ms apart; replay speed {args.replay_speed:g}"
+    )
+    print(f"  Dify calls: {calls} of {total}, hit rate {hits / total:.0%}")
+    print(f"  misses: {_summary([row for row in rows if not row['hit']])}")
+    print(f"    hits: {_summary([row for row in rows if row['hit']])}")
+    print(f"  stored: {stored:.0f} B per answer ({raw} B of SSE)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Time to first token of /api/chat turns with a curve image, over TLS.
+
+Drives the chat route against a local HTTPS Dify stand-in that answers
+uploads after ``--upload-latency`` and starts streaming after ``--latency``.
+Three clients are compared: a new connection per call with the upload
+after the quota check (what module-level ``requests.post`` did), the pooled
+client with the same serial order, and the pooled client with the upload
+running alongside the quota check, without and with the upload cache (each
+user resends the same curve every turn, as the frontend does).
+``--quota-latency`` adds a delay to every quota charge, as a contended
+SQLite file would.
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+
+import requests
+from flask import Flask
+
+from ..admission import AdmissionController
+from ..routes import create_chat_blueprint
+from ..services import DifyClient, UploadCache
+from ..storage import UsageRepository
+from .fakes import FakeDifyServer
+
+
+def _trust(session: requests.Session, server: FakeDifyServer) -> requests.Session:
+    # Ignore REQUESTS_CA_BUNDLE and proxy variables so the self-signed stand-in is trusted.
+    session.trust_env = False
+    session.verify = server.cert_path
+    return session
+
+
+class _SerialUploadClient(DifyClient):
+    """Uploads inline, so the quota check and the upload run one after the other."""
+
+    def submit_upload(self, base64_data: str, user_token: str) -> "Future[Optional[str]]":
+        future: "Future[Optional[str]]" = Future()
+        future.set_result(self.upload_image(base64_data, user_token))
+        return future
+
+
+class _UnpooledClient(_SerialUploadClient):
+    """A fresh session, and so a fresh TLS connection, for every call."""
+
+    def __init__(self, *args: Any, server: FakeDifyServer, **kwargs: Any) -> None:
+        self._server = server
+        super().__init__(*args, **kwargs)
+
+    @property  # type: ignore[override]
+    def _session(self) -> requests.Session:
+        return _trust(requests.Session(), self._server)
+
+    @_session.setter
+    def _session(self, value: requests.Session) -> None:
+        pass
+
+
+class _SlowUsageRepository(UsageRepository):
+    def __init__(self, *args: Any, delay: float, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+
+    def try_consume(self, user_token: str) -> bool:
+        time.sleep(self.delay)
+        return super().try_consume(user_token)
+
+
+def _run_turns(client: DifyClient, usage_repo: UsageRepository, turns: int, curve: Dict[str, Any]) -> Dict[str, float]:
+    """Time ``turns`` chats whose body carries the ``curve`` fields; users rotate over ten tokens."""
+    app = Flask(__name__)
+    unlimited = AdmissionController(max_streams=0, rate=0)
+    app.register_blueprint(create_chat_blueprint(client, usage_repo, unlimited, heartbeat_interval=0), url_prefix="/api")
+    http = app.test_client()
+
+    ttft: List[float] = []
+    for turn in range(turns):
+        body = {"userToken": f"user-{turn % 10}", "message": "推荐一款耳机", **curve}
+        began = time.perf_counter()
+        response = http.post("/api/chat", json=body, buffered=False)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        chunks = response.iter_encoded()
+        first = next(chunks)
+        assert first.startswith(b"data: "), first
+        ttft.append(time.perf_counter() - began)
+        for _ in chunks:
+            pass
+        response.close()
+
+    ttft.sort()
+    return {
+        "p50_ms": round(statistics.median(ttft) * 1e3, 2),
+        "p90_ms": round(ttft[int(len(ttft) * 0.9)] * 1e3, 2),
+        "mean_ms": round(statistics.fmean(ttft) * 1e3, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--upload-latency", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0.03, help="seconds before Dify's first event")
+    parser.add_argument("--quota-latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    image = "data:image/png;base64," + base64.b64encode(os.urandom(args.image_kb * 1024)).decode("ascii")
+    directory = tempfile.mkdtemp(prefix="chat-ttft-")
+    usage_repo = _SlowUsageRepository(
+        os.path.join(directory, "usage.db"),
+        daily_limit=1_000_000,
+        delay=args.quota_latency,
+    )
+    usage_repo.init_database()
+
+    results = {}
+    with FakeDifyServer(tls=True, latency=args.latency, upload_latency=args.upload_latency, events=5) as server:
+        clients = {
+            "per-call connections": _UnpooledClient(server.base_url, "bench-dify-key", server=server),
+            "pooled, serial": _SerialUploadClient(server.base_url, "bench-dify-key"),
+            "pooled, pipelined": DifyClient(server.base_url, "bench-dify-key"),
+            "pooled, upload cache": DifyClient(server.base_url, "bench-dify-key", upload_cache=UploadCache()),
+        }
+        for name, client in clients.items():
+            if not isinstance(client, _UnpooledClient):
+                _trust(client._session, server)
+            connections_before, uploads_before, bytes_before = server.connections, server.uploads, server.upload_bytes
+            results[name] = _run_turns(client, usage_repo, args.turns, {"curveImageBase64": image})
+            results[name]["connections"] = server.connections - connections_before
+            results[name]["uploads"] = server.uploads - uploads_before
+            results[name]["upload_MiB"] = round((server.upload_bytes - bytes_before) / 2**20, 1)
+            client.close()
+
+    print(
+        f"{args.turns} turns, {args.image_kb} KiB image, upload {args.upload_latency * 1e3:.0f} ms, "
+        f"first event {args.latency * 1e3:.0f} ms, quota {args.quota_latency * 1e3:.0f} ms"
+    )
+    for name, result in results.items():
+        print(f"{name:>22}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
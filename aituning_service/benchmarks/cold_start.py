@@ -0,0 +1,143 @@
+"""
+Cold-start cost of the backend.
+
+Each measurement runs in a fresh interpreter, ``--repeat`` times, and the
+median is reported: importing the package, ``main`` (what the gunicorn
+master loads before it decides anything), the Flask and aiohttp serving
+modules, building the Flask app, and the wall time from spawning
+``python -m aituning_service.main`` until ``/health`` answers. The
+packages that ``import aituning_service.app`` spends most time in come
+from ``-X importtime``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Tuple
+
+from ..main import BaseApplication
+
+_TIMED = """
+import time
+began = time.perf_counter()
+{code}
+print(time.perf_counter() - began)
+"""
+
+_CASES = {
+    "import aituning_service": "import aituning_service",
+    "import aituning_service.main": "import aituning_service.main",
+    "import aituning_service.app": "import aituning_service.app",
+    "import aituning_service.aio_app": "import aituning_service.aio_app",
+    "import + create_app()": "from aituning_service.app import create_app\ncreate_app()",
+}
+
+
+def _env(directory: str) -> Dict[str, str]:
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])),
+        USAGE_DATABASE_PATH=os.path.join(directory, "usage.db"),
+        PRODUCT_CATALOG_PATH="",
+        NO_PROXY="*",
+    )
+
+
+def _timed(code: str, env: Dict[str, str]) -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", _TIMED.format(code=code)], env=env, check=True, capture_output=True, text=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _until_healthy(arguments: List[str], env: Dict[str, str], timeout: float = 30.0) -> float:
+    port = _free_port()
+    began = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "aituning_service.main", "--host", "127.0.0.1", "--port", str(port), *arguments],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - began < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1):
+                    return time.perf_counter() - began
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"服务在 {timeout} 秒内未就绪")
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+def _slowest_imports(env: Dict[str, str], count: int) -> List[Tuple[int, str]]:
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import aituning_service.app"],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:") :].split("|"))
+        # A package's own line includes its submodules (and anything it imports first).
+        if "." not in name and not name.startswith(("_", "aituning_service", "site", "encodings")):
+            rows.append((int(cumulative), name))
+    return sorted(rows, reverse=True)[:count]
+
+
+def _median(samples: List[float]) -> Tuple[float, float]:
+    return statistics.median(samples), (max(samples) - min(samples)) / 2
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--top", type=int, default=8, help="slowest packages to list")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="cold-start-")
+    env = _env(directory)
+    results: Dict[str, List[float]] = {name: [] for name in _CASES}
+    servers: Dict[str, List[str]] = {"ready, single process": ["--single-process"]}
+    if BaseApplication is not None:
+        servers["ready, gunicorn 1 worker"] = ["--workers", "1"]
+    results.update({name: [] for name in servers})
+
+    for _ in range(args.repeat):
+        for name, code in _CASES.items():
+            results[name].append(_timed(code, env))
+    for _ in range(max(1, args.repeat // 2)):
+        for name, arguments in servers.items():
+            results[name].append(_until_healthy(arguments, env))
+
+    for name, samples in results.items():
+        median, spread = _median(samples)
+        print(f"{name:>32}: {median * 1e3:7.1f} ms  ±{spread * 1e3:.1f}")
+    print("slowest packages imported by aituning_service.app (cumulative):")
+    for micros, name in _slowest_imports(env, args.top):
+        print(f"{name:>32}: {micros / 1e3:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
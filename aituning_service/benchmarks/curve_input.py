@@ -0,0 +1,158 @@
+"""
+Payload size and time to first token of the curve as a PNG versus as points.
+
+Uses the measurement in ``test/test_data.json``: a header row and 957
+points, as strings. The image mode sends what the micro-app sends today:
+an 800x400 PNG of the curve (rendered here without text or antialiasing,
+so smaller than the canvas capture; pass ``--image`` to use a real one),
+which the backend uploads to Dify. The numeric mode sends the point list,
+which the backend resamples to ``--points`` log-spaced values and passes
+as a text input. Both run through the chat route against the local HTTPS
+Dify stand-in used by ``chat_ttft``, with the upload cache off, as on the
+first turn of a conversation.
+
+The points mode is not smaller on every leg: the browser's request
+carries the whole list (22.5 KiB against 10.4 KiB for the synthetic PNG),
+while the backend sends Dify a 1.5 KiB text input and uploads nothing,
+against 8.3 KiB per turn for the image. ``request_KiB`` and
+``dify_KiB_per_turn`` report both legs.
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import math
+import os
+import struct
+import tempfile
+import timeit
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+from .. import curve
+from ..services import DifyClient
+from ..storage import UsageRepository
+from .chat_ttft import _run_turns, _trust
+from .fakes import FakeDifyServer
+
+_TEST_DATA = Path(__file__).resolve().parents[2] / "test" / "test_data.json"
+
+
+def render_curve_png(rows: Sequence[Sequence[Any]], width: int = 800, height: int = 400) -> bytes:
+    """Draw the curve like ``curveImageGenerator.ts``: dark background, grid, 2 px line."""
+    freqs, spl = curve.parse_frequency_response(list(rows))
+    background, grid, line = (0x1E, 0x1E, 0x1E), (0x44, 0x44, 0x44), (0x88, 0x84, 0xD8)
+    pixels = [bytearray(bytes(background) * width) for _ in range(height)]
+    left, right, top, bottom = 50, width - 30, 30, height - 50
+    low, high = min(spl) - 5, max(spl) + 5
+
+    def x_of(freq: float) -> int:
+        return left + round((right - left) * math.log(freq / 20) / math.log(1000))
+
+    def y_of(level: float) -> int:
+        return bottom - round((bottom - top) * (level - low) / (high - low))
+
+    def plot(x: int, y: int, colour: tuple) -> None:
+        if 0 <= x < width and 0 <= y < height:
+            pixels[y][3 * x : 3 * x + 3] = bytes(colour)
+
+    for freq in (20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000):
+        for y in range(top, bottom + 1):
+            plot(x_of(freq), y, grid)
+    for step in range(math.ceil(low / 5), math.floor(high / 5) + 1):
+        for x in range(left, right + 1):
+            plot(x, y_of(step * 5), grid)
+
+    points = [(x_of(f), y_of(level)) for f, level in zip(freqs, spl) if 20 <= f <= 20000]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        steps = max(abs(x1 - x0), abs(y1 - y0), 1)
+        for i in range(steps + 1):
+            x, y = x0 + (x1 - x0) * i // steps, y0 + (y1 - y0) * i // steps
+            plot(x, y, line)
+            plot(x, y + 1, line)
+
+    raw = b"".join(b"\x00" + bytes(row) for row in pixels)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+
+def _resample_ms(rows: List[Any], points: int) -> Dict[str, float]:
+    timings = {}
+    backend = curve.np
+    for name, module in (("numpy", backend), ("python", None)):
+        if name == "numpy" and backend is None:
+            continue
+        curve.np = module
+        runs = 200
+        timings[name] = timeit.timeit(lambda: curve.frequency_response_text(rows, points), number=runs) / runs * 1e3
+    curve.np = backend
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data", default=str(_TEST_DATA))
+    parser.add_argument("--image", help="PNG capture of the curve to send instead of the synthetic render")
+    parser.add_argument("--points", type=int, default=120)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--upload-latency", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0.03, help="seconds before Dify's first event")
+    args = parser.parse_args()
+
+    with open(args.data, encoding="utf-8") as handle:
+        rows = json.load(handle)
+    if args.image:
+        png = Path(args.image).read_bytes()
+    else:
+        png = render_curve_png(rows)
+    image = "data:image/png;base64," + base64.b64encode(png).decode("ascii")
+    curve_text = curve.frequency_response_text(rows, args.points)
+
+    modes = {"image": {"curveImageBase64": image}, "points": {"frequencyResponse": rows}}
+    directory = tempfile.mkdtemp(prefix="curve-input-")
+    usage_repo = UsageRepository(os.path.join(directory, "usage.db"), daily_limit=1_000_000)
+    usage_repo.init_database()
+
+    results = {}
+    with FakeDifyServer(tls=True, latency=args.latency, upload_latency=args.upload_latency, events=5) as server:
+        for name, fields in modes.items():
+            client = DifyClient(server.base_url, "bench-dify-key", upload_cache=None)
+            _trust(client._session, server)
+            uploads_before, upload_bytes_before, chat_bytes_before = (
+                server.uploads,
+                server.upload_bytes,
+                server.chat_bytes,
+            )
+            result: Dict[str, Any] = {
+                # What the browser sends (JSON.stringify output is compact).
+                "request_KiB": round(len(json.dumps(fields, separators=(",", ":")).encode("utf-8")) / 1024, 1)
+            }
+            result.update(_run_turns(client, usage_repo, args.turns, fields))
+            result["dify_KiB_per_turn"] = round(
+                (server.upload_bytes - upload_bytes_before + server.chat_bytes - chat_bytes_before) / args.turns / 1024,
+                1,
+            )
+            result["uploads"] = server.uploads - uploads_before
+            results[name] = result
+            client.close()
+        assert server.last_chat["inputs"]["frequencyResponse"] == curve_text
+
+    print(
+        f"{len(rows) - 1} measured points -> {args.points}-point log grid ({len(curve_text)} chars); "
+        f"PNG {len(png) / 1024:.1f} KiB{'' if args.image else ' (synthetic render)'}; "
+        f"upload {args.upload_latency * 1e3:.0f} ms, first event {args.latency * 1e3:.0f} ms, {args.turns} turns"
+    )
+    for name, result in results.items():
+        print(f"{name:>8}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+    print("parse+resample+format: " + ", ".join(f"{k}={v:.3f}ms" for k, v in _resample_ms(rows, args.points).items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Throughput of the biquad EQ response engine on many filter sets at once.
+
+Random filter sets (every type, 20 Hz-20 kHz, +-15 dB, Q 0.2-8) are
+evaluated on a ``--points`` log grid three ways: ``response_db`` summing
+each section in dB, NumPy evaluating each filter's complex response
+``H(e^jw)`` separately (also the accuracy reference), and a scalar loop over
+frequencies and filters like ``calculateCombinedFilterResponse`` in the
+browser, timed on a few sets and scaled up. Sets have 1 to
+``MAX_FILTERS_PER_SET`` filters by default, the whole range the API
+accepts, and the error is reported per filter count. ``request`` times
+``evaluate_request`` from JSON-shaped filters, including parsing and
+rounding.
+"""
+
+from __future__ import annotations
+
+import argparse
+import cmath
+import math
+import random
+import time
+from typing import Any, Callable, Dict, List, Sequence
+
+import numpy as np
+
+from ..curve import log_grid
+from ..services.eq import (
+    DEFAULT_SAMPLE_RATE,
+    FILTER_TYPES,
+    MAX_FILTERS_PER_SET,
+    Filter,
+    evaluate_request,
+    response_db,
+)
+
+
+def _coefficients(item: Filter, sample_rate: float) -> Sequence[float]:
+    amp = 10 ** (item.gain / 40)
+    w0 = 2 * math.pi * item.freq / sample_rate
+    cos_w0 = math.cos(w0)
+    alpha = math.sin(w0) / (2 * item.q)
+    root = 2 * math.sqrt(amp) * alpha
+    return {
+        "peaking": (1 + alpha * amp, -2 * cos_w0, 1 - alpha * amp, 1 + alpha / amp, -2 * cos_w0, 1 - alpha / amp),
+        "low_shelf": (
+            amp * ((amp + 1) - (amp - 1) * cos_w0 + root),
+            2 * amp * ((amp - 1) - (amp + 1) * cos_w0),
+            amp * ((amp + 1) - (amp - 1) * cos_w0 - root),
+            (amp + 1) + (amp - 1) * cos_w0 + root,
+            -2 * ((amp - 1) + (amp + 1) * cos_w0),
+            (amp + 1) + (amp - 1) * cos_w0 - root,
+        ),
+        "high_shelf": (
+            amp * ((amp + 1) + (amp - 1) * cos_w0 + root),
+            -2 * amp * ((amp - 1) + (amp + 1) * cos_w0),
+            amp * ((amp + 1) + (amp - 1) * cos_w0 - root),
+            (amp + 1) - (amp - 1) * cos_w0 + root,
+            2 * ((amp - 1) - (amp + 1) * cos_w0),
+            (amp + 1) - (amp - 1) * cos_w0 - root,
+        ),
+        "lowpass": ((1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2, 1 + alpha, -2 * cos_w0, 1 - alpha),
+        "highpass": ((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2, 1 + alpha, -2 * cos_w0, 1 - alpha),
+    }[item.type]
+
+
+def complex_response(filter_sets: Sequence[Sequence[Filter]], grid: Sequence[float]) -> np.ndarray:
+    """Sum of 20 log10 |H(e^jw)| per filter, evaluated directly."""
+    z = np.exp(-2j * np.pi * np.asarray(grid) / DEFAULT_SAMPLE_RATE)
+    result = np.zeros((len(filter_sets), len(grid)))
+    for row, filters in enumerate(filter_sets):
+        for item in filters:
+            b0, b1, b2, a0, a1, a2 = _coefficients(item, DEFAULT_SAMPLE_RATE)
+            result[row] += 20 * np.log10(np.abs((b0 + (b1 + b2 * z) * z) / (a0 + (a1 + a2 * z) * z)))
+    return result
+
+
+def scalar_response(filter_sets: Sequence[Sequence[Filter]], grid: Sequence[float]) -> List[List[float]]:
+    """One frequency and one filter at a time, as the browser does."""
+    result = []
+    for filters in filter_sets:
+        coefficients = [_coefficients(item, DEFAULT_SAMPLE_RATE) for item in filters]
+        row = []
+        for freq in grid:
+            z = cmath.exp(-2j * math.pi * freq / DEFAULT_SAMPLE_RATE)
+            total = 0.0
+            for b0, b1, b2, a0, a1, a2 in coefficients:
+                total += 20 * math.log10(abs((b0 + b1 * z + b2 * z * z) / (a0 + a1 * z + a2 * z * z)))
+            row.append(total)
+        result.append(row)
+    return result
+
+
+def _best(action: Callable[[], Any], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - began)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sets", type=int, default=2000)
+    parser.add_argument("--points", type=int, default=4096)
+    parser.add_argument("--min-filters", type=int, default=1)
+    parser.add_argument("--max-filters", type=int, default=MAX_FILTERS_PER_SET)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scalar-sets", type=int, default=5, help="sets timed with the scalar loop")
+    args = parser.parse_args()
+
+    rng = random.Random(14)
+    filter_sets = [
+        [
+            Filter(
+                rng.choice(FILTER_TYPES),
+                10 ** rng.uniform(math.log10(20), math.log10(20000)),
+                round(rng.uniform(-15, 15), 1),
+                round(rng.uniform(0.2, 8), 2),
+            )
+            for _ in range(rng.randint(args.min_filters, args.max_filters))
+        ]
+        for _ in range(args.sets)
+    ]
+    grid = log_grid(args.points)
+    payload: Dict[str, Any] = {
+        "filterSets": [
+            [{"type": f.type, "freq": f.freq, "gain": f.gain, "qFactor": f.q} for f in filters] for filters in filter_sets
+        ],
+        "frequencies": grid,
+    }
+
+    engine = response_db(filter_sets, grid)
+    reference = complex_response(filter_sets, grid)
+    # Far stopbands (below -200 dB) are outside what the reference itself resolves.
+    visible = reference > -200
+    error = np.where(visible, np.abs(engine - reference), 0).max(axis=1)
+    assert np.isfinite(engine).all(), "response_db 输出了非有限值"
+    counts = np.array([len(filters) for filters in filter_sets])
+
+    timings = {
+        "response_db": _best(lambda: response_db(filter_sets, grid), args.repeat),
+        "per-filter numpy": _best(lambda: complex_response(filter_sets, grid), 1),
+        "scalar loop (scaled)": _best(lambda: scalar_response(filter_sets[: args.scalar_sets], grid), 1)
+        * args.sets
+        / args.scalar_sets,
+    }
+    if args.sets * args.points <= 1 << 20:
+        timings["request"] = _best(lambda: evaluate_request(payload), args.repeat)
+
+    filters = sum(len(filters) for filters in filter_sets)
+    print(f"{args.sets} sets ({filters} filters) x {args.points} points; max |error| {error.max():.1e} dB")
+    for low in range(args.min_filters, args.max_filters + 1, 16):
+        chosen = (counts >= low) & (counts < low + 16)
+        if chosen.any():
+            print(f"  {low:>2}-{min(low + 15, args.max_filters):<2} filters: max |error| {error[chosen].max():.1e} dB")
+    for name, seconds in timings.items():
+        print(
+            f"{name:>22}: {seconds * 1e3:9.1f} ms, {seconds / args.sets * 1e6:8.1f} us/set, "
+            f"{seconds / (args.sets * args.points) * 1e9:6.1f} ns/point"
+        )
+
+
+if __name__ == "__main__":
+    main()
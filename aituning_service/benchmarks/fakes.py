@@ -0,0 +1,383 @@
+"""Local stand-ins for the upstream services, used by the benchmarks."""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence
+
+FAKE_APP_KEY = "bench-app-key"
+FAKE_SECRET_KEY = "bench-secret-key"
+
+
+def synthetic_evaluation_item(index: int) -> Any:
+    """Return one evaluation item, cycling through every encoding variant the client accepts."""
+    variant = index % 6
+    brand: Any = {"uuid": f"brand-{index % 17}", "title": f"Brand {index % 17}", "logo": f"https://cdn/b{index % 17}.png"}
+    article: Any = {"thumbnails": [f"https://cdn/thumb/{index}-{n}.jpg" for n in range(3)], "uuid": f"art-{index}"}
+    category: Any = {"name": "耳机" if index % 2 else "耳放", "uuid": f"cat-{index % 2}"}
+    data_groups: Any = [f"group-{index}-a", f"group-{index}-b", 7]
+
+    if variant == 1:
+        brand = json.dumps(brand, ensure_ascii=False)
+        article = json.dumps(article, ensure_ascii=False)
+        category = category["name"]
+    elif variant == 2:
+        brand = brand["title"]
+        data_groups = f"group-{index}"
+    elif variant == 3:
+        article = None
+        data_groups = None
+    elif variant == 4:
+        brand = str(index)
+        article = "not json"
+        category = ""
+        data_groups = [True, 1.5, None, {"nested": index}]
+    elif variant == 5:
+        brand = None
+        article = json.dumps({"thumbnails": []})
+        category = None
+
+    item = {
+        "uuid": f"eval-{index:06d}",
+        "title": f"HiFi Headphone Model {index}",
+        "brand": brand,
+        "article": article,
+        "category": category,
+        "dataGroups": data_groups,
+        "createTime": 1_700_000_000_000 - index * 60_000,
+    }
+    return json.dumps(item, ensure_ascii=False) if variant == 1 else item
+
+
+def synthetic_evaluations_page(
+    count: int,
+    total: Optional[int] = None,
+    offset: int = 0,
+    encode: bool = True,
+    junk: bool = False,
+) -> Dict[str, Any]:
+    """
+    Build an OpenAPI evaluations response; ``encode`` double-encodes ``data``
+    and ``list`` as strings, ``junk`` mixes in entries the client must skip.
+    """
+    items: List[Any] = []
+    for n in range(count):
+        items.append(synthetic_evaluation_item(offset + n))
+        if junk and n % 10 == 9:
+            items.extend(["{broken", 42, None])
+    data: Any = {"list": json.dumps(items, ensure_ascii=False) if encode else items, "total": total if total is not None else count}
+    if encode:
+        data = json.dumps(data, ensure_ascii=False)
+    return {"code": 0, "message": "success", "data": data}
+
+
+def _self_signed_context(directory: str) -> ssl.SSLContext:
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+            "-keyout", key_path, "-out", cert_path,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+class _CountingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.connections = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+
+class FakeServer:
+    """Run a handler class on 127.0.0.1 in a background thread, optionally over TLS."""
+
+    handler_class: type = BaseHTTPRequestHandler
+
+    def __init__(self, tls: bool = False, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.cert_path: Optional[str] = None
+        self._httpd = _CountingServer(("127.0.0.1", 0), self.handler_class)
+        self._httpd.fake = self  # type: ignore[attr-defined]
+        if tls:
+            directory = tempfile.mkdtemp(prefix="fake-tls-")
+            self._httpd.socket = _self_signed_context(directory).wrap_socket(self._httpd.socket, server_side=True)
+            self.cert_path = os.path.join(directory, "cert.pem")
+        self._scheme = "https" if tls else "http"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"{self._scheme}://{host}:{port}"
+
+    @property
+    def connections(self) -> int:
+        return self._httpd.connections
+
+    @property
+    def requests(self) -> int:
+        return self._httpd.requests
+
+    def count_request(self) -> int:
+        with self._httpd.lock:
+            self._httpd.requests += 1
+            return self._httpd.requests
+
+    def __enter__(self) -> "FakeServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class _HuiHiFiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        encoded = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_POST(self) -> None:
+        fake: FakeHuiHiFiServer = self.server.fake  # type: ignore[attr-defined]
+        number = fake.count_request()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/").split("?")[0] != "/v1/openapi/evaluations":
+            self._send_json(404, {"code": 404, "message": "not found"})
+            return
+
+        expected = hmac.new(
+            FAKE_SECRET_KEY.encode("utf-8"),
+            (self.headers.get("appKey", "") + self.headers.get("timestamp", "")).encode("utf-8"),
+            hashlib.sha256,
+        ).digest()
+        if self.headers.get("sign") != base64.b64encode(expected).decode("utf-8"):
+            self._send_json(200, {"code": 401, "message": "invalid sign"})
+            return
+
+        payload = json.loads(body or b"{}")
+        fake.search_started()
+        try:
+            slow = fake.slow_every and number % fake.slow_every == 0
+            latency = fake.slow_latency if slow else fake.latency
+            if latency:
+                time.sleep(latency)
+        finally:
+            fake.search_finished()
+        page_size = int(payload.get("pageSize", 20))
+        page = int(payload.get(fake.page_param, 1)) if fake.page_param else 1
+        total = fake.catalog_size
+        offset = (page - 1) * page_size
+        count = max(0, min(page_size, total - offset))
+        self._send_json(200, synthetic_evaluations_page(count, total=total, offset=offset))
+
+
+class FakeHuiHiFiServer(FakeServer):
+    """
+    Serve ``/v1/openapi/evaluations`` with double-encoded payloads and signature checks;
+    ``peak_searches`` records how many searches were in flight at once. Every
+    ``slow_every``-th request takes ``slow_latency`` instead of ``latency``.
+    The page number is read from ``page_param``; with none, every request gets the first page.
+    """
+
+    handler_class = _HuiHiFiHandler
+
+    def __init__(
+        self, tls: bool = False, latency: float = 0.0, catalog_size: int = 500, page_param: str = "page"
+    ) -> None:
+        super().__init__(tls=tls, latency=latency)
+        self.catalog_size = catalog_size
+        self.page_param = page_param
+        self.slow_every = 0
+        self.slow_latency = 0.0
+        self.active_searches = 0
+        self.peak_searches = 0
+
+    def search_started(self) -> None:
+        with self._httpd.lock:
+            self.active_searches += 1
+            self.peak_searches = max(self.peak_searches, self.active_searches)
+
+    def search_finished(self) -> None:
+        with self._httpd.lock:
+            self.active_searches -= 1
+
+
+def dify_sse_events(
+    count: int,
+    conversation_id: str = "conv-bench",
+    answers: Optional[Sequence[str]] = None,
+) -> List[bytes]:
+    """
+    Return a Dify chat stream: ``count`` answer chunks (the ``answers``
+    deltas, when given) followed by ``message_end``.
+    """
+    events = []
+    for n in range(count):
+        answer = answers[n] if answers is not None else f"第{n}段回答 "
+        body = {"event": "message", "conversation_id": conversation_id, "answer": answer}
+        events.append(b"data: " + json.dumps(body, ensure_ascii=False).encode("utf-8") + b"\n\n")
+    end = {"event": "message_end", "conversation_id": conversation_id, "metadata": {}}
+    events.append(b"data: " + json.dumps(end).encode("utf-8") + b"\n\n")
+    return events
+
+
+class _DifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        encoded = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_POST(self) -> None:
+        fake: FakeDifyServer = self.server.fake  # type: ignore[attr-defined]
+        fake.count_request()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/files/upload"):
+            if fake.upload_latency:
+                time.sleep(fake.upload_latency)
+            self._send_json(201, {"id": fake.store_file(len(body)), "name": "curve.png"})
+            return
+        if not path.endswith("/chat-messages"):
+            self._send_json(404, {"code": "not_found"})
+            return
+
+        payload = json.loads(body or b"{}")
+        fake.record_chat(len(body), payload)
+        files = payload.get("files") or []
+        if any(not fake.has_file(item.get("upload_file_id")) for item in files):
+            self._send_json(400, {"code": "invalid_param", "message": "File not found"})
+            return
+
+        fake.stream_started()
+        try:
+            if fake.latency:
+                time.sleep(fake.latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            # Chunked like Dify's own responses, so the connection can be kept alive.
+            for event in dify_sse_events(fake.events, answers=fake.answers):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+                self.wfile.flush()
+                if fake.interval:
+                    time.sleep(fake.interval)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            fake.stream_finished()
+
+
+class FakeDifyServer(FakeServer):
+    """
+    Serve ``/files/upload`` and a streaming ``/chat-messages``, which rejects
+    unknown ``upload_file_id`` references with 400 like Dify.
+
+    ``latency`` delays the first event, ``interval`` spaces the ``events``
+    answer chunks (whose text ``answers`` may set); ``peak_streams`` records
+    how many streams were open at once.
+    """
+
+    handler_class = _DifyHandler
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        events: int = 20,
+        interval: float = 0.0,
+        upload_latency: float = 0.0,
+        tls: bool = False,
+    ) -> None:
+        super().__init__(tls=tls, latency=latency)
+        self.events = events
+        self.answers: Optional[Sequence[str]] = None
+        self.interval = interval
+        self.upload_latency = upload_latency
+        self.active_streams = 0
+        self.peak_streams = 0
+        self.uploads = 0
+        self.upload_bytes = 0
+        self.chat_bytes = 0
+        self.last_chat: Dict[str, Any] = {}
+        self._files: set = set()
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/v1"
+
+    def store_file(self, size: int) -> str:
+        with self._httpd.lock:
+            self.uploads += 1
+            self.upload_bytes += size
+            file_id = f"file-{self.uploads}"
+            self._files.add(file_id)
+        return file_id
+
+    def record_chat(self, size: int, payload: Dict[str, Any]) -> None:
+        with self._httpd.lock:
+            self.chat_bytes += size
+            self.last_chat = payload
+
+    def has_file(self, file_id: Optional[str]) -> bool:
+        with self._httpd.lock:
+            return file_id in self._files
+
+    def expire_files(self) -> None:
+        """Forget every upload, as Dify does once its retention has passed."""
+        with self._httpd.lock:
+            self._files.clear()
+
+    def stream_started(self) -> None:
+        with self._httpd.lock:
+            self.active_streams += 1
+            self.peak_streams = max(self.peak_streams, self.active_streams)
+
+    def stream_finished(self) -> None:
+        with self._httpd.lock:
+            self.active_streams -= 1
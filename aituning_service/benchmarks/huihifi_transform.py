@@ -0,0 +1,131 @@
+"""
+Throughput of ``HuiHiFiClient._transform_response`` on synthetic 50-item pages.
+
+Pages mix every encoding variant the client handles (string ``data`` and
+``list``, string items, JSON and plain-string brands, string articles,
+invalid entries). The previous implementation is kept here as the
+baseline; the outputs must serialize to identical bytes.
+
+The gain comes from orjson, installed with the ``json`` extra: about 1.9x
+per page with it, while with the standard library the single pass is on
+par with the baseline (nested ``json.loads`` calls dominate both).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List
+
+from ..jsonutil import JSON_BACKEND
+from ..jsonutil import loads as fast_loads
+from ..services import HuiHiFiClient
+from .fakes import synthetic_evaluations_page
+
+
+def _legacy_transform(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """The multi-pass implementation this benchmark replaced."""
+    data = raw.get("data") or {}
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            data = {}
+    products = []
+
+    raw_list = data.get("list", [])
+    if isinstance(raw_list, str):
+        try:
+            raw_list = json.loads(raw_list)
+        except ValueError:
+            raw_list = []
+
+    for raw_item in raw_list:
+        item = raw_item
+        if isinstance(raw_item, str):
+            try:
+                item = json.loads(raw_item)
+            except ValueError:
+                continue
+        if not isinstance(item, dict):
+            continue
+
+        brand = item.get("brand") or {}
+        if isinstance(brand, str):
+            try:
+                brand = json.loads(brand)
+            except ValueError:
+                brand = {"title": brand}
+
+        category = item.get("category") or {}
+        category_name = category if isinstance(category, str) else category.get("name", "")
+
+        article = item.get("article") or {}
+        if isinstance(article, str):
+            try:
+                article = json.loads(article)
+            except ValueError:
+                article = {}
+
+        data_groups_value = item.get("dataGroups")
+        data_groups: List[str] = []
+        if isinstance(data_groups_value, str):
+            data_groups = [data_groups_value]
+        elif isinstance(data_groups_value, list):
+            data_groups = [str(group) for group in data_groups_value if isinstance(group, (str, int, float))]
+
+        products.append(
+            {
+                "uuid": item.get("uuid"),
+                "title": item.get("title"),
+                "brand": brand if isinstance(brand, dict) else {"title": str(brand)},
+                "thumbnails": (article or {}).get("thumbnails", []),
+                "categoryName": category_name,
+                "dataGroup": data_groups[0] if data_groups else "",
+                "dataGroups": data_groups,
+            }
+        )
+
+    return {"products": products, "total": data.get("total", 0)}
+
+
+def _bench(label: str, bodies: List[bytes], parse: Callable[[bytes], Dict[str, Any]], rounds: int) -> float:
+    began = time.perf_counter()
+    for _ in range(rounds):
+        for body in bodies:
+            parse(body)
+    per_page = (time.perf_counter() - began) / (rounds * len(bodies))
+    print(f"{label:<34} {per_page * 1e6:8.1f} us/page")
+    return per_page
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    client = HuiHiFiClient("http://unused", "key", "secret")
+    bodies = [
+        json.dumps(synthetic_evaluations_page(50, offset=page * 50, encode=page % 2 == 0, junk=True), ensure_ascii=False).encode("utf-8")
+        for page in range(args.pages)
+    ]
+
+    for body in bodies:
+        expected = json.dumps(_legacy_transform(json.loads(body.decode("utf-8"))), ensure_ascii=False)
+        actual = json.dumps(client._transform_response(fast_loads(body)), ensure_ascii=False)
+        if expected != actual:
+            raise SystemExit("output mismatch between legacy and single-pass transform")
+    print(f"outputs identical on {len(bodies)} pages; JSON backend: {JSON_BACKEND}")
+
+    # response.json() decodes the body to text before parsing; the client now parses the bytes directly.
+    legacy = _bench("legacy (response.json + json)", bodies, lambda body: _legacy_transform(json.loads(body.decode("utf-8"))), args.rounds)
+    current = _bench(f"single-pass ({JSON_BACKEND})", bodies, lambda body: client._transform_response(fast_loads(body)), args.rounds)
+    print(f"speedup: {legacy / current:.2f}x")
+    if JSON_BACKEND != "orjson":
+        print("orjson is not installed (the json extra); the speedup depends on it")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Connection reuse and latency of consecutive product searches over TLS.
+
+Runs the same searches against a local HTTPS stand-in twice: once with a
+fresh client per call (what module-level ``requests.post`` did) and once
+with one pooled ``HuiHiFiClient``, reporting TLS connections opened and
+per-search latency.
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from ..services import HuiHiFiClient
+from .fakes import FAKE_APP_KEY, FAKE_SECRET_KEY, FakeHuiHiFiServer
+
+
+def _make_client(server: FakeHuiHiFiServer) -> HuiHiFiClient:
+    client = HuiHiFiClient(server.url, FAKE_APP_KEY, FAKE_SECRET_KEY)
+    # Ignore REQUESTS_CA_BUNDLE and proxy variables so the self-signed stand-in is trusted.
+    client._session.trust_env = False
+    client._session.verify = server.cert_path
+    return client
+
+
+def _measure(server: FakeHuiHiFiServer, searches: int, search: Callable[[], object]) -> Dict[str, float]:
+    connections_before = server.connections
+    latencies: List[float] = []
+    for _ in range(searches):
+        began = time.perf_counter()
+        search()
+        latencies.append(time.perf_counter() - began)
+    return {
+        "connections": server.connections - connections_before,
+        "first_ms": round(latencies[0] * 1e3, 2),
+        "p50_ms": round(statistics.median(latencies) * 1e3, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1e3, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--searches", type=int, default=200)
+    parser.add_argument("--page-size", type=int, default=20)
+    args = parser.parse_args()
+
+    with FakeHuiHiFiServer(tls=True) as server:
+        def unpooled() -> object:
+            client = _make_client(server)
+            try:
+                return client.search_products("hd600", args.page_size)
+            finally:
+                client.close()
+
+        pooled_client = _make_client(server)
+
+        def pooled() -> object:
+            return pooled_client.search_products("hd600", args.page_size)
+
+        print("per-call connection:", _measure(server, args.searches, unpooled))
+        print("pooled keep-alive:  ", _measure(server, args.searches, pooled))
+
+
+if __name__ == "__main__":
+    main()
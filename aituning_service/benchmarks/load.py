@@ -0,0 +1,288 @@
+"""
+Load test of /api/chat, /api/products/search and /api/usage against local stand-ins.
+
+Serves the real app (``--mode wsgi`` behind a pool of ``--threads``
+workers, or ``--mode async``) in front of ``FakeDifyServer`` (first event
+after ``--dify-latency``, ``--events`` answer chunks at ``--token-rate``
+per second) and ``FakeHuiHiFiServer`` (signed requests, double-encoded
+pages after ``--huihifi-latency``). Each scenario then runs for
+``--duration`` seconds with ``--concurrency`` clients that send their next
+request as soon as the last one finishes, after ``--warmup`` seconds that
+are not counted, ``--repeat`` times. Reported per scenario, as the median
+over the repeats: requests per second, p50/p99 of the whole request and of
+the first body byte, and errors (non-2xx or no response). Chat users
+rotate over ``--users`` tokens, all with unlimited quota; logs go to a file
+at ``--log-level`` as they would in production.
+
+``--output`` saves the results with the configuration, host and commit as
+JSON. ``--baseline`` compares against such a file and exits with status 1
+when any metric is worse by more than ``--tolerance``. Compare runs with
+the same options on the same host: the clients, the app and the stand-ins
+share its CPUs, so on a single core repeated runs of the same commit still
+differ by up to about 15%.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from ..config import Settings
+from .fakes import FAKE_APP_KEY, FAKE_SECRET_KEY, FakeDifyServer, FakeHuiHiFiServer
+from .stream_concurrency import _raise_fd_limit, _serve_async, _serve_wsgi
+
+SCENARIOS = ("chat", "products", "usage")
+_ORIGIN = "http://localhost:3000"
+_KEYWORDS = ("HD600", "耳机", "IEM", "dac", "Sennheiser", "", "平板耳机", "k7xx")
+# Metrics compared with a baseline, and whether a larger value is better.
+_COMPARED = {
+    "rps": True,
+    "latency_p50_ms": False,
+    "latency_p99_ms": False,
+    "ttfb_p50_ms": False,
+    "ttfb_p99_ms": False,
+    "error_rate": False,
+}
+# Differences below these are noise whatever the relative change.
+_ABSOLUTE_SLACK = {"latency_p50_ms": 1.0, "latency_p99_ms": 2.0, "ttfb_p50_ms": 1.0, "ttfb_p99_ms": 2.0, "error_rate": 0.001}
+
+Sample = Tuple[bool, float, float]
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def _request(session: aiohttp.ClientSession, url: str, scenario: str, n: int, users: int) -> Any:
+    user = f"load-user-{n % users}"
+    if scenario == "chat":
+        body = {"userToken": user, "message": "推荐一款适合古典乐的耳机", "currentFilters": ""}
+        return session.post(f"{url}/api/chat", json=body)
+    if scenario == "products":
+        return session.post(f"{url}/api/products/search", json={"keyword": _KEYWORDS[n % len(_KEYWORDS)], "pageSize": 20})
+    return session.get(f"{url}/api/usage/{user}")
+
+
+async def _one(session: aiohttp.ClientSession, url: str, scenario: str, n: int, users: int) -> Sample:
+    began = time.perf_counter()
+    first_byte: Optional[float] = None
+    try:
+        async with _request(session, url, scenario, n, users) as response:
+            async for _ in response.content.iter_any():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - began
+            ok = 200 <= response.status < 300
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        ok = False
+    latency = time.perf_counter() - began
+    return ok, latency, first_byte if first_byte is not None else latency
+
+
+async def _drive(url: str, scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=120)
+    samples: List[Sample] = []
+    counter = iter(range(sys.maxsize))
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers={"Origin": _ORIGIN}) as session:
+        started = time.perf_counter()
+        measure_from = started + args.warmup
+        deadline = measure_from + args.duration
+
+        async def client() -> None:
+            while time.perf_counter() < deadline:
+                sent = time.perf_counter()
+                sample = await _one(session, url, scenario, next(counter), args.users)
+                if sent >= measure_from:
+                    samples.append(sample)
+
+        await asyncio.gather(*(client() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - measure_from
+
+    latencies = sorted(sample[1] for sample in samples)
+    ttfbs = sorted(sample[2] for sample in samples)
+    errors = sum(1 for sample in samples if not sample[0])
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "rps": round(len(samples) / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 0.5) * 1e3, 2),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1e3, 2),
+        "ttfb_p50_ms": round(percentile(ttfbs, 0.5) * 1e3, 2),
+        "ttfb_p99_ms": round(percentile(ttfbs, 0.99) * 1e3, 2),
+    }
+
+
+def _median(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-metric median of repeated runs; request and error counts are summed."""
+    combined: Dict[str, Any] = {}
+    for key in runs[0]:
+        values = [run[key] for run in runs]
+        combined[key] = sum(values) if key in ("requests", "errors") else statistics.median(values)
+    return combined
+
+
+def _settings(dify: FakeDifyServer, huihifi: FakeHuiHiFiServer, directory: str, args: argparse.Namespace) -> Settings:
+    return Settings(
+        dify_api_key="bench-dify-key",
+        dify_base_url=dify.base_url,
+        daily_limit=1_000_000_000,
+        database_path=os.path.join(directory, "usage.db"),
+        usage_backend=args.usage_backend,
+        usage_shared_table_path="",
+        chat_heartbeat_interval=15,
+        huihifi_api_base_url=huihifi.url,
+        huihifi_app_key=FAKE_APP_KEY,
+        huihifi_secret_key=FAKE_SECRET_KEY,
+        product_cache_ttl=args.product_cache_ttl,
+        product_catalog_path="",
+        # Measure the server itself, not the admission limits.
+        admission_max_streams=0,
+        admission_rate=0,
+    )
+
+
+def _commit() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)))
+    return result.stdout.strip() + ("-dirty" if dirty.returncode else "")
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    directory = tempfile.mkdtemp(prefix="load-bench-")
+    # Left in place: background flushers may still write here at exit.
+    logging.basicConfig(
+        filename=os.path.join(directory, "backend.log"),
+        level=getattr(logging, args.log_level),
+        force=True,
+    )
+    interval = 1 / args.token_rate if args.token_rate > 0 else 0.0
+    results: Dict[str, Any] = {}
+    with FakeDifyServer(latency=args.dify_latency, events=args.events, interval=interval) as dify, FakeHuiHiFiServer(
+        latency=args.huihifi_latency
+    ) as huihifi:
+        settings = _settings(dify, huihifi, directory, args)
+        url, stop = _serve_wsgi(settings, args.threads) if args.mode == "wsgi" else _serve_async(settings)
+        try:
+            for scenario in args.scenarios:
+                results[scenario] = _median([asyncio.run(_drive(url, scenario, args)) for _ in range(args.repeat)])
+        finally:
+            stop()
+    return {
+        "config": {
+            key: getattr(args, key)
+            for key in (
+                "mode", "threads", "concurrency", "duration", "warmup", "repeat", "users", "scenarios", "dify_latency",
+                "token_rate", "events", "huihifi_latency", "usage_backend", "product_cache_ttl", "log_level",
+            )
+        },
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "commit": _commit(),
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print the change of every compared metric; return the regressions."""
+    if current["config"] != baseline.get("config"):
+        print("注意: 基线使用了不同的配置，结果不可直接比较")
+    if current["host"].get("platform") != baseline.get("host", {}).get("platform"):
+        print("注意: 基线来自不同的主机环境")
+    regressions = []
+    for scenario, result in current["results"].items():
+        before = baseline.get("results", {}).get(scenario)
+        if before is None:
+            continue
+        for metric, higher_is_better in _COMPARED.items():
+            old, new = before.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else math.inf)
+            worse = -change if higher_is_better else change
+            regressed = worse > tolerance and abs(new - old) > _ABSOLUTE_SLACK.get(metric, 0.0)
+            marker = "  <-- 退化" if regressed else ""
+            print(f"{scenario:>9} {metric:>15}: {old:>10} -> {new:>10} ({change:+.1%}){marker}")
+            if regressed:
+                regressions.append(f"{scenario}.{metric}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=("wsgi", "async"), default="wsgi")
+    parser.add_argument("--threads", type=int, default=32, help="worker threads for the WSGI app")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario; each metric is the median")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--dify-latency", type=float, default=0.2, help="seconds before Dify's first event")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="answer chunks per second; 0 sends at once")
+    parser.add_argument("--events", type=int, default=20, help="answer chunks per chat")
+    parser.add_argument("--huihifi-latency", type=float, default=0.05)
+    parser.add_argument("--usage-backend", choices=("sqlite", "memory", "shared"), default="sqlite")
+    parser.add_argument("--product-cache-ttl", type=float, default=300.0, help="0 sends every search upstream")
+    parser.add_argument("--log-level", choices=("DEBUG", "INFO", "WARNING"), default="INFO")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file from an earlier --output run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    _raise_fd_limit(args.concurrency * 2)
+    report = run(args)
+
+    config = report["config"]
+    print(
+        f"{config['mode']} mode, {config['concurrency']} clients, {config['duration']:.0f}s per scenario; "
+        f"Dify {config['dify_latency'] * 1e3:.0f} ms + {config['events']} chunks at {config['token_rate']:.0f}/s, "
+        f"HuiHiFi {config['huihifi_latency'] * 1e3:.0f} ms, usage backend {config['usage_backend']}"
+    )
+    for scenario, result in report["results"].items():
+        print(f"{scenario:>9}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, ensure_ascii=False, indent=2)
+            handle.write("\n")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"性能退化超过 {args.tolerance:.0%}: {', '.join(regressions)}")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Request-thread cost of logging, before and after the queued pipeline.
+
+Checks, as asserts: a JSON line carries the request id, extras, a cut
+payload and the traceback; the text format keeps ``LEVEL:logger:message``
+with extras appended; a full queue drops and counts records instead of
+blocking; and payload sampling logs about the configured fraction.
+
+Then times the logging one chat request does on its own thread (the Dify
+call with its payload, the upload result, the stream summary) three ways:
+a synchronous handler with the payload serialized eagerly (as before),
+the queue with a lazy ``Payload``, and the queue with payloads sampled at
+``--sample-rate``. Each runs against a fast sink and against one whose
+writes take ``--slow-write`` seconds, as a congested stderr or disk would.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueListener
+from typing import Callable, Dict
+
+from .. import logs
+from ..metrics import LOG_RECORDS_DROPPED
+
+
+class _SlowSink(io.StringIO):
+    def __init__(self, delay: float) -> None:
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        time.sleep(self.delay)
+        return super().write(text)
+
+
+def _payload(size: int) -> Dict[str, object]:
+    curve = "".join(random.choice("0123456789.,") for _ in range(size))
+    return {
+        "inputs": {"currentFilters": '[{"type":"PK","fc":1000,"gain":-3,"q":1.4}]', "frequencyResponse": curve},
+        "query": "低频再多一点，人声靠前",
+        "response_mode": "streaming",
+        "user": "bench-user",
+        "auto_generate_name": True,
+    }
+
+
+def _logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(f"aituning_service.benchmarks.{name}")
+    logger.handlers = [handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def check_json_format() -> None:
+    sink = io.StringIO()
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logs.JsonFormatter())
+    handler_queue: queue.Queue = queue.Queue()
+    front = logs._DroppingQueueHandler(handler_queue)
+    logger = _logger("json", front)
+    token = logs.REQUEST_ID.set("req-check")
+    try:
+        logger.info("调用 Dify API", extra={"payload": logs.Payload({"image": "x" * 1000})})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("出错了")
+    finally:
+        logs.REQUEST_ID.reset(token)
+    while not handler_queue.empty():
+        handler.handle(handler_queue.get())
+    first, second = (json.loads(line) for line in sink.getvalue().splitlines())
+    assert first["request_id"] == "req-check" and first["message"] == "调用 Dify API", first
+    image = first["payload"]["image"]
+    assert image.startswith("x" * logs._max_field_chars) and image.endswith("…(共 1000 字符)"), image
+    assert second["level"] == "ERROR" and "ValueError: boom" in second["exc"], second
+
+
+def check_text_format() -> None:
+    record = logging.LogRecord("svc", logging.INFO, __file__, 1, "流式响应结束: %s", ("ok",), None)
+    record.request_id = "req-text"
+    line = logs.TextFormatter().format(record)
+    assert line == "INFO:svc:流式响应结束: ok request_id=req-text", line
+
+
+def check_drops() -> None:
+    logger = _logger("drops", logs._DroppingQueueHandler(queue.Queue(1)))
+    before = LOG_RECORDS_DROPPED.labels().value
+    began = time.perf_counter()
+    for _ in range(3):
+        logger.info("队列已满")
+    assert time.perf_counter() - began < 0.05, "队列满时日志调用被阻塞"
+    assert LOG_RECORDS_DROPPED.labels().value - before == 2, "丢弃的日志未计数"
+
+
+def check_sampling() -> None:
+    logs._payload_sample_rate = 0.1
+    try:
+        sampled = sum(logs.sample_payload() for _ in range(20000))
+    finally:
+        logs._payload_sample_rate = 1.0
+    assert 1600 < sampled < 2400, f"采样比例偏离 0.1: {sampled / 20000:.3f}"
+
+
+def _sync_request(logger: logging.Logger, payload: Dict[str, object]) -> Callable[[], None]:
+    def request() -> None:
+        logger.info("调用 Dify API: payload=%s", json.dumps(payload, ensure_ascii=False))
+        logger.info("图片上传到 Dify 成功: %s", "file-123")
+        logger.info("流式响应结束: bytes=%d chunks=%d", 4096, 32)
+
+    return request
+
+
+def _queued_request(logger: logging.Logger, payload: Dict[str, object]) -> Callable[[], None]:
+    def request() -> None:
+        if logs.sample_payload():
+            logger.info("调用 Dify API", extra={"payload": logs.Payload(payload)})
+        logger.info("图片上传到 Dify 成功: %s", "file-123")
+        logger.info("流式响应结束: bytes=%d chunks=%d", 4096, 32)
+
+    return request
+
+
+def _per_request(request: Callable[[], None], runs: int) -> float:
+    began = time.perf_counter()
+    for _ in range(runs):
+        request()
+    return (time.perf_counter() - began) / runs
+
+
+def _time_sync(sink: io.StringIO, payload: Dict[str, object], runs: int) -> float:
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    return _per_request(_sync_request(_logger("sync", handler), payload), runs)
+
+
+def _time_queued(sink: io.StringIO, payload: Dict[str, object], runs: int, rate: float) -> Dict[str, float]:
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logs.JsonFormatter())
+    front = logs._DroppingQueueHandler(queue.Queue(10000))
+    listener = QueueListener(front.queue, handler)
+    listener.start()
+    logs._payload_sample_rate = rate
+    before = LOG_RECORDS_DROPPED.labels().value
+    try:
+        seconds = _per_request(_queued_request(_logger("queued", front), payload), runs)
+    finally:
+        logs._payload_sample_rate = 1.0
+        listener.stop()
+    return {"seconds": seconds, "dropped": LOG_RECORDS_DROPPED.labels().value - before}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5000)
+    parser.add_argument("--payload-chars", type=int, default=16000, help="size of the curve input in the payload")
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    parser.add_argument("--slow-write", type=float, default=0.0005, help="seconds per write of the slow sink")
+    args = parser.parse_args()
+
+    check_json_format()
+    check_text_format()
+    check_drops()
+    check_sampling()
+    print("logging checks passed", file=sys.stderr)
+
+    payload = _payload(args.payload_chars)
+    slow_runs = max(1, min(args.runs, int(0.5 / (3 * args.slow_write)))) if args.slow_write > 0 else args.runs
+    print(f"3 records per request, payload of {len(json.dumps(payload, ensure_ascii=False)) / 1024:.1f} KiB")
+    for sink_name, make_sink, runs in (
+        ("fast sink", io.StringIO, args.runs),
+        (f"slow sink ({args.slow_write * 1e3:.1f} ms/write)", lambda: _SlowSink(args.slow_write), slow_runs),
+    ):
+        sync = _time_sync(make_sink(), payload, runs)
+        full = _time_queued(make_sink(), payload, runs, 1.0)
+        sampled = _time_queued(make_sink(), payload, runs, args.sample_rate)
+        print(f"{sink_name}, {runs} requests:")
+        print(f"{'sync, eager json.dumps':>32}: {sync * 1e6:9.2f} us/request")
+        print(f"{'queue, lazy payload':>32}: {full['seconds'] * 1e6:9.2f} us/request  dropped={full['dropped']:.0f}")
+        print(
+            f"{f'queue, payload sampled {args.sample_rate:g}':>32}: {sampled['seconds'] * 1e6:9.2f} us/request  "
+            f"dropped={sampled['dropped']:.0f}"
+        )
+        print(f"{'removed from request thread':>32}: {(sync - sampled['seconds']) * 1e6:9.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
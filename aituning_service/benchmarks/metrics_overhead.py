@@ -0,0 +1,131 @@
+"""
+Cost of the hot-path metrics and validity of the ``/metrics`` output.
+
+Checks that counters stay exact under ``--threads`` concurrent writers and
+that every rendered line parses as the Prometheus text format, with
+cumulative buckets whose ``+Inf`` bucket equals ``_count``. Then times a
+counter increment, a labelled histogram observation and an
+``UpstreamCall`` block per call, a trivial Flask route with and without
+``instrument_flask``, and one scrape of every metric.
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from flask import Flask
+
+from .. import metrics
+
+_SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_]\w*="(?:[^"\\]|\\.)*"(,[a-zA-Z_]\w*="(?:[^"\\]|\\.)*")*\})? \S+$')
+
+
+def check_exposition(text: str) -> int:
+    """Assert ``text`` is well-formed; return the number of samples."""
+    samples = 0
+    buckets: Dict[str, List[float]] = {}
+    counts: Dict[str, float] = {}
+    for line in text.splitlines():
+        if line.startswith("# HELP ") or line.startswith("# TYPE "):
+            continue
+        assert _SAMPLE.match(line), f"无法解析的指标行: {line}"
+        samples += 1
+        name, value = line.rsplit(" ", 1)
+        if "_bucket{" in name:
+            series = re.sub(r',?le="[^"]*"', "", name).replace("_bucket", "")
+            buckets.setdefault(series, []).append(float(value))
+        elif re.match(r"^\w+_count(\{|$)", name):
+            counts[name.replace("_count", "")] = float(value)
+    for series, values in buckets.items():
+        assert values == sorted(values), f"{series} 的桶计数不是累计的"
+        assert values[-1] == counts[series.replace("{}", "")], f"{series} 的 +Inf 桶与 _count 不一致"
+    return samples
+
+
+def check_concurrency(threads: int, per_thread: int) -> None:
+    counter = metrics.CACHE_LOOKUPS.labels("benchmark", "hits")
+    histogram = metrics.UPSTREAM_LATENCY.labels("benchmark", "concurrency")
+    before = counter.value
+
+    def work() -> None:
+        for _ in range(per_thread):
+            counter.inc()
+            histogram.observe(0.01)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert counter.value - before == threads * per_thread, "并发计数丢失"
+    counts, _ = histogram.snapshot()
+    assert sum(counts) == threads * per_thread, "并发直方图计数丢失"
+
+
+def _per_call(action: Callable[[], Any], runs: int) -> float:
+    began = time.perf_counter()
+    for _ in range(runs):
+        action()
+    return (time.perf_counter() - began) / runs
+
+
+def _flask_app(instrumented: bool) -> Any:
+    app = Flask(__name__)
+    if instrumented:
+        metrics.instrument_flask(app)
+
+    @app.route("/ping")
+    def ping() -> str:
+        return "ok"
+
+    return app.test_client()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    check_concurrency(args.threads, 20000)
+
+    counter = metrics.STREAM_BYTES
+    histogram = metrics.DATABASE_LATENCY
+
+    def upstream_call() -> None:
+        with metrics.UpstreamCall("benchmark", "call") as call:
+            call.status = 200
+
+    timings = {
+        "Counter.inc": _per_call(lambda: counter.inc(100), args.runs),
+        "labels().observe": _per_call(lambda: histogram.labels("benchmark").observe(0.0004), args.runs),
+        "UpstreamCall block": _per_call(upstream_call, args.runs // 4),
+    }
+    plain, instrumented = _flask_app(False), _flask_app(True)
+    for client in (plain, instrumented):
+        client.get("/ping")
+    # Alternate the two so drift affects both alike.
+    flask_timings = {"flask request": 0.0, "flask request, instrumented": 0.0}
+    for _ in range(5):
+        flask_timings["flask request"] += _per_call(lambda: plain.get("/ping"), args.requests // 5)
+        flask_timings["flask request, instrumented"] += _per_call(lambda: instrumented.get("/ping"), args.requests // 5)
+    timings.update({name: total / 5 for name, total in flask_timings.items()})
+
+    text = metrics.render()
+    samples = check_exposition(text)
+    timings["render"] = _per_call(metrics.render, 200)
+
+    print(f"{samples} samples, {len(text) / 1024:.1f} KiB per scrape; {args.threads}-thread counts exact")
+    for name, seconds in timings.items():
+        print(f"{name:>28}: {seconds * 1e6:8.2f} us")
+    overhead = timings["flask request, instrumented"] - timings["flask request"]
+    print(f"{'instrument_flask overhead':>28}: {overhead * 1e6:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
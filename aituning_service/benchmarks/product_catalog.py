@@ -0,0 +1,62 @@
+"""
+Catalog-mirror search latency versus an upstream round trip.
+
+Syncs a synthetic catalog from the local HuiHiFi stand-in into a snapshot,
+then times the same keyword searches against the in-memory index and
+against the stand-in (with ``--upstream-latency`` added per request).
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from ..services import HuiHiFiClient, ProductCatalog
+from .fakes import FAKE_APP_KEY, FAKE_SECRET_KEY, FakeHuiHiFiServer
+
+KEYWORDS = ("", "model 12", "brand 3", "耳机", "hifi headphone", "model 49", "brand 16 耳放")
+
+
+def _time(search: Callable[[str], object], rounds: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    for _ in range(rounds):
+        for keyword in KEYWORDS:
+            began = time.perf_counter()
+            search(keyword)
+            latencies.append(time.perf_counter() - began)
+    return {"p50_us": round(statistics.median(latencies) * 1e6, 1), "max_us": round(max(latencies) * 1e6, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--catalog-size", type=int, default=5000)
+    parser.add_argument("--upstream-latency", type=float, default=0.05)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    with FakeHuiHiFiServer(catalog_size=args.catalog_size) as server:
+        client = HuiHiFiClient(server.url, FAKE_APP_KEY, FAKE_SECRET_KEY, page_param="page")
+        client._session.trust_env = False
+        catalog = ProductCatalog(client, os.path.join(tempfile.mkdtemp(prefix="catalog-"), "catalog.json.gz"))
+
+        began = time.perf_counter()
+        catalog.sync(full=True)
+        print(
+            f"full sync: {len(catalog)} items in {time.perf_counter() - began:.2f}s over {server.requests} pages, "
+            f"snapshot {os.path.getsize(catalog.snapshot_path) >> 10} KiB"
+        )
+        requests_before = server.requests
+        catalog.sync()
+        print(f"incremental sync with no new items: {server.requests - requests_before} page(s)")
+
+        print("catalog index:", _time(lambda keyword: catalog.search_products(keyword, 20), args.rounds))
+        server.latency = args.upstream_latency
+        print("upstream:     ", _time(lambda keyword: client.search_products(keyword, 20), 1))
+
+
+if __name__ == "__main__":
+    main()
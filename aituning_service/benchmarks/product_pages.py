@@ -0,0 +1,189 @@
+"""
+Concurrent paged product retrieval and the NDJSON ``/api/products/stream``.
+
+Checks, as asserts: ``iter_pages`` returns the whole synthetic catalog once,
+in upstream order, for every concurrency, with no more searches
+in flight than asked for; a consumer that stops early leaves no fetches
+running; and both serving modes stream the same products as NDJSON,
+honour ``limit``, and answer 502 when the first page fails.
+
+Then, against ``--latency`` seconds per upstream page, times a full scan of
+``--catalog`` items at each ``--concurrency``, and the stream endpoint's
+time to its first line against its total time.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Sequence
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from ..aio_app import create_async_app
+from ..app import create_app
+from ..config import Settings
+from ..services import HuiHiFiClient
+from ..services.huihifi_async import AsyncHuiHiFiClient
+from .fakes import FAKE_APP_KEY, FAKE_SECRET_KEY, FakeHuiHiFiServer
+
+HEADERS = {"Origin": "http://localhost:3000"}
+
+
+def _client(server: FakeHuiHiFiServer, concurrency: int = 4) -> HuiHiFiClient:
+    return HuiHiFiClient(server.url, FAKE_APP_KEY, FAKE_SECRET_KEY, page_concurrency=concurrency, page_param="page")
+
+
+def _settings(base_url: str) -> Settings:
+    directory = tempfile.mkdtemp(prefix="product-pages-bench-")
+    return Settings(
+        huihifi_api_base_url=base_url,
+        huihifi_app_key=FAKE_APP_KEY,
+        huihifi_secret_key=FAKE_SECRET_KEY,
+        huihifi_page_param="page",
+        database_path=os.path.join(directory, "usage.db"),
+        product_cache_ttl=0,
+        product_catalog_path="",
+    )
+
+
+def _check_order(products: List[Dict[str, Any]], size: int) -> None:
+    assert len(products) == size, f"分页结果不完整: {len(products)}/{size}"
+    assert len({product["uuid"] for product in products}) == size, "分页结果有重复"
+    # The fake lists ``eval-000000`` (the newest) first.
+    uuids = [product["uuid"] for product in products]
+    assert uuids == sorted(uuids), "分页结果未按上游顺序排列"
+
+
+def check_iter_pages(size: int) -> None:
+    with FakeHuiHiFiServer(latency=0.01, catalog_size=size) as server:
+        for concurrency in (1, 3, 8):
+            server.peak_searches = 0
+            client = _client(server)
+            _check_order([p for page in client.iter_pages("", 50, concurrency=concurrency) for p in page], size)
+            assert server.peak_searches <= concurrency, f"并发页数超出上限: {server.peak_searches} > {concurrency}"
+            client.close()
+
+        # An exact multiple of the page size ends on the total, without asking for an empty page.
+        server.catalog_size = 200
+        before = server.requests
+        assert sum(len(page) for page in _client(server).iter_pages("", 50)) == 200
+        assert server.requests - before == 4, f"多请求了 {server.requests - before - 4} 页"
+
+        server.catalog_size = size
+        client = _client(server)
+        pages = client.iter_pages("", 50, concurrency=4)
+        next(pages)
+        next(pages)
+        pages.close()
+        time.sleep(0.05)
+        assert server.active_searches == 0, "提前结束后仍有分页请求在运行"
+        client.close()
+
+
+def check_iter_pages_async(size: int) -> None:
+    async def run(server: FakeHuiHiFiServer) -> List[Dict[str, Any]]:
+        client = AsyncHuiHiFiClient(_client(server))
+        await client.start()
+        try:
+            return [p async for page in client.iter_pages("", 50, concurrency=4) for p in page]
+        finally:
+            await client.close()
+
+    with FakeHuiHiFiServer(latency=0.01, catalog_size=size) as server:
+        _check_order(asyncio.run(run(server)), size)
+        assert server.peak_searches <= 4
+
+
+def _lines(body: bytes) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in body.decode("utf-8").splitlines()]
+
+
+def check_flask(size: int) -> None:
+    with FakeHuiHiFiServer(catalog_size=size) as server:
+        client = create_app(_settings(server.url)).test_client()
+        response = client.get("/api/products/stream", headers=HEADERS)
+        assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+        _check_order(_lines(response.data), size)
+        limited = _lines(client.get("/api/products/stream?limit=75", headers=HEADERS).data)
+        assert [p["uuid"] for p in limited] == [f"eval-{n:06d}" for n in range(75)], "limit 未生效"
+        assert client.get("/api/products/stream?limit=-1", headers=HEADERS).status_code == 400
+    failing = create_app(_settings("http://127.0.0.1:9"))
+    assert failing.test_client().get("/api/products/stream", headers=HEADERS).status_code == 502
+
+
+def check_async(size: int) -> None:
+    async def run(base_url: str) -> Sequence[Any]:
+        async with TestClient(TestServer(create_async_app(_settings(base_url)))) as client:
+            response = await client.get("/api/products/stream", headers=HEADERS)
+            body = await response.read()
+            limited = await (await client.get("/api/products/stream?limit=75", headers=HEADERS)).read()
+            return response.status, response.content_type, body, limited
+
+    with FakeHuiHiFiServer(catalog_size=size) as server:
+        status, content_type, body, limited = asyncio.run(run(server.url))
+    assert status == 200 and content_type == "application/x-ndjson"
+    _check_order(_lines(body), size)
+    assert len(_lines(limited)) == 75, "异步模式 limit 未生效"
+
+    async def failing() -> int:
+        async with TestClient(TestServer(create_async_app(_settings("http://127.0.0.1:9")))) as client:
+            return (await client.get("/api/products/stream", headers=HEADERS)).status
+
+    assert asyncio.run(failing()) == 502
+
+
+def _time_scan(server: FakeHuiHiFiServer, concurrency: int) -> float:
+    client = _client(server)
+    began = time.perf_counter()
+    for _ in client.iter_pages("", 50, concurrency=concurrency):
+        pass
+    elapsed = time.perf_counter() - began
+    client.close()
+    return elapsed
+
+
+def _time_stream(server: FakeHuiHiFiServer) -> Dict[str, float]:
+    client = create_app(_settings(server.url)).test_client()
+    began = time.perf_counter()
+    response = client.get("/api/products/stream", headers=HEADERS, buffered=False)
+    chunks = iter(response.response)
+    first = next(chunks)
+    first_line = time.perf_counter() - began
+    lines = first.count(b"\n") + sum(chunk.count(b"\n") for chunk in chunks)
+    response.close()
+    return {"first_line": first_line, "total": time.perf_counter() - began, "lines": lines}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--catalog", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.08, help="seconds per upstream page")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    check_iter_pages(1234)
+    check_iter_pages_async(1234)
+    check_flask(321)
+    check_async(321)
+    print("paging checks passed")
+
+    pages = -(-args.catalog // 50)
+    print(f"{args.catalog} items in {pages} pages of 50, {args.latency * 1e3:.0f} ms per page")
+    with FakeHuiHiFiServer(latency=args.latency, catalog_size=args.catalog) as server:
+        for concurrency in args.concurrency:
+            elapsed = _time_scan(server, concurrency)
+            print(f"  iter_pages concurrency={concurrency}: {elapsed:6.2f} s ({pages / elapsed:5.1f} pages/s)")
+        stream = _time_stream(server)
+    print(
+        f"  /api/products/stream: first line {stream['first_line'] * 1e3:.0f} ms, "
+        f"{stream['lines']:.0f} lines in {stream['total']:.2f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
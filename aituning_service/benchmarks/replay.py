@@ -0,0 +1,382 @@
+"""
+Replay a captured request mix against the app at N times its speed.
+
+Reads ``capture.py`` files (plain, or gzipped rotations; several workers'
+files are merged by time) and sends each request at its captured offset
+divided by ``--speed``, whether or not earlier ones have answered, so a
+slow server sees the backlog grow as it would in production. Requests are
+rebuilt from the captured shape: every user, message, filters, keyword
+and image hash maps to the same synthetic value each time, so repeats,
+and the caches they hit, stay as captured; continued conversations send a
+``conversationId``.
+
+The target is the app served here (``--mode wsgi|async``) in front of
+``FakeDifyServer`` and ``FakeHuiHiFiServer``, or ``--target``, a staging
+build pointed at the stand-ins started here (their URLs are printed).
+Reported per route: captured and replayed requests, latency percentiles
+of both and their deltas, and errors; then the offered against the
+achieved rate, and how late the client sent. Captured latencies are the
+server's handler times (for WSGI chats, to the first byte); replayed ones
+are measured by the client to the response headers, with the end of chat
+streams reported separately.
+
+Without capture files a synthetic mix is captured from the local app
+first, which also checks, as asserts, that the capture keeps no token,
+message or keyword and that its rotated files read back whole.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import glob
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+
+from ..config import Settings
+from .fakes import FAKE_APP_KEY, FAKE_SECRET_KEY, FakeDifyServer, FakeHuiHiFiServer
+from .load import percentile
+from .stream_concurrency import _raise_fd_limit, _serve_async, _serve_wsgi
+
+ROUTES = ("chat", "search", "usage")
+_ORIGIN = "http://localhost:3000"
+_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def read_capture(paths: List[str]) -> List[Dict[str, Any]]:
+    """Every captured line of ``paths`` (rotated ``.gz`` files included), oldest first."""
+    records = []
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as lines:  # type: ignore[operator]
+            for line in lines:
+                if line.strip():
+                    records.append(json.loads(line))
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def _capture_files(pattern: str) -> List[str]:
+    return sorted(glob.glob(pattern) + glob.glob(pattern + ".*.gz"))
+
+
+class RequestBuilder:
+    """Synthetic requests of the captured shapes; equal hashes give equal values."""
+
+    def __init__(self) -> None:
+        self._images: Dict[Tuple[str, int], str] = {}
+
+    @staticmethod
+    def _text(digest: Optional[str], length: int, prefix: str) -> str:
+        if not digest:
+            return ""
+        text = f"{prefix}{digest} "
+        return text + "音" * max(0, length - len(text))
+
+    def _image(self, digest: str, length: int) -> str:
+        key = (digest, length)
+        if key not in self._images:
+            raw = (digest.encode("ascii") * (length // len(digest) + 1))[: length * 3 // 4]
+            self._images[key] = base64.b64encode(raw).decode("ascii")
+        return self._images[key]
+
+    def build(self, record: Dict[str, Any]) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+        """Method, path and JSON body for one captured line."""
+        user = f"replay-{record.get('user') or 'anonymous'}"
+        route = record["route"]
+        if route == "usage":
+            return "GET", f"/api/usage/{user}", None
+        if route == "search":
+            keyword = f"kw{record['keyword']}" if record.get("keyword") else ""
+            return "POST", "/api/products/search", {"keyword": keyword, "pageSize": record.get("page_size") or 20}
+        body: Dict[str, Any] = {
+            "userToken": user,
+            "message": self._text(record.get("message"), record.get("message_len", 0), "回放问题 ") or "回放问题",
+            "currentFilters": self._text(record.get("filters"), record.get("filters_len", 0), "filters "),
+        }
+        if record.get("image"):
+            body["curveImageBase64"] = self._image(record["image"], record.get("image_len", 0))
+        points = record.get("curve_points", 0)
+        if points >= 2:
+            body["frequencyResponse"] = [[20 * 1000 ** (n / (points - 1)), 0.0] for n in range(points)]
+        if record.get("continued"):
+            body["conversationId"] = f"conv-{user}"
+        return "POST", "/api/chat", body
+
+
+async def _send(session: aiohttp.ClientSession, url: str, request: Tuple[str, str, Any]) -> Dict[str, Any]:
+    method, path, body = request
+    began = time.perf_counter()
+    result: Dict[str, Any] = {"status": None, "headers_ms": None, "total_ms": None}
+    try:
+        async with session.request(method, url + path, json=body) as response:
+            result["headers_ms"] = (time.perf_counter() - began) * 1e3
+            result["status"] = response.status
+            async for _ in response.content.iter_any():
+                pass
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        pass
+    result["total_ms"] = (time.perf_counter() - began) * 1e3
+    return result
+
+
+async def replay(url: str, records: List[Dict[str, Any]], speed: float) -> Dict[str, Any]:
+    """Send ``records`` on their captured schedule, ``speed`` times faster."""
+    builder = RequestBuilder()
+    results: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    lags: List[float] = []
+    # A new connection per request: idle keep-alives would hold the threads of a pooled WSGI server.
+    connector = aiohttp.TCPConnector(limit=0, force_close=True)
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers={"Origin": _ORIGIN}) as session:
+
+        async def one(record: Dict[str, Any], request: Tuple[str, str, Any]) -> None:
+            results.append((record, await _send(session, url, request)))
+
+        tasks = []
+        first = records[0]["t"]
+        started = time.perf_counter()
+        for record in records:
+            request = builder.build(record)
+            due = started + (record["t"] - first) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lags.append(max(0.0, time.perf_counter() - due))
+            tasks.append(asyncio.create_task(one(record, request)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    span = (records[-1]["t"] - first) / speed
+    return {"results": results, "lags": sorted(lags), "elapsed": elapsed, "span": span}
+
+
+def _quantiles(values: List[float]) -> List[float]:
+    ordered = sorted(values)
+    return [percentile(ordered, q) for q in _QUANTILES]
+
+
+def report(replayed: Dict[str, Any], speed: float) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {}
+    results = replayed["results"]
+    for route in ROUTES:
+        rows = [(record, result) for record, result in results if record["route"] == route]
+        if not rows:
+            continue
+        captured = _quantiles([record["ms"] for record, _ in rows])
+        answered = [result["headers_ms"] for _, result in rows if result["headers_ms"] is not None]
+        current = _quantiles(answered) if answered else [float("nan")] * len(_QUANTILES)
+        summary[route] = {
+            "requests": len(rows),
+            "captured_ms": [round(value, 1) for value in captured],
+            "replayed_ms": [round(value, 1) for value in current],
+            "delta_ms": [round(after - before, 1) for before, after in zip(captured, current)],
+            "captured_errors": sum(1 for record, _ in rows if not 200 <= record["status"] < 300),
+            "replayed_errors": sum(1 for _, result in rows if not result["status"] or not 200 <= result["status"] < 300),
+        }
+        if route == "chat":
+            summary[route]["stream_ms"] = [round(value, 1) for value in _quantiles([r["total_ms"] for _, r in rows])]
+    total = len(results)
+    summary["throughput"] = {
+        "requests": total,
+        "offered_rps": round(total / replayed["span"], 1) if replayed["span"] > 0 else None,
+        "achieved_rps": round(total / replayed["elapsed"], 1),
+        "speed": speed,
+        "send_lag_p99_ms": round(percentile(replayed["lags"], 0.99) * 1e3, 1),
+    }
+    return summary
+
+
+def _print(summary: Dict[str, Any]) -> None:
+    labels = "/".join(f"p{int(q * 100)}" for q in _QUANTILES)
+    print(f"{'route':>7} {'requests':>8}  {'captured ' + labels:>24}  {'replayed ' + labels:>24}  {'delta ms':>20}  errors")
+    for route in ROUTES:
+        row = summary.get(route)
+        if row is None:
+            continue
+        join = lambda values: "/".join(f"{value:.1f}" for value in values)  # noqa: E731
+        print(
+            f"{route:>7} {row['requests']:>8}  {join(row['captured_ms']):>24}  {join(row['replayed_ms']):>24}  "
+            f"{join(row['delta_ms']):>20}  {row['captured_errors']} -> {row['replayed_errors']}"
+        )
+        if "stream_ms" in row:
+            print(f"{'':>7} {'':>8}  {'':>24}  {'stream ' + join(row['stream_ms']):>24}")
+    throughput = summary["throughput"]
+    print(
+        f"{throughput['requests']} requests at {throughput['speed']:g}x: offered {throughput['offered_rps']} req/s, "
+        f"achieved {throughput['achieved_rps']} req/s, send lag p99 {throughput['send_lag_p99_ms']} ms"
+    )
+
+
+def _settings(dify: FakeDifyServer, huihifi: FakeHuiHiFiServer, directory: str, **overrides: Any) -> Settings:
+    values: Dict[str, Any] = dict(
+        dify_api_key="bench-dify-key",
+        dify_base_url=dify.base_url,
+        daily_limit=1_000_000_000,
+        database_path=os.path.join(directory, "usage.db"),
+        usage_backend="memory",
+        huihifi_api_base_url=huihifi.url,
+        huihifi_app_key=FAKE_APP_KEY,
+        huihifi_secret_key=FAKE_SECRET_KEY,
+        product_catalog_path="",
+        admission_max_streams=0,
+        admission_rate=0,
+    )
+    values.update(overrides)
+    return Settings(**values)
+
+
+def _synthetic_requests(count: int, seed: int = 7) -> Iterator[Tuple[str, str, Any]]:
+    """A mix like production's: mostly usage polls and searches, some chats, repeated keywords and questions."""
+    rng = random.Random(seed)
+    keywords = ["HD600", "耳机", "IEM", "dac", "Sennheiser", "", "平板耳机", "k7xx"]
+    for n in range(count):
+        user = f"secret-token-{rng.randrange(40)}"
+        kind = rng.random()
+        if kind < 0.4:
+            yield "GET", f"/api/usage/{user}", None
+        elif kind < 0.75:
+            keyword = keywords[min(len(keywords) - 1, int(rng.expovariate(0.6)))]
+            yield "POST", "/api/products/search", {"keyword": keyword, "pageSize": rng.choice((10, 20, 50))}
+        else:
+            body = {"userToken": user, "message": f"私密问题 {rng.randrange(6)}", "currentFilters": "[]"}
+            if rng.random() < 0.3:
+                body["conversationId"] = "conv-bench"
+            if rng.random() < 0.5:
+                body["frequencyResponse"] = [[20 * 1000 ** (i / 99), rng.uniform(-5, 5)] for i in range(100)]
+            yield "POST", "/api/chat", body
+
+
+def capture_synthetic(directory: str, args: argparse.Namespace) -> List[str]:
+    """Capture a synthetic mix from the local app and check the capture; returns its files."""
+    pattern = os.path.join(directory, "capture.jsonl")
+    requests = list(_synthetic_requests(args.synthetic))
+    with FakeDifyServer(latency=args.dify_latency, events=args.events, interval=args.interval) as dify, FakeHuiHiFiServer(
+        latency=args.huihifi_latency
+    ) as huihifi:
+        settings = _settings(
+            dify, huihifi, directory, capture_path=pattern, capture_max_bytes=16384, capture_backups=50, capture_salt="bench"
+        )
+        url, stop = _serve_wsgi(settings, args.threads)
+        try:
+
+            async def drive() -> None:
+                connector = aiohttp.TCPConnector(limit=0, force_close=True)
+                async with aiohttp.ClientSession(connector=connector, headers={"Origin": _ORIGIN}) as session:
+                    tasks = []
+                    for request in requests:
+                        tasks.append(asyncio.create_task(_send(session, url, request)))
+                        await asyncio.sleep(random.expovariate(args.synthetic_rate))
+                    await asyncio.gather(*tasks)
+
+            asyncio.run(drive())
+            deadline = time.monotonic() + 5
+            while len(read_capture(_capture_files(pattern))) < len(requests) and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop()
+
+    files = _capture_files(pattern)
+    records = read_capture(files)
+    assert len(records) == len(requests), f"捕获记录不完整: {len(records)}/{len(requests)}"
+    assert any(path.endswith(".gz") for path in files), "捕获文件未轮转"
+    text = "".join(json.dumps(record, ensure_ascii=False) for record in records)
+    assert "secret-token" not in text and "私密问题" not in text and "HD600" not in text, "捕获中含有用户原文"
+    chats = [record for record in records if record["route"] == "chat"]
+    assert any(record["continued"] for record in chats) and any(record["curve_points"] == 100 for record in chats)
+    assert len({record["message"] for record in chats}) <= 6, "相同消息应得到相同哈希"
+    print(f"captured {len(records)} requests in {len(files)} files, {sum(map(os.path.getsize, files))} bytes")
+    return files
+
+
+def check_async_capture(directory: str) -> None:
+    """The asyncio app captures the same lines."""
+    from aiohttp.test_utils import TestClient, TestServer
+
+    from ..aio_app import create_async_app
+
+    pattern = os.path.join(directory, "async-capture.jsonl")
+
+    async def run(huihifi_url: str) -> None:
+        settings = Settings(
+            dify_api_key="bench-dify-key",
+            database_path=os.path.join(directory, "async-usage.db"),
+            usage_backend="memory",
+            huihifi_api_base_url=huihifi_url,
+            huihifi_app_key=FAKE_APP_KEY,
+            huihifi_secret_key=FAKE_SECRET_KEY,
+            product_catalog_path="",
+            capture_path=pattern,
+        )
+        async with TestClient(TestServer(create_async_app(settings))) as client:
+            headers = {"Origin": _ORIGIN}
+            await (await client.post("/api/products/search", json={"keyword": "HD600", "pageSize": 10}, headers=headers)).read()
+            await (await client.get("/api/usage/secret-token", headers=headers)).read()
+
+    with FakeHuiHiFiServer() as huihifi:
+        asyncio.run(run(huihifi.url))
+    deadline = time.monotonic() + 5
+    while len(read_capture(_capture_files(pattern))) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    search, usage = read_capture(_capture_files(pattern))
+    assert search["route"] == "search" and search["keyword_len"] == 5 and search["page_size"] == 10, search
+    assert usage["route"] == "usage" and usage["user"] and usage["status"] == 200, usage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("captures", nargs="*", help="capture files; rotated .gz siblings of each are read too")
+    parser.add_argument("--speed", type=float, default=4.0)
+    parser.add_argument("--target", help="base URL of a running build; the app is served here when omitted")
+    parser.add_argument("--mode", choices=("wsgi", "async"), default="wsgi")
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--dify-latency", type=float, default=0.3)
+    parser.add_argument("--events", type=int, default=40)
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between Dify answer chunks")
+    parser.add_argument("--huihifi-latency", type=float, default=0.03)
+    parser.add_argument("--synthetic", type=int, default=400, help="requests in the mix captured when no files are given")
+    parser.add_argument("--synthetic-rate", type=float, default=40.0, help="requests per second of that mix")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+    _raise_fd_limit(1024)
+
+    directory = tempfile.mkdtemp(prefix="replay-bench-")
+    files = [path for pattern in args.captures for path in _capture_files(pattern)]
+    if not files:
+        files = capture_synthetic(directory, args)
+        check_async_capture(directory)
+        print("capture checks passed")
+    records = read_capture(files)
+    if not records:
+        raise SystemExit("捕获文件中没有记录")
+
+    with FakeDifyServer(latency=args.dify_latency, events=args.events, interval=args.interval) as dify, FakeHuiHiFiServer(
+        latency=args.huihifi_latency
+    ) as huihifi:
+        stop = None
+        if args.target:
+            url = args.target.rstrip("/")
+            print(f"stand-ins: DIFY_BASE_URL={dify.base_url} HUIHIFI_API_BASE_URL={huihifi.url}")
+        else:
+            settings = _settings(dify, huihifi, directory)
+            url, stop = _serve_wsgi(settings, args.threads) if args.mode == "wsgi" else _serve_async(settings)
+        try:
+            summary = report(asyncio.run(replay(url, records, args.speed)), args.speed)
+        finally:
+            if stop is not None:
+                stop()
+    _print(summary)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(summary, output, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Circuit breakers and hedged product searches against degraded upstreams.
+
+Checks, as asserts: the breaker opens after its failure threshold, fails
+calls at once while open, lets exactly one probe through when half-open,
+and closes or reopens on the probe's outcome; a HuiHiFi search against a
+hanging upstream waits out the timeout only until the breaker opens; with
+Dify's breaker open, ``/api/chat`` answers 503 with Retry-After and
+charges no quota, ``/api/usage`` stays fast, and ``/health`` reports the
+breaker (503 with ``HEALTH_FAIL_WHEN_DEGRADED``) in both serving modes.
+
+Then ``--searches`` sequential searches against an upstream where every
+``--slow-every``-th request takes ``--slow`` seconds, with and without
+hedging, threaded and asyncio: latency percentiles and hedges sent.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from ..aio_app import create_async_app
+from ..app import create_app
+from ..config import Settings
+from ..metrics import HEDGES
+from ..resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, Hedger
+from ..services import HuiHiFiClient, HuiHiFiClientError, HuiHiFiUnavailableError
+from ..services.huihifi_async import AsyncHuiHiFiClient
+from .fakes import FAKE_APP_KEY, FAKE_SECRET_KEY, FakeHuiHiFiServer
+
+HEADERS = {"Origin": "http://localhost:3000"}
+
+
+def check_breaker() -> None:
+    breaker = CircuitBreaker("benchmark", failure_threshold=3, reset_timeout=0.1)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(False)
+    breaker.record(True)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == OPEN and not breaker.allow(), "连续失败后熔断器未打开"
+    assert breaker.retry_after() == 1
+    time.sleep(0.11)
+    assert breaker.allow() and breaker.state == HALF_OPEN, "半开状态未放行探测请求"
+    assert not breaker.allow(), "半开状态只应放行一个探测请求"
+    breaker.record(False)
+    assert breaker.state == OPEN, "探测失败后熔断器应重新打开"
+    time.sleep(0.11)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED and breaker.allow(), "探测成功后熔断器应关闭"
+
+
+def check_fast_fail() -> None:
+    with FakeHuiHiFiServer(latency=2.0) as server:
+        client = HuiHiFiClient(
+            server.url,
+            FAKE_APP_KEY,
+            FAKE_SECRET_KEY,
+            timeout=0.2,
+            max_retries=0,
+            breaker=CircuitBreaker("huihifi", failure_threshold=3, reset_timeout=30),
+        )
+        waits: List[float] = []
+        for _ in range(5):
+            began = time.perf_counter()
+            try:
+                client.search_products("", 10)
+            except HuiHiFiUnavailableError as exc:
+                assert exc.retry_after > 0
+            except HuiHiFiClientError:
+                pass
+            waits.append(time.perf_counter() - began)
+        client.close()
+    assert all(wait >= 0.2 for wait in waits[:3]), waits
+    assert all(wait < 0.01 for wait in waits[3:]), f"熔断后请求未立即失败: {waits}"
+
+
+def _settings(directory: str, **overrides: Any) -> Settings:
+    values: Dict[str, Any] = dict(
+        dify_api_key="bench-dify-key",
+        dify_base_url="http://127.0.0.1:9/v1",
+        database_path=os.path.join(directory, "usage.db"),
+        usage_backend="sqlite",
+        product_cache_ttl=0,
+        product_catalog_path="",
+        admission_rate=0,
+        breaker_failure_threshold=2,
+    )
+    values.update(overrides)
+    return Settings(**values)
+
+
+def check_flask_routes() -> None:
+    directory = tempfile.mkdtemp(prefix="resilience-bench-")
+    client = create_app(_settings(directory)).test_client()
+    assert client.get("/health").get_json()["status"] == "healthy"
+    statuses = [client.post("/api/chat", json={"userToken": "u", "message": "hi"}, headers=HEADERS) for _ in range(3)]
+    assert [response.status_code for response in statuses[:2]] == [502, 502]
+    assert statuses[2].status_code == 503 and statuses[2].headers.get("Retry-After"), "熔断时应返回 503 与 Retry-After"
+    began = time.perf_counter()
+    usage = client.get("/api/usage/u", headers=HEADERS).get_json()
+    assert time.perf_counter() - began < 0.05 and usage["used"] == 0, f"熔断不应影响配额与其他接口: {usage}"
+    health = client.get("/health").get_json()
+    assert health["status"] == "degraded" and health["upstreams"]["dify"]["state"] == OPEN, health
+
+    strict = create_app(_settings(directory, health_fail_when_degraded=True)).test_client()
+    for _ in range(2):
+        strict.post("/api/chat", json={"userToken": "u", "message": "hi"}, headers=HEADERS)
+    assert strict.get("/health").status_code == 503, "HEALTH_FAIL_WHEN_DEGRADED 未生效"
+
+
+def check_async_routes() -> None:
+    async def run() -> List[Any]:
+        directory = tempfile.mkdtemp(prefix="resilience-bench-")
+        settings = _settings(directory, health_fail_when_degraded=True)
+        async with TestClient(TestServer(create_async_app(settings))) as client:
+            statuses = []
+            for _ in range(3):
+                response = await client.post("/api/chat", json={"userToken": "u", "message": "hi"}, headers=HEADERS)
+                statuses.append(response.status)
+            health = await client.get("/health")
+            return [statuses, health.status, (await health.json())["upstreams"]["dify"]["state"]]
+
+    statuses, health_status, state = asyncio.run(run())
+    assert statuses == [502, 502, 503], statuses
+    assert health_status == 503 and state == OPEN
+
+
+def _percentiles(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": round(statistics.median(ordered) * 1e3, 1),
+        "p95_ms": round(ordered[int(len(ordered) * 0.95)] * 1e3, 1),
+        "p99_ms": round(ordered[int(len(ordered) * 0.99)] * 1e3, 1),
+        "max_ms": round(ordered[-1] * 1e3, 1),
+    }
+
+
+def _hedges_sent() -> float:
+    return HEDGES.labels("huihifi", "sent").value
+
+
+def _run_threaded(server: FakeHuiHiFiServer, searches: int, hedger: Optional[Hedger]) -> Dict[str, float]:
+    client = HuiHiFiClient(server.url, FAKE_APP_KEY, FAKE_SECRET_KEY, hedger=hedger)
+    before = _hedges_sent()
+    latencies = []
+    for _ in range(searches):
+        began = time.perf_counter()
+        client.search_products("", 20)
+        latencies.append(time.perf_counter() - began)
+    client.close()
+    return {**_percentiles(latencies), "hedges": _hedges_sent() - before}
+
+
+def _run_async(server: FakeHuiHiFiServer, searches: int, hedger: Optional[Hedger]) -> Dict[str, float]:
+    async def run() -> List[float]:
+        client = AsyncHuiHiFiClient(HuiHiFiClient(server.url, FAKE_APP_KEY, FAKE_SECRET_KEY, hedger=hedger))
+        await client.start()
+        latencies = []
+        try:
+            for _ in range(searches):
+                began = time.perf_counter()
+                await client.search_products("", 20)
+                latencies.append(time.perf_counter() - began)
+        finally:
+            await client.close()
+        return latencies
+
+    before = _hedges_sent()
+    latencies = asyncio.run(run())
+    return {**_percentiles(latencies), "hedges": _hedges_sent() - before}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--searches", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds for a normal search")
+    parser.add_argument("--slow", type=float, default=0.4, help="seconds for a slow search")
+    parser.add_argument("--slow-every", type=int, default=40)
+    parser.add_argument("--budget", type=float, default=0.1)
+    args = parser.parse_args()
+
+    check_breaker()
+    check_fast_fail()
+    check_flask_routes()
+    check_async_routes()
+    print("resilience checks passed")
+
+    print(
+        f"{args.searches} searches, {args.latency * 1e3:.0f} ms each, every {args.slow_every}th "
+        f"{args.slow * 1e3:.0f} ms; hedge budget {args.budget}"
+    )
+    results = {}
+    with FakeHuiHiFiServer(latency=args.latency) as server:
+        server.slow_every = args.slow_every
+        server.slow_latency = args.slow
+        for mode, run in (("threads", _run_threaded), ("async", _run_async)):
+            for hedged in (False, True):
+                hedger = Hedger("huihifi", budget=args.budget) if hedged else None
+                results[(mode, hedged)] = result = run(server, args.searches, hedger)
+                print(f"  {mode:>7} {'hedged' if hedged else 'plain':>6}: {result}")
+    for mode in ("threads", "async"):
+        plain, hedged = results[(mode, False)], results[(mode, True)]
+        assert hedged["p99_ms"] < plain["p99_ms"], f"{mode} 对冲未降低尾延迟"
+        assert hedged["hedges"] <= args.searches * args.budget + 10, f"{mode} 对冲超出预算"
+
+
+if __name__ == "__main__":
+    main()
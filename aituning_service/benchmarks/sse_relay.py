@@ -0,0 +1,110 @@
+"""
+CPU cost per streamed token of the chat SSE relays.
+
+A local Dify stand-in, running in a child process so its CPU is not
+counted, streams ``--events`` answer events per chat. Each relay consumes
+the stream exactly as the chat route would and every chunk it yields is
+sent to a socket drained by the child, the way the WSGI server writes it
+to the browser. The parent's CPU time is divided by the number of events. The passthrough output is checked to be
+byte-identical to the upstream stream, and the line relay's output to
+carry the same ``data:`` events.
+"""
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List
+
+import requests
+
+from ..services import DifyClient
+from ..streaming import StreamStats, relay_lines, relay_passthrough
+from .fakes import FakeDifyServer, dify_sse_events
+
+
+def _drain(sink: socket.socket) -> None:
+    while sink.recv(1 << 20):
+        pass
+
+
+def _serve(connection, sink: socket.socket, events: int) -> None:
+    threading.Thread(target=_drain, args=(sink,), daemon=True).start()
+    with FakeDifyServer(events=events) as server:
+        connection.send(server.base_url)
+        connection.recv()
+
+
+def _data_lines(body: bytes) -> List[bytes]:
+    return [line for line in body.split(b"\n") if line.startswith(b"data: ")]
+
+
+def _measure(
+    client: DifyClient,
+    browser: socket.socket,
+    streams: int,
+    relay: Callable[[requests.Response, Callable[[StreamStats], None]], Iterator[bytes]],
+) -> Dict[str, Any]:
+    stats: List[StreamStats] = []
+    output = b""
+    cpu = wall = 0.0
+    for _ in range(streams):
+        response = client.stream_chat("bench", "", "bench-user", None, None)
+        cpu_began, wall_began = time.process_time(), time.perf_counter()
+        chunks = []
+        for chunk in relay(response, stats.append):
+            browser.sendall(chunk)
+            chunks.append(chunk)
+        output = b"".join(chunks)
+        cpu += time.process_time() - cpu_began
+        wall += time.perf_counter() - wall_began
+    return {"cpu": cpu, "wall": wall, "bytes": stats[-1].bytes, "chunks": stats[-1].chunks, "output": output}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=20000, help="answer events per stream")
+    parser.add_argument("--streams", type=int, default=5)
+    args = parser.parse_args()
+
+    parent, child = multiprocessing.Pipe()
+    browser, sink = socket.socketpair()
+    server = multiprocessing.Process(target=_serve, args=(child, sink, args.events), daemon=True)
+    server.start()
+    client = DifyClient(parent.recv(), "bench-dify-key")
+    expected = b"".join(dify_sse_events(args.events))
+
+    relays = {
+        "lines": lambda response, done: relay_lines(response, on_complete=done),
+        "passthrough": lambda response, done: relay_passthrough(response, heartbeat_interval=0, on_complete=done),
+        "passthrough+heartbeat": lambda response, done: relay_passthrough(response, on_complete=done),
+    }
+    try:
+        results = {name: _measure(client, browser, args.streams, relay) for name, relay in relays.items()}
+    finally:
+        parent.send("stop")
+        server.join(5)
+
+    for name, result in results.items():
+        if name.startswith("passthrough"):
+            assert result["output"] == expected, f"{name} 输出与上游不一致"
+        else:
+            assert _data_lines(result["output"]) == _data_lines(expected), f"{name} 事件与上游不一致"
+
+    tokens = args.events * args.streams
+    baseline = results["lines"]["cpu"] / tokens
+    print(f"{args.streams} streams x {args.events + 1} events, {len(expected)} bytes each")
+    for name, result in results.items():
+        per_token = result["cpu"] / tokens
+        print(
+            f"{name:>22}: cpu/token={per_token * 1e6:.2f}us "
+            f"({baseline / per_token:.1f}x), chunks={result['chunks']}, "
+            f"wall/stream={result['wall'] / args.streams * 1e3:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
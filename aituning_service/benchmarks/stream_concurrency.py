@@ -0,0 +1,180 @@
+"""
+Concurrent chat streams: thread-pooled WSGI app versus the asyncio app.
+
+Opens ``--streams`` simultaneous ``/api/chat`` requests against each serving
+mode, both proxying a local Dify stand-in that streams slowly, and reports
+time to first byte, total stream time and how many upstream streams were
+actually open at once. The WSGI app runs behind a fixed pool of
+``--threads`` workers, the way gthread or waitress would serve it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import resource
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import aiohttp
+from aiohttp import web
+from werkzeug.serving import BaseWSGIServer
+
+from ..aio_app import create_async_app
+from ..app import create_app
+from ..config import Settings
+from .fakes import FakeDifyServer
+
+_ORIGIN = "http://localhost:3000"
+
+
+class _PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server that hands each connection to a bounded thread pool."""
+
+    request_queue_size = 1024
+
+    def __init__(self, app: Any, threads: int) -> None:
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+        super().__init__("127.0.0.1", 0, app)
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        self._pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request: Any, client_address: Any) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def _raise_fd_limit(streams: int) -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, max(soft, streams * 4 + 256))
+    if wanted > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+
+def _settings(dify: FakeDifyServer, database_path: str) -> Settings:
+    return Settings(
+        dify_api_key="bench-dify-key",
+        dify_base_url=dify.base_url,
+        daily_limit=1_000_000,
+        database_path=database_path,
+        usage_backend="memory",
+        product_cache_ttl=0,
+        product_catalog_path="",
+        # Measure the server itself, not the admission limits.
+        admission_max_streams=0,
+        admission_rate=0,
+    )
+
+
+def _serve_wsgi(settings: Settings, threads: int) -> Tuple[str, Any]:
+    server = _PooledWSGIServer(create_app(settings), threads)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop() -> None:
+        server.shutdown()
+        server.server_close()
+
+    return f"http://127.0.0.1:{server.port}", stop
+
+
+def _serve_async(settings: Settings) -> Tuple[str, Any]:
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(create_async_app(settings), access_log=None)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    def stop() -> None:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    return f"http://127.0.0.1:{port}", stop
+
+
+async def _one_stream(session: aiohttp.ClientSession, url: str, index: int) -> Tuple[float, float, int]:
+    began = time.perf_counter()
+    body = {"userToken": f"bench-user-{index}", "message": "推荐一款适合古典乐的耳机"}
+    async with session.post(f"{url}/api/chat", json=body, headers={"Origin": _ORIGIN}) as response:
+        response.raise_for_status()
+        first_byte = None
+        received = 0
+        async for chunk in response.content.iter_any():
+            if first_byte is None:
+                first_byte = time.perf_counter() - began
+            received += len(chunk)
+    return first_byte or 0.0, time.perf_counter() - began, received
+
+
+async def _drive(url: str, streams: int) -> Dict[str, Any]:
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=600)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        began = time.perf_counter()
+        results = await asyncio.gather(*(_one_stream(session, url, n) for n in range(streams)))
+        wall = time.perf_counter() - began
+
+    ttfb = sorted(result[0] for result in results)
+    total = sorted(result[1] for result in results)
+    return {
+        "wall_s": round(wall, 2),
+        "ttfb_p50_ms": round(statistics.median(ttfb) * 1e3, 1),
+        "ttfb_p99_ms": round(ttfb[int(len(ttfb) * 0.99) - 1 if len(ttfb) > 1 else 0] * 1e3, 1),
+        "stream_p50_s": round(statistics.median(total), 2),
+        "stream_max_s": round(total[-1], 2),
+        "bytes": sum(result[2] for result in results),
+    }
+
+
+def _run(mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    with FakeDifyServer(latency=args.latency, events=args.events, interval=args.interval) as dify:
+        # Left in place: the write-behind flusher still writes here at exit.
+        directory = tempfile.mkdtemp(prefix="stream-bench-")
+        settings = _settings(dify, f"{directory}/usage.db")
+        if mode == "wsgi":
+            url, stop = _serve_wsgi(settings, args.threads)
+        else:
+            url, stop = _serve_async(settings)
+        try:
+            result = asyncio.run(_drive(url, args.streams))
+        finally:
+            stop()
+        result["peak_upstream_streams"] = dify.peak_streams
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=32, help="worker threads for the WSGI app")
+    parser.add_argument("--events", type=int, default=20, help="answer chunks per Dify stream")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between answer chunks")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before Dify's first event")
+    args = parser.parse_args()
+
+    _raise_fd_limit(args.streams)
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    rows: List[Tuple[str, Dict[str, Any]]] = [
+        (f"wsgi ({args.threads} threads)", _run("wsgi", args)),
+        ("asyncio", _run("async", args)),
+    ]
+
+    print(f"{args.streams} concurrent streams, {args.events} chunks every {args.interval}s")
+    for label, result in rows:
+        print(f"{label:>20}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Cost of announcing answer tags as SSE events.
+
+A long answer (``--tokens`` deltas of a few characters, with a
+``<freq_manipulation>`` tag every ``--tag-every`` deltas and a closing
+``<segment_cover>``) is parsed three ways: the regexes re-run over the
+accumulated text after every delta (what re-parsing on each chunk costs),
+``TagParser`` fed each delta, and ``TagEventScanner`` over the SSE bytes
+(JSON decoding included), compared with forwarding the bytes unchanged.
+That the tags found do not depend on how the stream is split is tested in
+``tests/test_tag_events.py``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import time
+from typing import Any, Callable, List, Sequence, Tuple
+
+from ..streaming import TagEventScanner
+from ..tags import TagParser
+from .fakes import dify_sse_events
+
+MANIPULATION_TAG = re.compile(r"<freq_manipulation>([\s\S]*?)</freq_manipulation>")
+SEGMENT_COVER_TAG = re.compile(r"<segment_cover>([\s\S]*?)</segment_cover>")
+
+
+def _regex_tags(text: str) -> List[Tuple[str, Any]]:
+    found = [(m.start(), "freq_manipulation", json.loads(m.group(1))) for m in MANIPULATION_TAG.finditer(text)]
+    found += [(m.start(), "segment_cover", json.loads(m.group(1))) for m in SEGMENT_COVER_TAG.finditer(text)]
+    return [(name, body) for _, name, body in sorted(found, key=lambda item: item[0])]
+
+
+def build_answer(tokens: int, tag_every: int, rng: random.Random) -> List[str]:
+    """Split an answer with embedded tags into deltas of 1-6 characters, as an LLM streams it."""
+    parts = []
+    for n in range(tokens // 3):
+        parts.append(f"第{n}句建议：提升中频的清晰度。")
+        if tag_every and n % tag_every == tag_every - 1:
+            manipulation = {
+                "manipulationType": "add",
+                "filterParams": {"filterType": "peaking", "freq": 1000 + n, "gain": -2.5, "qFactor": 1.4},
+            }
+            parts.append(f"<freq_manipulation>{json.dumps(manipulation, ensure_ascii=False)}</freq_manipulation>")
+    cover = {"data_list": [{"uuid": "p-1", "frequency_range": [20, 200]}]}
+    parts.append(f"<segment_cover>{json.dumps(cover)}</segment_cover>完毕。")
+    text = "".join(parts)
+    deltas, position = [], 0
+    while position < len(text):
+        size = rng.randint(1, 6)
+        deltas.append(text[position : position + size])
+        position += size
+    return deltas
+
+
+def _split(data: bytes, cuts: Sequence[int]) -> List[bytes]:
+    edges = [0, *sorted(cuts), len(data)]
+    return [data[a:b] for a, b in zip(edges, edges[1:])]
+
+
+def _cpu(action: Callable[[], Any]) -> float:
+    began = time.process_time()
+    action()
+    return time.process_time() - began
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=20000, help="answer deltas in the long response")
+    parser.add_argument("--tag-every", type=int, default=200, help="sentences between manipulation tags")
+    args = parser.parse_args()
+
+    rng = random.Random(15)
+    deltas = build_answer(args.tokens, args.tag_every, rng)
+    answer = "".join(deltas)
+    events = dify_sse_events(len(deltas), answers=deltas)
+    stream = b"".join(events)
+    # Upstream chunks as the relay reads them: a few events at a time.
+    chunks = _split(stream, sorted(rng.sample(range(1, len(stream)), len(events) // 3)))
+
+    expected = _regex_tags(answer)
+
+    def accumulated_regex() -> None:
+        text = ""
+        for delta in deltas:
+            text += delta
+            _regex_tags(text)
+
+    def incremental() -> None:
+        tag_parser = TagParser()
+        for delta in deltas:
+            tag_parser.feed(delta)
+
+    def scanned() -> None:
+        scanner = TagEventScanner()
+        for chunk in chunks:
+            scanner.scan(chunk)
+
+    def forwarded() -> None:
+        for chunk in chunks:
+            bytes(chunk)
+
+    timings = {
+        "regex over accumulated": _cpu(accumulated_regex),
+        "TagParser": _cpu(incremental),
+        "TagEventScanner": _cpu(scanned),
+        "forward only": _cpu(forwarded),
+    }
+    print(
+        f"{len(deltas)} deltas, {len(answer)} chars, "
+        f"{len(expected)} tags, {len(stream)} bytes in {len(chunks)} chunks"
+    )
+    for name, seconds in timings.items():
+        print(f"{name:>24}: {seconds * 1e3:9.1f} ms, {seconds / len(deltas) * 1e6:7.2f} us/delta")
+
+
+if __name__ == "__main__":
+    main()
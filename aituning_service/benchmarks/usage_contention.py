@@ -0,0 +1,131 @@
+"""
+Multi-process quota contention benchmark.
+
+Several worker processes charge quota against one database at the same time,
+comparing the original per-request-connection code path with the pooled
+``UsageRepository`` and the ``SharedMemoryUsageRepository`` backend.
+"""
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date
+from typing import List
+
+from ..storage import SharedMemoryUsageRepository, UsageRepository
+
+BACKENDS = ("per-request", "sqlite", "shared")
+
+
+def _legacy_consume(database_path: str, user_token: str, daily_limit: int) -> bool:
+    """The pre-pooling implementation: fresh connection, SELECT, then INSERT OR REPLACE."""
+    today = date.today().isoformat()
+    conn = sqlite3.connect(database_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT usage_count FROM user_usage WHERE user_token = ? AND usage_date = ?",
+            (user_token, today),
+        )
+        row = cursor.fetchone()
+        if row and int(row[0]) >= daily_limit:
+            return False
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO user_usage (user_token, usage_date, usage_count, updated_at)
+            VALUES (
+                ?,
+                ?,
+                COALESCE(
+                    (SELECT usage_count FROM user_usage WHERE user_token = ? AND usage_date = ?),
+                    0
+                ) + 1,
+                CURRENT_TIMESTAMP
+            )
+            """,
+            (user_token, today, user_token, today),
+        )
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def _worker(backend: str, database_path: str, worker_id: int, operations: int, tokens: int, start, results) -> None:
+    limit = operations * 1000
+    if backend == "sqlite":
+        repo = UsageRepository(database_path, limit, busy_timeout=30)
+        consume = repo.try_consume
+    elif backend == "shared":
+        repo = SharedMemoryUsageRepository(database_path, limit, table_path=f"{database_path}.quota")
+        repo.init_database()
+        consume = repo.try_consume
+    else:
+        def consume(user_token: str) -> bool:
+            return _legacy_consume(database_path, user_token, limit)
+
+    latencies: List[float] = []
+    start.wait()
+    for index in range(operations):
+        user_token = f"user-{(worker_id * 7919 + index) % tokens}"
+        began = time.perf_counter()
+        consume(user_token)
+        latencies.append(time.perf_counter() - began)
+
+    if backend == "shared":
+        repo.shutdown()
+    results.put(latencies)
+
+
+def run(backend: str, workers: int, operations: int, tokens: int) -> dict:
+    database_path = os.path.join(tempfile.mkdtemp(prefix=f"usage-{backend}-"), "usage.db")
+    UsageRepository(database_path, 0).init_database()
+
+    start = multiprocessing.Barrier(workers + 1)
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_worker, args=(backend, database_path, i, operations, tokens, start, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    start.wait()
+    began = time.perf_counter()
+    latencies: List[float] = []
+    for _ in processes:
+        latencies.extend(results.get())
+    elapsed = time.perf_counter() - began
+    for process in processes:
+        process.join()
+
+    latencies.sort()
+    return {
+        "backend": backend,
+        "ops_per_sec": round(len(latencies) / elapsed),
+        "p50_us": round(statistics.median(latencies) * 1e6, 1),
+        "p99_us": round(latencies[int(len(latencies) * 0.99) - 1] * 1e6, 1),
+        "max_ms": round(latencies[-1] * 1e3, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=2000, help="charges per worker")
+    parser.add_argument("--tokens", type=int, default=500, help="distinct user tokens")
+    parser.add_argument("--backend", choices=BACKENDS, action="append")
+    args = parser.parse_args()
+
+    for backend in args.backend or BACKENDS:
+        result = run(backend, args.workers, args.operations, args.tokens)
+        print("  ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
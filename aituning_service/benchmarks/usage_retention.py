@@ -0,0 +1,110 @@
+"""
+Quota lookup latency on a year of synthetic usage, before and after compaction.
+
+Builds a ``user_usage`` table with ``--days`` x ``--tokens-per-day`` rows,
+times ``get_usage``/``try_consume`` on random tokens, runs the retention
+maintenance in bounded chunks, and times the lookups again.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict
+
+from ..storage import UsageRepository
+
+
+def _populate(database_path: str, days: int, tokens_per_day: int, token_pool: int) -> None:
+    UsageRepository(database_path, 0).init_database()
+    conn = sqlite3.connect(database_path, isolation_level=None)
+    conn.execute("PRAGMA synchronous=OFF")
+    rng = random.Random(42)
+    today = date.today()
+    conn.execute("BEGIN")
+    for offset in range(days, -1, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        tokens = rng.sample(range(token_pool), tokens_per_day)
+        conn.executemany(
+            "INSERT INTO user_usage (user_token, usage_date, usage_count) VALUES (?, ?, ?)",
+            ((f"user-{token}", day, rng.randint(1, 10)) for token in tokens),
+        )
+    conn.execute("COMMIT")
+    conn.close()
+
+
+def _time_lookups(repo: UsageRepository, samples: int, token_pool: int) -> Dict[str, float]:
+    rng = random.Random(7)
+    results: Dict[str, float] = {}
+    operations: Dict[str, Callable[[str], object]] = {
+        "get_usage": repo.get_usage,
+        "try_consume": repo.try_consume,
+    }
+    for name, operation in operations.items():
+        latencies = []
+        for _ in range(samples):
+            user_token = f"user-{rng.randrange(token_pool)}"
+            began = time.perf_counter()
+            operation(user_token)
+            latencies.append(time.perf_counter() - began)
+        latencies.sort()
+        results[f"{name}_p50_us"] = round(statistics.median(latencies) * 1e6, 1)
+        results[f"{name}_p99_us"] = round(latencies[int(samples * 0.99) - 1] * 1e6, 1)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--tokens-per-day", type=int, default=8000)
+    parser.add_argument("--token-pool", type=int, default=50000)
+    parser.add_argument("--retention-days", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--samples", type=int, default=20000)
+    args = parser.parse_args()
+
+    database_path = os.path.join(tempfile.mkdtemp(prefix="usage-retention-"), "usage.db")
+    began = time.perf_counter()
+    _populate(database_path, args.days, args.tokens_per_day, args.token_pool)
+    repo = UsageRepository(database_path, daily_limit=10**9)
+    with repo._connect() as conn:
+        (rows,) = conn.execute("SELECT COUNT(*) FROM user_usage").fetchone()
+    print(f"populated {rows} rows in {time.perf_counter() - began:.1f}s, {os.path.getsize(database_path) >> 20} MiB")
+    print("before:", _time_lookups(repo, args.samples, args.token_pool))
+
+    chunk_times = []
+    while True:
+        chunk_began = time.perf_counter()
+        removed = repo.compact_usage(args.retention_days, args.batch_size)
+        chunk_times.append(time.perf_counter() - chunk_began)
+        if removed < args.batch_size:
+            break
+    released = 0
+    while True:
+        pages = repo.vacuum_incremental(20000)
+        released += pages
+        if pages == 0:
+            break
+    repo.close()
+    repo = UsageRepository(database_path, daily_limit=10**9)
+    with repo._connect() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        (rows,) = conn.execute("SELECT COUNT(*) FROM user_usage").fetchone()
+        (totals,) = conn.execute("SELECT COUNT(*) FROM user_usage_totals").fetchone()
+
+    print(
+        f"compacted in {len(chunk_times)} chunks, max chunk {max(chunk_times) * 1e3:.1f} ms, "
+        f"released {released} pages; {rows} daily rows + {totals} totals, "
+        f"{os.path.getsize(database_path) >> 20} MiB"
+    )
+    print("after: ", _time_lookups(repo, args.samples, args.token_pool))
+
+
+if __name__ == "__main__":
+    main()
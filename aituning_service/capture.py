@@ -0,0 +1,173 @@
+"""
+Sanitized capture of the request mix, for replay against a staging build.
+
+With ``CAPTURE_PATH`` set, every ``/api/chat``, ``/api/products/search``
+and ``/api/usage`` request (or the ``CAPTURE_SAMPLE_RATE`` fraction of
+them) is written as one JSON line: when it came, how long the handler
+took, its status, the request and response sizes, and the shape of the
+request. Nothing a user typed or sent is kept: user tokens, messages,
+filters, keywords and curve images become keyed hashes (``CAPTURE_SALT``),
+which still show repeats, plus their lengths. Lines are written by a
+background thread to a file rotated at ``CAPTURE_MAX_BYTES``, with the
+older files gzipped.
+
+``python -m aituning_service.benchmarks.replay`` drives a captured mix
+against the app.
+"""
+
+from __future__ import annotations
+
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import time
+from logging.handlers import QueueListener, RotatingFileHandler
+from typing import Any, Dict, Optional
+
+from .metrics import CAPTURE_RECORDS
+
+logger = logging.getLogger(__name__)
+
+ROUTES = {"/api/chat": "chat", "/api/products/search": "search"}
+_USAGE_PREFIX = "/api/usage/"
+
+
+def route_name(path: str) -> Optional[str]:
+    """The captured route a request path belongs to, or None."""
+    if path.startswith(_USAGE_PREFIX):
+        return "usage"
+    return ROUTES.get(path.rstrip("/"))
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as plain, gzip.open(dest, "wb") as packed:
+        shutil.copyfileobj(plain, packed)
+    os.remove(source)
+
+
+class TrafficCapture:
+    """Describe captured requests and hand their lines to a background writer."""
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 16 << 20,
+        backups: int = 5,
+        sample_rate: float = 1.0,
+        salt: str = "",
+        queue_size: int = 10000,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self._salt = hashlib.blake2b(salt.encode("utf-8"), digest_size=32).digest()
+        # Each worker process writes its own file; "{pid}" in the path tells them apart.
+        self.path = path.replace("{pid}", str(os.getpid()))
+        handler = RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        handler.namer = lambda name: name + ".gz"
+        handler.rotator = _gzip_rotator
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._handler = handler
+        self._queue: queue.Queue = queue.Queue(queue_size)
+        self._listener = QueueListener(self._queue, handler)
+        self._listener.start()
+        atexit.register(self.close)
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def digest(self, value: Any) -> str:
+        """Keyed hash of a user-supplied value; equal values get equal hashes."""
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False, sort_keys=True)
+        return hashlib.blake2b(value.encode("utf-8"), digest_size=6, key=self._salt).hexdigest()
+
+    def record(
+        self,
+        route: str,
+        status: int,
+        seconds: float,
+        request_bytes: Optional[int],
+        response_bytes: Optional[int],
+        payload: Any = None,
+        user_token: Optional[str] = None,
+    ) -> None:
+        """Queue the line of one request; called after its handler returned."""
+        payload = payload if isinstance(payload, dict) else {}
+        user_token = user_token if user_token is not None else payload.get("userToken")
+        line: Dict[str, Any] = {
+            "t": round(time.time() - seconds, 3),
+            "route": route,
+            "status": status,
+            "ms": round(seconds * 1e3, 2),
+            "req_bytes": request_bytes,
+            "resp_bytes": response_bytes,
+            "user": self.digest(user_token) if user_token else None,
+        }
+        if route == "chat":
+            line.update(self._chat(payload))
+        elif route == "search":
+            keyword = payload.get("keyword")
+            keyword = "" if keyword is None else str(keyword).strip()
+            line["keyword"] = self.digest(keyword) if keyword else ""
+            line["keyword_len"] = len(keyword)
+            line["page_size"] = payload.get("pageSize")
+        try:
+            self._queue.put_nowait(logging.makeLogRecord({"msg": json.dumps(line, separators=(",", ":"))}))
+            CAPTURE_RECORDS.labels("written").inc()
+        except queue.Full:
+            CAPTURE_RECORDS.labels("dropped").inc()
+
+    def _chat(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        message = payload.get("message")
+        filters = payload.get("currentFilters") or ""
+        image = payload.get("curveImageBase64") or ""
+        curve = payload.get("frequencyResponse")
+        return {
+            "message": self.digest(message) if message else None,
+            "message_len": len(message) if isinstance(message, str) else 0,
+            "filters": self.digest(filters) if filters else "",
+            "filters_len": len(filters) if isinstance(filters, str) else 0,
+            "image": self.digest(image) if image else "",
+            "image_len": len(image) if isinstance(image, str) else 0,
+            "curve_points": len(curve) if isinstance(curve, list) else 0,
+            "continued": bool(payload.get("conversationId")),
+        }
+
+    def close(self) -> None:
+        """Write out what is queued and close the file."""
+        if self._listener._thread is not None:
+            self._listener.stop()
+        self._handler.close()
+
+
+def capture_flask(app: Any, capture: TrafficCapture) -> None:
+    """Capture the requests of a Flask app; for streamed chats ``ms`` ends at the first byte."""
+    from flask import g, request
+
+    def start() -> None:
+        if route_name(request.path) is not None and capture.sampled():
+            g.capture_started = time.perf_counter()
+
+    def finish(response: Any) -> Any:
+        started = g.pop("capture_started", None)
+        if started is None:
+            return response
+        route = route_name(request.path)
+        capture.record(
+            route,  # type: ignore[arg-type]
+            response.status_code,
+            time.perf_counter() - started,
+            request.content_length,
+            response.calculate_content_length(),
+            request.get_json(silent=True) if route != "usage" else None,
+            (request.view_args or {}).get("user_token") if route == "usage" else None,
+        )
+        return response
+
+    app.before_request(start)
+    app.after_request(finish)
@@ -0,0 +1,49 @@
+"""
+Product catalog mirror sync, run as ``python -m aituning_service.catalog_sync``.
+
+Pages the HuiHiFi evaluation catalog into the snapshot at
+``PRODUCT_CATALOG_PATH``: incrementally (items listed before the first one
+already held) when a snapshot exists, or from scratch with ``--full`` or once
+``PRODUCT_CATALOG_FULL_SYNC_INTERVAL`` has passed since the last full sync,
+which is what picks up edited and deleted items.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+
+from .config import Settings
+from .services import HuiHiFiClient, ProductCatalog
+
+
+def main() -> None:
+    settings = Settings()
+    parser = argparse.ArgumentParser(description="同步 HuiHiFi 产品目录到本地快照")
+    parser.add_argument("--snapshot", default=settings.product_catalog_path or "product_catalog.json.gz")
+    parser.add_argument("--full", action="store_true", help="ignore the existing snapshot and re-fetch everything")
+    args = parser.parse_args()
+
+    if not settings.huihifi_page_param:
+        parser.error("未配置 HUIHIFI_PAGE_PARAM，只能获取产品目录的第一页")
+
+    logging.basicConfig(level=logging.INFO)
+    client = HuiHiFiClient(
+        base_url=settings.huihifi_api_base_url,
+        app_key=settings.huihifi_app_key,
+        secret_key=settings.huihifi_secret_key,
+        timeout=settings.huihifi_api_timeout,
+        max_page_size=settings.huihifi_max_page_size,
+        connect_timeout=settings.huihifi_connect_timeout,
+        max_retries=settings.huihifi_max_retries,
+        page_param=settings.huihifi_page_param,
+    )
+    catalog = ProductCatalog(client, args.snapshot, full_sync_interval=settings.product_catalog_full_sync_interval)
+    if not args.full:
+        catalog.load()
+    changed = catalog.sync(full=args.full or not catalog.is_ready or catalog.full_sync_due)
+    print(f"synced {changed} items, {len(catalog)} in catalog -> {args.snapshot}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Response compression, negotiated from ``Accept-Encoding``.
+
+Whole JSON (and ``/metrics`` text) bodies from ``min_size`` bytes on are
+compressed with brotli when it is installed and accepted, else gzip.
+Streamed SSE and NDJSON bodies go through a ``StreamCompressor``, which
+flushes whenever a chunk completes an event (or line): every complete
+event reaches the client as soon as it would uncompressed, and only a
+chunk holding nothing but part of an event waits for the rest.
+"""
+
+from __future__ import annotations
+
+import zlib
+from typing import Any, Awaitable, Callable, Iterable, Iterator, Optional, Tuple
+
+from .metrics import COMPRESSION_BYTES
+
+try:  # pragma: no cover - depends on the deployment
+    import brotli
+except ImportError:  # pragma: no cover - depends on the deployment
+    brotli = None
+
+BROTLI_AVAILABLE = brotli is not None
+COMPRESSIBLE_TYPES = frozenset({"application/json", "text/plain"})
+# Streamed types and the byte sequences that end one of their events.
+STREAM_BOUNDARIES = {
+    "text/event-stream": (b"\n\n", b"\r\n\r\n"),
+    "application/x-ndjson": (b"\n",),
+}
+# Small windows for streams: each open stream holds its compressor for its whole life.
+_STREAM_GZIP_MEM_LEVEL = 6
+_STREAM_BROTLI_LGWIN = 16
+
+
+def negotiate(accept_encoding: Optional[str], stream: bool = False) -> Optional[str]:
+    """
+    ``br`` or ``gzip`` if the client accepts it, else None. Bodies prefer
+    brotli; streams prefer gzip, which stays smaller and cheaper when
+    flushed after every event.
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    for encoding in ("gzip", "br") if stream else ("br", "gzip"):
+        if encoding == "br" and not BROTLI_AVAILABLE:
+            continue
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+class StreamCompressor:
+    """Compress one streamed body, flushing whenever a chunk completes an event."""
+
+    __slots__ = ("encoding", "boundaries", "_compressor", "_tail")
+
+    def __init__(self, encoding: str, boundaries: Tuple[bytes, ...], gzip_level: int = 6, brotli_quality: int = 5) -> None:
+        self.encoding = encoding
+        self.boundaries = boundaries
+        if encoding == "br":
+            self._compressor: Any = brotli.Compressor(
+                mode=brotli.MODE_TEXT, quality=brotli_quality, lgwin=_STREAM_BROTLI_LGWIN
+            )
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31, _STREAM_GZIP_MEM_LEVEL)
+        # The end of the previous chunk, for boundaries split across two chunks.
+        self._tail = b""
+
+    def _completes_event(self, chunk: bytes) -> bool:
+        window = self._tail + chunk
+        self._tail = window[-3:]
+        return any(boundary in window for boundary in self.boundaries)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            out = self._compressor.process(chunk)
+            if self._completes_event(chunk):
+                out += self._compressor.flush()
+        else:
+            out = self._compressor.compress(chunk)
+            if self._completes_event(chunk):
+                out += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        COMPRESSION_BYTES.labels(self.encoding, "in").inc(len(chunk))
+        COMPRESSION_BYTES.labels(self.encoding, "out").inc(len(out))
+        return out
+
+    def finish(self) -> bytes:
+        out = self._compressor.finish() if self.encoding == "br" else self._compressor.flush(zlib.Z_FINISH)
+        COMPRESSION_BYTES.labels(self.encoding, "out").inc(len(out))
+        return out
+
+
+class CompressionPolicy:
+    def __init__(self, min_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5) -> None:
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def compress(self, data: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            out = brotli.compress(data, mode=brotli.MODE_TEXT, quality=self.brotli_quality)
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+            out = compressor.compress(data) + compressor.flush()
+        COMPRESSION_BYTES.labels(encoding, "in").inc(len(data))
+        COMPRESSION_BYTES.labels(encoding, "out").inc(len(out))
+        return out
+
+    def stream_compressor(self, encoding: str, mimetype: str) -> StreamCompressor:
+        return StreamCompressor(encoding, STREAM_BOUNDARIES[mimetype], self.gzip_level, self.brotli_quality)
+
+    def compress_stream(self, chunks: Iterable[bytes], encoding: str, mimetype: str) -> Iterator[bytes]:
+        """Compress a WSGI body; closing the result closes ``chunks``."""
+        compressor = self.stream_compressor(encoding, mimetype)
+        try:
+            for chunk in chunks:
+                out = compressor.compress(chunk)
+                if out:
+                    yield out
+            yield compressor.finish()
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+
+def _mimetype(content_type: Optional[str]) -> str:
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def compress_flask(app: Any, policy: CompressionPolicy) -> None:
+    """Compress the responses of a Flask app that the client accepts compressed."""
+    from flask import request
+
+    def compress(response: Any) -> Any:
+        mimetype = _mimetype(response.content_type)
+        streamed = mimetype in STREAM_BOUNDARIES and response.is_streamed
+        if not streamed and mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+        if (
+            request.method == "HEAD"
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+        encoding = negotiate(request.headers.get("Accept-Encoding"), streamed)
+        if encoding is None:
+            return response
+        if streamed:
+            response.response = policy.compress_stream(response.response, encoding, mimetype)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < policy.min_size:
+                return response
+            response.set_data(policy.compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    app.after_request(compress)
+
+
+class StreamWriter:
+    """The write side of a streamed aiohttp response, compressed when negotiated."""
+
+    __slots__ = ("_write", "_compressor")
+
+    def __init__(self, write: Callable[[bytes], Awaitable[None]], compressor: Optional[StreamCompressor]) -> None:
+        self._write = write
+        self._compressor = compressor
+
+    async def write(self, chunk: bytes) -> None:
+        if self._compressor is None:
+            await self._write(chunk)
+            return
+        out = self._compressor.compress(chunk)
+        if out:
+            await self._write(out)
+
+    async def finish(self) -> None:
+        """Write what the compressor still holds; call before ``write_eof``."""
+        if self._compressor is not None:
+            await self._write(self._compressor.finish())
@@ -25,6 +25,11 @@ ALLOWED_ORIGINS: List[str] = [
     "https://www.huihifi.com",
 ]
 
+USAGE_BACKENDS = ("sqlite", "memory", "shared")
+RELAY_MODES = ("passthrough", "lines")
+WORKER_MODELS = ("threads", "async")
+LOG_FORMATS = ("text", "json")
+
 
 @dataclass
 class Settings:
@@ -32,14 +37,134 @@ class Settings:
 
     dify_api_key: Optional[str] = os.getenv("DIFY_API_KEY")
     dify_base_url: str = os.getenv("DIFY_BASE_URL", "http://49.232.175.67/v1")
+    dify_connect_timeout: float = float(os.getenv("DIFY_CONNECT_TIMEOUT", "3.05"))
+    # Longest wait for Dify to start answering a chat, then the longest silence mid-stream.
+    dify_first_byte_timeout: float = float(os.getenv("DIFY_FIRST_BYTE_TIMEOUT", "30"))
+    dify_read_timeout: float = float(os.getenv("DIFY_READ_TIMEOUT", "60"))
+    dify_upload_timeout: float = float(os.getenv("DIFY_UPLOAD_TIMEOUT", "30"))
+    dify_pool_size: int = int(os.getenv("DIFY_POOL_SIZE", "20"))
+    # Reuse the Dify file of an unchanged curve image; keep the TTL below the
+    # Dify server's retention for uploaded files. 0 disables the cache.
+    dify_upload_cache_ttl: float = float(os.getenv("DIFY_UPLOAD_CACHE_TTL", "3600"))
+    dify_upload_cache_max_entries: int = int(os.getenv("DIFY_UPLOAD_CACHE_MAX_ENTRIES", "4096"))
     daily_limit: int = int(os.getenv("DAILY_LIMIT", "10"))
     database_path: str = os.getenv("USAGE_DATABASE_PATH", "usage.db")
+    # "sqlite" charges quota directly in usage.db; "memory" serves it from
+    # in-process counters flushed in the background (single process only);
+    # "shared" uses a memory-mapped table shared by all workers on the host.
+    usage_backend: str = os.getenv("USAGE_BACKEND", "sqlite")
+    usage_flush_interval: float = float(os.getenv("USAGE_FLUSH_INTERVAL", "2"))
+    usage_flush_threshold: int = int(os.getenv("USAGE_FLUSH_THRESHOLD", "100"))
+    # Defaults to "<database_path>.quota"; point it at /dev/shm on Linux hosts.
+    usage_shared_table_path: str = os.getenv("USAGE_SHARED_TABLE_PATH", "")
+    usage_shared_table_slots: int = int(os.getenv("USAGE_SHARED_TABLE_SLOTS", "65536"))
+    usage_retention_days: int = int(os.getenv("USAGE_RETENTION_DAYS", "90"))
+
+    # Log-spaced points (20 Hz-20 kHz) a numeric frequency response is resampled to;
+    # 120 is 1/12 octave.
+    chat_curve_points: int = int(os.getenv("CHAT_CURVE_POINTS", "120"))
+    # "passthrough" forwards Dify's bytes unchanged; "lines" re-frames them line by line.
+    chat_relay_mode: str = os.getenv("CHAT_RELAY_MODE", "passthrough")
+    # Seconds of upstream silence before a ": ping" comment is sent; 0 disables heartbeats.
+    chat_heartbeat_interval: float = float(os.getenv("CHAT_HEARTBEAT_INTERVAL", "15"))
+    # Announce each closed <freq_manipulation>/<segment_cover> tag in the answer as its own
+    # tag_freq_manipulation/tag_segment_cover SSE event. Off until the micro-app handles them:
+    # it warns about events it does not know.
+    chat_tag_events: bool = os.getenv("CHAT_TAG_EVENTS", "false").lower() in ("1", "true", "yes")
+    # Replay recorded answers to identical first-turn chats from this SQLite file; empty disables it.
+    # A replayed answer carries no conversation id, so the user's follow-up opens a new Dify
+    # conversation that has not seen the first question or answer; the model answers it cold.
+    answer_cache_path: str = os.getenv("ANSWER_CACHE_PATH", "")
+    answer_cache_max_bytes: int = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(64 << 20)))
+    answer_cache_ttl: float = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+    # Pace of replayed answers relative to the recording; 0 sends them at once.
+    answer_cache_replay_speed: float = float(os.getenv("ANSWER_CACHE_REPLAY_SPEED", "1"))
+    # Whether a replayed answer uses up one of the user's daily chats.
+    answer_cache_charge_quota: bool = os.getenv("ANSWER_CACHE_CHARGE_QUOTA", "true").lower() in ("1", "true", "yes")
+
+    # Logging (logs.py): records are written by a background thread as "text" or "json" lines.
+    log_level: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    log_format: str = os.getenv("LOG_FORMAT", "text")
+    # Records waiting for the writer thread; beyond this they are dropped, never waited for.
+    log_queue_size: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # Fraction of upstream calls whose request payload is logged.
+    log_payload_sample_rate: float = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1"))
+    # Longer strings in logged payloads (base64 images, curves, filters) are cut to this.
+    log_max_field_chars: int = int(os.getenv("LOG_MAX_FIELD_CHARS", "256"))
+
+    # Sanitized capture of chat, product search and usage requests (capture.py); empty disables it.
+    # With several workers put "{pid}" in the path, so each writes its own file.
+    capture_path: str = os.getenv("CAPTURE_PATH", "")
+    capture_max_bytes: int = int(os.getenv("CAPTURE_MAX_BYTES", str(16 << 20)))
+    capture_backups: int = int(os.getenv("CAPTURE_BACKUPS", "5"))
+    capture_sample_rate: float = float(os.getenv("CAPTURE_SAMPLE_RATE", "1"))
+    # Key for the hashes of tokens, messages and keywords; keep it secret and stable across workers.
+    capture_salt: str = os.getenv("CAPTURE_SALT", "")
+
+    # Admission control for /api/chat, per worker process (see admission.py): with
+    # SERVER_WORKERS > 1, divide the stream cap and the per-user rate by the worker count.
+    # Upstream streams at once; 0 removes the cap.
+    admission_max_streams: int = int(os.getenv("ADMISSION_MAX_STREAMS", "16"))
+    # Requests that may wait for a stream slot, and how long, before a 503.
+    admission_queue_size: int = int(os.getenv("ADMISSION_QUEUE_SIZE", "8"))
+    admission_queue_timeout: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+    admission_max_queued_per_user: int = int(os.getenv("ADMISSION_MAX_QUEUED_PER_USER", "2"))
+    # Per-user token bucket: chats per second, and how many may come at once. Off (0) by
+    # default; e.g. ADMISSION_RATE=0.1 with ADMISSION_BURST=3 allows three chats, then one per 10 s.
+    admission_rate: float = float(os.getenv("ADMISSION_RATE", "0"))
+    admission_burst: int = int(os.getenv("ADMISSION_BURST", "3"))
+
+    # python -m aituning_service.main: "threads" serves the Flask app from threaded
+    # workers, "async" the aiohttp app from event-loop workers.
+    server_worker_model: str = os.getenv("SERVER_WORKER_MODEL", "threads")
+    # Worker processes; 0 starts one per CPU. /metrics, the admission limits, the product
+    # cache and the circuit breakers are per worker: with N workers the limits admit N times
+    # as much and a scrape reports only the worker that served it.
+    server_workers: int = int(os.getenv("SERVER_WORKERS", "1"))
+    # Request threads per "threads" worker; every open chat stream holds one.
+    server_threads: int = int(os.getenv("SERVER_THREADS", "32"))
+    server_host: str = os.getenv("SERVER_HOST", "0.0.0.0")
+    server_port: int = int(os.getenv("SERVER_PORT", "5005"))
+    # Seconds open chat streams may run after SIGTERM before they are cut off.
+    server_drain_timeout: float = float(os.getenv("SERVER_DRAIN_TIMEOUT", "25"))
 
     huihifi_api_base_url: str = os.getenv("HUIHIFI_API_BASE_URL", "https://huihifi.com/api")
     huihifi_app_key: Optional[str] = os.getenv("HUIHIFI_APP_KEY")
     huihifi_secret_key: Optional[str] = os.getenv("HUIHIFI_SECRET_KEY")
-    huihifi_api_timeout: int = int(os.getenv("HUIHIFI_API_TIMEOUT", "10"))
+    huihifi_api_timeout: float = float(os.getenv("HUIHIFI_API_TIMEOUT", "10"))
+    huihifi_connect_timeout: float = float(os.getenv("HUIHIFI_CONNECT_TIMEOUT", "3.05"))
+    huihifi_max_retries: int = int(os.getenv("HUIHIFI_MAX_RETRIES", "2"))
+    huihifi_pool_size: int = int(os.getenv("HUIHIFI_POOL_SIZE", "10"))
+    # Pages fetched at once by paged scans such as /api/products/stream; capped by the pool size.
+    huihifi_page_concurrency: int = int(os.getenv("HUIHIFI_PAGE_CONCURRENCY", "4"))
+    # Set PRODUCT_CACHE_TTL=0 to send every search upstream.
+    product_cache_ttl: float = float(os.getenv("PRODUCT_CACHE_TTL", "300"))
+    product_cache_stale_ttl: float = float(os.getenv("PRODUCT_CACHE_STALE_TTL", "600"))
+    product_cache_max_entries: int = int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", "512"))
+    # When set, searches are served from a locally mirrored catalog snapshot.
+    product_catalog_path: str = os.getenv("PRODUCT_CATALOG_PATH", "")
+    product_catalog_refresh_interval: float = float(os.getenv("PRODUCT_CATALOG_REFRESH_INTERVAL", "600"))
+    # Refreshes only add newly listed items; a full sync this often picks up edits and deletions.
+    product_catalog_full_sync_interval: float = float(os.getenv("PRODUCT_CATALOG_FULL_SYNC_INTERVAL", "21600"))
     huihifi_max_page_size: int = int(os.getenv("HUIHIFI_MAX_PAGE_SIZE", "50"))
+    # Request body field for the page number. The OpenAPI documents none, so it is unset by default
+    # and listings (the product stream, the catalog sync) stop after the first page.
+    huihifi_page_param: str = os.getenv("HUIHIFI_PAGE_PARAM", "")
+    # Hedged duplicates per product search, sent once a search outlasts the recent p95; 0 disables.
+    huihifi_hedge_budget: float = float(os.getenv("HUIHIFI_HEDGE_BUDGET", "0.1"))
+
+    # Consecutive failed calls that open an upstream's circuit breaker (0 disables it), and
+    # the seconds it then fails calls at once before letting a probe through.
+    breaker_failure_threshold: int = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+    breaker_reset_timeout: float = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+    # Answer /health with 503 while a breaker is open, so a load balancer routes around this node.
+    health_fail_when_degraded: bool = os.getenv("HEALTH_FAIL_WHEN_DEGRADED", "false").lower() in ("1", "true", "yes")
+
+    # gzip/brotli for clients that accept it: JSON from COMPRESSION_MIN_SIZE bytes on, SSE and NDJSON streams always.
+    compression_enabled: bool = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+    compression_min_size: int = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+    compression_gzip_level: int = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+    compression_brotli_quality: int = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
 
     def validate(self) -> None:
         """Emit warnings for missing critical configuration."""
@@ -48,3 +173,51 @@ class Settings:
 
         if not self.huihifi_app_key or not self.huihifi_secret_key:
             logger.warning("缺少 HuiHiFi API 凭证，产品搜索接口将不可用")
+
+        if self.usage_backend not in USAGE_BACKENDS:
+            logger.warning("未知的 USAGE_BACKEND=%s，回退到 sqlite", self.usage_backend)
+            self.usage_backend = "sqlite"
+
+        if self.chat_relay_mode not in RELAY_MODES:
+            logger.warning("未知的 CHAT_RELAY_MODE=%s，回退到 passthrough", self.chat_relay_mode)
+            self.chat_relay_mode = "passthrough"
+
+        if self.chat_curve_points < 2:
+            logger.warning("CHAT_CURVE_POINTS=%s 过小，回退到 120", self.chat_curve_points)
+            self.chat_curve_points = 120
+
+        if self.server_worker_model not in WORKER_MODELS:
+            logger.warning("未知的 SERVER_WORKER_MODEL=%s，回退到 threads", self.server_worker_model)
+            self.server_worker_model = "threads"
+
+        if self.server_workers <= 0:
+            self.server_workers = os.cpu_count() or 1
+
+        if self.server_threads < 1:
+            logger.warning("SERVER_THREADS=%s 过小，回退到 32", self.server_threads)
+            self.server_threads = 32
+
+        if self.log_format not in LOG_FORMATS:
+            logger.warning("未知的 LOG_FORMAT=%s，回退到 text", self.log_format)
+            self.log_format = "text"
+
+        if not isinstance(logging.getLevelName(self.log_level), int):
+            logger.warning("未知的 LOG_LEVEL=%s，回退到 INFO", self.log_level)
+            self.log_level = "INFO"
+
+        if self.admission_rate > 0 and self.admission_burst < 1:
+            logger.warning("ADMISSION_BURST=%s 过小，回退到 1", self.admission_burst)
+            self.admission_burst = 1
+
+        if (
+            self.server_worker_model == "threads"
+            and self.admission_max_streams > 0
+            and self.admission_max_streams + self.admission_queue_size >= self.server_threads
+        ):
+            logger.warning(
+                "ADMISSION_MAX_STREAMS + ADMISSION_QUEUE_SIZE 不小于 SERVER_THREADS=%s，聊天请求可能占满所有线程",
+                self.server_threads,
+            )
+
+        if not self.usage_shared_table_path:
+            self.usage_shared_table_path = f"{self.database_path}.quota"
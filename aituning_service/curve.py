@@ -0,0 +1,188 @@
+"""Frequency-response point lists: parsing, log-grid resampling and the compact text sent to Dify."""
+
+from __future__ import annotations
+
+import bisect
+import math
+from typing import Any, Dict, List, Sequence, Tuple
+
+try:  # pragma: no cover - depends on the deployment
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the deployment
+    np = None
+
+CURVE_BACKEND = "numpy" if np is not None else "python"
+
+# Frequency range the tuning UI plots.
+GRID_MIN_HZ = 20.0
+GRID_MAX_HZ = 20000.0
+MAX_INPUT_POINTS = 20000
+
+
+class CurveError(ValueError):
+    """Raised when a frequency-response point list cannot be used."""
+
+
+def log_grid(points: int, f_min: float = GRID_MIN_HZ, f_max: float = GRID_MAX_HZ) -> List[float]:
+    """``points`` frequencies evenly spaced on a log axis from ``f_min`` to ``f_max``."""
+    if points < 2:
+        raise CurveError("重采样点数至少为 2")
+    ratio = math.log(f_max / f_min) / (points - 1)
+    return [f_min * math.exp(ratio * i) for i in range(points)]
+
+
+def parse_frequency_response(rows: Any) -> Tuple[Sequence[float], Sequence[float]]:
+    """
+    Read ``[["Freq(Hz)", "SPL(dB)"], ["20", "96.91"], ...]`` into ascending
+    frequency and SPL sequences. The header row is optional and values may be
+    strings or numbers, as the main app's measurement files are.
+    """
+    if not isinstance(rows, list) or not rows:
+        raise CurveError("频率响应数据必须是非空数组")
+    if len(rows) > MAX_INPUT_POINTS + 1:
+        raise CurveError(f"频率响应数据点过多 (最多 {MAX_INPUT_POINTS} 个)")
+
+    first = rows[0]
+    if isinstance(first, list) and first and isinstance(first[0], str) and not _is_number(first[0]):
+        rows = rows[1:]
+    if len(rows) < 2:
+        raise CurveError("频率响应数据至少需要 2 个点")
+
+    freqs, spl = _parse_numpy(rows) if np is not None else _parse_python(rows)
+    # Repeated frequencies were merged, which can leave a single point.
+    if len(freqs) < 2:
+        raise CurveError("频率响应数据至少需要 2 个点")
+    return freqs, spl
+
+
+def _parse_python(rows: List[Any]) -> Tuple[Sequence[float], Sequence[float]]:
+    freqs: List[float] = []
+    spl: List[float] = []
+    try:
+        for row in rows:
+            freq, level = float(row[0]), float(row[1])
+            if not (math.isfinite(freq) and math.isfinite(level)) or freq <= 0:
+                raise ValueError(row)
+            freqs.append(freq)
+            spl.append(level)
+    except (TypeError, ValueError, OverflowError, IndexError, KeyError) as exc:
+        raise CurveError("频率响应数据格式错误") from exc
+
+    if any(b <= a for a, b in zip(freqs, freqs[1:])):
+        # Sorted, keeping the first level given for a repeated frequency, as np.unique does.
+        first: Dict[float, float] = {}
+        for freq, level in zip(freqs, spl):
+            first.setdefault(freq, level)
+        freqs = sorted(first)
+        spl = [first[freq] for freq in freqs]
+    return freqs, spl
+
+
+def _parse_numpy(rows: List[Any]) -> Tuple[Sequence[float], Sequence[float]]:
+    try:
+        # Converts numeric strings too; ragged or non-numeric rows raise.
+        data = np.array(rows, dtype=float)
+    except (TypeError, ValueError, OverflowError) as exc:
+        raise CurveError("频率响应数据格式错误") from exc
+    if data.ndim != 2 or data.shape[1] < 2:
+        raise CurveError("频率响应数据格式错误")
+    freqs, spl = data[:, 0], data[:, 1]
+    if not (np.isfinite(data[:, :2]).all() and (freqs > 0).all()):
+        raise CurveError("频率响应数据格式错误")
+    if (np.diff(freqs) <= 0).any():
+        freqs, index = np.unique(freqs, return_index=True)
+        spl = spl[index]
+    return freqs, spl
+
+
+def resample_log(
+    freqs: Sequence[float],
+    spl: Sequence[float],
+    grid: Sequence[float],
+) -> List[float]:
+    """
+    Mean SPL over each ``grid`` point's band on a log-frequency axis.
+
+    Each band runs between the geometric midpoints of its neighbours, so
+    every measured point counts once and a narrow peak is averaged into its
+    band rather than hit or missed by a point sample. ``freqs`` must be
+    ascending; grid points outside the measured range take the nearest value.
+    """
+    if np is not None:
+        x = np.log(np.asarray(freqs, dtype=float))
+        y = np.asarray(spl, dtype=float)
+        centres = np.log(np.asarray(grid, dtype=float))
+        # Running integral of SPL over log frequency (trapezoid rule).
+        area = np.concatenate(([0.0], np.cumsum((y[1:] + y[:-1]) * np.diff(x) / 2)))
+        edges = np.clip(np.concatenate(([centres[0]], (centres[1:] + centres[:-1]) / 2, [centres[-1]])), x[0], x[-1])
+        # Exact integral of the piecewise-linear curve up to each edge.
+        index = np.clip(np.searchsorted(x, edges, side="right") - 1, 0, len(x) - 2)
+        offset = edges - x[index]
+        slope = np.diff(y)[index] / np.diff(x)[index]
+        edge_area = area[index] + (y[index] + slope * offset / 2) * offset
+        widths = np.diff(edges)
+        band = np.diff(edge_area) / np.where(widths > 0, widths, 1.0)
+        values = np.where(widths > 0, band, np.interp(centres, x, y))
+        return values.tolist()
+
+    x = [math.log(freq) for freq in freqs]
+    area = [0.0]
+    for i in range(1, len(x)):
+        area.append(area[-1] + (spl[i] + spl[i - 1]) * (x[i] - x[i - 1]) / 2)
+    centres = [math.log(freq) for freq in grid]
+    edges = [centres[0]] + [(a + b) / 2 for a, b in zip(centres, centres[1:])] + [centres[-1]]
+    edges = [min(max(edge, x[0]), x[-1]) for edge in edges]
+    values = []
+    for centre, low, high in zip(centres, edges, edges[1:]):
+        if high > low:
+            values.append((_area_at(x, spl, area, high) - _area_at(x, spl, area, low)) / (high - low))
+        else:
+            values.append(_interp(x, spl, centre))
+    return values
+
+
+def _area_at(xs: Sequence[float], ys: Sequence[float], area: Sequence[float], x: float) -> float:
+    index = min(max(bisect.bisect_right(xs, x) - 1, 0), len(xs) - 2)
+    offset = x - xs[index]
+    slope = (ys[index + 1] - ys[index]) / (xs[index + 1] - xs[index])
+    return area[index] + (ys[index] + slope * offset / 2) * offset
+
+
+def _interp(xs: Sequence[float], ys: Sequence[float], x: float) -> float:
+    index = bisect.bisect_right(xs, x)
+    if index == 0:
+        return ys[0]
+    if index >= len(xs):
+        return ys[-1]
+    x0, x1 = xs[index - 1], xs[index]
+    return ys[index - 1] + (ys[index] - ys[index - 1]) * (x - x0) / (x1 - x0)
+
+
+def format_curve(grid: Sequence[float], values: Sequence[float]) -> str:
+    """
+    Compact text form: one ``Hz,dB`` pair per line, 3 significant figures
+    for frequency and 0.1 dB for level, which is finer than an on-screen chart.
+    """
+    lines = ["Hz,dB"]
+    lines.extend(f"{_frequency_label(freq)},{value:.1f}" for freq, value in zip(grid, values))
+    return "\n".join(lines)
+
+
+def frequency_response_text(rows: Any, points: int) -> str:
+    """Parse a point list, resample it onto a ``points``-point log grid and format it for Dify."""
+    freqs, spl = parse_frequency_response(rows)
+    grid = log_grid(points)
+    return format_curve(grid, resample_log(freqs, spl, grid))
+
+
+def _frequency_label(freq: float) -> str:
+    rounded = float(f"{freq:.3g}")
+    return f"{rounded:.0f}" if rounded >= 100 else f"{rounded:g}"
+
+
+def _is_number(text: str) -> bool:
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
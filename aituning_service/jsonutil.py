@@ -0,0 +1,15 @@
+"""JSON decoding that uses orjson when it is installed (the ``json`` extra) and the standard library otherwise."""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Union
+
+try:  # pragma: no cover - depends on the deployment
+    import orjson
+except ImportError:  # pragma: no cover - depends on the deployment
+    orjson = None
+
+# Both backends raise a ValueError subclass on malformed input and accept str or bytes.
+loads: Callable[[Union[str, bytes]], Any] = orjson.loads if orjson is not None else json.loads
+JSON_BACKEND = "orjson" if orjson is not None else "json"
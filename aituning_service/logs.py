@@ -0,0 +1,244 @@
+"""
+Logging that keeps formatting and handler I/O off the request path.
+
+``configure_logging`` puts a single ``QueueHandler`` on the root logger. A
+request thread (or the event loop) only builds the record and appends it
+to a bounded queue, and a ``QueueListener`` thread formats it and writes
+it out, as text or as one JSON object per line. When the queue is full the
+record is dropped and counted, never waited for. Records carry the id of
+the request they were logged under (``REQUEST_ID``). Upstream payloads are
+logged as ``Payload`` extras: they are serialized by the writer thread,
+with long strings such as base64 images cut short, and only for the
+sampled fraction of calls (``sample_payload``).
+"""
+
+from __future__ import annotations
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from .config import Settings
+from .metrics import LOG_RECORDS_DROPPED
+
+REQUEST_ID: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+REQUEST_ID_HEADER = "X-Request-ID"
+
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+# Attributes every LogRecord has; anything else on a record came from ``extra``.
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_payload_sample_rate = 1.0
+_max_field_chars = 256
+_handler: Optional["_DroppingQueueHandler"] = None
+_listener: Optional[QueueListener] = None
+
+
+class Payload:
+    """
+    A logged request or response body, serialized only when written.
+
+    The value must not be mutated after it is logged; strings longer than
+    ``LOG_MAX_FIELD_CHARS`` are cut, at any depth.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+    def to_json(self) -> Any:
+        return _truncate(self.value, _max_field_chars)
+
+    def __str__(self) -> str:
+        return json.dumps(self.to_json(), ensure_ascii=False)
+
+
+def _truncate(value: Any, limit: int) -> Any:
+    if isinstance(value, str):
+        return value if len(value) <= limit else f"{value[:limit]}…(共 {len(value)} 字符)"
+    if isinstance(value, dict):
+        return {key: _truncate(item, limit) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_truncate(item, limit) for item in value]
+    return value
+
+
+def sample_payload() -> bool:
+    """Whether this upstream call's payload should be logged."""
+    return _payload_sample_rate >= 1.0 or random.random() < _payload_sample_rate
+
+
+def new_request_id(header: Optional[str] = None) -> str:
+    """The client's ``X-Request-ID`` if it is a sane token, else a fresh id."""
+    if header and _VALID_REQUEST_ID.match(header):
+        return header
+    return uuid.uuid4().hex[:16]
+
+
+def bind_request_id(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Iterate a streamed WSGI body under the current request id.
+
+    The server iterates the body after the view has returned and its
+    context is gone, so the id is taken now and set again around each step.
+    """
+    return _with_request_id(iter(chunks), REQUEST_ID.get())
+
+
+def _with_request_id(iterator: Iterator[bytes], request_id: Optional[str]) -> Iterator[bytes]:
+    try:
+        while True:
+            token = REQUEST_ID.set(request_id)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                REQUEST_ID.reset(token)
+            yield chunk
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            token = REQUEST_ID.set(request_id)
+            try:
+                close()
+            finally:
+                REQUEST_ID.reset(token)
+
+
+def bind_flask(app: Any) -> None:
+    """Give every request of a Flask app an id, echoed in ``X-Request-ID``; register it first."""
+    from flask import g, request
+
+    def start() -> None:
+        g.request_id_token = REQUEST_ID.set(new_request_id(request.headers.get(REQUEST_ID_HEADER)))
+
+    def finish(response: Any) -> Any:
+        response.headers[REQUEST_ID_HEADER] = REQUEST_ID.get()
+        return response
+
+    def teardown(exc: Optional[BaseException]) -> None:
+        token = g.pop("request_id_token", None)
+        if token is not None:
+            REQUEST_ID.reset(token)
+
+    app.before_request(start)
+    app.after_request(finish)
+    app.teardown_request(teardown)
+
+
+def _extras(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class TextFormatter(logging.Formatter):
+    """``LEVEL:logger:message`` as before, then the request id and any extras as ``key=value``."""
+
+    def __init__(self) -> None:
+        super().__init__(logging.BASIC_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = [f"{key}={value}" for key, value in _extras(record).items() if value is not None]
+        if not fields:
+            return text
+        head, newline, rest = text.partition("\n")
+        return f"{head} {' '.join(fields)}{newline}{rest}"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, message, request_id, extras and exc."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in _extras(record).items() if value is not None)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=_json_default)
+
+
+def _json_default(value: Any) -> Any:
+    return value.to_json() if isinstance(value, Payload) else str(value)
+
+
+class _DroppingQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the writer thread. Only what cannot wait is
+        # resolved here: the request id, and a traceback whose frames move on.
+        record.request_id = REQUEST_ID.get()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def configure_logging(settings: Settings) -> None:
+    """
+    Route every log record through the queue; safe to call more than once.
+
+    Handlers already on the root logger (a ``basicConfig`` file, say) are
+    moved behind the queue and given the configured format; without any, a
+    stderr handler is created and the root level set to ``LOG_LEVEL``.
+    """
+    global _payload_sample_rate, _max_field_chars, _handler, _listener
+    _payload_sample_rate = settings.log_payload_sample_rate
+    _max_field_chars = settings.log_max_field_chars
+    if _handler is not None:
+        return
+
+    root = logging.getLogger()
+    handlers: List[logging.Handler] = list(root.handlers)
+    if not handlers:
+        handlers = [logging.StreamHandler()]
+        root.setLevel(settings.log_level)
+    formatter = JsonFormatter() if settings.log_format == "json" else TextFormatter()
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        root.removeHandler(handler)
+
+    _handler = _DroppingQueueHandler(queue.Queue(settings.log_queue_size))
+    root.addHandler(_handler)
+    _listener = QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop)
+    # The writer thread does not survive fork(); each child starts its own.
+    os.register_at_fork(after_in_child=_restart_in_child)
+
+
+def _stop() -> None:
+    """Write out what is queued and stop the writer thread."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def _restart_in_child() -> None:
+    global _listener
+    if _handler is None or _listener is None:
+        return
+    # Records queued by the parent are the parent's to write.
+    _handler.queue = queue.Queue(_handler.queue.maxsize)
+    _listener = QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
@@ -1,5 +1,254 @@
-def main():
-    print("Hello from aituning-backend!")
+"""
+Production entry point: ``python -m aituning_service.main``.
+
+Runs ``Settings.server_workers`` gunicorn workers: gthread workers serving
+the Flask app (``SERVER_WORKER_MODEL=threads``) or aiohttp workers serving
+``create_async_app`` (``async``). The master imports the serving modules
+and creates the usage schema once before forking, so workers share those
+pages; each worker then builds its own app, so HTTP sessions, connection
+pools, SQLite connections and background threads are never inherited
+across ``fork``.
+
+On SIGTERM a worker stops accepting connections, open chat streams get
+``SERVER_DRAIN_TIMEOUT`` seconds to finish and are then ended with an error
+event, and gunicorn waits for them before the worker exits. Without
+gunicorn (the ``server`` extra) the same app is served by a single process
+that drains the same way.
+
+Only the quota is shared between workers (``USAGE_BACKEND=shared``). The
+metrics, admission limits, product cache and circuit breakers live in
+each worker, so the default is one worker; with more, ``/metrics`` reports
+whichever worker answered the scrape and every admission limit is
+multiplied by the worker count.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import logging
+import math
+import signal
+import threading
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from .config import Settings
+from .logs import configure_logging
+
+try:  # pragma: no cover - depends on the deployment
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # pragma: no cover - depends on the deployment
+    BaseApplication = None
+
+logger = logging.getLogger(__name__)
+
+# Time allowed past the drain deadline for cut-off streams to send their error event.
+_DRAIN_MARGIN = 5.0
+_SERVING_MODULES = {"threads": ".app", "async": ".aio_app"}
+
+
+def _preload(settings: Settings) -> ModuleType:
+    """Import the serving module and create the usage schema, without opening anything that stays open."""
+    module = importlib.import_module(_SERVING_MODULES[settings.server_worker_model], __package__)
+    from .storage import UsageRepository
+
+    repository = UsageRepository(settings.database_path, settings.daily_limit)
+    repository.init_database()
+    repository.close()
+    return module
+
+
+def _app_factory(settings: Settings, module: ModuleType) -> Callable[[], Any]:
+    if settings.server_worker_model == "async":
+        return lambda: module.create_async_app(settings)
+    return lambda: module.create_app(settings)
+
+
+def _drain_then(handler: Callable[..., Any], timeout: float) -> Callable[..., Any]:
+    def on_sigterm(*args: Any) -> None:
+        from .streaming import begin_drain
+
+        begin_drain(timeout)
+        handler(*args)
+
+    return on_sigterm
+
+
+def _install_drain(settings: Settings) -> Callable[[Any], None]:
+    """gunicorn ``post_worker_init`` hook: start draining streams when the worker gets SIGTERM."""
+
+    def post_worker_init(worker: Any) -> None:
+        handler = _drain_then(worker.handle_exit, settings.server_drain_timeout)
+        loop = getattr(worker, "loop", None)
+        if loop is not None:
+            # aiohttp workers take their signals through the event loop.
+            loop.add_signal_handler(signal.SIGTERM, handler, signal.SIGTERM, None)
+        else:
+            signal.signal(signal.SIGTERM, handler)
+
+    return post_worker_init
+
+
+def gunicorn_options(settings: Settings) -> Dict[str, Any]:
+    return {
+        "bind": f"{settings.server_host}:{settings.server_port}",
+        "workers": settings.server_workers,
+        "worker_class": "aiohttp.GunicornWebWorker" if settings.server_worker_model == "async" else "gthread",
+        "threads": settings.server_threads,
+        "graceful_timeout": math.ceil(settings.server_drain_timeout + _DRAIN_MARGIN),
+        "keepalive": 5,
+        "post_worker_init": _install_drain(settings),
+    }
+
+
+if BaseApplication is not None:
+
+    class _GunicornServer(BaseApplication):  # pragma: no cover - depends on the deployment
+        def __init__(self, options: Dict[str, Any], factory: Callable[[], Any]) -> None:
+            self._options = options
+            self._factory = factory
+            super().__init__()
+
+        def load_config(self) -> None:
+            for key, value in self._options.items():
+                self.cfg.set(key, value)
+
+        def load(self) -> Any:
+            # preload_app is off: this runs in each worker after the fork.
+            return self._factory()
+
+
+def serve(settings: Settings) -> None:
+    """Run the gunicorn master with ``settings.server_workers`` workers."""
+    if settings.server_workers > 1 and settings.usage_backend == "memory":
+        logger.warning("USAGE_BACKEND=memory 仅支持单进程，多 worker 下回退到 shared")
+        settings.usage_backend = "shared"
+    if settings.server_workers > 1:
+        logger.warning(
+            "%s 个 worker 各自计算准入限制与指标: 合计最多 %s 个并发聊天流、每用户每秒 %s 次，"
+            "/metrics 只反映响应抓取的 worker",
+            settings.server_workers,
+            settings.admission_max_streams * settings.server_workers or "不限",
+            round(settings.admission_rate * settings.server_workers, 3) or "不限",
+        )
+    module = _preload(settings)
+    logger.info(
+        "启动HuiHiFi AI后端服务: %s 模式, %s 个 worker, 监听 %s:%s",
+        settings.server_worker_model,
+        settings.server_workers,
+        settings.server_host,
+        settings.server_port,
+    )
+    _GunicornServer(gunicorn_options(settings), _app_factory(settings, module)).run()
+
+
+class _InFlight:
+    """WSGI middleware counting requests until their response body is closed."""
+
+    def __init__(self, app: Any) -> None:
+        self._app = app
+        self._count = 0
+        self._cond = threading.Condition()
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+        from werkzeug.wsgi import ClosingIterator
+
+        with self._cond:
+            self._count += 1
+        try:
+            body = self._app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        return ClosingIterator(body, self._done)
+
+    def _done(self) -> None:
+        with self._cond:
+            self._count -= 1
+            self._cond.notify_all()
+
+    def wait(self, timeout: float) -> int:
+        """Wait until no request is in flight; return how many still are."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._count == 0, timeout)
+            return self._count
+
+
+def serve_single_process(settings: Settings) -> None:
+    """Serve from this process, with the same drain on SIGTERM or Ctrl+C."""
+    module = _preload(settings)
+    app = _app_factory(settings, module)()
+    logger.info("启动HuiHiFi AI后端服务 (单进程, %s 模式)...", settings.server_worker_model)
+
+    if settings.server_worker_model == "async":
+        from aiohttp import web
+
+        async def drain(app: Any) -> None:
+            from .streaming import begin_drain
+
+            begin_drain(settings.server_drain_timeout)
+
+        app.on_shutdown.append(drain)
+        web.run_app(
+            app,
+            host=settings.server_host,
+            port=settings.server_port,
+            shutdown_timeout=settings.server_drain_timeout + _DRAIN_MARGIN,
+            access_log=None,
+        )
+        return
+
+    from werkzeug.serving import make_server
+
+    from .streaming import begin_drain
+
+    tracked = _InFlight(app)
+    server = make_server(settings.server_host, settings.server_port, tracked, threaded=True)
+    stopping = threading.Event()
+
+    def stop(signum: int, frame: Optional[Any]) -> None:
+        if stopping.is_set():
+            return
+        stopping.set()
+        begin_drain(settings.server_drain_timeout)
+        # shutdown() waits for serve_forever(), which this handler interrupted.
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+    remaining = tracked.wait(settings.server_drain_timeout + _DRAIN_MARGIN)
+    if remaining:
+        logger.warning("排空超时，仍有 %s 个请求未完成", remaining)
+    logger.info("服务已停止")
+
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="启动 HuiHiFi AI 后端服务")
+    parser.add_argument("--worker-model", choices=("threads", "async"), help="默认取 SERVER_WORKER_MODEL")
+    parser.add_argument("--workers", type=int, help="默认取 SERVER_WORKERS，0 为每个 CPU 一个")
+    parser.add_argument("--threads", type=int, help="默认取 SERVER_THREADS")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--single-process", action="store_true", help="不使用 gunicorn，单进程运行")
+    args = parser.parse_args(None if argv is None else list(argv))
+
+    settings = Settings()
+    for name in ("worker_model", "workers", "threads", "host", "port"):
+        value = getattr(args, name)
+        if value is not None:
+            setattr(settings, f"server_{name}", value)
+    settings.validate()
+    # Started in the master; each forked worker restarts the writer thread.
+    configure_logging(settings)
+
+    if args.single_process or BaseApplication is None:
+        if not args.single_process:
+            logger.warning("未安装 gunicorn（server 扩展），以单进程模式运行")
+        serve_single_process(settings)
+    else:
+        serve(settings)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,50 @@
+"""
+Usage database maintenance, run as ``python -m aituning_service.maintenance``.
+
+Folds daily ``user_usage`` rows older than the retention window into
+``user_usage_totals`` in bounded-time chunks and releases free pages with
+incremental VACUUM. Safe to run from cron while the service is serving.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+
+from .config import Settings
+from .storage import UsageRepository
+
+
+def main() -> None:
+    settings = Settings()
+    parser = argparse.ArgumentParser(description="压缩过期的使用记录并回收数据库空间")
+    parser.add_argument("--database", default=settings.database_path)
+    parser.add_argument("--retention-days", type=int, default=settings.usage_retention_days)
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per write transaction")
+    parser.add_argument("--time-budget", type=float, default=5.0, help="seconds to spend compacting")
+    parser.add_argument("--vacuum-pages", type=int, default=2000, help="max pages released per run")
+    parser.add_argument(
+        "--enable-incremental-vacuum",
+        action="store_true",
+        help="one-off full VACUUM to convert a database created before incremental vacuum",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    repo = UsageRepository(args.database, settings.daily_limit)
+    repo.init_database()
+    if args.enable_incremental_vacuum:
+        repo.enable_incremental_vacuum()
+
+    result = repo.run_maintenance(
+        retention_days=args.retention_days,
+        batch_size=args.batch_size,
+        time_budget=args.time_budget,
+        vacuum_pages=args.vacuum_pages,
+    )
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
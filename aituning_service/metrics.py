@@ -0,0 +1,362 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+The backend only needs counters, gauges and fixed-bucket histograms, so
+they are implemented here instead of adding ``prometheus_client`` to the
+hashed requirements. Recording a sample is a dict lookup, a bisect and a
+short critical section; ``render`` formats everything when ``/metrics``
+is scraped. Values are per process: a scrape reports the worker that
+served it, so ``rate()`` is only meaningful with one worker per scrape
+target, which is why ``SERVER_WORKERS`` defaults to 1.
+
+Cache hit ratios are derived at query time, for example
+``sum by (cache) (rate(aituning_cache_lookups_total{result=~"hits|stale_hits"}[5m]))``
+divided by ``sum by (cache) (rate(aituning_cache_lookups_total{result!="bypasses"}[5m]))``.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; request latencies and upstream calls.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Seconds; SQLite statements.
+DATABASE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5, 2.0)
+# Seconds; whole chat streams.
+STREAM_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class _Value:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+
+class _Buckets:
+    __slots__ = ("_lock", "_bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        # Per-bucket (not cumulative) counts; the last slot is +Inf.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        # The same children keyed by the values as passed (a status may be an int).
+        self._lookup: Dict[Tuple[Any, ...], Any] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Report zero before the first sample.
+            self.labels()
+        REGISTRY.append(self)
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def labels(self, *values: Any) -> Any:
+        child = self._lookup.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            key = tuple(str(value) for value in values)
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+                self._lookup[values] = child
+        return child
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return sorted(self._children.items())
+
+    def _label_text(self, values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._items():
+            lines.append(f"{self.name}{self._label_text(values)} {_number(child.value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        bounds = [_number(bound) for bound in self.buckets] + ["+Inf"]
+        for values, child in self._items():
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self._label_text(values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(values)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    """Every metric in the text exposition format."""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUESTS = Counter(
+    "aituning_http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status")
+)
+HTTP_LATENCY = Histogram(
+    "aituning_http_request_duration_seconds",
+    "Time until the handler returned; for streamed chats the WSGI app returns at the first byte, "
+    "the asyncio app at the end of the stream.",
+    ("route", "method"),
+)
+HTTP_IN_FLIGHT = Gauge("aituning_http_requests_in_flight", "Requests being handled.")
+
+UPSTREAM_LATENCY = Histogram(
+    "aituning_upstream_request_duration_seconds",
+    "Upstream calls until the response headers (Dify chat) or the whole response.",
+    ("upstream", "operation"),
+)
+UPSTREAM_REQUESTS = Counter(
+    "aituning_upstream_requests_total",
+    "Upstream calls by HTTP status, or error when no response arrived.",
+    ("upstream", "operation", "status"),
+)
+UPSTREAM_IN_FLIGHT = Gauge("aituning_upstream_requests_in_flight", "Upstream calls in progress.", ("upstream",))
+BREAKER_STATE = Gauge(
+    "aituning_upstream_breaker_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open.", ("upstream",)
+)
+BREAKER_REJECTIONS = Counter(
+    "aituning_upstream_breaker_rejections_total", "Calls failed at once by an open circuit breaker.", ("upstream",)
+)
+HEDGES = Counter(
+    "aituning_upstream_hedges_total", "Hedged duplicate calls: sent, and won (answered first).", ("upstream", "outcome")
+)
+
+DATABASE_LATENCY = Histogram(
+    "aituning_usage_db_duration_seconds", "Time spent in SQLite by usage operation.", ("operation",), DATABASE_BUCKETS
+)
+
+STREAMS_ACTIVE = Gauge("aituning_chat_streams_active", "Chat streams being relayed.")
+STREAMS = Counter("aituning_chat_streams_total", "Relayed chat streams by outcome.", ("outcome",))
+STREAM_DURATION = Histogram(
+    "aituning_chat_stream_duration_seconds", "Chat request start to end of the relayed stream.", (), STREAM_BUCKETS
+)
+STREAM_TTFB = Histogram("aituning_chat_stream_ttfb_seconds", "Chat request start to the first relayed byte.")
+STREAM_BYTES = Counter("aituning_chat_stream_bytes_total", "Bytes relayed to chat clients.")
+STREAM_HEARTBEATS = Counter("aituning_chat_stream_heartbeats_total", "Heartbeat comments sent on idle streams.")
+STREAM_TAGS = Counter("aituning_chat_stream_tags_total", "Answer tags announced as their own events.")
+
+ADMISSIONS = Counter(
+    "aituning_admission_decisions_total",
+    "Chat admission decisions: admitted, queued (admitted after waiting), rate_limited, shed, timed_out, cancelled.",
+    ("outcome",),
+)
+ADMISSION_SLOTS = Gauge("aituning_admission_slots_in_use", "Upstream chat stream slots held.")
+ADMISSION_QUEUE = Gauge("aituning_admission_queue_depth", "Chat requests waiting for a stream slot.")
+ADMISSION_WAIT = Histogram("aituning_admission_wait_seconds", "Time queued chat requests waited before admission.")
+
+LOG_RECORDS_DROPPED = Counter(
+    "aituning_log_records_dropped_total", "Log records dropped because the logging queue was full."
+)
+CAPTURE_RECORDS = Counter(
+    "aituning_capture_records_total", "Captured request lines, written or dropped on a full queue.", ("outcome",)
+)
+
+COMPRESSION_BYTES = Counter(
+    "aituning_compression_bytes_total",
+    "Response bytes compressed, before (in) and after (out) compression, by encoding.",
+    ("encoding", "direction"),
+)
+
+CACHE_LOOKUPS = Counter("aituning_cache_lookups_total", "Cache lookups by cache and result.", ("cache", "result"))
+CACHE_ENTRIES = Gauge("aituning_cache_entries", "Entries held by each cache.", ("cache",))
+CACHE_BYTES = Gauge("aituning_cache_bytes", "Bytes held by each size-bounded cache.", ("cache",))
+CACHE_EVICTIONS = Counter("aituning_cache_evictions_total", "Entries evicted to keep a cache within its size.", ("cache",))
+
+
+class UpstreamCall:
+    """
+    Time one upstream call; set ``status`` to the HTTP status once known.
+
+    Used as a context manager around the request, in both serving modes.
+    A call that ends without a status (no response arrived) counts as ``error``.
+    """
+
+    __slots__ = ("upstream", "operation", "status", "_started")
+
+    def __init__(self, upstream: str, operation: str) -> None:
+        self.upstream = upstream
+        self.operation = operation
+        self.status: Optional[int] = None
+        self._started = 0.0
+
+    def __enter__(self) -> "UpstreamCall":
+        UPSTREAM_IN_FLIGHT.labels(self.upstream).inc()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        UPSTREAM_LATENCY.labels(self.upstream, self.operation).observe(time.perf_counter() - self._started)
+        status = self.status if self.status is not None else "error"
+        UPSTREAM_REQUESTS.labels(self.upstream, self.operation, status).inc()
+        UPSTREAM_IN_FLIGHT.labels(self.upstream).dec()
+
+
+def observe_stream(stats: Any) -> None:
+    """Record a finished ``streaming.StreamStats``."""
+    outcome = "error" if stats.error else "cancelled" if stats.cancelled else "completed"
+    STREAMS.labels(outcome).inc()
+    STREAM_DURATION.observe(stats.duration)
+    if stats.ttfb is not None:
+        STREAM_TTFB.observe(stats.ttfb)
+    STREAM_BYTES.inc(stats.bytes)
+    if stats.heartbeats:
+        STREAM_HEARTBEATS.inc(stats.heartbeats)
+    if stats.tags:
+        STREAM_TAGS.inc(stats.tags)
+
+
+def observe_request(route: str, method: str, status: int, seconds: float) -> None:
+    HTTP_REQUESTS.labels(route, method, status).inc()
+    HTTP_LATENCY.labels(route, method).observe(seconds)
+
+
+def instrument_flask(app: Any) -> None:
+    """Count and time every request of a Flask app; register before the origin verifier."""
+    # Imported here so the relays and storage can record metrics without loading Flask.
+    from flask import g, request
+
+    def start() -> None:
+        HTTP_IN_FLIGHT.inc()
+        g.metrics_started = time.perf_counter()
+
+    def finish(response: Any) -> Any:
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            rule = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            observe_request(rule, request.method, response.status_code, time.perf_counter() - started)
+        return response
+
+    def teardown(exc: Optional[BaseException]) -> None:
+        HTTP_IN_FLIGHT.dec()
+
+    app.before_request(start)
+    app.after_request(finish)
+    app.teardown_request(teardown)
+
+
+def timed(histogram: Histogram, *labels: str) -> "_Timer":
+    """``with timed(DATABASE_LATENCY, "try_consume"): ...``"""
+    return _Timer(histogram.labels(*labels))
+
+
+class _Timer:
+    __slots__ = ("_child", "_started")
+
+    def __init__(self, child: _Buckets) -> None:
+        self._child = child
+        self._started = 0.0
+
+    def __enter__(self) -> None:
+        self._started = time.perf_counter()
+
+    def __exit__(self, *exc: Any) -> None:
+        self._child.observe(time.perf_counter() - self._started)
+
@@ -0,0 +1,196 @@
+"""Memory-mapped quota counters shared by every worker process on one host."""
+
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+
+_MAGIC = b"HHQTBL01"
+_HEADER = struct.Struct("<8sII")  # magic, stripe_count, slots_per_stripe
+_HEADER_SIZE = 64
+_STRIPE_HEADER = struct.Struct("<i")  # day ordinal the stripe was last rolled over to
+_STRIPE_HEADER_SIZE = 8
+_SLOT = struct.Struct("<16sii")  # token digest, day ordinal (0 = empty), count
+
+
+class QuotaTableFull(Exception):
+    """Raised when a stripe has no free slot for a new (token, day) key."""
+
+
+def token_digest(user_token: str) -> bytes:
+    return hashlib.blake2b(user_token.encode("utf-8"), digest_size=16).digest()
+
+
+class SharedQuotaTable:
+    """
+    Fixed-size open-addressing hash table of (token, day) -> count in a shared mmap.
+
+    The table is split into independent stripes of contiguous slots. A key
+    always probes inside its own stripe, so one stripe lock (a thread lock
+    plus a POSIX byte-range lock for other processes) covers every read and
+    write for that key. Entries older than yesterday are dropped the first
+    time a stripe is touched on a new day; yesterday's stay readable for the
+    last checkpoint but give their slot to any new key of the day. Today's
+    entries are never evicted, so a stripe that is full stays full until
+    the next day and a token that found no slot never gets one that day.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        capacity: int = 65536,
+        stripe_count: int = 64,
+        initializer: Optional[Callable[["SharedQuotaTable"], None]] = None,
+    ) -> None:
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        # Whole-file lock while the layout is created or read; the creating
+        # process also seeds the table before anyone else can use it.
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                self.stripe_count = stripe_count
+                self.slots_per_stripe = max(1, capacity // stripe_count)
+                os.ftruncate(self._fd, self._size())
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, self.stripe_count, self.slots_per_stripe), 0)
+                created = True
+            else:
+                magic, self.stripe_count, self.slots_per_stripe = _HEADER.unpack(
+                    os.pread(self._fd, _HEADER.size, 0)
+                )
+                if magic != _MAGIC:
+                    raise ValueError(f"{path} 不是有效的配额表文件")
+                created = False
+
+            self._map = mmap.mmap(self._fd, self._size())
+            self._thread_locks = [threading.Lock() for _ in range(self.stripe_count)]
+            if created and initializer is not None:
+                initializer(self)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def capacity(self) -> int:
+        return self.stripe_count * self.slots_per_stripe
+
+    def _stripe_bytes(self) -> int:
+        return _STRIPE_HEADER_SIZE + self.slots_per_stripe * _SLOT.size
+
+    def _size(self) -> int:
+        return _HEADER_SIZE + self.stripe_count * self._stripe_bytes()
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+    @contextmanager
+    def _stripe(self, digest: bytes) -> Iterator[Tuple[int, int]]:
+        stripe = int.from_bytes(digest[:4], "little") % self.stripe_count
+        with self._thread_locks[stripe]:
+            # Lock byte ``stripe`` of the file header; byte-range locks are
+            # advisory, so the range only has to be agreed on, not meaningful.
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                yield stripe, _HEADER_SIZE + stripe * self._stripe_bytes()
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+
+    def _rollover(self, base: int, day: int) -> None:
+        (stripe_day,) = _STRIPE_HEADER.unpack_from(self._map, base)
+        if stripe_day >= day:
+            return
+
+        kept: List[Tuple[bytes, int, int]] = []
+        slots = base + _STRIPE_HEADER_SIZE
+        for index in range(self.slots_per_stripe):
+            digest, slot_day, count = _SLOT.unpack_from(self._map, slots + index * _SLOT.size)
+            if slot_day >= day - 1:
+                kept.append((digest, slot_day, count))
+
+        self._map[slots : slots + self.slots_per_stripe * _SLOT.size] = bytes(self.slots_per_stripe * _SLOT.size)
+        for digest, slot_day, count in kept:
+            _, free = self._probe(base, digest, slot_day)
+            _SLOT.pack_into(self._map, free, digest, slot_day, count)
+        _STRIPE_HEADER.pack_into(self._map, base, day)
+
+    def _probe(self, base: int, digest: bytes, day: int) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Return (offset of the key, offset of the first free slot) within one stripe.
+
+        A slot holding an earlier day is free for ``day``: overwriting it
+        keeps the probe chain intact, since probing only stops at empty slots.
+        """
+        slots = base + _STRIPE_HEADER_SIZE
+        start = int.from_bytes(digest[4:12], "little") % self.slots_per_stripe
+        free: Optional[int] = None
+        for step in range(self.slots_per_stripe):
+            offset = slots + ((start + step) % self.slots_per_stripe) * _SLOT.size
+            slot_digest, slot_day, _ = _SLOT.unpack_from(self._map, offset)
+            if slot_day == 0:
+                return None, offset if free is None else free
+            if slot_day == day and slot_digest == digest:
+                return offset, None
+            if free is None and slot_day < day:
+                free = offset
+        return None, free
+
+    def get(self, user_token: str, day: int) -> Optional[int]:
+        """Return the stored count, or None if the key is not in the table."""
+        digest = token_digest(user_token)
+        with self._stripe(digest) as (_, base):
+            self._rollover(base, day)
+            offset, _ = self._probe(base, digest, day)
+            if offset is None:
+                return None
+            return _SLOT.unpack_from(self._map, offset)[2]
+
+    def try_increment(self, user_token: str, day: int, limit: int) -> bool:
+        """Increment the count unless it has reached ``limit``; raise QuotaTableFull if no slot is left."""
+        digest = token_digest(user_token)
+        with self._stripe(digest) as (_, base):
+            self._rollover(base, day)
+            offset, free = self._probe(base, digest, day)
+            if offset is None:
+                if free is None:
+                    raise QuotaTableFull(self.path)
+                if limit <= 0:
+                    return False
+                _SLOT.pack_into(self._map, free, digest, day, 1)
+                return True
+
+            count = _SLOT.unpack_from(self._map, offset)[2]
+            if count >= limit:
+                return False
+            _SLOT.pack_into(self._map, offset, digest, day, count + 1)
+            return True
+
+    def decrement(self, user_token: str, day: int) -> None:
+        digest = token_digest(user_token)
+        with self._stripe(digest) as (_, base):
+            self._rollover(base, day)
+            offset, _ = self._probe(base, digest, day)
+            if offset is None:
+                return
+            count = _SLOT.unpack_from(self._map, offset)[2]
+            if count > 0:
+                _SLOT.pack_into(self._map, offset, digest, day, count - 1)
+
+    def seed(self, user_token: str, day: int, count: int) -> None:
+        """Raise the stored count to at least ``count``; used to warm the table from SQLite."""
+        digest = token_digest(user_token)
+        with self._stripe(digest) as (_, base):
+            self._rollover(base, day)
+            offset, free = self._probe(base, digest, day)
+            if offset is None:
+                if free is None:
+                    raise QuotaTableFull(self.path)
+                _SLOT.pack_into(self._map, free, digest, day, count)
+            elif _SLOT.unpack_from(self._map, offset)[2] < count:
+                _SLOT.pack_into(self._map, offset, digest, day, count)
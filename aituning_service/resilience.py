@@ -0,0 +1,229 @@
+"""
+Circuit breakers and hedged requests for the upstream clients.
+
+A ``CircuitBreaker`` per upstream opens after ``failure_threshold``
+consecutive failed calls (no response, or a 5xx). While open, calls fail at
+once instead of waiting out a timeout; after ``reset_timeout`` seconds one
+probe call is let through (half-open), and its outcome closes the breaker
+or opens it again.
+
+A ``Hedger`` sends an idempotent call a second time when the first has
+not answered within the p95 latency of recent calls, and takes whichever
+answers first. A budget keeps hedges to a fraction of calls, so a slow
+upstream sees at most that much extra load.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, FIRST_COMPLETED, TimeoutError as FutureTimeoutError, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from .metrics import BREAKER_REJECTIONS, BREAKER_STATE, HEDGES
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def upstream_ok(status: Optional[int]) -> bool:
+    """Whether a call's outcome shows the upstream healthy: it answered, without a 5xx."""
+    return status is not None and status < 500
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        # When the half-open probe was let through; None while no probe is out.
+        self._probe_started: Optional[float] = None
+        BREAKER_STATE.labels(name).set(0)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now; a refused call should fail at once."""
+        if self._state == CLOSED or self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            # A probe that never reported back (its caller went away) is replaced after a while.
+            if self._state == HALF_OPEN and (
+                self._probe_started is None or now - self._probe_started >= self.reset_timeout
+            ):
+                self._probe_started = now
+                return True
+            if self._state == CLOSED:
+                return True
+        BREAKER_REJECTIONS.labels(self.name).inc()
+        return False
+
+    def record(self, ok: bool) -> None:
+        """Report the outcome of an allowed call."""
+        if ok and self._state == CLOSED and not self._failures:
+            return
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_started = None
+                if ok:
+                    self._failures = 0
+                    self._set_state(CLOSED)
+                else:
+                    self._open()
+            elif self._state == CLOSED:
+                if ok:
+                    self._failures = 0
+                else:
+                    self._failures += 1
+                    if 0 < self.failure_threshold <= self._failures:
+                        self._open()
+            # Outcomes of calls that started before the breaker opened change nothing.
+
+    def retry_after(self) -> int:
+        """Whole seconds until a probe may pass; 0 when calls go through now."""
+        if self._state != OPEN:
+            return 0
+        remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+        return max(0, math.ceil(remaining))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"state": self._state, "failures": self._failures, "retryAfter": self.retry_after()}
+
+    def _open(self) -> None:
+        self._opened_at = time.monotonic()
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        BREAKER_STATE.labels(self.name).set(_STATE_VALUES[state])
+
+
+class Hedger:
+    """
+    When to hedge an idempotent call: after the ``quantile`` latency of the
+    last ``window`` successful calls (once ``min_samples`` are known), and
+    only while the budget of ``budget`` hedges per call lasts.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        quantile: float = 0.95,
+        budget: float = 0.1,
+        window: int = 200,
+        min_samples: int = 20,
+        min_delay: float = 0.02,
+    ) -> None:
+        self.name = name
+        self.quantile = quantile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._delay: Optional[float] = None
+        self._unsorted = 0
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        """Record a successful call's latency; the delay is recomputed every few calls."""
+        with self._lock:
+            self._samples.append(seconds)
+            self._unsorted += 1
+            if self._unsorted >= 10 and len(self._samples) >= self.min_samples:
+                ordered = sorted(self._samples)
+                self._delay = max(self.min_delay, ordered[int(self.quantile * (len(ordered) - 1))])
+                self._unsorted = 0
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging this call; None when it is not to be hedged."""
+        if self._delay is None or self.budget <= 0:
+            return None
+        with self._lock:
+            self._tokens = min(10.0, self._tokens + self.budget)
+        return self._delay
+
+    def take(self) -> bool:
+        """Spend a hedge from the budget."""
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+        HEDGES.labels(self.name, "sent").inc()
+        return True
+
+
+def hedged_call(call: Callable[[], T], hedger: Optional[Hedger], executor: Executor) -> T:
+    """
+    Run ``call``, and once more on ``executor`` if it is slow; the first
+    success wins and the other attempt finishes unobserved. An attempt's
+    error is raised only when no attempt succeeds.
+    """
+    delay = hedger.delay() if hedger is not None else None
+    if delay is None:
+        return call()
+    # Each attempt runs in its own copy of the caller's context (request id for the logs).
+    primary = executor.submit(contextvars.copy_context().run, call)
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeoutError:
+        pass
+    if not hedger.take():
+        return primary.result()
+    hedge = executor.submit(contextvars.copy_context().run, call)
+    pending = {primary, hedge}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    HEDGES.labels(hedger.name, "won").inc()
+                return future.result()
+            error = error or future.exception()
+    raise error  # type: ignore[misc]
+
+
+async def hedged_call_async(call: Callable[[], Awaitable[T]], hedger: Optional[Hedger]) -> T:
+    """``hedged_call`` on the event loop; the losing attempt is cancelled."""
+    delay = hedger.delay() if hedger is not None else None
+    if delay is None:
+        return await call()
+    tasks = [asyncio.ensure_future(call())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not hedger.take():
+            return await tasks[0]
+        tasks.append(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is tasks[1]:
+                        HEDGES.labels(hedger.name, "won").inc()
+                    return task.result()
+                error = error or task.exception()
+        raise error  # type: ignore[misc]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
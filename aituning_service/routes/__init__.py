@@ -1,7 +1,8 @@
 """Flask blueprint factories."""
 
 from .chat import create_chat_blueprint
+from .eq import create_eq_blueprint
 from .products import create_products_blueprint
 from .usage import create_usage_blueprint
 
-__all__ = ["create_chat_blueprint", "create_products_blueprint", "create_usage_blueprint"]
+__all__ = ["create_chat_blueprint", "create_eq_blueprint", "create_products_blueprint", "create_usage_blueprint"]
@@ -1,22 +1,62 @@
 from __future__ import annotations
 
-import json
 import logging
-from typing import Optional
+import time
+from concurrent.futures import Future
+from typing import List, Optional
 
 from flask import Blueprint, Response, jsonify, request
 
-from ..services import DifyClient
+from ..admission import AdmissionController, Rejection
+from ..curve import CurveError, frequency_response_text
+from ..logs import Payload, bind_request_id
+from ..services import AnswerCache, DifyClient, DifyClientError, DifyTimeoutError, DifyUnavailableError
+from ..services.answer_cache import Event, answer_key, record_stream
 from ..storage import UsageRepository
+from ..streaming import relay_lines, relay_passthrough
 
 logger = logging.getLogger(__name__)
 
 
-def create_chat_blueprint(dify_client: DifyClient, usage_repo: UsageRepository) -> Blueprint:
+def _unavailable(exc: DifyUnavailableError):
+    return jsonify({"error": str(exc), "retryAfter": exc.retry_after}), 503, {"Retry-After": str(exc.retry_after)}
+
+
+def _quota_exhausted(usage_repo: UsageRepository):
+    return jsonify({"error": "今日使用次数已达上限", "remaining": 0, "limit": usage_repo.daily_limit}), 429
+
+
+def create_chat_blueprint(
+    dify_client: DifyClient,
+    usage_repo: UsageRepository,
+    admission: AdmissionController,
+    relay_mode: str = "passthrough",
+    heartbeat_interval: float = 15.0,
+    curve_points: int = 120,
+    tag_events: bool = False,
+    answer_cache: Optional[AnswerCache] = None,
+    answer_cache_charge_quota: bool = True,
+) -> Blueprint:
     bp = Blueprint("chat", __name__)
+    stream_headers = {"Cache-Control": "no-cache", "Connection": "keep-alive"}
+    # Recordings include the tag events, so they are only replayed with the same setting.
+    cache_variant = "tag-events" if tag_events else ""
+
+    def replay_answer(user_token: str, events: List[Event]) -> Response:
+        ticket = admission.admit(user_token)
+        if isinstance(ticket, Rejection):
+            return jsonify(ticket.body), ticket.status, ticket.headers
+        with ticket:
+            if answer_cache_charge_quota and not usage_repo.try_consume(user_token):
+                return _quota_exhausted(usage_repo)
+            body = bind_request_id(answer_cache.replay(events))
+            response = Response(body, mimetype="text/event-stream", headers=dict(stream_headers, **{"X-Cache": "HIT"}))
+            response.call_on_close(ticket.detach())
+            return response
 
     @bp.route("/chat", methods=["POST"])
     def chat() -> Response:
+        started = time.perf_counter()
         if not dify_client.is_configured:
             return jsonify({"error": "AI服务未配置"}), 503
 
@@ -26,71 +66,121 @@ def create_chat_blueprint(dify_client: DifyClient, usage_repo: UsageRepository)
         current_filters: str = data.get("currentFilters", "")
         curve_image_base64: Optional[str] = data.get("curveImageBase64")
         conversation_id: Optional[str] = data.get("conversationId")
+        frequency_response = data.get("frequencyResponse")
 
         if not user_token:
             return jsonify({"error": "缺少用户token"}), 400
         if not message:
             return jsonify({"error": "缺少消息内容"}), 400
 
-        current_usage = usage_repo.get_usage(user_token)
-        if current_usage >= usage_repo.daily_limit:
-            return (
-                jsonify(
-                    {
-                        "error": "今日使用次数已达上限",
-                        "remaining": 0,
-                        "limit": usage_repo.daily_limit,
-                    }
-                ),
-                429,
-            )
-
-        image_file_id: Optional[str] = None
-        if curve_image_base64:
-            image_file_id = dify_client.upload_image(curve_image_base64, user_token)
-            if not image_file_id:
-                return jsonify({"error": "图片上传失败"}), 500
-
-        if not usage_repo.increment_usage(user_token):
-            return jsonify({"error": "更新使用次数失败"}), 500
-
-        try:
-            dify_response = dify_client.stream_chat(
-                query=message,
-                current_filters=current_filters,
-                user_token=user_token,
-                conversation_id=conversation_id,
-                image_file_id=image_file_id,
-            )
-        except RuntimeError as exc:
-            return jsonify({"error": str(exc)}), 503
-
-        if dify_response.status_code != 200:
-            logger.error(
-                "Dify API调用失败: status=%s body=%s",
-                dify_response.status_code,
-                dify_response.text,
-            )
-            return jsonify({"error": "AI服务调用失败"}), 500
-
-        def generate():
+        # The measured points, when sent, replace the rendered curve image.
+        curve_text: Optional[str] = None
+        if frequency_response is not None:
+            try:
+                curve_text = frequency_response_text(frequency_response, curve_points)
+            except CurveError as exc:
+                return jsonify({"error": str(exc)}), 400
+            curve_image_base64 = None
+
+        # An identical first turn replays the recorded answer, even while Dify is unavailable.
+        cache_key: Optional[bytes] = None
+        if answer_cache is not None and not conversation_id:
+            cache_key = answer_key(message, current_filters, curve_image_base64, curve_text, cache_variant)
+            events = answer_cache.get(cache_key)
+            if events is not None:
+                return replay_answer(user_token, events)
+
+        # While Dify's breaker is open the request fails here, before it queues or spends quota.
+        retry_after = dify_client.breaker.retry_after()
+        if retry_after:
+            return _unavailable(DifyUnavailableError(retry_after))
+
+        # Admitted before any upstream work or quota is spent; the ticket
+        # releases the stream slot on every early return below.
+        ticket = admission.admit(user_token)
+        if isinstance(ticket, Rejection):
+            return jsonify(ticket.body), ticket.status, ticket.headers
+
+        with ticket:
+            # An unchanged curve reuses the file Dify already has. Otherwise the
+            # upload runs while quota is charged and the request is prepared; a
+            # rejected request simply drops its result.
+            cached_file_id: Optional[str] = None
+            upload: Optional[Future] = None
+            if curve_image_base64:
+                cached_file_id = dify_client.cached_upload(curve_image_base64, user_token)
+                if cached_file_id is None:
+                    upload = dify_client.submit_upload(curve_image_base64, user_token)
+
+            if not usage_repo.try_consume(user_token):
+                if upload is not None:
+                    upload.cancel()
+                return _quota_exhausted(usage_repo)
+
+            image_file_id = cached_file_id
+            if upload is not None:
+                image_file_id = upload.result()
+                if not image_file_id:
+                    usage_repo.release(user_token)
+                    return jsonify({"error": "图片上传失败"}), 500
+
+            def open_stream(file_id: Optional[str]):
+                return dify_client.stream_chat(
+                    query=message,
+                    current_filters=current_filters,
+                    user_token=user_token,
+                    conversation_id=conversation_id,
+                    image_file_id=file_id,
+                    frequency_response=curve_text,
+                )
+
             try:
-                for line in dify_response.iter_lines():
-                    if not line:
-                        yield "\n"
-                        continue
-
-                    decoded = line.decode("utf-8")
-                    if decoded.startswith("data: "):
-                        yield f"{decoded}\n\n"
-                    else:
-                        yield f"{decoded}\n"
-            except Exception as exc:  # pragma: no cover - defensive fallback
-                logger.error("流式响应转发失败: %s", exc)
-                payload = json.dumps({"error": str(exc)}, ensure_ascii=False)
-                yield f"data: {payload}\n\n"
-
-        headers = {"Cache-Control": "no-cache", "Connection": "keep-alive"}
-        return Response(generate(), mimetype="text/event-stream", headers=headers)
+                dify_response = open_stream(image_file_id)
+                if cached_file_id and dify_response.status_code in (400, 404):
+                    # Dify may have dropped the cached file already; upload it again once.
+                    logger.warning("缓存的 Dify 图片已失效，重新上传: %s", cached_file_id)
+                    dify_response.close()
+                    dify_client.forget_upload(curve_image_base64, user_token)
+                    image_file_id = dify_client.upload_image(curve_image_base64, user_token)
+                    if not image_file_id:
+                        usage_repo.release(user_token)
+                        return jsonify({"error": "图片上传失败"}), 500
+                    dify_response = open_stream(image_file_id)
+            except RuntimeError as exc:
+                return jsonify({"error": str(exc)}), 503
+            except DifyUnavailableError as exc:
+                usage_repo.release(user_token)
+                return _unavailable(exc)
+            except DifyTimeoutError:
+                usage_repo.release(user_token)
+                return jsonify({"error": "AI服务响应超时"}), 504
+            except DifyClientError as exc:
+                logger.error("Dify API调用失败: %s", exc)
+                usage_repo.release(user_token)
+                return jsonify({"error": "AI服务调用失败"}), 502
+
+            if dify_response.status_code != 200:
+                logger.error(
+                    "Dify API调用失败",
+                    extra={"status": dify_response.status_code, "body": Payload(dify_response.text)},
+                )
+                return jsonify({"error": "AI服务调用失败"}), 500
+
+            if relay_mode == "lines":
+                body = relay_lines(dify_response, started=started, tag_events=tag_events)
+            else:
+                body = relay_passthrough(
+                    dify_response,
+                    heartbeat_interval=heartbeat_interval,
+                    started=started,
+                    tag_events=tag_events,
+                )
+            if cache_key is not None:
+                body = record_stream(body, answer_cache.recorder(cache_key))
+
+            response = Response(bind_request_id(body), mimetype="text/event-stream", headers=stream_headers)
+            # The slot is held until the server closes the streamed response.
+            response.call_on_close(ticket.detach())
+            return response
 
     return bp
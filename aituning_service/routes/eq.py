@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+from flask import Blueprint, jsonify, request
+
+from ..services.eq import EQ_AVAILABLE, FilterError, evaluate_request
+
+
+def create_eq_blueprint() -> Blueprint:
+    bp = Blueprint("eq", __name__)
+
+    @bp.route("/eq/response", methods=["POST"])
+    def eq_response():
+        if not EQ_AVAILABLE:
+            return jsonify({"error": "EQ 计算服务不可用 (未安装 numpy)"}), 503
+        try:
+            return jsonify(evaluate_request(request.get_json(silent=True)))
+        except FilterError as exc:
+            return jsonify({"error": str(exc)}), 400
+
+    return bp
@@ -1,16 +1,83 @@
 from __future__ import annotations
 
+import json
 import logging
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 
-from ..services import HuiHiFiClient, HuiHiFiClientError, HuiHiFiCredentialsError
+from ..logs import bind_request_id
+from ..services import (
+    HuiHiFiClient,
+    HuiHiFiClientError,
+    HuiHiFiCredentialsError,
+    HuiHiFiUnavailableError,
+    ProductCatalog,
+    ProductSearchCache,
+)
 
 logger = logging.getLogger(__name__)
 
+NDJSON_MIMETYPE = "application/x-ndjson"
 
-def create_products_blueprint(huihifi_client: HuiHiFiClient) -> Blueprint:
+
+def ndjson_chunk(products: List[Dict[str, Any]]) -> bytes:
+    """One page of products as NDJSON, one product per line."""
+    return "".join(json.dumps(product, ensure_ascii=False) + "\n" for product in products).encode("utf-8")
+
+
+def ndjson_error(exc: Exception) -> bytes:
+    """The line that ends a stream whose scan failed midway, shaped like the search API's errors."""
+    return ndjson_chunk([{"code": 1001, "message": str(exc), "data": None}])
+
+
+def _unavailable(exc: HuiHiFiUnavailableError):
+    """503 while the HuiHiFi breaker is open; the catalog and cache still answer what they can."""
+    return jsonify({"code": 1001, "message": str(exc), "data": None}), 503, {"Retry-After": str(exc.retry_after)}
+
+
+def stream_limit(raw: Optional[str]) -> Optional[int]:
+    """The ``limit`` query parameter: 0 or absent for every product, None when invalid."""
+    try:
+        limit = int(raw or 0)
+    except ValueError:
+        return None
+    return limit if limit >= 0 else None
+
+
+def cache_bypassed(flag: Any, cache_control: str) -> bool:
+    """A ``noCache`` flag read like the boolean settings ("1", "true", "yes"), or ``Cache-Control: no-cache``."""
+    return str(flag).strip().lower() in ("1", "true", "yes") or "no-cache" in cache_control
+
+
+def _ndjson(first: List[Dict[str, Any]], rest: Iterator[List[Dict[str, Any]]], limit: int) -> Iterator[bytes]:
+    remaining = limit or None
+    page: Optional[List[Dict[str, Any]]] = first
+    try:
+        while page is not None:
+            if remaining is not None:
+                page = page[:remaining]
+                remaining -= len(page)
+            if page:
+                yield ndjson_chunk(page)
+            if remaining == 0:
+                return
+            page = next(rest, None)
+    except HuiHiFiClientError as exc:
+        logger.error("HuiHiFi 分页拉取中断: %s", exc)
+        yield ndjson_error(exc)
+    finally:
+        # Stops the page fetches still in flight when the client leaves or the limit is reached.
+        close = getattr(rest, "close", None)
+        if close is not None:
+            close()
+
+
+def create_products_blueprint(
+    huihifi_client: HuiHiFiClient,
+    product_cache: Optional[ProductSearchCache] = None,
+    product_catalog: Optional[ProductCatalog] = None,
+) -> Blueprint:
     bp = Blueprint("products", __name__)
 
     @bp.route("/products/search", methods=["POST"])
@@ -45,6 +112,12 @@ def create_products_blueprint(huihifi_client: HuiHiFiClient) -> Blueprint:
                 400,
             )
 
+        bypass_cache = cache_bypassed(payload.get("noCache"), request.headers.get("Cache-Control", ""))
+
+        if product_catalog is not None and product_catalog.is_ready and not bypass_cache:
+            data = product_catalog.search_products(keyword.strip(), page_size)
+            return jsonify({"code": 0, "message": "success", "data": data}), 200, {"X-Cache": "CATALOG"}
+
         if not huihifi_client.is_configured:
             return (
                 jsonify(
@@ -58,9 +131,13 @@ def create_products_blueprint(huihifi_client: HuiHiFiClient) -> Blueprint:
             )
 
         try:
-            data = huihifi_client.search_products(keyword.strip(), page_size)
+            if product_cache is not None:
+                data, cache_status = product_cache.search_products(keyword.strip(), page_size, bypass=bypass_cache)
+            else:
+                data, cache_status = huihifi_client.search_products(keyword.strip(), page_size), None
             response = {"code": 0, "message": "success", "data": data}
-            return jsonify(response), 200
+            headers = {"X-Cache": cache_status} if cache_status else {}
+            return jsonify(response), 200, headers
         except HuiHiFiCredentialsError as exc:
             logger.error("HuiHiFi 凭证错误: %s", exc)
             return (
@@ -73,6 +150,8 @@ def create_products_blueprint(huihifi_client: HuiHiFiClient) -> Blueprint:
                 ),
                 503,
             )
+        except HuiHiFiUnavailableError as exc:
+            return _unavailable(exc)
         except HuiHiFiClientError as exc:
             logger.error("HuiHiFi API 调用失败: %s", exc)
             return (
@@ -86,4 +165,42 @@ def create_products_blueprint(huihifi_client: HuiHiFiClient) -> Blueprint:
                 500,
             )
 
+    @bp.route("/products/stream", methods=["GET"])
+    def stream_products():
+        """Every product matching ``keyword`` (up to ``limit``) as NDJSON, written as pages arrive."""
+        keyword = request.args.get("keyword", "").strip()
+        limit = stream_limit(request.args.get("limit"))
+        if limit is None:
+            return jsonify({"code": 1000, "message": "limit 必须是非负整数", "data": None}), 400
+
+        bypass_cache = cache_bypassed(request.args.get("noCache"), request.headers.get("Cache-Control", ""))
+        if product_catalog is not None and product_catalog.is_ready and not bypass_cache:
+            products = product_catalog.search_products(keyword, limit or len(product_catalog))["products"]
+            return Response(_ndjson(products, iter(()), limit), mimetype=NDJSON_MIMETYPE, headers={"X-Cache": "CATALOG"})
+
+        credentials_error = {"code": 1003, "message": "服务器配置错误: 未设置 HuiHiFi API 凭证", "data": None}
+        if not huihifi_client.is_configured:
+            return jsonify(credentials_error), 503
+
+        # The first page is fetched before answering, so an upstream failure still gets a proper status.
+        pages = huihifi_client.iter_pages(keyword)
+        try:
+            first = next(pages, [])
+        except HuiHiFiCredentialsError as exc:
+            logger.error("HuiHiFi 凭证错误: %s", exc)
+            return jsonify(credentials_error), 503
+        except HuiHiFiUnavailableError as exc:
+            return _unavailable(exc)
+        except HuiHiFiClientError as exc:
+            logger.error("HuiHiFi API 调用失败: %s", exc)
+            return jsonify({"code": 1001, "message": str(exc), "data": None}), 502
+        body = bind_request_id(_ndjson(first, pages, limit))
+        return Response(body, mimetype=NDJSON_MIMETYPE, headers={"Cache-Control": "no-cache"})
+
+    @bp.route("/products/cache/stats", methods=["GET"])
+    def product_cache_stats():
+        if product_cache is None:
+            return jsonify({"code": 0, "message": "success", "data": {"enabled": False}})
+        return jsonify({"code": 0, "message": "success", "data": {"enabled": True, **product_cache.stats()}})
+
     return bp
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import logging
-from typing import Iterable, Sequence
+from typing import Iterable, Optional, Sequence, Tuple
 
 from flask import Flask, jsonify, request
 from flask_cors import CORS
@@ -15,36 +15,59 @@ def apply_cors(app: Flask, allowed_origins: Sequence[str]) -> None:
         app,
         origins=list(allowed_origins),
         supports_credentials=True,
-        allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
+        allow_headers=["Content-Type", "Authorization", "X-Requested-With", "X-Request-ID"],
+        expose_headers=["X-Request-ID", "Retry-After"],
     )
 
 
+# Paths that load balancers and scrapers call without browser origin headers.
+ORIGIN_EXEMPT_PATHS = frozenset({"/health", "/metrics"})
+
+
+def check_origin(
+    method: str,
+    path: str,
+    origin: Optional[str],
+    referer: str,
+    allowed: Tuple[str, ...],
+) -> Optional[Tuple[dict, int]]:
+    """Return an (error body, status) pair if the request origin is not allowed."""
+    if method == "OPTIONS":
+        return None
+
+    if path in ORIGIN_EXEMPT_PATHS:
+        return None
+
+    if origin:
+        if origin not in allowed:
+            logger.warning("拒绝来自未授权域名的请求: %s", origin)
+            return {"error": "不允许的请求来源"}, 403
+    elif referer:
+        if not any(referer.startswith(item) for item in allowed):
+            logger.warning("拒绝来自未授权Referer的请求: %s", referer)
+            return {"error": "不允许的请求来源"}, 403
+    else:
+        logger.warning("拒绝没有来源信息的请求")
+        return {"error": "缺少请求来源信息"}, 403
+
+    return None
+
+
 def create_origin_verifier(allowed_origins: Iterable[str]):
     """Return a before_request hook that validates the request origin."""
     allowed = tuple(allowed_origins)
 
     def verify_origin():
-        if request.method == "OPTIONS":
-            return None
-
-        if request.path == "/health":
-            return None
-
-        origin = request.headers.get("Origin")
-        referer = request.headers.get("Referer", "")
-
-        if origin:
-            if origin not in allowed:
-                logger.warning("拒绝来自未授权域名的请求: %s", origin)
-                return jsonify({"error": "不允许的请求来源"}), 403
-        elif referer:
-            if not any(referer.startswith(item) for item in allowed):
-                logger.warning("拒绝来自未授权Referer的请求: %s", referer)
-                return jsonify({"error": "不允许的请求来源"}), 403
-        else:
-            logger.warning("拒绝没有来源信息的请求")
-            return jsonify({"error": "缺少请求来源信息"}), 403
-
+        rejection = check_origin(
+            request.method,
+            request.path,
+            request.headers.get("Origin"),
+            request.headers.get("Referer", ""),
+            allowed,
+        )
+        if rejection is not None:
+            body, status = rejection
+            return jsonify(body), status
         return None
 
     return verify_origin
@@ -1,6 +1,23 @@
 """Service layer helpers for the AITuning backend."""
 
-from .dify import DifyClient
-from .huihifi import HuiHiFiClient, HuiHiFiClientError, HuiHiFiCredentialsError
+from .answer_cache import AnswerCache
+from .catalog import ProductCatalog
+from .dify import DifyClient, DifyClientError, DifyTimeoutError, DifyUnavailableError
+from .huihifi import HuiHiFiClient, HuiHiFiClientError, HuiHiFiCredentialsError, HuiHiFiUnavailableError
+from .product_cache import ProductSearchCache
+from .upload_cache import UploadCache
 
-__all__ = ["DifyClient", "HuiHiFiClient", "HuiHiFiClientError", "HuiHiFiCredentialsError"]
+__all__ = [
+    "AnswerCache",
+    "DifyClient",
+    "DifyClientError",
+    "DifyTimeoutError",
+    "DifyUnavailableError",
+    "HuiHiFiClient",
+    "HuiHiFiClientError",
+    "HuiHiFiCredentialsError",
+    "HuiHiFiUnavailableError",
+    "ProductCatalog",
+    "ProductSearchCache",
+    "UploadCache",
+]
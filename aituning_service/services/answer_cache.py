@@ -0,0 +1,293 @@
+"""
+Replayable answers for stateless first-turn chats.
+
+A chat without ``conversationId`` depends only on its message, filters and
+curve, so identical first turns can share one Dify generation. The first
+one's relayed SSE events are recorded with their timing and stored in a
+SQLite file; later ones replay the events at the recorded pace instead of
+calling Dify. Only complete answers (ending in ``message_end``, with no
+error event) are stored. Dify's conversation, message and task ids are
+blanked, since they belong to the user who asked first: a replayed answer
+opens no conversation, and the next turn starts a new one. That follow-up
+reaches Dify without the first question and answer in its history, so it
+is answered as if it were the first turn. Seeding a conversation for each
+replay would take a Dify generation and defeat the cache, so deployments
+whose users mostly ask follow-ups should leave the cache off.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from contextlib import closing
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from ..metrics import CACHE_BYTES, CACHE_ENTRIES, CACHE_EVICTIONS, CACHE_LOOKUPS
+from ..streaming import HEARTBEAT
+from .upload_cache import image_digest
+
+logger = logging.getLogger(__name__)
+
+# A recorded event: milliseconds after the first event, and its bytes.
+Event = Tuple[int, bytes]
+
+_LOOKUPS = {result: CACHE_LOOKUPS.labels("chat_answer", result) for result in ("hits", "misses")}
+_ENTRIES = CACHE_ENTRIES.labels("chat_answer")
+_BYTES = CACHE_BYTES.labels("chat_answer")
+_EVICTIONS = CACHE_EVICTIONS.labels("chat_answer")
+
+_EVENT_HEADER = struct.Struct(">II")
+# Fields tying a Dify answer to the user who asked first.
+_SESSION_FIELDS = ("conversation_id", "message_id", "task_id", "id")
+# A stall in the recorded stream is replayed for at most this long.
+_MAX_REPLAY_GAP = 1.0
+
+
+def answer_key(
+    message: str,
+    current_filters: str,
+    curve_image_base64: Optional[str],
+    curve_text: Optional[str],
+    variant: str = "",
+) -> bytes:
+    """Digest of what a first-turn answer depends on; ``variant`` separates differently relayed streams."""
+    digest = hashlib.blake2b(digest_size=16)
+    image = image_digest(curve_image_base64).hex() if curve_image_base64 else ""
+    for part in (message, current_filters or "", image, curve_text or "", variant):
+        encoded = part.encode("utf-8")
+        digest.update(len(encoded).to_bytes(4, "big"))
+        digest.update(encoded)
+    return digest.digest()
+
+
+def _encode(events: List[Event]) -> bytes:
+    return zlib.compress(b"".join(_EVENT_HEADER.pack(offset, len(data)) + data for offset, data in events))
+
+
+def _decode(blob: bytes) -> List[Event]:
+    data = zlib.decompress(blob)
+    events: List[Event] = []
+    position = 0
+    while position < len(data):
+        offset, size = _EVENT_HEADER.unpack_from(data, position)
+        position += _EVENT_HEADER.size
+        events.append((offset, data[position:position + size]))
+        position += size
+    return events
+
+
+def _anonymize(events: List[Event]) -> Optional[List[Event]]:
+    """The events with session ids blanked; None unless they form one complete answer."""
+    result: List[Event] = []
+    ended = False
+    for offset, event in events:
+        if not event.startswith(b"data:"):
+            result.append((offset, event))
+            continue
+        try:
+            payload = json.loads(event[5:])
+        except ValueError:
+            return None
+        if not isinstance(payload, dict) or "error" in payload or payload.get("event") == "error":
+            return None
+        ended = ended or payload.get("event") == "message_end"
+        for field in _SESSION_FIELDS:
+            if payload.get(field):
+                payload[field] = ""
+        result.append((offset, f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")))
+    return result if ended else None
+
+
+class AnswerRecorder:
+    """Collect the events of one relayed stream; ``commit`` stores them if they form a complete answer."""
+
+    def __init__(self, cache: "AnswerCache", key: bytes) -> None:
+        self._cache = cache
+        self._key = key
+        self._events: List[Event] = []
+        self._pending = b""
+        self._started: Optional[float] = None
+        self._size = 0
+        self._overflow = False
+
+    def feed(self, chunk: bytes) -> None:
+        if self._overflow or chunk == HEARTBEAT:
+            return
+        now = time.perf_counter()
+        if self._started is None:
+            self._started = now
+        self._size += len(chunk)
+        if self._size > self._cache.max_entry_bytes:
+            self._overflow = True
+            self._events = []
+            return
+        offset = int((now - self._started) * 1000)
+        *complete, self._pending = (self._pending + chunk).split(b"\n\n")
+        # The lines relay ends each data event with an extra blank line; empty pieces are dropped.
+        self._events.extend((offset, event.lstrip(b"\n") + b"\n\n") for event in complete if event.strip(b"\n"))
+
+    def commit(self) -> bool:
+        if self._overflow or self._pending.strip() or not self._events:
+            return False
+        events = _anonymize(self._events)
+        if events is None:
+            return False
+        self._cache.put(self._key, events)
+        return True
+
+
+class AnswerCache:
+    """
+    Size-bounded store of recorded answers in a SQLite file, shared by the
+    worker processes of a host. Entries older than ``ttl`` seconds are not
+    replayed; past ``max_bytes`` of compressed events, the least recently
+    replayed entries are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 64 << 20,
+        ttl: float = 86400,
+        max_entry_bytes: int = 1 << 20,
+        replay_speed: float = 1.0,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        # 1 replays at the recorded pace, 2 twice as fast; 0 sends everything at once.
+        self.replay_speed = replay_speed
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn: Optional[sqlite3.Connection] = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def init_database(self) -> None:
+        conn = self._connection()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chat_answers (
+                key BLOB PRIMARY KEY,
+                events BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                used_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_answers_used ON chat_answers (used_at)")
+        self._update_gauges(conn)
+
+    def get(self, key: bytes) -> Optional[List[Event]]:
+        """The recorded events for ``key``, or None; a storage error counts as a miss."""
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT events, created_at FROM chat_answers WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and now - row[1] < self.ttl:
+                conn.execute("UPDATE chat_answers SET used_at = ?, hits = hits + 1 WHERE key = ?", (now, key))
+                _LOOKUPS["hits"].inc()
+                return _decode(row[0])
+            if row is not None:
+                conn.execute("DELETE FROM chat_answers WHERE key = ?", (key,))
+        except (sqlite3.Error, zlib.error, struct.error) as exc:
+            logger.warning("读取回答缓存失败: %s", exc)
+        _LOOKUPS["misses"].inc()
+        return None
+
+    def put(self, key: bytes, events: List[Event]) -> None:
+        blob = _encode(events)
+        now = time.time()
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO chat_answers (key, events, size, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._evict(conn)
+        except sqlite3.Error as exc:
+            logger.warning("写入回答缓存失败: %s", exc)
+
+    def recorder(self, key: bytes) -> AnswerRecorder:
+        return AnswerRecorder(self, key)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM chat_answers").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess > 0:
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM chat_answers ORDER BY used_at"):
+                victims.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM chat_answers WHERE key = ?", victims)
+            conn.execute("PRAGMA incremental_vacuum")
+            _EVICTIONS.inc(len(victims))
+        self._update_gauges(conn)
+
+    def _update_gauges(self, conn: sqlite3.Connection) -> None:
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM chat_answers").fetchone()
+        _ENTRIES.set(entries)
+        _BYTES.set(size)
+
+    def _batches(self, events: List[Event]) -> Iterator[Tuple[float, bytes]]:
+        """Events sharing a recorded millisecond as one write, each with the pause before it."""
+        previous = 0
+        index = 0
+        while index < len(events):
+            offset = events[index][0]
+            batch = []
+            while index < len(events) and events[index][0] == offset:
+                batch.append(events[index][1])
+                index += 1
+            pause = 0.0 if self.replay_speed <= 0 else min(_MAX_REPLAY_GAP, (offset - previous) / 1000 / self.replay_speed)
+            previous = offset
+            yield pause, b"".join(batch)
+
+    def replay(self, events: List[Event]) -> Iterator[bytes]:
+        for pause, data in self._batches(events):
+            if pause > 0:
+                time.sleep(pause)
+            yield data
+
+    async def replay_async(self, events: List[Event]) -> AsyncIterator[bytes]:
+        for pause, data in self._batches(events):
+            if pause > 0:
+                await asyncio.sleep(pause)
+            yield data
+
+
+def record_stream(chunks: Iterable[bytes], recorder: AnswerRecorder) -> Iterator[bytes]:
+    """Pass a relayed WSGI body through, storing it once it has been sent in full."""
+    with closing(iter(chunks)) as body:  # type: ignore[type-var]
+        for chunk in body:
+            recorder.feed(chunk)
+            yield chunk
+    recorder.commit()
+
+
+def record_writes(write: Callable[[bytes], Awaitable[None]], recorder: AnswerRecorder) -> Callable[[bytes], Awaitable[None]]:
+    """``write`` for an asyncio relay, also feeding ``recorder``; commit once the relay has finished."""
+
+    async def recording_write(chunk: bytes) -> None:
+        recorder.feed(chunk)
+        await write(chunk)
+
+    return recording_write
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import bisect
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from .huihifi import HuiHiFiClient, HuiHiFiClientError, product_key
+
+logger = logging.getLogger(__name__)
+
+# Version 1 snapshots carried ``createTime`` on each item and were re-sorted by it.
+_SNAPSHOT_VERSION = 2
+# Latin letters and digits form word tokens; each CJK character is its own
+# token, since titles such as "森海塞尔HD600" have no word boundaries.
+_TOKEN_PATTERN = re.compile(r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.casefold())
+
+
+def _searchable_text(product: Dict[str, Any]) -> str:
+    brand = product.get("brand") or {}
+    return " ".join(
+        str(part)
+        for part in (product.get("title"), brand.get("title"), product.get("categoryName"))
+        if part
+    )
+
+
+class _CatalogIndex:
+    """
+    Immutable inverted index over title, brand and category; swapped whole on refresh.
+
+    A keyword token matches every term containing it, as HuiHiFi's own
+    substring search does, so "600" finds "HD600".
+    """
+
+    def __init__(self, products: List[Dict[str, Any]]) -> None:
+        # Upstream order (newest first) is kept, so posting lists and results stay in that order.
+        self.products = products
+        postings: Dict[str, Set[int]] = {}
+        for doc_id, product in enumerate(self.products):
+            for token in set(tokenize(_searchable_text(product))):
+                postings.setdefault(token, set()).add(doc_id)
+        self.postings = postings
+        self.terms = sorted(postings)
+        # Terms joined into one string, so a substring is found by str.find rather than a loop over terms.
+        self._vocabulary = "\n".join(self.terms)
+        self._starts: List[int] = []
+        offset = 0
+        for term in self.terms:
+            self._starts.append(offset)
+            offset += len(term) + 1
+
+    def _substring_matches(self, fragment: str) -> Set[int]:
+        matched: Set[int] = set()
+        position = self._vocabulary.find(fragment)
+        while position != -1:
+            term_id = bisect.bisect_right(self._starts, position) - 1
+            matched |= self.postings[self.terms[term_id]]
+            if term_id + 1 == len(self.terms):
+                break
+            position = self._vocabulary.find(fragment, self._starts[term_id + 1])
+        return matched
+
+    def search(self, keyword: str, page_size: int) -> Dict[str, Any]:
+        tokens = tokenize(keyword)
+        if not tokens:
+            return {"products": self.products[:page_size], "total": len(self.products)}
+
+        result: Optional[Set[int]] = None
+        # The rarest-looking (longest) tokens first keeps the intersection small.
+        for token in sorted(set(tokens), key=len, reverse=True):
+            matched = self._substring_matches(token)
+            result = matched if result is None else result & matched
+            if not result:
+                return {"products": [], "total": 0}
+
+        doc_ids = sorted(result)
+        return {"products": [self.products[doc_id] for doc_id in doc_ids[:page_size]], "total": len(doc_ids)}
+
+
+class ProductCatalog:
+    """
+    Local mirror of the HuiHiFi evaluation catalog.
+
+    ``sync`` pages the catalog through ``HuiHiFiClient`` and persists a gzip
+    JSON snapshot, so searches are answered from an in-memory index and
+    survive upstream slowness or restarts. A full sync (pages fetched
+    concurrently) replaces the catalog, picking up edits and deletions; an
+    incremental sync only prepends the items listed before the first one
+    already held. Full syncs run every ``full_sync_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        client: HuiHiFiClient,
+        snapshot_path: str,
+        page_size: Optional[int] = None,
+        full_sync_interval: float = 21600,
+    ) -> None:
+        self.client = client
+        self.snapshot_path = snapshot_path
+        self.page_size = page_size or client.max_page_size
+        self.full_sync_interval = full_sync_interval
+        self._index: Optional[_CatalogIndex] = None
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.last_synced: Optional[float] = None
+        self.last_full_sync: Optional[float] = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self._index is not None
+
+    @property
+    def full_sync_due(self) -> bool:
+        if self.last_full_sync is None:
+            return True
+        return time.time() - self.last_full_sync >= self.full_sync_interval
+
+    def __len__(self) -> int:
+        return len(self._index.products) if self._index else 0
+
+    def search_products(self, keyword: str, page_size: int) -> Dict[str, Any]:
+        index = self._index
+        if index is None:
+            raise HuiHiFiClientError("产品目录尚未同步")
+        return index.search(keyword, page_size)
+
+    def load(self) -> bool:
+        """Load the snapshot from disk; returns False if there is none."""
+        try:
+            with gzip.open(self.snapshot_path, "rt", encoding="utf-8") as handle:
+                snapshot = json.load(handle)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as exc:
+            logger.warning("读取产品目录快照失败，将重新全量同步: %s", exc)
+            return False
+
+        if snapshot.get("version") != _SNAPSHOT_VERSION:
+            return False
+        self._index = _CatalogIndex(snapshot["products"])
+        self.last_synced = snapshot.get("syncedAt")
+        self.last_full_sync = snapshot.get("fullSyncedAt")
+        logger.info("已加载产品目录快照: %s 条", len(self))
+        return True
+
+    def _save(self, products: List[Dict[str, Any]]) -> None:
+        snapshot = {
+            "version": _SNAPSHOT_VERSION,
+            "syncedAt": self.last_synced,
+            "fullSyncedAt": self.last_full_sync,
+            "products": products,
+        }
+        # Several workers may sync the same snapshot; each writes its own temp file.
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=os.path.basename(self.snapshot_path) + ".",
+            suffix=".tmp",
+            dir=os.path.dirname(os.path.abspath(self.snapshot_path)),
+        )
+        try:
+            with gzip.open(os.fdopen(fd, "wb"), "wt", encoding="utf-8") as handle:
+                json.dump(snapshot, handle, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.snapshot_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def sync(self, full: bool = False) -> int:
+        """Fetch new items (or everything when ``full``); returns the number of items fetched."""
+        with self._sync_lock:
+            current = self._index.products if (self._index and not full) else []
+            held = {product_key(item) for item in current}
+            seen: Set[Any] = set()
+
+            fetched: List[Dict[str, Any]] = []
+            # An incremental sync usually stops on its first page, so it fetches no pages ahead.
+            pages = self.client.iter_pages("", self.page_size, concurrency=1 if current else None)
+            try:
+                for products in pages:
+                    reached = False
+                    for item in products:
+                        key = product_key(item)
+                        # Pages arrive newest first, so the first item already held ends an incremental sync.
+                        if key in held:
+                            reached = True
+                            break
+                        if key not in seen:
+                            seen.add(key)
+                            fetched.append(item)
+                    if reached:
+                        break
+            finally:
+                pages.close()
+
+            products = fetched + current
+            previous = len(self)
+            self._index = _CatalogIndex(products)
+            self.last_synced = time.time()
+            if full:
+                self.last_full_sync = self.last_synced
+            self._save(self._index.products)
+            if full:
+                logger.info("产品目录全量同步完成: 共 %s 条（此前 %s 条）", len(products), previous)
+            else:
+                logger.info("产品目录增量同步完成: 新增 %s 条，共 %s 条", len(fetched), len(products))
+            return len(fetched)
+
+    def start_background_refresh(self, interval: float) -> threading.Thread:
+        """Load the snapshot, then sync every ``interval`` seconds in a daemon thread, fully when one is due."""
+
+        def run() -> None:
+            if not self.load() or self.full_sync_due:
+                self._safe_sync(full=True)
+            while not self._stop.wait(interval):
+                self._safe_sync(full=self.full_sync_due)
+
+        thread = threading.Thread(target=run, name="product-catalog-sync", daemon=True)
+        thread.start()
+        return thread
+
+    def _safe_sync(self, full: bool) -> None:
+        try:
+            self.sync(full=full)
+        except (HuiHiFiClientError, OSError) as exc:
+            logger.warning("产品目录同步失败: %s", exc)
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -1,21 +1,125 @@
 from __future__ import annotations
 
 import base64
+import contextvars
 import json
 import logging
-from typing import Iterable, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from ..logs import Payload, sample_payload
+from ..metrics import UpstreamCall
+from ..resilience import CircuitBreaker, upstream_ok
+from .upload_cache import UploadCache
 
 logger = logging.getLogger(__name__)
 
 
+def decode_image_data(base64_data: str) -> Optional[bytes]:
+    """Decode a (possibly ``data:`` URL prefixed) base64 image; returns None if it is invalid."""
+    data = base64_data.split(",", 1)[1] if base64_data.startswith("data:") else base64_data
+    try:
+        return base64.b64decode(data)
+    except Exception as exc:
+        logger.error("解码图片数据失败: %s", exc)
+        return None
+
+
+def build_chat_payload(
+    query: str,
+    current_filters: str,
+    user_token: str,
+    conversation_id: Optional[str],
+    image_file_id: Optional[str],
+    frequency_response: Optional[str] = None,
+) -> dict:
+    payload: dict = {
+        "inputs": {"currentFilters": current_filters},
+        "query": query,
+        "response_mode": "streaming",
+        "user": user_token,
+        "auto_generate_name": True,
+    }
+
+    if frequency_response:
+        # Resampled curve text (see curve.py); the Dify app declares it as a paragraph input.
+        payload["inputs"]["frequencyResponse"] = frequency_response
+
+    if conversation_id:
+        payload["conversation_id"] = conversation_id
+
+    if image_file_id:
+        payload["files"] = [
+            {
+                "type": "image",
+                "transfer_method": "local_file",
+                "upload_file_id": image_file_id,
+            }
+        ]
+    return payload
+
+
+class DifyClientError(Exception):
+    """Raised when Dify cannot be reached or does not answer in time."""
+
+
+class DifyTimeoutError(DifyClientError):
+    """Raised when Dify does not connect or start responding in time."""
+
+
+class DifyUnavailableError(DifyClientError):
+    """Raised without calling Dify while its circuit breaker is open."""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("AI服务暂时不可用，请稍后再试")
+        self.retry_after = retry_after
+
+
 class DifyClient:
     """Wrapper around Dify API calls used by the AI assistant."""
 
-    def __init__(self, base_url: str, api_key: Optional[str]) -> None:
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str],
+        connect_timeout: float = 3.05,
+        first_byte_timeout: float = 30,
+        read_timeout: float = 60,
+        upload_timeout: float = 30,
+        pool_size: int = 20,
+        upload_cache: Optional[UploadCache] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
         self.base_url = base_url.rstrip("/")
         self.api_key = api_key
+        self.breaker = breaker or CircuitBreaker("dify")
+        self.connect_timeout = connect_timeout
+        self.first_byte_timeout = first_byte_timeout
+        self.read_timeout = read_timeout
+        self.upload_timeout = upload_timeout
+        self.pool_size = pool_size
+        self.upload_cache = upload_cache
+        self._session = self._create_session(pool_size)
+        self._upload_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="dify-upload")
+
+    @staticmethod
+    def _create_session(pool_size: int) -> requests.Session:
+        # Chat and upload are not idempotent, so only failed connects are
+        # retried: the request never reached Dify.
+        retry = Retry(total=1, connect=1, read=False, status=0, other=0, allowed_methods=None, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self) -> None:
+        self._upload_executor.shutdown(wait=False)
+        self._session.close()
 
     @property
     def is_configured(self) -> bool:
@@ -27,24 +131,38 @@ class DifyClient:
             logger.error("Dify 客户端未配置，无法上传图片")
             return None
 
-        data = base64_data.split(",", 1)[1] if base64_data.startswith("data:") else base64_data
-        try:
-            image_bytes = base64.b64decode(data)
-        except Exception as exc:
-            logger.error("解码图片数据失败: %s", exc)
+        image_bytes = decode_image_data(base64_data)
+        if image_bytes is None:
+            return None
+
+        if not self.breaker.allow():
+            logger.error("Dify 熔断中，跳过图片上传")
             return None
 
         files = {"file": ("curve.png", image_bytes, "image/png")}
         payload = {"user": user_token}
         headers = {"Authorization": f"Bearer {self.api_key}"}
 
-        response = requests.post(f"{self.base_url}/files/upload", files=files, data=payload, headers=headers)
+        try:
+            with UpstreamCall("dify", "upload") as call:
+                response = self._session.post(
+                    f"{self.base_url}/files/upload",
+                    files=files,
+                    data=payload,
+                    headers=headers,
+                    timeout=(self.connect_timeout, self.upload_timeout),
+                )
+                call.status = response.status_code
+        except requests.RequestException as exc:
+            self.breaker.record(False)
+            logger.error("上传图片到 Dify 失败: %s", exc)
+            return None
+        self.breaker.record(upstream_ok(response.status_code))
 
         if response.status_code != 201:
             logger.error(
-                "上传图片到 Dify 失败: status=%s body=%s",
-                response.status_code,
-                response.text,
+                "上传图片到 Dify 失败",
+                extra={"status": response.status_code, "body": Payload(response.text)},
             )
             return None
 
@@ -56,8 +174,26 @@ class DifyClient:
 
         file_id = result.get("id")
         logger.info("图片上传到 Dify 成功: %s", file_id)
+        if file_id and self.upload_cache is not None:
+            self.upload_cache.put(user_token, base64_data, file_id)
         return file_id
 
+    def cached_upload(self, base64_data: str, user_token: str) -> Optional[str]:
+        """Return the file id of an identical image this user uploaded recently, if any."""
+        if self.upload_cache is None:
+            return None
+        return self.upload_cache.get(user_token, base64_data)
+
+    def forget_upload(self, base64_data: str, user_token: str) -> None:
+        if self.upload_cache is not None:
+            self.upload_cache.invalidate(user_token, base64_data)
+
+    def submit_upload(self, base64_data: str, user_token: str) -> "Future[Optional[str]]":
+        """Start ``upload_image`` in the background so the caller can prepare the chat meanwhile."""
+        # Run under the caller's context, so the upload logs carry its request id.
+        context = contextvars.copy_context()
+        return self._upload_executor.submit(context.run, self.upload_image, base64_data, user_token)
+
     def stream_chat(
         self,
         query: str,
@@ -65,36 +201,51 @@ class DifyClient:
         user_token: str,
         conversation_id: Optional[str],
         image_file_id: Optional[str],
+        frequency_response: Optional[str] = None,
     ) -> requests.Response:
         """Send a chat request to Dify and return the streaming response object."""
         if not self.is_configured:
             raise RuntimeError("AI服务未配置")
+        if not self.breaker.allow():
+            raise DifyUnavailableError(self.breaker.retry_after())
 
-        payload: dict = {
-            "inputs": {"currentFilters": current_filters},
-            "query": query,
-            "response_mode": "streaming",
-            "user": user_token,
-            "auto_generate_name": True,
-        }
-
-        if conversation_id:
-            payload["conversation_id"] = conversation_id
-
-        if image_file_id:
-            payload["files"] = [
-                {
-                    "type": "image",
-                    "transfer_method": "local_file",
-                    "upload_file_id": image_file_id,
-                }
-            ]
+        payload = build_chat_payload(
+            query, current_filters, user_token, conversation_id, image_file_id, frequency_response
+        )
 
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
 
-        logger.info("调用 Dify API: payload=%s", json.dumps(payload, ensure_ascii=False))
-        response = requests.post(f"{self.base_url}/chat-messages", json=payload, headers=headers, stream=True)
+        if sample_payload():
+            logger.info("调用 Dify API", extra={"payload": Payload(payload)})
+        try:
+            # The read timeout bounds the wait for the response headers (first byte) ...
+            with UpstreamCall("dify", "chat") as call:
+                response = self._session.post(
+                    f"{self.base_url}/chat-messages",
+                    json=payload,
+                    headers=headers,
+                    stream=True,
+                    timeout=(self.connect_timeout, self.first_byte_timeout),
+                )
+                call.status = response.status_code
+        except requests.Timeout as exc:
+            self.breaker.record(False)
+            raise DifyTimeoutError("AI服务响应超时") from exc
+        except requests.RequestException as exc:
+            self.breaker.record(False)
+            raise DifyClientError(f"AI服务连接失败: {exc}") from exc
+        self.breaker.record(upstream_ok(response.status_code))
+
+        # ... and is then relaxed to the idle limit between streamed chunks.
+        _set_stream_timeout(response, self.read_timeout)
         return response
+
+
+def _set_stream_timeout(response: requests.Response, timeout: float) -> None:
+    connection = getattr(response.raw, "connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        sock.settimeout(timeout)
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import Optional
+
+import aiohttp
+
+from ..logs import Payload, sample_payload
+from ..metrics import UpstreamCall
+from ..resilience import CircuitBreaker, upstream_ok
+from .dify import DifyClientError, DifyTimeoutError, DifyUnavailableError, build_chat_payload, decode_image_data
+from .upload_cache import UploadCache
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDifyClient:
+    """Event-loop counterpart of ``DifyClient`` for the async serving mode."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str],
+        pool_size: int = 0,
+        connect_timeout: float = 3.05,
+        first_byte_timeout: float = 30,
+        read_timeout: float = 60,
+        upload_timeout: float = 30,
+        upload_cache: Optional[UploadCache] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.breaker = breaker or CircuitBreaker("dify")
+        self._pool_size = pool_size
+        self._connect_timeout = connect_timeout
+        self.first_byte_timeout = first_byte_timeout
+        self.read_timeout = read_timeout
+        self.upload_timeout = upload_timeout
+        self.upload_cache = upload_cache
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def is_configured(self) -> bool:
+        return bool(self.api_key)
+
+    async def start(self) -> None:
+        # pool_size=0 means no connection cap: every open chat holds one upstream stream.
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self._pool_size, keepalive_timeout=30),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self._connect_timeout, sock_read=self.read_timeout),
+        )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    async def upload_image(self, base64_data: str, user_token: str) -> Optional[str]:
+        """Upload an image and return the file identifier."""
+        if not self.is_configured:
+            logger.error("Dify 客户端未配置，无法上传图片")
+            return None
+
+        image_bytes = decode_image_data(base64_data)
+        if image_bytes is None:
+            return None
+
+        if not self.breaker.allow():
+            logger.error("Dify 熔断中，跳过图片上传")
+            return None
+
+        form = aiohttp.FormData()
+        form.add_field("user", user_token)
+        form.add_field("file", image_bytes, filename="curve.png", content_type="image/png")
+
+        try:
+            with UpstreamCall("dify", "upload") as call:
+                async with self._session.post(
+                    f"{self.base_url}/files/upload",
+                    data=form,
+                    headers=self._headers(),
+                    timeout=aiohttp.ClientTimeout(sock_connect=self._connect_timeout, total=self.upload_timeout),
+                ) as response:
+                    body = await response.read()
+                    call.status = response.status
+            self.breaker.record(upstream_ok(response.status))
+            if response.status != 201:
+                logger.error(
+                    "上传图片到 Dify 失败",
+                    extra={"status": response.status, "body": Payload(body.decode("utf-8", "replace"))},
+                )
+                return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            self.breaker.record(False)
+            logger.error("上传图片到 Dify 失败: %r", exc)
+            return None
+
+        try:
+            result = json.loads(body)
+        except ValueError:
+            logger.error("解析 Dify 图片上传响应失败")
+            return None
+
+        file_id = result.get("id")
+        logger.info("图片上传到 Dify 成功: %s", file_id)
+        if file_id and self.upload_cache is not None:
+            self.upload_cache.put(user_token, base64_data, file_id)
+        return file_id
+
+    def cached_upload(self, base64_data: str, user_token: str) -> Optional[str]:
+        """Return the file id of an identical image this user uploaded recently, if any."""
+        if self.upload_cache is None:
+            return None
+        return self.upload_cache.get(user_token, base64_data)
+
+    def forget_upload(self, base64_data: str, user_token: str) -> None:
+        if self.upload_cache is not None:
+            self.upload_cache.invalidate(user_token, base64_data)
+
+    async def stream_chat(
+        self,
+        query: str,
+        current_filters: str,
+        user_token: str,
+        conversation_id: Optional[str],
+        image_file_id: Optional[str],
+        frequency_response: Optional[str] = None,
+    ) -> aiohttp.ClientResponse:
+        """Send a chat request to Dify and return the (unread) streaming response; the caller releases it."""
+        if not self.is_configured:
+            raise RuntimeError("AI服务未配置")
+        if not self.breaker.allow():
+            raise DifyUnavailableError(self.breaker.retry_after())
+
+        payload = build_chat_payload(
+            query, current_filters, user_token, conversation_id, image_file_id, frequency_response
+        )
+        if sample_payload():
+            logger.info("调用 Dify API", extra={"payload": Payload(payload)})
+        try:
+            # Waiting for the response headers is bounded by the first-byte
+            # timeout; the body is then bounded by the session's sock_read.
+            with UpstreamCall("dify", "chat") as call:
+                response = await asyncio.wait_for(
+                    self._session.post(f"{self.base_url}/chat-messages", json=payload, headers=self._headers()),
+                    self.first_byte_timeout,
+                )
+                call.status = response.status
+            self.breaker.record(upstream_ok(response.status))
+            return response
+        except asyncio.TimeoutError as exc:
+            self.breaker.record(False)
+            raise DifyTimeoutError("AI服务响应超时") from exc
+        except aiohttp.ClientError as exc:
+            self.breaker.record(False)
+            raise DifyClientError(f"AI服务连接失败: {exc}") from exc
@@ -0,0 +1,321 @@
+"""
+Exact magnitude responses of RBJ "Audio EQ Cookbook" biquads, vectorized with NumPy.
+
+The tuning UI approximates shelf and pass filters; this module evaluates
+the digital filters themselves, for many filter sets over one frequency
+grid in a single call.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Sequence
+
+try:  # pragma: no cover - depends on the deployment
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the deployment
+    np = None
+
+from ..curve import GRID_MAX_HZ, GRID_MIN_HZ, log_grid
+
+EQ_AVAILABLE = np is not None
+
+FILTER_TYPES = ("peaking", "low_shelf", "high_shelf", "lowpass", "highpass")
+_KIND = {kind: index for index, kind in enumerate(FILTER_TYPES)}
+# The reference rate filterCalculations.ts uses.
+DEFAULT_SAMPLE_RATE = 44100.0
+# Butterworth Q; used when a shelf or pass filter has no qFactor.
+DEFAULT_Q = 1 / math.sqrt(2)
+
+MAX_FILTER_SETS = 4096
+MAX_FILTERS_PER_SET = 64
+MAX_GRID_POINTS = 8192
+# Values one /api/eq/response call may return (sets x points); JSON encoding dominates beyond this.
+MAX_RESPONSE_VALUES = 1 << 20
+DEFAULT_POINTS = 512
+# Section values (sets x filters x points) computed per block.
+_BLOCK_VALUES = 1 << 16
+
+_CONTEXT_LINE = re.compile(r'type:\s*"(?P<type>[^"]*)"(?P<rest>.*)')
+_CONTEXT_FIELD = re.compile(r"(freq|gain|qFactor):\s*(-?[\d.]+(?:[eE][-+]?\d+)?)")
+
+
+class FilterError(ValueError):
+    """Raised when a filter description cannot be evaluated."""
+
+
+@dataclass(frozen=True)
+class Filter:
+    type: str
+    freq: float
+    gain: float = 0.0
+    q: float = DEFAULT_Q
+
+
+def parse_filters(items: Any, sample_rate: float = DEFAULT_SAMPLE_RATE) -> List[Filter]:
+    """
+    Read the frontend's ``FilterParams`` objects (``type``/``filterType``,
+    ``freq``/``frequency``, ``gain``, ``qFactor``/``q``) into ``Filter``\\ s.
+    """
+    if not isinstance(items, list):
+        raise FilterError("滤波器列表必须是数组")
+    if len(items) > MAX_FILTERS_PER_SET:
+        raise FilterError(f"每组滤波器最多 {MAX_FILTERS_PER_SET} 个")
+    filters = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise FilterError("滤波器必须是 JSON 对象")
+        filters.append(
+            _make_filter(
+                item.get("type", item.get("filterType")),
+                item.get("freq", item.get("frequency")),
+                item.get("gain"),
+                item.get("qFactor", item.get("q")),
+                sample_rate,
+            )
+        )
+    return filters
+
+
+def parse_filter_context(text: str, sample_rate: float = DEFAULT_SAMPLE_RATE) -> List[Filter]:
+    """Read the ``currentFilters`` text ``getFilterContext`` builds for the chat."""
+    if not isinstance(text, str):
+        raise FilterError("currentFilters 必须是字符串")
+    filters = []
+    for line in text.splitlines():
+        match = _CONTEXT_LINE.search(line)
+        if match is None:
+            continue
+        fields = dict(_CONTEXT_FIELD.findall(match.group("rest")))
+        filters.append(
+            _make_filter(match.group("type"), fields.get("freq"), fields.get("gain"), fields.get("qFactor"), sample_rate)
+        )
+    if len(filters) > MAX_FILTERS_PER_SET:
+        raise FilterError(f"每组滤波器最多 {MAX_FILTERS_PER_SET} 个")
+    return filters
+
+
+def _make_filter(kind: Any, freq: Any, gain: Any, q: Any, sample_rate: float) -> Filter:
+    if kind not in FILTER_TYPES:
+        raise FilterError(f"不支持的滤波器类型: {kind}")
+    try:
+        freq = float(freq)
+        gain = 0.0 if gain is None else float(gain)
+        q = DEFAULT_Q if q is None else float(q)
+    except (TypeError, ValueError) as exc:
+        raise FilterError("滤波器参数必须是数字") from exc
+    if not 0 < freq < sample_rate / 2:
+        raise FilterError(f"滤波器频率必须在 0 到 {sample_rate / 2:g} Hz 之间")
+    if not (q > 0 and math.isfinite(q)) or not -60 <= gain <= 60:
+        raise FilterError("滤波器 Q 值必须为正数，增益必须在 ±60 dB 之内")
+    return Filter(kind, freq, gain, q)
+
+
+def evaluate_request(payload: Any) -> Dict[str, Any]:
+    """
+    Handle an ``/api/eq/response`` body.
+
+    The filters come as ``filterSets`` (a list of ``FilterParams`` lists),
+    ``filters`` (one list) or ``currentFilters`` (the chat's text form). The
+    grid is ``frequencies`` or ``points`` log-spaced values over 20 Hz-20 kHz.
+    """
+    if not isinstance(payload, dict):
+        raise FilterError("请求体必须为 JSON 对象")
+    try:
+        sample_rate = float(payload.get("sampleRate", DEFAULT_SAMPLE_RATE))
+    except (TypeError, ValueError) as exc:
+        raise FilterError("sampleRate 必须是数字") from exc
+    if not 8000 <= sample_rate <= 384000:
+        raise FilterError("sampleRate 必须在 8000 到 384000 之间")
+
+    if "filterSets" in payload:
+        raw_sets = payload["filterSets"]
+        if not isinstance(raw_sets, list):
+            raise FilterError("filterSets 必须是数组")
+        if len(raw_sets) > MAX_FILTER_SETS:
+            raise FilterError(f"滤波器组最多 {MAX_FILTER_SETS} 组")
+        filter_sets = [parse_filters(filters, sample_rate) for filters in raw_sets]
+    elif "filters" in payload:
+        filter_sets = [parse_filters(payload["filters"], sample_rate)]
+    else:
+        filter_sets = [parse_filter_context(payload.get("currentFilters", ""), sample_rate)]
+
+    if "frequencies" in payload:
+        frequencies = payload["frequencies"]
+        if not isinstance(frequencies, list):
+            raise FilterError("frequencies 必须是数组")
+        try:
+            frequencies = [float(value) for value in frequencies]
+        except (TypeError, ValueError) as exc:
+            raise FilterError("frequencies 必须是数字数组") from exc
+    else:
+        try:
+            points = int(payload.get("points", DEFAULT_POINTS))
+        except (TypeError, ValueError) as exc:
+            raise FilterError("points 必须是整数") from exc
+        if not 2 <= points <= MAX_GRID_POINTS:
+            raise FilterError(f"points 必须在 2 到 {MAX_GRID_POINTS} 之间")
+        grid = log_grid(points, GRID_MIN_HZ, min(GRID_MAX_HZ, sample_rate * 0.49))
+        frequencies = [round(freq, 3) for freq in grid]
+
+    if len(filter_sets) * len(frequencies) > MAX_RESPONSE_VALUES:
+        raise FilterError(f"滤波器组数 x 频率点数不能超过 {MAX_RESPONSE_VALUES}")
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        responses = response_db(filter_sets, frequencies, sample_rate)
+    # NaN and infinity are not JSON; extreme Q values can leave a point without a dB value.
+    if not np.isfinite(responses).all():
+        raise FilterError("滤波器响应在部分频率点无法计算")
+    return {
+        "sampleRate": sample_rate,
+        "frequencies": frequencies,
+        # 0.001 dB is far below anything audible or visible on the chart.
+        "responses": np.round(responses, 3).tolist(),
+    }
+
+
+def response_db(
+    filter_sets: Sequence[Sequence[Filter]],
+    frequencies: Iterable[float],
+    sample_rate: float = DEFAULT_SAMPLE_RATE,
+) -> "np.ndarray":
+    """
+    Combined gain in dB of each filter set at each frequency, shape ``(sets, points)``.
+
+    Each section uses the cookbook's closed form in ``phi = sin^2(w/2)``,
+    ``(b0+b1+b2)^2 - 4(b0b1 + 4b0b2 + b1b2)phi + 16b0b2phi^2`` over the same
+    in ``a``, which stays accurate far below the corner frequencies where
+    expanding ``|B(e^jw)|^2`` in ``cos w`` cancels out. Sections are taken
+    to dB one by one and summed per set; multiplying a set's quadratics into
+    one polynomial first is ill-conditioned beyond a handful of filters.
+    """
+    if np is None:
+        raise RuntimeError("EQ 计算需要安装 numpy")
+    freqs = np.asarray(list(frequencies), dtype=float)
+    if freqs.ndim != 1 or not len(freqs):
+        raise FilterError("频率列表必须是非空数组")
+    if len(freqs) > MAX_GRID_POINTS:
+        raise FilterError(f"频率点最多 {MAX_GRID_POINTS} 个")
+    if len(filter_sets) > MAX_FILTER_SETS:
+        raise FilterError(f"滤波器组最多 {MAX_FILTER_SETS} 组")
+    if not ((freqs > 0) & (freqs < sample_rate / 2)).all():
+        raise FilterError(f"频率必须在 0 到 {sample_rate / 2:g} Hz 之间")
+
+    count = len(filter_sets)
+    result = np.zeros((count, len(freqs)))
+    width = max((len(filters) for filters in filter_sets), default=0)
+    if width == 0:
+        return result
+
+    numerator, denominator, zeros = _section_quadratics(filter_sets, width, sample_rate)
+    phi = np.sin(np.pi * freqs / sample_rate) ** 2
+    zero_terms = 20 * np.log10(np.stack([phi, 1 - phi]))  # highpass and lowpass zeros
+
+    # Blocks of sets sized to stay in cache while their sections are evaluated.
+    block = max(1, _BLOCK_VALUES // (width * len(freqs)))
+    for start in range(0, count, block):
+        stop = min(start + block, count)
+        ratio = _horner(numerator[start:stop], phi)
+        ratio /= _horner(denominator[start:stop], phi)
+        np.log10(ratio, out=ratio)
+        out = result[start:stop]
+        np.sum(ratio, axis=1, out=out)
+        out *= 10
+        out += zeros[start:stop] @ zero_terms
+    return result
+
+
+def _horner(coefficients: "np.ndarray", phi: "np.ndarray") -> "np.ndarray":
+    """Quadratics ``(sets, width, 3)`` evaluated at every ``phi``, shape ``(sets, width, points)``."""
+    values = coefficients[..., 2:3] * phi
+    values += coefficients[..., 1:2]
+    values *= phi
+    values += coefficients[..., 0:1]
+    return values
+
+
+def _section_quadratics(
+    filter_sets: Sequence[Sequence[Filter]], width: int, sample_rate: float
+) -> "tuple[np.ndarray, np.ndarray, np.ndarray]":
+    """
+    |B|^2 and |A|^2 of every section as quadratics in phi, and per set the
+    number of highpass and lowpass zeros.
+
+    The highpass and lowpass numerators, exactly ``16 b0^2 phi^2`` and
+    ``16 b0^2 (1 - phi)^2``, keep only ``16 b0^2``; their zeros are added
+    as counted ``20 log10`` terms, which stay exact deep in the stopband.
+    """
+    kinds, freq, gain, q = _filter_table(filter_sets, width, sample_rate)
+    numerator, denominator = _phi_polynomials(kinds, freq, gain, q, sample_rate)
+    highpass, lowpass = kinds == _KIND["highpass"], kinds == _KIND["lowpass"]
+    zeros = np.stack([highpass.sum(axis=1), lowpass.sum(axis=1)], axis=1).astype(float)
+    passes = highpass | lowpass
+    numerator[passes] = numerator[passes][:, 2:] * (1.0, 0.0, 0.0)
+    return numerator, denominator, zeros
+
+
+def _filter_table(
+    filter_sets: Sequence[Sequence[Filter]], width: int, sample_rate: float
+) -> "tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]":
+    """Kind index, frequency, gain and Q of every filter, shape ``(sets, width)``; padding has kind -1."""
+    padding = (-1, sample_rate / 4, 0.0, DEFAULT_Q)
+    rows = []
+    for filters in filter_sets:
+        rows.extend((_KIND[item.type], item.freq, item.gain, item.q) for item in filters)
+        rows.extend([padding] * (width - len(filters)))
+    table = np.array(rows, dtype=float).reshape(len(filter_sets), width, 4)
+    return table[..., 0].astype(int), table[..., 1], table[..., 2], table[..., 3]
+
+
+def _phi_polynomials(
+    kinds: "np.ndarray", freq: "np.ndarray", gain: "np.ndarray", q: "np.ndarray", sample_rate: float
+) -> "tuple[np.ndarray, np.ndarray]":
+    """Coefficients of |B|^2 and |A|^2 as quadratics in phi, shape ``(sets, width, 3)``."""
+    w0 = 2 * np.pi * freq / sample_rate
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    amp = 10 ** (gain / 40)
+    root = 2 * np.sqrt(amp) * alpha
+
+    # Padding entries keep b = a = (1, 0, 0), a unity response.
+    b0, b1, b2 = np.ones_like(w0), np.zeros_like(w0), np.zeros_like(w0)
+    a0, a1, a2 = np.ones_like(w0), np.zeros_like(w0), np.zeros_like(w0)
+
+    def assign(kind: str, values: Sequence["np.ndarray"]) -> None:
+        mask = kinds == _KIND[kind]
+        for target, value in zip((b0, b1, b2, a0, a1, a2), values):
+            target[mask] = np.broadcast_to(value, w0.shape)[mask]
+
+    assign("peaking", (1 + alpha * amp, -2 * cos_w0, 1 - alpha * amp, 1 + alpha / amp, -2 * cos_w0, 1 - alpha / amp))
+    assign(
+        "low_shelf",
+        (
+            amp * ((amp + 1) - (amp - 1) * cos_w0 + root),
+            2 * amp * ((amp - 1) - (amp + 1) * cos_w0),
+            amp * ((amp + 1) - (amp - 1) * cos_w0 - root),
+            (amp + 1) + (amp - 1) * cos_w0 + root,
+            -2 * ((amp - 1) + (amp + 1) * cos_w0),
+            (amp + 1) + (amp - 1) * cos_w0 - root,
+        ),
+    )
+    assign(
+        "high_shelf",
+        (
+            amp * ((amp + 1) + (amp - 1) * cos_w0 + root),
+            -2 * amp * ((amp - 1) + (amp + 1) * cos_w0),
+            amp * ((amp + 1) + (amp - 1) * cos_w0 - root),
+            (amp + 1) - (amp - 1) * cos_w0 + root,
+            2 * ((amp - 1) - (amp + 1) * cos_w0),
+            (amp + 1) - (amp - 1) * cos_w0 - root,
+        ),
+    )
+    assign("lowpass", ((1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2, 1 + alpha, -2 * cos_w0, 1 - alpha))
+    assign("highpass", ((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2, 1 + alpha, -2 * cos_w0, 1 - alpha))
+
+    def quadratic(c0: "np.ndarray", c1: "np.ndarray", c2: "np.ndarray") -> "np.ndarray":
+        return np.stack([(c0 + c1 + c2) ** 2, -4 * (c0 * c1 + 4 * c0 * c2 + c1 * c2), 16 * c0 * c2], axis=-1)
+
+    return quadratic(b0, b1, b2), quadratic(a0, a1, a2)
+
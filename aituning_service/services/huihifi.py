@@ -1,14 +1,25 @@
 from __future__ import annotations
 
 import base64
+import contextvars
 import hashlib
 import hmac
 import json
 import logging
+import math
 import time
-from typing import Any, Dict, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from ..jsonutil import loads
+from ..logs import Payload, sample_payload
+from ..metrics import UpstreamCall
+from ..resilience import CircuitBreaker, Hedger, hedged_call, upstream_ok
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +32,83 @@ class HuiHiFiCredentialsError(HuiHiFiClientError):
     """Raised when the client is missing required credentials."""
 
 
+class HuiHiFiUnavailableError(HuiHiFiClientError):
+    """Raised without calling HuiHiFi while its circuit breaker is open."""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("HuiHiFi 服务暂时不可用，请稍后再试")
+        self.retry_after = retry_after
+
+
+def _normalize_item(raw_item: Any) -> Optional[Dict[str, Any]]:
+    """
+    Normalize one evaluation item in a single pass.
+
+    Items, brands and articles may each arrive JSON-encoded as strings;
+    undecodable items and non-objects are skipped.
+    """
+    item = raw_item
+    if type(item) is str:
+        try:
+            item = loads(item)
+        except ValueError:
+            return None
+    if type(item) is not dict:
+        return None
+    get = item.get
+
+    brand = get("brand") or {}
+    if type(brand) is str:
+        try:
+            brand = loads(brand)
+        except ValueError:
+            brand = {"title": brand}
+    if type(brand) is not dict:
+        brand = {"title": str(brand)}
+
+    category = get("category")
+    if type(category) is str:
+        category_name = category
+    elif type(category) is dict:
+        category_name = category.get("name", "")
+    else:
+        category_name = ""
+
+    article = get("article")
+    if type(article) is str:
+        try:
+            article = loads(article)
+        except ValueError:
+            article = None
+    thumbnails = article.get("thumbnails", []) if type(article) is dict else []
+
+    groups = get("dataGroups")
+    if type(groups) is str:
+        data_groups = [groups]
+    elif type(groups) is list:
+        data_groups = [str(group) for group in groups if isinstance(group, (str, int, float))]
+    else:
+        data_groups = []
+
+    return {
+        "uuid": get("uuid"),
+        "title": get("title"),
+        "brand": brand,
+        "thumbnails": thumbnails,
+        "categoryName": category_name,
+        "dataGroup": data_groups[0] if data_groups else "",
+        "dataGroups": data_groups,
+    }
+
+
+def product_key(product: Dict[str, Any]) -> Any:
+    """Identity of a normalized product: its uuid, or for an item without one, its whole content."""
+    uuid = product.get("uuid")
+    if isinstance(uuid, (str, int)):
+        return ("uuid", uuid)
+    return ("item", json.dumps(product, ensure_ascii=False, sort_keys=True))
+
+
 class HuiHiFiClient:
     """Thin wrapper around HuiHiFi OpenAPI."""
 
@@ -29,14 +117,61 @@ class HuiHiFiClient:
         base_url: str,
         app_key: Optional[str],
         secret_key: Optional[str],
-        timeout: int = 10,
+        timeout: float = 10,
         max_page_size: int = 50,
+        connect_timeout: float = 3.05,
+        max_retries: int = 2,
+        pool_size: int = 10,
+        page_concurrency: int = 4,
+        page_param: str = "",
+        breaker: Optional[CircuitBreaker] = None,
+        hedger: Optional[Hedger] = None,
     ) -> None:
         self.base_url = base_url.rstrip("/")
         self.app_key = app_key
         self.secret_key = secret_key
         self.timeout = timeout
+        self.connect_timeout = connect_timeout
         self.max_page_size = max_page_size
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.page_concurrency = page_concurrency
+        # Body field carrying the page number; unset, only the first page of a listing is fetched.
+        self.page_param = page_param
+        self.breaker = breaker or CircuitBreaker("huihifi")
+        # Searches are read-only, so a slow one may be sent twice; off unless a hedger is given.
+        self.hedger = hedger
+        self._hedge_executor = (
+            ThreadPoolExecutor(max_workers=2 * pool_size, thread_name_prefix="huihifi-hedge") if hedger else None
+        )
+        self._hmac_key = hmac.new(secret_key.encode("utf-8"), digestmod=hashlib.sha256) if secret_key else None
+        self._session = self._create_session(max_retries, pool_size)
+
+    @staticmethod
+    def _create_session(max_retries: int, pool_size: int) -> requests.Session:
+        # The evaluations search is a read-only POST, so it is safe to retry
+        # on connection failures and gateway errors.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=0.2,
+            backoff_jitter=0.1,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self) -> None:
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+        self._session.close()
 
     @property
     def is_configured(self) -> bool:
@@ -52,9 +187,9 @@ class HuiHiFiClient:
             raise HuiHiFiCredentialsError("未配置 HuiHiFi API 凭证")
 
         timestamp = int(time.time() * 1000)
-        message = (self.app_key + str(timestamp)).encode("utf-8")
-        key = self.secret_key.encode("utf-8")
-        digest = hmac.new(key, message, hashlib.sha256).digest()
+        mac = self._hmac_key.copy()
+        mac.update((self.app_key + str(timestamp)).encode("utf-8"))
+        digest = mac.digest()
         sign = base64.b64encode(digest).decode("utf-8")
         return sign, timestamp
 
@@ -63,78 +198,33 @@ class HuiHiFiClient:
             raise HuiHiFiClientError(f"HuiHiFi API 错误: {raw.get('message', 'unknown error')}")
 
         data = raw.get("data") or {}
-        if isinstance(data, str):
+        if type(data) is str:
             try:
-                data = json.loads(data)
+                data = loads(data)
             except ValueError:
                 data = {}
-        products = []
+        if type(data) is not dict:
+            data = {}
 
         raw_list = data.get("list", [])
-        if isinstance(raw_list, str):
+        if type(raw_list) is str:
             try:
-                raw_list = json.loads(raw_list)
+                raw_list = loads(raw_list)
             except ValueError:
                 raw_list = []
+        if type(raw_list) is not list:
+            raw_list = []
 
+        products = []
+        append = products.append
         for raw_item in raw_list:
-            item = raw_item
-            if isinstance(raw_item, str):
-                try:
-                    item = json.loads(raw_item)
-                except ValueError:
-                    continue
-
-            if not isinstance(item, dict):
-                continue
-
-            brand = item.get("brand") or {}
-            if isinstance(brand, str):
-                try:
-                    brand = json.loads(brand)
-                except ValueError:
-                    brand = {"title": brand}
-
-            category = item.get("category") or {}
-            if isinstance(category, str):
-                category_name = category
-            else:
-                category_name = category.get("name", "")
-
-            article = item.get("article") or {}
-            if isinstance(article, str):
-                try:
-                    article = json.loads(article)
-                except ValueError:
-                    article = {}
-
-            data_group_value = ""
-            data_groups_value = item.get("dataGroups")
-            data_groups: list[str] = []
-
-            if isinstance(data_groups_value, str):
-                data_groups = [data_groups_value]
-            elif isinstance(data_groups_value, list):
-                data_groups = [str(group) for group in data_groups_value if isinstance(group, (str, int, float))]
-
-            if data_groups:
-                data_group_value = data_groups[0]
-
-            products.append(
-                {
-                    "uuid": item.get("uuid"),
-                    "title": item.get("title"),
-                    "brand": brand if isinstance(brand, dict) else {"title": str(brand)},
-                    "thumbnails": (article or {}).get("thumbnails", []),
-                    "categoryName": category_name,
-                    "dataGroup": data_group_value,
-                    "dataGroups": data_groups,
-                }
-            )
+            product = _normalize_item(raw_item)
+            if product is not None:
+                append(product)
 
         return {"products": products, "total": data.get("total", 0)}
 
-    def search_products(self, keyword: str, page_size: int) -> Dict[str, Any]:
+    def _build_search_request(self, keyword: str, page_size: int, page: int) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
         if not self.is_configured:
             raise HuiHiFiCredentialsError("未配置 HuiHiFi API 凭证")
 
@@ -145,31 +235,149 @@ class HuiHiFiClient:
             "timestamp": str(timestamp),
             "sign": sign,
         }
-        payload = {
+        payload: Dict[str, Any] = {
             "orderBy": "createTime",
             "direction": "DESC",
             "pageSize": min(page_size, self.max_page_size),
             "keyword": keyword or "",
         }
+        if page > 1:
+            if not self.page_param:
+                raise HuiHiFiClientError("未配置 HuiHiFi 分页参数 (HUIHIFI_PAGE_PARAM)")
+            payload[self.page_param] = page
 
         url = f"{self.base_url}/v1/openapi/evaluations"
-        logger.info(
-            "调用 HuiHiFi 产品搜索: url=%s payload=%s",
-            url,
-            json.dumps(payload, ensure_ascii=False),
-        )
+        if sample_payload():
+            logger.info("调用 HuiHiFi 产品搜索", extra={"url": url, "payload": Payload(payload)})
+        return url, headers, payload
+
+    def _parse_search_body(self, body: bytes) -> Dict[str, Any]:
+        try:
+            raw = loads(body)
+        except ValueError as exc:
+            raise HuiHiFiClientError("HuiHiFi API 调用失败: 响应格式错误") from exc
+        if type(raw) is not dict:
+            raise HuiHiFiClientError("HuiHiFi API 调用失败: 响应格式错误")
+        return self._transform_response(raw)
 
+    def check_breaker(self) -> None:
+        """Fail at once while the breaker is open, instead of waiting out the timeout."""
+        if not self.breaker.allow():
+            raise HuiHiFiUnavailableError(self.breaker.retry_after())
+
+    def settle(self, status: Optional[int], elapsed: float) -> None:
+        """Report one search attempt to the breaker and, if it succeeded, to the hedger."""
+        self.breaker.record(upstream_ok(status))
+        if self.hedger is not None and status is not None and status < 400:
+            self.hedger.observe(elapsed)
+
+    def search_products(self, keyword: str, page_size: int, page: int = 1) -> Dict[str, Any]:
+        url, headers, payload = self._build_search_request(keyword, page_size, page)
+        self.check_breaker()
+        return hedged_call(lambda: self._search_once(url, headers, payload), self.hedger, self._hedge_executor)
+
+    def _search_once(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> Dict[str, Any]:
+        call = UpstreamCall("huihifi", "search")
+        began = time.perf_counter()
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=self.timeout)
+            # Retries happen inside the adapter, so this times the whole search as the caller sees it.
+            with call:
+                response = self._session.post(
+                    url,
+                    json=payload,
+                    headers=headers,
+                    timeout=(self.connect_timeout, self.timeout),
+                )
+                call.status = response.status_code
             response.raise_for_status()
         except requests.Timeout as exc:
             raise HuiHiFiClientError("HuiHiFi API 调用失败: 请求超时") from exc
         except requests.RequestException as exc:
             raise HuiHiFiClientError(f"HuiHiFi API 调用失败: {exc}") from exc
+        finally:
+            self.settle(call.status, time.perf_counter() - began)
+
+        return self._parse_search_body(response.content)
+
+    def _page_scan(self, page_size: Optional[int], concurrency: Optional[int]) -> Tuple[int, int]:
+        """Page size and pages in flight for ``iter_pages``; never more than the connection pool."""
+        size = max(1, min(page_size or self.max_page_size, self.max_page_size))
+        workers = max(1, min(concurrency or self.page_concurrency, self.pool_size))
+        return size, workers
+
+    def _pages_available(self, first: Dict[str, Any]) -> bool:
+        """Whether pages past the first can be asked for; warns when the rest of a listing is left out."""
+        if self.page_param:
+            return True
+        logger.warning(
+            "未配置 HUIHIFI_PAGE_PARAM，只获取第一页: 共 %s 条，已获取 %s 条", first.get("total"), len(first["products"])
+        )
+        return False
 
+    def iter_pages(
+        self, keyword: str, page_size: Optional[int] = None, concurrency: Optional[int] = None
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Yield every page of a search in upstream (``createTime`` DESC) order.
+
+        The first page gives the total; up to ``concurrency`` of the following
+        pages are then fetched at once by a worker pool and yielded in page
+        order, so at most that many pages are held. The scan ends at the
+        first short page, or at a page with no new items, as an upstream
+        that ignores ``page_param`` sends. An item the listing shifted onto
+        the next page while it was scanned is yielded once. Without a
+        ``page_param`` only the first page is fetched.
+        """
+        size, workers = self._page_scan(page_size, concurrency)
+        first = self.search_products(keyword, size)
+        seen: Set[Any] = set()
+        products = _unseen(first["products"], seen)
+        if products:
+            yield products
+        last_page = _last_page(first, size)
+        if last_page == 1 or not self._pages_available(first):
+            return
+
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="huihifi-pages")
+        pending: Deque[Future] = deque()
+        next_page = 2
         try:
-            raw = response.json()
-        except ValueError as exc:
-            raise HuiHiFiClientError("HuiHiFi API 调用失败: 响应格式错误") from exc
-
-        return self._transform_response(raw)
+            while True:
+                while len(pending) < workers and (last_page is None or next_page <= last_page):
+                    # Fetched under the caller's context, so the pages log with its request id.
+                    context = contextvars.copy_context()
+                    pending.append(pool.submit(context.run, self.search_products, keyword, size, next_page))
+                    next_page += 1
+                if not pending:
+                    return
+                page = pending.popleft().result()["products"]
+                products = _unseen(page, seen)
+                if products:
+                    yield products
+                # A page with nothing new is the first page again, or the listing ran out.
+                if len(page) < size or not products:
+                    return
+        finally:
+            # A consumer that stops early does not wait for the pages still in flight.
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _last_page(first: Dict[str, Any], page_size: int) -> Optional[int]:
+    """The last page to fetch, from the first page; None when the total is unknown."""
+    if len(first["products"]) < page_size:
+        return 1
+    try:
+        total = int(first.get("total") or 0)
+    except (TypeError, ValueError):
+        total = 0
+    return math.ceil(total / page_size) if total > page_size else (1 if total else None)
+
+
+def _unseen(products: List[Dict[str, Any]], seen: Set[Any]) -> List[Dict[str, Any]]:
+    fresh = []
+    for product in products:
+        key = product_key(product)
+        if key not in seen:
+            seen.add(key)
+            fresh.append(product)
+    return fresh
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set
+
+import aiohttp
+
+from ..metrics import UpstreamCall
+from ..resilience import CircuitBreaker, hedged_call_async
+from .huihifi import HuiHiFiClient, HuiHiFiClientError, _last_page, _unseen
+
+logger = logging.getLogger(__name__)
+
+_RETRY_STATUSES = frozenset({502, 503, 504})
+
+
+class AsyncHuiHiFiClient:
+    """
+    Event-loop counterpart of ``HuiHiFiClient``.
+
+    Signing, request building and response normalization are delegated to
+    the wrapped synchronous client, so both modes send and return the same
+    data; only the transport differs.
+    """
+
+    def __init__(self, client: HuiHiFiClient) -> None:
+        self._client = client
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def is_configured(self) -> bool:
+        return self._client.is_configured
+
+    @property
+    def max_page_size(self) -> int:
+        return self._client.max_page_size
+
+    async def start(self) -> None:
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self._client.pool_size, keepalive_timeout=30),
+            timeout=aiohttp.ClientTimeout(sock_connect=self._client.connect_timeout, sock_read=self._client.timeout),
+        )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self._client.breaker
+
+    async def search_products(self, keyword: str, page_size: int, page: int = 1) -> Dict[str, Any]:
+        url, headers, payload = self._client._build_search_request(keyword, page_size, page)
+        # Breaker and hedging state are the wrapped client's, shared with the catalog sync thread.
+        self._client.check_breaker()
+        return await hedged_call_async(lambda: self._search_once(url, headers, payload), self._client.hedger)
+
+    async def _search_once(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> Dict[str, Any]:
+        call = UpstreamCall("huihifi", "search")
+        began = time.perf_counter()
+        cancelled = False
+        try:
+            # Timed with its retries, like the synchronous client's adapter-level retries.
+            with call:
+                return await self._post_with_retries(url, headers, payload, call)
+        except asyncio.CancelledError:
+            # A hedge that lost, or a client that left, says nothing about HuiHiFi.
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                self._client.settle(call.status, time.perf_counter() - began)
+
+    async def iter_pages(
+        self, keyword: str, page_size: Optional[int] = None, concurrency: Optional[int] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """``HuiHiFiClient.iter_pages`` with the pages fetched as tasks on the loop."""
+        size, workers = self._client._page_scan(page_size, concurrency)
+        first = await self.search_products(keyword, size)
+        seen: Set[Any] = set()
+        products = _unseen(first["products"], seen)
+        if products:
+            yield products
+        last_page = _last_page(first, size)
+        if last_page == 1 or not self._client._pages_available(first):
+            return
+
+        pending: Deque[asyncio.Task] = deque()
+        next_page = 2
+        try:
+            while True:
+                while len(pending) < workers and (last_page is None or next_page <= last_page):
+                    pending.append(asyncio.ensure_future(self.search_products(keyword, size, next_page)))
+                    next_page += 1
+                if not pending:
+                    return
+                page = (await pending.popleft())["products"]
+                products = _unseen(page, seen)
+                if products:
+                    yield products
+                # A page with nothing new is the first page again, or the listing ran out.
+                if len(page) < size or not products:
+                    return
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _post_with_retries(
+        self, url: str, headers: Dict[str, str], payload: Dict[str, Any], call: UpstreamCall
+    ) -> Dict[str, Any]:
+        for attempt in range(self._client.max_retries + 1):
+            last_attempt = attempt == self._client.max_retries
+            try:
+                async with self._session.post(url, json=payload, headers=headers) as response:
+                    call.status = response.status
+                    if response.status in _RETRY_STATUSES and not last_attempt:
+                        await self._backoff(attempt)
+                        continue
+                    if response.status >= 400:
+                        raise HuiHiFiClientError(f"HuiHiFi API 调用失败: HTTP {response.status}")
+                    body = await response.read()
+                    return self._client._parse_search_body(body)
+            except asyncio.TimeoutError as exc:
+                if last_attempt:
+                    raise HuiHiFiClientError("HuiHiFi API 调用失败: 请求超时") from exc
+            except aiohttp.ClientError as exc:
+                if last_attempt:
+                    raise HuiHiFiClientError(f"HuiHiFi API 调用失败: {exc}") from exc
+            await self._backoff(attempt)
+
+        raise HuiHiFiClientError("HuiHiFi API 调用失败: 重试次数已用尽")
+
+    @staticmethod
+    async def _backoff(attempt: int) -> None:
+        # Exponential backoff with jitter, mirroring the synchronous client's urllib3 Retry.
+        await asyncio.sleep(0.2 * (2**attempt) + random.uniform(0, 0.1))
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from ..metrics import CACHE_ENTRIES, CACHE_LOOKUPS
+from .huihifi import HuiHiFiClient
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, int]
+
+CACHE_HIT = "HIT"
+CACHE_STALE = "STALE"
+CACHE_MISS = "MISS"
+CACHE_BYPASS = "BYPASS"
+
+_LOOKUPS = {
+    result: CACHE_LOOKUPS.labels("product_search", result)
+    for result in ("hits", "stale_hits", "misses", "coalesced", "bypasses")
+}
+_ENTRIES = CACHE_ENTRIES.labels("product_search")
+
+
+def normalize_keyword(keyword: str) -> str:
+    return " ".join(keyword.split()).casefold()
+
+
+class _Entry:
+    __slots__ = ("value", "stored_at", "refreshing")
+
+    def __init__(self, value: Dict[str, Any]) -> None:
+        self.value = value
+        self.stored_at = time.monotonic()
+        self.refreshing = False
+
+
+class _Flight:
+    """An upstream call that concurrent misses for the same key wait on."""
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+class ProductSearchCache:
+    """
+    Bounded TTL/LRU cache in front of ``HuiHiFiClient.search_products``.
+
+    Fresh entries (younger than ``ttl``) are served directly. Entries up to
+    ``stale_ttl`` past expiry are served while one background refresh runs.
+    Concurrent misses for the same key share a single upstream call.
+    """
+
+    def __init__(
+        self,
+        client: HuiHiFiClient,
+        ttl: float = 300,
+        stale_ttl: float = 600,
+        max_entries: int = 512,
+    ) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._inflight: Dict[CacheKey, _Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "bypasses": 0, "refresh_errors": 0}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        served = stats["hits"] + stats["stale_hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_ratio"] = round((stats["hits"] + stats["stale_hits"]) / served, 4) if served else 0.0
+        return stats
+
+    def _count(self, result: str) -> None:
+        # Called with the lock held.
+        self._stats[result] += 1
+        _LOOKUPS[result].inc()
+
+    def search_products(self, keyword: str, page_size: int, bypass: bool = False) -> Tuple[Dict[str, Any], str]:
+        """Return ``(data, cache_status)`` for a product search."""
+        key = (normalize_keyword(keyword), page_size)
+
+        if bypass:
+            with self._lock:
+                self._count("bypasses")
+            value = self.client.search_products(keyword, page_size)
+            self._store(key, value)
+            return value, CACHE_BYPASS
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = time.monotonic() - entry.stored_at
+                if age < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._count("hits")
+                    return entry.value, CACHE_HIT
+                if age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self._count("stale_hits")
+                    if not entry.refreshing:
+                        entry.refreshing = True
+                        threading.Thread(
+                            target=self._refresh,
+                            args=(key, keyword, page_size),
+                            name="product-cache-refresh",
+                            daemon=True,
+                        ).start()
+                    return entry.value, CACHE_STALE
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self._count("misses")
+            else:
+                self._count("coalesced")
+
+        if leader:
+            self._fetch(key, keyword, page_size, flight)
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.value, CACHE_MISS
+
+    def _fetch(self, key: CacheKey, keyword: str, page_size: int, flight: _Flight) -> None:
+        try:
+            flight.value = self.client.search_products(keyword, page_size)
+            self._store(key, flight.value)
+        except BaseException as exc:
+            flight.error = exc
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def _refresh(self, key: CacheKey, keyword: str, page_size: int) -> None:
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if leader:
+            self._fetch(key, keyword, page_size, flight)
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            logger.warning("产品搜索缓存后台刷新失败: %s", flight.error)
+            with self._lock:
+                self._stats["refresh_errors"] += 1
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refreshing = False
+
+    def _store(self, key: CacheKey, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = _Entry(value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            _ENTRIES.set(len(self._entries))
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from ..metrics import CACHE_ENTRIES, CACHE_LOOKUPS
+
+UploadKey = Tuple[str, bytes]
+
+_LOOKUPS = {result: CACHE_LOOKUPS.labels("dify_upload", result) for result in ("hits", "misses")}
+_ENTRIES = CACHE_ENTRIES.labels("dify_upload")
+
+
+def image_digest(base64_data: str) -> bytes:
+    """Digest of the base64 payload; a ``data:`` URL prefix does not change it."""
+    data = base64_data.split(",", 1)[1] if base64_data.startswith("data:") else base64_data
+    return hashlib.blake2b(data.encode("ascii", "ignore"), digest_size=16).digest()
+
+
+class UploadCache:
+    """
+    Bounded TTL/LRU map from (user, image digest) to a Dify ``upload_file_id``.
+
+    The frontend resends the same curve image on every turn; a hit lets the
+    chat reuse the file Dify already holds. ``ttl`` must stay below the Dify
+    server's retention for unused uploads.
+    """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 4096) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[UploadKey, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, user_token: str, base64_data: str) -> Optional[str]:
+        key = (user_token, image_digest(base64_data))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self._count("hits")
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+                _ENTRIES.set(len(self._entries))
+            self._count("misses")
+            return None
+
+    def put(self, user_token: str, base64_data: str, file_id: str) -> None:
+        key = (user_token, image_digest(base64_data))
+        with self._lock:
+            self._entries[key] = (file_id, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            _ENTRIES.set(len(self._entries))
+
+    def invalidate(self, user_token: str, base64_data: str) -> None:
+        key = (user_token, image_digest(base64_data))
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._stats["invalidations"] += 1
+                _ENTRIES.set(len(self._entries))
+
+    def _count(self, result: str) -> None:
+        # Called with the lock held.
+        self._stats[result] += 1
+        _LOOKUPS[result].inc()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        return stats
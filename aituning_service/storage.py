@@ -1,30 +1,68 @@
+import atexit
 import logging
 import sqlite3
+import threading
+import time
 from contextlib import contextmanager
-from datetime import date
-from typing import Iterator, Optional
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from .metrics import DATABASE_LATENCY
+from .quota_table import QuotaTableFull, SharedQuotaTable
 
 logger = logging.getLogger(__name__)
 
+# Applied once per connection; connections are reused for the lifetime of a thread.
+# auto_vacuum must precede the WAL switch to take effect on a new database.
+_CONNECTION_PRAGMAS = (
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
 
 class UsageRepository:
     """Persist and query per-user usage limits."""
 
-    def __init__(self, database_path: str, daily_limit: int) -> None:
+    def __init__(self, database_path: str, daily_limit: int, busy_timeout: float = 5.0) -> None:
         self._database_path = database_path
+        self._busy_timeout = busy_timeout
+        self._local = threading.local()
         self.daily_limit = daily_limit
 
+    def _open_connection(self) -> sqlite3.Connection:
+        # Autocommit mode: every statement is its own transaction, so a single
+        # UPSERT needs no explicit BEGIN/COMMIT round trip.
+        conn = sqlite3.connect(self._database_path, timeout=self._busy_timeout, isolation_level=None)
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
     @contextmanager
-    def _connect(self) -> Iterator[sqlite3.Connection]:
-        conn = sqlite3.connect(self._database_path)
+    def _connect(self, operation: str = "other") -> Iterator[sqlite3.Connection]:
+        """Yield this thread's connection; the time spent in the block is recorded under ``operation``."""
+        conn: Optional[sqlite3.Connection] = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open_connection()
+            self._local.conn = conn
+        started = time.perf_counter()
         try:
             yield conn
         finally:
+            DATABASE_LATENCY.labels(operation).observe(time.perf_counter() - started)
+
+    def close(self) -> None:
+        """Close the connection owned by the calling thread, if any."""
+        conn: Optional[sqlite3.Connection] = getattr(self._local, "conn", None)
+        if conn is not None:
             conn.close()
+            self._local.conn = None
 
     def init_database(self) -> None:
         """Ensure required tables exist."""
-        with self._connect() as conn:
+        with self._connect("init") as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
@@ -39,59 +77,497 @@ class UsageRepository:
                 )
                 """
             )
-            conn.commit()
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_usage_date ON user_usage (usage_date)")
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_usage_totals (
+                    user_token TEXT PRIMARY KEY,
+                    total_count INTEGER NOT NULL,
+                    active_days INTEGER NOT NULL,
+                    first_date DATE NOT NULL,
+                    last_date DATE NOT NULL
+                ) WITHOUT ROWID
+                """
+            )
         logger.info("数据库初始化完成")
 
     def get_usage(self, user_token: str) -> int:
         """Return the number of times the user has interacted today."""
-        today = date.today()
-        with self._connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
+        today = date.today().isoformat()
+        with self._connect("get_usage") as conn:
+            row = conn.execute(
                 "SELECT usage_count FROM user_usage WHERE user_token = ? AND usage_date = ?",
                 (user_token, today),
-            )
-            row = cursor.fetchone()
+            ).fetchone()
         return int(row[0]) if row else 0
 
-    def increment_usage(self, user_token: str) -> bool:
+    def try_consume(self, user_token: str) -> bool:
         """
-        Increase usage count for a user.
+        Atomically charge one unit of today's quota.
 
+        The limit check and the increment happen in a single UPSERT, so
+        concurrent requests for the same token cannot overshoot the limit.
         Returns False if the user has already exhausted the daily limit.
         """
-        today = date.today()
-        with self._connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT usage_count FROM user_usage WHERE user_token = ? AND usage_date = ?",
-                (user_token, today),
-            )
-            result = cursor.fetchone()
-            current_count = int(result[0]) if result else 0
+        if self.daily_limit <= 0:
+            return False
 
-            if current_count >= self.daily_limit:
-                return False
+        today = date.today().isoformat()
+        with self._connect("try_consume") as conn:
+            row = conn.execute(
+                """
+                INSERT INTO user_usage (user_token, usage_date, usage_count)
+                VALUES (?, ?, 1)
+                ON CONFLICT(user_token, usage_date) DO UPDATE SET
+                    usage_count = usage_count + 1,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE usage_count < ?
+                RETURNING usage_count
+                """,
+                (user_token, today, self.daily_limit),
+            ).fetchone()
+        return row is not None
 
-            cursor.execute(
+    def release(self, user_token: str) -> None:
+        """Return one unit of today's quota after a request failed before reaching Dify."""
+        today = date.today().isoformat()
+        with self._connect("release") as conn:
+            conn.execute(
                 """
-                INSERT OR REPLACE INTO user_usage (user_token, usage_date, usage_count, updated_at)
-                VALUES (
-                    ?,
-                    ?,
-                    COALESCE(
-                        (SELECT usage_count FROM user_usage WHERE user_token = ? AND usage_date = ?),
-                        0
-                    ) + 1,
-                    CURRENT_TIMESTAMP
-                )
+                UPDATE user_usage
+                SET usage_count = usage_count - 1, updated_at = CURRENT_TIMESTAMP
+                WHERE user_token = ? AND usage_date = ? AND usage_count > 0
                 """,
-                (user_token, today, user_token, today),
+                (user_token, today),
             )
-            conn.commit()
-            return True
+
+    def increment_usage(self, user_token: str) -> bool:
+        """
+        Increase usage count for a user.
+
+        Returns False if the user has already exhausted the daily limit.
+        """
+        return self.try_consume(user_token)
 
     def remaining_quota(self, user_token: str) -> int:
         usage = self.get_usage(user_token)
         remaining = self.daily_limit - usage
         return remaining if remaining > 0 else 0
+
+    def compact_usage(self, retention_days: int, batch_size: int = 5000) -> int:
+        """
+        Fold one chunk of daily rows older than ``retention_days`` into
+        ``user_usage_totals`` and delete them. Returns the number of rows removed.
+        """
+        if retention_days < 2:
+            raise ValueError("retention_days 必须至少为 2，以免影响今日和昨日的配额")
+
+        cutoff = (date.today() - timedelta(days=retention_days)).isoformat()
+        with self._connect("compact") as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS compact_batch (id INTEGER PRIMARY KEY)")
+                conn.execute("DELETE FROM compact_batch")
+                conn.execute(
+                    """
+                    INSERT INTO compact_batch (id)
+                    SELECT id FROM user_usage WHERE usage_date < ? ORDER BY usage_date LIMIT ?
+                    """,
+                    (cutoff, batch_size),
+                )
+                conn.execute(
+                    """
+                    INSERT INTO user_usage_totals (user_token, total_count, active_days, first_date, last_date)
+                    SELECT user_token, SUM(usage_count), COUNT(*), MIN(usage_date), MAX(usage_date)
+                    FROM user_usage
+                    WHERE id IN (SELECT id FROM compact_batch)
+                    GROUP BY user_token
+                    ON CONFLICT(user_token) DO UPDATE SET
+                        total_count = total_count + excluded.total_count,
+                        active_days = active_days + excluded.active_days,
+                        first_date = MIN(first_date, excluded.first_date),
+                        last_date = MAX(last_date, excluded.last_date)
+                    """
+                )
+                removed = conn.execute(
+                    "DELETE FROM user_usage WHERE id IN (SELECT id FROM compact_batch)"
+                ).rowcount
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        return removed
+
+    def vacuum_incremental(self, max_pages: int) -> int:
+        """Return up to ``max_pages`` free pages to the filesystem; returns pages released."""
+        with self._connect("vacuum") as conn:
+            (mode,) = conn.execute("PRAGMA auto_vacuum").fetchone()
+            if mode != 2:
+                logger.warning("数据库未启用增量 VACUUM，需先执行一次完整 VACUUM")
+                return 0
+            (before,) = conn.execute("PRAGMA freelist_count").fetchone()
+            conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+            (after,) = conn.execute("PRAGMA freelist_count").fetchone()
+        return before - after
+
+    def enable_incremental_vacuum(self) -> None:
+        """Switch an existing database to incremental auto-vacuum (runs a full VACUUM once)."""
+        with self._connect("vacuum") as conn:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+
+    def run_maintenance(
+        self,
+        retention_days: int,
+        batch_size: int = 5000,
+        time_budget: float = 5.0,
+        vacuum_pages: int = 2000,
+    ) -> Dict[str, Any]:
+        """
+        Compact expired rows in chunks until none are left or ``time_budget``
+        seconds have passed, then release free pages. Each chunk is its own
+        short write transaction, so live quota charges are never blocked for
+        longer than one chunk.
+        """
+        started = time.monotonic()
+        removed = 0
+        chunks = 0
+        finished = False
+        while time.monotonic() - started < time_budget:
+            count = self.compact_usage(retention_days, batch_size)
+            removed += count
+            chunks += 1
+            if count < batch_size:
+                finished = True
+                break
+
+        released = self.vacuum_incremental(vacuum_pages)
+        result = {
+            "rows_compacted": removed,
+            "chunks": chunks,
+            "pages_released": released,
+            "finished": finished,
+            "elapsed": round(time.monotonic() - started, 3),
+        }
+        logger.info("使用记录维护完成: %s", result)
+        return result
+
+
+class _CounterShard:
+    """One lock-protected slice of the in-memory quota counters."""
+
+    __slots__ = ("lock", "counts", "dirty")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.dirty: Set[Tuple[str, str]] = set()
+
+
+class WriteBehindUsageRepository(UsageRepository):
+    """
+    Serve quota reads and charges from sharded in-process counters.
+
+    Counters are authoritative for this process and are written back to
+    ``user_usage`` by a background thread every ``flush_interval`` seconds,
+    as soon as ``flush_threshold`` charges are pending, and at shutdown.
+    A crash loses at most the charges made since the last flush, so only
+    use this mode when a single process owns the database.
+    """
+
+    def __init__(
+        self,
+        database_path: str,
+        daily_limit: int,
+        flush_interval: float = 2.0,
+        flush_threshold: int = 100,
+        shard_count: int = 16,
+        busy_timeout: float = 5.0,
+    ) -> None:
+        super().__init__(database_path, daily_limit, busy_timeout)
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._shards = [_CounterShard() for _ in range(shard_count)]
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def _shard(self, key: Tuple[str, str]) -> _CounterShard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def init_database(self) -> None:
+        """Ensure tables exist, warm today's counters and start the flusher."""
+        super().init_database()
+        today = date.today().isoformat()
+        with self._connect("init") as conn:
+            rows = conn.execute(
+                "SELECT user_token, usage_count FROM user_usage WHERE usage_date = ?",
+                (today,),
+            ).fetchall()
+        for user_token, usage_count in rows:
+            key = (user_token, today)
+            self._shard(key).counts[key] = int(usage_count)
+        logger.info("已加载 %s 条今日使用记录到内存计数器", len(rows))
+        self._start_flusher()
+
+    def _start_flusher(self) -> None:
+        if self._flusher is not None:
+            return
+        self._flusher = threading.Thread(target=self._run_flusher, name="usage-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.shutdown)
+
+    def _run_flusher(self) -> None:
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as exc:
+                logger.error("使用次数落盘失败，将在下次重试: %s", exc)
+
+    def _mark_dirty(self) -> None:
+        with self._pending_lock:
+            self._pending += 1
+            pending = self._pending
+        if pending >= self.flush_threshold:
+            self._wake.set()
+
+    def get_usage(self, user_token: str) -> int:
+        """Return the number of times the user has interacted today."""
+        key = (user_token, date.today().isoformat())
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.counts.get(key, 0)
+
+    def try_consume(self, user_token: str) -> bool:
+        """Charge one unit of today's quota from the in-memory counters."""
+        key = (user_token, date.today().isoformat())
+        shard = self._shard(key)
+        with shard.lock:
+            current = shard.counts.get(key, 0)
+            if current >= self.daily_limit:
+                return False
+            shard.counts[key] = current + 1
+            shard.dirty.add(key)
+        self._mark_dirty()
+        return True
+
+    def release(self, user_token: str) -> None:
+        """Return one unit of today's quota after a request failed before reaching Dify."""
+        key = (user_token, date.today().isoformat())
+        shard = self._shard(key)
+        with shard.lock:
+            current = shard.counts.get(key, 0)
+            if current <= 0:
+                return
+            shard.counts[key] = current - 1
+            shard.dirty.add(key)
+        self._mark_dirty()
+
+    def flush(self) -> int:
+        """Write dirty counters to SQLite in one transaction; return rows written."""
+        with self._flush_lock:
+            with self._pending_lock:
+                self._pending = 0
+
+            batch = self._collect_dirty()
+            if not batch:
+                return 0
+
+            try:
+                self._write_batch(batch)
+            except sqlite3.Error:
+                self._restore_dirty(batch)
+                raise
+            return len(batch)
+
+    def _collect_dirty(self) -> List[Tuple[str, str, int]]:
+        today = date.today().isoformat()
+        batch: List[Tuple[str, str, int]] = []
+        for shard in self._shards:
+            with shard.lock:
+                batch.extend((token, day, shard.counts[(token, day)]) for token, day in shard.dirty)
+                shard.dirty = set()
+                stale = [key for key in shard.counts if key[1] != today]
+                for key in stale:
+                    del shard.counts[key]
+        return batch
+
+    def _write_batch(self, batch: List[Tuple[str, str, int]]) -> None:
+        with self._connect("flush") as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    """
+                    INSERT INTO user_usage (user_token, usage_date, usage_count)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(user_token, usage_date) DO UPDATE SET
+                        usage_count = excluded.usage_count,
+                        updated_at = CURRENT_TIMESTAMP
+                    """,
+                    self._checkpoint_rows(batch),
+                )
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _checkpoint_rows(self, batch: List[Tuple[str, str, int]]) -> List[Tuple[str, str, int]]:
+        """Rows to write, called with the SQLite write lock held."""
+        return batch
+
+    def _restore_dirty(self, batch: List[Tuple[str, str, int]]) -> None:
+        for token, day, count in batch:
+            key = (token, day)
+            shard = self._shard(key)
+            with shard.lock:
+                # Keys purged as stale are put back so the next flush retries them.
+                shard.counts.setdefault(key, count)
+                shard.dirty.add(key)
+        with self._pending_lock:
+            self._pending += len(batch)
+
+    def shutdown(self) -> None:
+        """Stop the flusher and persist every outstanding charge."""
+        self._stopping.set()
+        self._wake.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join(timeout=self.flush_interval + 5)
+        try:
+            self.flush()
+        except sqlite3.Error as exc:
+            logger.error("关闭时使用次数落盘失败: %s", exc)
+        self.close()
+
+
+class SharedMemoryUsageRepository(WriteBehindUsageRepository):
+    """
+    Share quota counters between worker processes through a memory-mapped table.
+
+    Every worker on the host maps the same ``SharedQuotaTable`` file and
+    charges quota with a striped lock instead of the SQLite write lock.
+    SQLite is only a checkpoint: each worker periodically writes back the
+    counts of the tokens it has charged, and the first worker to create the
+    table seeds it from today's rows.
+    """
+
+    def __init__(
+        self,
+        database_path: str,
+        daily_limit: int,
+        table_path: str,
+        table_capacity: int = 65536,
+        flush_interval: float = 2.0,
+        flush_threshold: int = 100,
+        busy_timeout: float = 5.0,
+    ) -> None:
+        super().__init__(
+            database_path,
+            daily_limit,
+            flush_interval=flush_interval,
+            flush_threshold=flush_threshold,
+            shard_count=1,
+            busy_timeout=busy_timeout,
+        )
+        self._table_path = table_path
+        self._table_capacity = table_capacity
+        self._table: Optional[SharedQuotaTable] = None
+        self._dirty: Set[Tuple[str, str]] = set()
+        self._dirty_lock = threading.Lock()
+
+    def init_database(self) -> None:
+        """Ensure tables exist, map the shared table and start the checkpoint thread."""
+        UsageRepository.init_database(self)
+        self._table = SharedQuotaTable(self._table_path, self._table_capacity, initializer=self._seed_table)
+        logger.info("共享配额表已映射: %s (容量 %s)", self._table_path, self._table.capacity)
+        self._start_flusher()
+
+    def _seed_table(self, table: SharedQuotaTable) -> None:
+        today = date.today()
+        with self._connect("init") as conn:
+            rows = conn.execute(
+                "SELECT user_token, usage_count FROM user_usage WHERE usage_date = ?",
+                (today.isoformat(),),
+            ).fetchall()
+        skipped = 0
+        for user_token, usage_count in rows:
+            try:
+                table.seed(user_token, today.toordinal(), int(usage_count))
+            except QuotaTableFull:
+                # Its stripe stays full today, so this token is counted in SQLite alone.
+                skipped += 1
+        logger.info("已从数据库加载 %s 条今日使用记录到共享配额表", len(rows) - skipped)
+        if skipped:
+            logger.warning("共享配额表已满，%s 个用户今日改由数据库计数", skipped)
+
+    def _mark_key_dirty(self, key: Tuple[str, str]) -> None:
+        with self._dirty_lock:
+            self._dirty.add(key)
+        self._mark_dirty()
+
+    def get_usage(self, user_token: str) -> int:
+        """Return the number of times the user has interacted today."""
+        today = date.today()
+        count = self._table.get(user_token, today.toordinal())
+        if count is None:
+            return UsageRepository.get_usage(self, user_token)
+        return count
+
+    def try_consume(self, user_token: str) -> bool:
+        """Charge one unit of today's quota in the shared table."""
+        today = date.today()
+        try:
+            charged = self._table.try_increment(user_token, today.toordinal(), self.daily_limit)
+        except QuotaTableFull:
+            # Today's entries are never evicted, so every worker keeps finding this token's stripe
+            # full and counts the token in SQLite alone until tomorrow; no count is split between stores.
+            logger.warning("共享配额表已满，回退到数据库计数")
+            return UsageRepository.try_consume(self, user_token)
+        if charged:
+            self._mark_key_dirty((user_token, today.isoformat()))
+        return charged
+
+    def release(self, user_token: str) -> None:
+        """Return one unit of today's quota after a request failed before reaching Dify."""
+        today = date.today()
+        if self._table.get(user_token, today.toordinal()) is None:
+            UsageRepository.release(self, user_token)
+            return
+        self._table.decrement(user_token, today.toordinal())
+        self._mark_key_dirty((user_token, today.isoformat()))
+
+    def _collect_dirty(self) -> List[Tuple[str, str, int]]:
+        with self._dirty_lock:
+            keys, self._dirty = self._dirty, set()
+        batch: List[Tuple[str, str, int]] = []
+        for user_token, day in keys:
+            count = self._table.get(user_token, date.fromisoformat(day).toordinal())
+            if count is not None:
+                batch.append((user_token, day, count))
+        return batch
+
+    def _checkpoint_rows(self, batch: List[Tuple[str, str, int]]) -> List[Tuple[str, str, int]]:
+        # Another worker may have checkpointed a newer count since this batch was collected; the
+        # write lock orders the checkpoints, so the count read now is never older than the stored one.
+        rows = []
+        for user_token, day, count in batch:
+            current = self._table.get(user_token, date.fromisoformat(day).toordinal())
+            rows.append((user_token, day, count if current is None else current))
+        return rows
+
+    def _restore_dirty(self, batch: List[Tuple[str, str, int]]) -> None:
+        with self._dirty_lock:
+            self._dirty.update((token, day) for token, day, _ in batch)
+        with self._pending_lock:
+            self._pending += len(batch)
+
+    def shutdown(self) -> None:
+        """Checkpoint this worker's tokens and unmap the shared table."""
+        super().shutdown()
+        if self._table is not None:
+            self._table.close()
+            self._table = None
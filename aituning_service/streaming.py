@@ -0,0 +1,461 @@
+"""Relays for forwarding the Dify SSE stream to the browser."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterator, List, Optional
+
+import requests
+
+from .jsonutil import loads
+from .metrics import STREAMS_ACTIVE, observe_stream
+from .tags import TagParser
+
+logger = logging.getLogger(__name__)
+
+# An SSE comment; EventSource and the micro-app's line parser both ignore it.
+HEARTBEAT = b": ping\n\n"
+# Added to tag names to form the event names TagEventScanner sends.
+TAG_EVENT_PREFIX = "tag_"
+# Longest upstream event the tag scanner buffers while waiting for its end.
+_MAX_PENDING_EVENT = 1 << 20
+# Sent to clients whose stream is cut short because the server is stopping.
+DRAIN_MESSAGE = "服务正在重启，请稍后重新发送"
+
+# perf_counter() time by which open relays end their streams; set by begin_drain.
+_drain_deadline: Optional[float] = None
+
+
+def begin_drain(timeout: float) -> None:
+    """
+    The server is stopping: let open streams run for up to ``timeout``
+    seconds, then end each with an error event and abort its upstream.
+    """
+    global _drain_deadline
+    _drain_deadline = time.perf_counter() + max(0.0, timeout)
+    logger.info("开始排空流式响应，%.1f 秒后中断仍未结束的流", timeout)
+
+
+def _idle_timeout(interval: Optional[float]) -> Optional[float]:
+    """``interval`` (None waits forever), cut short to wake at the drain deadline."""
+    if _drain_deadline is None:
+        return interval
+    remaining = max(0.0, _drain_deadline - time.perf_counter())
+    return remaining if interval is None else min(interval, remaining)
+
+
+@dataclass
+class StreamStats:
+    """Per-stream counters reported when a relay finishes."""
+
+    bytes: int = 0
+    chunks: int = 0
+    heartbeats: int = 0
+    tags: int = 0
+    ttfb: Optional[float] = None
+    duration: float = 0.0
+    cancelled: bool = False
+    error: Optional[str] = None
+
+
+class EventBoundary:
+    """Track whether the bytes forwarded so far end on an SSE event boundary."""
+
+    __slots__ = ("_tail",)
+
+    def __init__(self) -> None:
+        # Nothing sent yet counts as a boundary.
+        self._tail = b"\n\n"
+
+    def feed(self, chunk: bytes) -> None:
+        self._tail = (self._tail + chunk[-4:])[-4:]
+
+    @property
+    def at_boundary(self) -> bool:
+        return self._tail.endswith(b"\n\n") or self._tail.endswith(b"\r\n\r\n")
+
+
+class TagEventScanner:
+    """
+    Watch the Dify SSE bytes for tags in the answer text and announce each
+    one as its own event.
+
+    ``scan`` returns the chunk unchanged, except that a
+    ``data: {"event": "tag_<tag name>", "data": <tag JSON>}`` event is
+    inserted right after the upstream event that closed the tag. The prefix
+    keeps them apart from the micro-app's own ``segment_cover`` event, which
+    appends the tag to the answer text a second time. Only the answer of
+    each complete upstream event is decoded; partial events are kept until
+    their boundary arrives.
+    """
+
+    def __init__(self) -> None:
+        self._parser = TagParser()
+        self._pending = b""
+        self.tags = 0
+
+    def scan(self, chunk: bytes) -> bytes:
+        data = self._pending + chunk if self._pending else chunk
+        base = len(self._pending)
+        pieces: List[bytes] = []
+        sent = 0
+        event_start = 0
+        boundary = data.find(b"\n\n", max(0, base - 1))
+        while boundary != -1:
+            extra = self._events(data[event_start:boundary])
+            event_start = boundary + 2
+            if extra:
+                cut = event_start - base
+                pieces.append(chunk[sent:cut])
+                pieces.extend(extra)
+                sent = cut
+            boundary = data.find(b"\n\n", event_start)
+        self._pending = data[event_start:]
+        if len(self._pending) > _MAX_PENDING_EVENT:
+            logger.warning("SSE 事件过长，跳过标签解析")
+            self._pending = b""
+        if not pieces:
+            return chunk
+        pieces.append(chunk[sent:])
+        return b"".join(pieces)
+
+    def _events(self, event: bytes) -> List[bytes]:
+        # Dify sends one data line per event; only message events carry answer text.
+        if b'"answer"' not in event:
+            return []
+        extra = []
+        for line in event.split(b"\n"):
+            if not line.startswith(b"data:"):
+                continue
+            try:
+                payload = loads(line[5:])
+            except ValueError:
+                continue
+            answer = payload.get("answer") if isinstance(payload, dict) else None
+            if not isinstance(answer, str) or not answer:
+                continue
+            for name, body in self._parser.feed(answer):
+                self.tags += 1
+                encoded = json.dumps({"event": TAG_EVENT_PREFIX + name, "data": body}, ensure_ascii=False)
+                extra.append(f"data: {encoded}\n\n".encode("utf-8"))
+        return extra
+
+
+def error_event(exc: BaseException, boundary: Optional[EventBoundary] = None) -> bytes:
+    """Build the ``data: {"error": ...}`` event, closing any half-sent event first."""
+    payload = json.dumps({"error": str(exc)}, ensure_ascii=False)
+    prefix = b"" if boundary is None or boundary.at_boundary else b"\n\n"
+    return prefix + f"data: {payload}\n\n".encode("utf-8")
+
+
+def log_stream_stats(stats: StreamStats) -> None:
+    logger.info(
+        "流式响应结束: bytes=%s chunks=%s heartbeats=%s tags=%s ttfb=%s duration=%.3fs cancelled=%s error=%s",
+        stats.bytes,
+        stats.chunks,
+        stats.heartbeats,
+        stats.tags,
+        f"{stats.ttfb:.3f}s" if stats.ttfb is not None else "-",
+        stats.duration,
+        stats.cancelled,
+        stats.error,
+    )
+
+
+def _abort(response: requests.Response) -> None:
+    """Close the upstream response, unblocking a reader thread stuck in ``recv``."""
+    connection = getattr(response.raw, "connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            # close() alone does not wake a recv() running in another thread.
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+class _Relay:
+    def __init__(
+        self,
+        started: Optional[float],
+        on_complete: Optional[Callable[[StreamStats], None]],
+        tag_events: bool = False,
+    ) -> None:
+        self.started = started if started is not None else time.perf_counter()
+        self.on_complete = on_complete or log_stream_stats
+        self.stats = StreamStats()
+        self.scanner = TagEventScanner() if tag_events else None
+        STREAMS_ACTIVE.inc()
+
+    def drained(self) -> bool:
+        """True once the drain deadline has passed; the stream must end now."""
+        if _drain_deadline is None or time.perf_counter() < _drain_deadline:
+            return False
+        self.stats.error = "drained"
+        return True
+
+    def scan(self, chunk: bytes) -> bytes:
+        return self.scanner.scan(chunk) if self.scanner is not None else chunk
+
+    def sent(self, size: int) -> None:
+        if self.stats.ttfb is None:
+            self.stats.ttfb = time.perf_counter() - self.started
+        self.stats.bytes += size
+        self.stats.chunks += 1
+
+    def finish(self) -> None:
+        if self.scanner is not None:
+            self.stats.tags = self.scanner.tags
+        self.stats.duration = time.perf_counter() - self.started
+        STREAMS_ACTIVE.dec()
+        observe_stream(self.stats)
+        try:
+            self.on_complete(self.stats)
+        except Exception:  # pragma: no cover - reporting must not break the stream
+            logger.exception("流式响应统计回调失败")
+
+
+def relay_lines(
+    response: requests.Response,
+    started: Optional[float] = None,
+    on_complete: Optional[Callable[[StreamStats], None]] = None,
+    tag_events: bool = False,
+) -> Iterator[bytes]:
+    """Re-frame the stream line by line, decoding each line (the original relay)."""
+    relay = _Relay(started, on_complete, tag_events)
+    try:
+        for line in response.iter_lines():
+            if relay.drained():
+                yield error_event(RuntimeError(DRAIN_MESSAGE))
+                break
+            if not line:
+                out = "\n"
+            else:
+                decoded = line.decode("utf-8")
+                out = f"{decoded}\n\n" if decoded.startswith("data: ") else f"{decoded}\n"
+            encoded = relay.scan(out.encode("utf-8"))
+            relay.sent(len(encoded))
+            yield encoded
+    except GeneratorExit:
+        relay.stats.cancelled = True
+        raise
+    except Exception as exc:  # pragma: no cover - defensive fallback
+        logger.error("流式响应转发失败: %s", exc)
+        relay.stats.error = str(exc)
+        yield error_event(exc)
+    finally:
+        response.close()
+        relay.finish()
+
+
+def relay_passthrough(
+    response: requests.Response,
+    heartbeat_interval: float = 15.0,
+    chunk_size: int = 65536,
+    buffer_limit: int = 1 << 20,
+    started: Optional[float] = None,
+    on_complete: Optional[Callable[[StreamStats], None]] = None,
+    tag_events: bool = False,
+) -> Iterator[bytes]:
+    """
+    Forward upstream bytes unchanged, chunk by chunk, as they arrive.
+
+    Dify already frames its events, so nothing is split, decoded or
+    re-encoded. With ``heartbeat_interval`` > 0 a reader thread fills a
+    buffer of at most ``buffer_limit`` bytes (a slow client stalls the
+    upstream read rather than buffering without limit), whatever has
+    arrived is sent as one write, and ``HEARTBEAT`` is sent whenever the
+    upstream has been idle that long on an event boundary. Closing the
+    generator (the client went away) aborts the upstream connection. With
+    ``tag_events`` a ``TagEventScanner`` adds an event for each closed tag.
+    After ``begin_drain`` the stream is ended at the deadline; without
+    heartbeats that is noticed only when the next chunk arrives.
+    """
+    relay = _Relay(started, on_complete, tag_events)
+    boundary = EventBoundary()
+
+    chunks: Iterator[object] = _upstream_chunks(response, chunk_size)
+    if heartbeat_interval > 0:
+        chunks = _pump(chunks, heartbeat_interval, buffer_limit)
+
+    try:
+        for chunk in chunks:
+            if relay.drained():
+                yield error_event(RuntimeError(DRAIN_MESSAGE), boundary)
+                break
+            if chunk is None:
+                if not boundary.at_boundary:
+                    continue
+                relay.stats.heartbeats += 1
+                yield HEARTBEAT
+                continue
+            if isinstance(chunk, BaseException):
+                raise chunk
+            chunk = relay.scan(chunk)  # type: ignore[arg-type]
+            boundary.feed(chunk)  # type: ignore[arg-type]
+            relay.sent(len(chunk))  # type: ignore[arg-type]
+            yield chunk  # type: ignore[misc]
+    except GeneratorExit:
+        relay.stats.cancelled = True
+        raise
+    except Exception as exc:
+        logger.error("流式响应转发失败: %s", exc)
+        relay.stats.error = str(exc)
+        yield error_event(exc, boundary)
+    finally:
+        chunks.close()  # type: ignore[attr-defined]
+        if relay.stats.cancelled or relay.stats.error:
+            _abort(response)
+        else:
+            response.close()
+        relay.finish()
+
+
+def _upstream_chunks(response: requests.Response, chunk_size: int) -> Iterator[bytes]:
+    """Yield body bytes as soon as they arrive, without waiting to fill ``chunk_size``."""
+    raw = response.raw
+    if raw.chunked:
+        yield from raw.read_chunked(chunk_size, decode_content=True)
+        return
+    while True:
+        data = raw.read1(chunk_size, decode_content=True)
+        if not data:
+            return
+        yield data
+
+
+class _ChunkBuffer:
+    """Bytes handed from the reader thread to the relay, bounded by ``limit`` buffered bytes."""
+
+    def __init__(self, limit: int) -> None:
+        self._limit = limit
+        self._chunks: List[bytes] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+    def put(self, data: bytes) -> bool:
+        with self._cond:
+            while self._size >= self._limit and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return False
+            self._chunks.append(data)
+            self._size += len(data)
+            self._cond.notify()
+            return True
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def take(self, timeout: float) -> List[bytes]:
+        """Return everything buffered, waiting up to ``timeout`` if nothing is."""
+        with self._cond:
+            if not self._chunks and not self.done:
+                self._cond.wait(timeout)
+            chunks, self._chunks, self._size = self._chunks, [], 0
+            self._cond.notify_all()
+            return chunks
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+def _pump(chunks: Iterator[bytes], heartbeat_interval: float, buffer_limit: int) -> Iterator[object]:
+    """
+    Read ``chunks`` in a thread; yield what has arrived since the last
+    yield as one chunk, or None after each idle ``heartbeat_interval``
+    (or at the drain deadline).
+    """
+    buffer = _ChunkBuffer(buffer_limit)
+
+    def run() -> None:
+        try:
+            for data in chunks:
+                if not buffer.put(data):
+                    break
+        except Exception as exc:
+            buffer.finish(exc)
+        else:
+            buffer.finish()
+
+    reader = threading.Thread(target=run, name="sse-relay-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            batch = buffer.take(_idle_timeout(heartbeat_interval))  # type: ignore[arg-type]
+            if batch:
+                yield batch[0] if len(batch) == 1 else b"".join(batch)
+            elif buffer.done:
+                if buffer.error is not None:
+                    yield buffer.error
+                return
+            else:
+                yield None
+    finally:
+        buffer.close()
+
+
+async def relay_passthrough_async(
+    content,
+    write: Callable[[bytes], Awaitable[None]],
+    heartbeat_interval: float = 15.0,
+    started: Optional[float] = None,
+    on_complete: Optional[Callable[[StreamStats], None]] = None,
+    tag_events: bool = False,
+) -> StreamStats:
+    """
+    Event-loop counterpart of ``relay_passthrough`` for an aiohttp ``StreamReader``.
+
+    ``write`` applies backpressure itself (``StreamResponse.write`` waits for
+    the transport to drain). Cancellation from a disconnected client
+    propagates; the caller releases the upstream response.
+    """
+    relay = _Relay(started, on_complete, tag_events)
+    boundary = EventBoundary()
+    timeout = heartbeat_interval if heartbeat_interval > 0 else None
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(content.readany(), _idle_timeout(timeout))
+            except asyncio.TimeoutError:
+                if relay.drained():
+                    await write(error_event(RuntimeError(DRAIN_MESSAGE), boundary))
+                    break
+                if boundary.at_boundary:
+                    relay.stats.heartbeats += 1
+                    await write(HEARTBEAT)
+                continue
+            if not chunk:
+                break
+            if relay.drained():
+                await write(error_event(RuntimeError(DRAIN_MESSAGE), boundary))
+                break
+            chunk = relay.scan(chunk)
+            boundary.feed(chunk)
+            relay.sent(len(chunk))
+            await write(chunk)
+    except (asyncio.CancelledError, ConnectionResetError):
+        relay.stats.cancelled = True
+        raise
+    except Exception as exc:
+        logger.error("流式响应转发失败: %s", exc)
+        relay.stats.error = str(exc)
+        await write(error_event(exc, boundary))
+    finally:
+        relay.finish()
+    return relay.stats
@@ -0,0 +1,102 @@
+"""Incremental parser for the tags the assistant embeds in its answer text."""
+
+from __future__ import annotations
+
+import logging
+from typing import Any, List, Optional, Tuple
+
+from .jsonutil import loads
+
+logger = logging.getLogger(__name__)
+
+# Tags the micro-app acts on (see llmParser.ts); their bodies are JSON.
+TAG_NAMES = ("freq_manipulation", "segment_cover")
+# A tag body longer than this is abandoned rather than buffered without limit.
+MAX_TAG_BODY = 1 << 16
+
+
+class TagParser:
+    """
+    Find ``<name>...</name>`` tags in text that arrives in pieces.
+
+    ``feed`` takes each answer delta and returns the tags closed by it as
+    ``(name, parsed JSON body)``. Every character is examined a bounded
+    number of times, however the text is split: only a possible partial
+    opening or closing tag is carried over to the next call.
+    """
+
+    def __init__(self, names: Tuple[str, ...] = TAG_NAMES) -> None:
+        self._opens = {f"<{name}>": name for name in names}
+        self._longest_open = max(len(tag) for tag in self._opens)
+        self._carry = ""
+        self._name: Optional[str] = None
+        self._close = ""
+        self._body: List[str] = []
+        self._body_size = 0
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        text = self._carry + text
+        self._carry = ""
+        found: List[Tuple[str, Any]] = []
+        position = 0
+        while position < len(text):
+            if self._name is None:
+                position = self._find_open(text, position)
+            else:
+                position = self._find_close(text, position, found)
+        return found
+
+    def _find_open(self, text: str, position: int) -> int:
+        while True:
+            start = text.find("<", position)
+            if start == -1:
+                return len(text)
+            rest = text[start : start + self._longest_open]
+            for tag, name in self._opens.items():
+                if rest.startswith(tag):
+                    self._name, self._close = name, f"</{name}>"
+                    self._body, self._body_size = [], 0
+                    return start + len(tag)
+                if tag.startswith(rest) and start + len(rest) == len(text):
+                    # The text ends in what may be the start of a tag.
+                    self._carry = rest
+                    return len(text)
+            position = start + 1
+
+    def _find_close(self, text: str, position: int, found: List[Tuple[str, Any]]) -> int:
+        end = text.find(self._close, position)
+        if end == -1:
+            # Keep back anything that could be the start of the closing tag.
+            keep = len(self._close) - 1
+            split = max(position, len(text) - keep)
+            while split < len(text) and not self._close.startswith(text[split:]):
+                split += 1
+            self._append(text[position:split])
+            self._carry = text[split:]
+            return len(text)
+        self._append(text[position:end])
+        name, body = self._name, "".join(self._body)
+        self._name, self._body, self._body_size = None, [], 0
+        if name is not None:
+            parsed = _parse_body(name, body)
+            if parsed is not None:
+                found.append((name, parsed))
+        return end + len(self._close)
+
+    def _append(self, piece: str) -> None:
+        if not piece or self._name is None:
+            return
+        self._body_size += len(piece)
+        if self._body_size > MAX_TAG_BODY:
+            logger.warning("标签 <%s> 内容过长，已放弃解析", self._name)
+            self._name, self._body, self._body_size = None, [], 0
+            return
+        self._body.append(piece)
+
+
+def _parse_body(name: str, body: str) -> Optional[Any]:
+    try:
+        return loads(body.strip())
+    except ValueError:
+        logger.warning("解析 <%s> 标签 JSON 失败", name)
+        return None
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+import pytest
+
+from ..config import Settings
+
+# Requests from another origin are refused before they reach the routes.
+HEADERS = {"Origin": "http://localhost:3000"}
+
+
+@pytest.fixture
+def make_settings(tmp_path: Path) -> Callable[..., Settings]:
+    """Settings with every store under ``tmp_path`` and no background services."""
+
+    def make(**overrides: Any) -> Settings:
+        values: Dict[str, Any] = dict(
+            dify_api_key="test-dify-key",
+            database_path=str(tmp_path / "usage.db"),
+            usage_backend="sqlite",
+            product_catalog_path="",
+        )
+        values.update(overrides)
+        return Settings(**values)
+
+    return make
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import gzip
+import json
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pytest
+
+from ..app import create_product_catalog
+from ..config import Settings
+from ..services.catalog import ProductCatalog
+from ..services.huihifi import HuiHiFiClient, _normalize_item, product_key
+
+
+def _item(uuid: Optional[str], title: str) -> Dict[str, Any]:
+    return {
+        "uuid": uuid,
+        "title": title,
+        "brand": {"title": "Brand"},
+        "thumbnails": [],
+        "categoryName": "耳机",
+        "dataGroup": "",
+        "dataGroups": [],
+    }
+
+
+class ListingClient:
+    """Serves ``listing`` (newest first) in pages, as ``HuiHiFiClient.iter_pages`` does."""
+
+    max_page_size = 2
+
+    def __init__(self, listing: List[Dict[str, Any]]) -> None:
+        self.listing = listing
+        self.pages = 0
+
+    def iter_pages(
+        self, keyword: str, page_size: Optional[int] = None, concurrency: Optional[int] = None
+    ) -> Iterator[List[Dict[str, Any]]]:
+        size = page_size or self.max_page_size
+        for start in range(0, len(self.listing), size):
+            self.pages += 1
+            yield self.listing[start:start + size]
+
+
+@pytest.fixture
+def snapshot(tmp_path: Path) -> str:
+    return str(tmp_path / "catalog.json.gz")
+
+
+def _titles(catalog: ProductCatalog) -> List[str]:
+    return [item["title"] for item in catalog.search_products("", 100)["products"]]
+
+
+def test_incremental_sync_prepends_new_items_and_stops_at_a_known_one(snapshot: str) -> None:
+    client = ListingClient([_item(f"u{n}", f"HD{n}") for n in range(6, 0, -1)])
+    catalog = ProductCatalog(client, snapshot)  # type: ignore[arg-type]
+    assert catalog.sync(full=True) == 6
+
+    client.listing = [_item("u8", "HD8"), _item("u7", "HD7")] + client.listing
+    client.pages = 0
+    assert catalog.sync() == 2
+    assert client.pages == 2
+    assert _titles(catalog) == ["HD8", "HD7", "HD6", "HD5", "HD4", "HD3", "HD2", "HD1"]
+
+
+def test_full_sync_reflects_edits_and_deletions(snapshot: str) -> None:
+    client = ListingClient([_item("u3", "HD3"), _item("u2", "HD2"), _item("u1", "HD1")])
+    catalog = ProductCatalog(client, snapshot)  # type: ignore[arg-type]
+    catalog.sync(full=True)
+
+    client.listing = [_item("u3", "HD3"), _item("u1", "HD1 重新测量")]
+    catalog.sync()
+    # An incremental sync sees nothing new.
+    assert _titles(catalog) == ["HD3", "HD2", "HD1"]
+    catalog.sync(full=True)
+    assert _titles(catalog) == ["HD3", "HD1 重新测量"]
+    assert catalog.search_products("hd2", 10) == {"products": [], "total": 0}
+
+
+def test_items_without_uuid_are_kept_apart(snapshot: str) -> None:
+    first, second = _item(None, "无编号 A"), _item(None, "无编号 B")
+    client = ListingClient([first, second, dict(first), _item("u1", "HD1")])
+    catalog = ProductCatalog(client, snapshot)  # type: ignore[arg-type]
+    assert catalog.sync(full=True) == 3
+    assert _titles(catalog) == ["无编号 A", "无编号 B", "HD1"]
+    assert product_key(first) != product_key(second)
+
+    client.listing = [_item(None, "无编号 C")] + client.listing
+    assert catalog.sync() == 1
+    assert _titles(catalog) == ["无编号 C", "无编号 A", "无编号 B", "HD1"]
+
+
+def test_full_sync_is_due_after_the_interval(snapshot: str) -> None:
+    client = ListingClient([_item("u1", "HD1")])
+    catalog = ProductCatalog(client, snapshot, full_sync_interval=3600)  # type: ignore[arg-type]
+    assert catalog.full_sync_due
+    catalog.sync(full=True)
+    assert not catalog.full_sync_due
+    catalog.last_full_sync -= 3600
+    assert catalog.full_sync_due
+
+
+def test_snapshot_round_trip(snapshot: str) -> None:
+    client = ListingClient([_item("u2", "HD2"), _item("u1", "HD1")])
+    catalog = ProductCatalog(client, snapshot)  # type: ignore[arg-type]
+    catalog.sync(full=True)
+
+    reloaded = ProductCatalog(client, snapshot)  # type: ignore[arg-type]
+    assert reloaded.load()
+    assert _titles(reloaded) == ["HD2", "HD1"]
+    assert reloaded.last_full_sync == catalog.last_full_sync
+
+
+def test_old_snapshot_version_is_ignored(snapshot: str) -> None:
+    with gzip.open(snapshot, "wt", encoding="utf-8") as handle:
+        json.dump({"version": 1, "syncedAt": 0, "products": [dict(_item("u1", "HD1"), createTime=1)]}, handle)
+    catalog = ProductCatalog(ListingClient([]), snapshot)  # type: ignore[arg-type]
+    assert not catalog.load()
+
+
+def test_search_response_has_no_create_time() -> None:
+    raw = {
+        "uuid": "u1",
+        "title": "HD1",
+        "brand": {"title": "Brand"},
+        "categoryName": "耳机",
+        "createTime": 1_700_000_000_000,
+        "dataGroups": [],
+    }
+    product = _normalize_item(raw)
+    assert product is not None
+    assert set(product) == {"uuid", "title", "brand", "thumbnails", "categoryName", "dataGroup", "dataGroups"}
+
+
+def test_keywords_match_inside_terms(snapshot: str) -> None:
+    items = [_item("u1", "Sennheiser HD600"), _item("u2", "森海塞尔HD650"), _item("u3", "Moondrop Aria")]
+    catalog = ProductCatalog(ListingClient(items), snapshot)  # type: ignore[arg-type]
+    catalog.sync(full=True)
+
+    def found(keyword: str) -> List[str]:
+        return [item["uuid"] for item in catalog.search_products(keyword, 10)["products"]]
+
+    assert found("600") == ["u1"]
+    assert found("hd6") == ["u1", "u2"]
+    assert found("d65 塞尔") == ["u2"]
+    assert found("heiser 600") == ["u1"]
+    assert found("ria") == ["u3"]
+    assert found("700") == []
+
+
+def test_catalog_needs_a_page_param(make_settings: Callable[..., Settings], tmp_path: Path) -> None:
+    settings = make_settings(
+        product_catalog_path=str(tmp_path / "catalog.json.gz"), huihifi_app_key="key", huihifi_secret_key="secret"
+    )
+    client = HuiHiFiClient("http://127.0.0.1:9", "key", "secret")
+    try:
+        assert create_product_catalog(settings, client) is None
+    finally:
+        client.close()
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Iterator
+
+import pytest
+
+from .. import curve
+from ..app import create_app
+from ..config import Settings
+from ..curve import CurveError, frequency_response_text, parse_frequency_response
+from .conftest import HEADERS
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request: Any, monkeypatch: pytest.MonkeyPatch) -> Iterator[str]:
+    if request.param == "python":
+        monkeypatch.setattr(curve, "np", None)
+    elif curve.np is None:
+        pytest.skip("numpy is not installed")
+    yield request.param
+
+
+def test_unsorted_points_are_sorted(backend: str) -> None:
+    freqs, spl = parse_frequency_response([["Freq(Hz)", "SPL(dB)"], ["1000", "3"], ["20", "1"], [100, 2]])
+    assert list(freqs) == [20, 100, 1000]
+    assert list(spl) == [1, 2, 3]
+
+
+def test_duplicate_frequencies_keep_the_first_level(backend: str) -> None:
+    freqs, spl = parse_frequency_response([[100, 1], [20, 5], [100, 2], [1000, 3]])
+    assert list(freqs) == [20, 100, 1000]
+    assert list(spl) == [5, 1, 3]
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        [[100, 1], [100, 2]],
+        [["Freq(Hz)", "SPL(dB)"], ["100", "1"], ["100.0", "2"], [100, 3]],
+    ],
+)
+def test_one_distinct_frequency_is_rejected(backend: str, rows: Any) -> None:
+    with pytest.raises(CurveError, match="至少需要 2 个点"):
+        parse_frequency_response(rows)
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        [],
+        [[100, 1]],
+        [[100, "x"], [200, 1]],
+        [[0, 1], [200, 1]],
+        "100,1",
+        # Integers too large for a float.
+        [[10**400, 1], [200, 2]],
+        [[100, 1], [200, -(10**400)]],
+    ],
+)
+def test_malformed_input_is_rejected(backend: str, rows: Any) -> None:
+    with pytest.raises(CurveError):
+        parse_frequency_response(rows)
+
+
+def test_backends_agree(monkeypatch: pytest.MonkeyPatch) -> None:
+    if curve.np is None:
+        pytest.skip("numpy is not installed")
+    rows = [[20 * 1.01 ** n, (n * 7) % 13 - 6.0] for n in range(700)]
+    rows += [[1000, 9.0], [50, -3.0]]
+    expected = frequency_response_text(rows, 120)
+    monkeypatch.setattr(curve, "np", None)
+    assert frequency_response_text(rows, 120) == expected
+
+
+def test_chat_rejects_overflowing_points_with_400(make_settings: Callable[..., Settings]) -> None:
+    client = create_app(make_settings()).test_client()
+    response = client.post(
+        "/api/chat",
+        json={"userToken": "u", "message": "hi", "frequencyResponse": [[10**400, 1], [200, 2]]},
+        headers=HEADERS,
+    )
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "频率响应数据格式错误"}
+
+
+def test_chat_rejects_duplicate_points_with_400(make_settings: Callable[..., Settings]) -> None:
+    client = create_app(make_settings()).test_client()
+    response = client.post(
+        "/api/chat",
+        json={"userToken": "u", "message": "hi", "frequencyResponse": [[100, 1], [100, 2]]},
+        headers=HEADERS,
+    )
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "频率响应数据至少需要 2 个点"}
+    assert client.get("/api/usage/u", headers=HEADERS).get_json()["used"] == 0
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import json
+import math
+import random
+from typing import Callable, List
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from ..app import create_app  # noqa: E402
+from ..benchmarks.eq_response import complex_response  # noqa: E402
+from ..config import Settings  # noqa: E402
+from ..curve import log_grid  # noqa: E402
+from ..services.eq import FILTER_TYPES, Filter, FilterError, evaluate_request, response_db  # noqa: E402
+from .conftest import HEADERS  # noqa: E402
+
+GRID = log_grid(512)
+
+
+def _random_sets(rng: random.Random, kinds: tuple, filters: int, sets: int = 20) -> List[List[Filter]]:
+    return [
+        [
+            Filter(
+                rng.choice(kinds),
+                10 ** rng.uniform(math.log10(20), math.log10(20000)),
+                rng.uniform(-12, 12),
+                rng.uniform(0.5, 10),
+            )
+            for _ in range(filters)
+        ]
+        for _ in range(sets)
+    ]
+
+
+@pytest.mark.parametrize("kinds", [("peaking",), FILTER_TYPES], ids=["peaking", "mixed"])
+@pytest.mark.parametrize("filters", [1, 10, 31, 64])
+def test_matches_direct_complex_evaluation(kinds: tuple, filters: int) -> None:
+    filter_sets = _random_sets(random.Random(filters), kinds, filters)
+    engine = response_db(filter_sets, GRID)
+    reference = complex_response(filter_sets, GRID)
+    assert np.isfinite(engine).all()
+    # Far stopbands (below -200 dB) are outside what the reference itself resolves.
+    visible = reference > -200
+    assert np.abs(engine - reference)[visible].max() < 1e-6
+
+
+def test_sets_of_different_sizes_are_padded_to_unity() -> None:
+    filter_sets = _random_sets(random.Random(3), FILTER_TYPES, 5, sets=2) + [[]]
+    filter_sets[1] = filter_sets[1][:2]
+    engine = response_db(filter_sets, GRID)
+    assert np.abs(engine - complex_response(filter_sets, GRID)).max() < 1e-6
+    assert not engine[2].any()
+
+
+def test_non_finite_response_is_rejected() -> None:
+    with pytest.raises(FilterError):
+        evaluate_request({"filters": [{"type": "peaking", "freq": 1000, "gain": 6, "qFactor": 1e-300}]})
+
+
+def test_route_returns_valid_json_for_many_filters(make_settings: Callable[..., Settings]) -> None:
+    client = create_app(make_settings()).test_client()
+    filters = [
+        {"type": "peaking", "freq": 20 * 1.7**n, "gain": 12 if n % 2 else -12, "qFactor": 0.5 + n * 0.8}
+        for n in range(12)
+    ]
+    response = client.post("/api/eq/response", json={"filters": filters, "points": 256}, headers=HEADERS)
+    assert response.status_code == 200
+    body = json.loads(response.data, parse_constant=lambda name: pytest.fail(f"{name} in response"))
+    assert all(math.isfinite(value) for value in body["responses"][0])
+
+    bad = dict(filters[0], qFactor=1e-300)
+    assert client.post("/api/eq/response", json={"filters": [bad]}, headers=HEADERS).status_code == 400
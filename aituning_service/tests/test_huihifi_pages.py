@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+
+from ..benchmarks.fakes import FAKE_APP_KEY, FAKE_SECRET_KEY, FakeHuiHiFiServer
+from ..services import HuiHiFiClient, HuiHiFiClientError
+
+
+def _scan(server: FakeHuiHiFiServer, page_param: str) -> List[Dict[str, Any]]:
+    client = HuiHiFiClient(server.url, FAKE_APP_KEY, FAKE_SECRET_KEY, page_param=page_param)
+    client._session.trust_env = False
+    try:
+        return [product for page in client.iter_pages("", 50, concurrency=3) for product in page]
+    finally:
+        client.close()
+
+
+def _uuids(count: int) -> List[str]:
+    return [f"eval-{n:06d}" for n in range(count)]
+
+
+@pytest.mark.parametrize("page_param", ["page", "pageNum"])
+def test_configured_page_param_scans_the_whole_listing(page_param: str) -> None:
+    with FakeHuiHiFiServer(catalog_size=180, page_param=page_param) as server:
+        assert [p["uuid"] for p in _scan(server, page_param)] == _uuids(180)
+        assert server.requests == 4
+
+
+def test_without_page_param_only_the_first_page_is_fetched() -> None:
+    with FakeHuiHiFiServer(catalog_size=180) as server:
+        assert [p["uuid"] for p in _scan(server, "")] == _uuids(50)
+        assert server.requests == 1
+        client = HuiHiFiClient(server.url, FAKE_APP_KEY, FAKE_SECRET_KEY)
+        with pytest.raises(HuiHiFiClientError, match="HUIHIFI_PAGE_PARAM"):
+            client.search_products("", 50, page=2)
+        client.close()
+
+
+def test_scan_stops_when_upstream_ignores_the_page_param() -> None:
+    # The upstream answers every page with the first one.
+    with FakeHuiHiFiServer(catalog_size=180, page_param="") as server:
+        assert [p["uuid"] for p in _scan(server, "page")] == _uuids(50)
+        assert server.requests <= 1 + 3
+
+
+def test_async_scan_stops_when_upstream_ignores_the_page_param() -> None:
+    pytest.importorskip("aiohttp")
+    from ..services.huihifi_async import AsyncHuiHiFiClient
+
+    async def scan(url: str) -> List[Dict[str, Any]]:
+        client = AsyncHuiHiFiClient(HuiHiFiClient(url, FAKE_APP_KEY, FAKE_SECRET_KEY, page_param="page"))
+        await client.start()
+        try:
+            return [product async for page in client.iter_pages("", 50, concurrency=3) for product in page]
+        finally:
+            await client.close()
+
+    with FakeHuiHiFiServer(catalog_size=180, page_param="") as server:
+        assert [p["uuid"] for p in asyncio.run(scan(server.url))] == _uuids(50)
@@ -0,0 +1,100 @@
+"""Both serving modes answer repeated product searches from the TTL cache and report its stats."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import pytest
+
+from ..app import create_app
+from ..benchmarks.fakes import FAKE_APP_KEY, FAKE_SECRET_KEY, FakeHuiHiFiServer
+from ..config import Settings
+from ..routes.products import cache_bypassed
+from .conftest import HEADERS
+
+SEARCH = {"keyword": "HD600", "pageSize": 10}
+# A miss, then hits however noCache is turned off, then a bypass.
+EXTRAS = ({}, {}, {"noCache": "false"}, {"noCache": 0}, {"noCache": "0"}, {"noCache": True})
+
+
+@pytest.fixture
+def server(monkeypatch: pytest.MonkeyPatch) -> Iterator[FakeHuiHiFiServer]:
+    monkeypatch.setenv("NO_PROXY", "*")
+    with FakeHuiHiFiServer(catalog_size=40) as fake:
+        yield fake
+
+
+@pytest.fixture
+def settings(make_settings: Callable[..., Settings], server: FakeHuiHiFiServer) -> Settings:
+    return make_settings(
+        huihifi_api_base_url=server.url,
+        huihifi_app_key=FAKE_APP_KEY,
+        huihifi_secret_key=FAKE_SECRET_KEY,
+        product_cache_ttl=60,
+    )
+
+
+def _flask(settings: Settings) -> Tuple[List[str], Dict[str, Any]]:
+    client = create_app(settings).test_client()
+    statuses = []
+    for extra in EXTRAS:
+        response = client.post("/api/products/search", json=dict(SEARCH, **extra), headers=HEADERS)
+        assert response.status_code == 200
+        statuses.append(response.headers.get("X-Cache"))
+    return statuses, client.get("/api/products/cache/stats", headers=HEADERS).get_json()["data"]
+
+
+def _aiohttp(settings: Settings) -> Tuple[List[str], Dict[str, Any]]:
+    pytest.importorskip("aiohttp")
+    from aiohttp.test_utils import TestClient, TestServer
+
+    from ..aio_app import create_async_app
+
+    async def run() -> Tuple[List[str], Dict[str, Any]]:
+        async with TestClient(TestServer(create_async_app(settings))) as client:
+            statuses = []
+            for extra in EXTRAS:
+                response = await client.post("/api/products/search", json=dict(SEARCH, **extra), headers=HEADERS)
+                assert response.status == 200
+                statuses.append(response.headers.get("X-Cache"))
+            stats = await (await client.get("/api/products/cache/stats", headers=HEADERS)).json()
+            return statuses, stats["data"]
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("serve", [_flask, _aiohttp], ids=["flask", "aiohttp"])
+def test_repeated_search_is_served_from_cache(
+    serve: Callable[[Settings], Tuple[List[str], Dict[str, Any]]], settings: Settings, server: FakeHuiHiFiServer
+) -> None:
+    statuses, stats = serve(settings)
+    assert statuses == ["MISS", "HIT", "HIT", "HIT", "HIT", "BYPASS"]
+    assert server.requests == 2
+    assert stats["enabled"] is True
+    assert (stats["misses"], stats["hits"], stats["bypasses"], stats["entries"]) == (1, 4, 1, 1)
+
+
+@pytest.mark.parametrize(
+    "flag, cache_control, bypassed",
+    [
+        (None, "", False),
+        ("0", "", False),
+        ("false", "", False),
+        ("", "", False),
+        (0, "", False),
+        (False, "", False),
+        ("1", "", True),
+        ("TRUE", "", True),
+        ("yes", "", True),
+        (True, "", True),
+        (None, "no-cache", True),
+    ],
+)
+def test_no_cache_flag_is_parsed_like_boolean_settings(flag: Any, cache_control: str, bypassed: bool) -> None:
+    assert cache_bypassed(flag, cache_control) is bypassed
+
+
+def test_stats_report_a_disabled_cache(make_settings: Callable[..., Settings]) -> None:
+    client = create_app(make_settings(product_cache_ttl=0)).test_client()
+    assert client.get("/api/products/cache/stats", headers=HEADERS).get_json()["data"] == {"enabled": False}
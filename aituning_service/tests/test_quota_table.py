@@ -0,0 +1,126 @@
+"""SharedQuotaTable day rollover and overflow, and SharedMemoryUsageRepository across processes."""
+
+from __future__ import annotations
+
+import multiprocessing
+from datetime import date
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from ..quota_table import QuotaTableFull, SharedQuotaTable
+from ..storage import SharedMemoryUsageRepository, UsageRepository
+
+DAY = 100
+
+
+def _admitted(table: SharedQuotaTable, tokens: List[str], day: int) -> List[str]:
+    admitted = []
+    for token in tokens:
+        try:
+            if table.try_increment(token, day, 10):
+                admitted.append(token)
+        except QuotaTableFull:
+            pass
+    return admitted
+
+
+def test_a_busy_day_leaves_the_next_day_free(tmp_path: Path) -> None:
+    table = SharedQuotaTable(str(tmp_path / "busy.qt"), capacity=128, stripe_count=4)
+    busy = _admitted(table, [f"day-{DAY}-{n}" for n in range(1000)], DAY)
+    assert len(busy) == 128
+
+    tomorrow = [f"day-{DAY + 1}-{n}" for n in range(1000)]
+    fresh = SharedQuotaTable(str(tmp_path / "fresh.qt"), capacity=128, stripe_count=4)
+    assert _admitted(table, tomorrow, DAY + 1) == _admitted(fresh, tomorrow, DAY + 1)
+    assert len(_admitted(table, tomorrow, DAY + 1)) == 128
+
+
+def test_yesterday_stays_readable_until_its_slot_is_taken(tmp_path: Path) -> None:
+    table = SharedQuotaTable(str(tmp_path / "quota.qt"), capacity=8, stripe_count=1)
+    for _ in range(3):
+        table.try_increment("late-user", DAY, 10)
+    table.try_increment("early-user", DAY + 1, 10)
+    assert table.get("late-user", DAY) == 3
+
+    _admitted(table, [f"new-{n}" for n in range(20)], DAY + 1)
+    assert table.get("late-user", DAY) is None
+    assert table.get("early-user", DAY + 1) == 1
+    # Two days on, nothing from DAY is kept.
+    assert table.get("late-user", DAY + 2) is None
+
+
+def test_full_stripe_stays_full_for_the_day(tmp_path: Path) -> None:
+    table = SharedQuotaTable(str(tmp_path / "quota.qt"), capacity=4, stripe_count=1)
+    assert len(_admitted(table, [f"user-{n}" for n in range(4)], DAY)) == 4
+    with pytest.raises(QuotaTableFull):
+        table.try_increment("overflow", DAY, 10)
+    for n in range(4):
+        table.decrement(f"user-{n}", DAY)
+    with pytest.raises(QuotaTableFull):
+        table.try_increment("overflow", DAY, 10)
+
+
+def _repository(tmp_path: Path, limit: int, capacity: int = 65536) -> SharedMemoryUsageRepository:
+    repo = SharedMemoryUsageRepository(
+        str(tmp_path / "usage.db"), limit, str(tmp_path / "quota.qt"), table_capacity=capacity, flush_interval=30
+    )
+    repo.init_database()
+    return repo
+
+
+def test_overflowing_token_is_counted_in_sqlite_alone(tmp_path: Path) -> None:
+    # 64 stripes of one slot each.
+    repo = _repository(tmp_path, limit=3, capacity=64)
+    try:
+        users = [f"user-{n}" for n in range(200)]
+        for user in users:
+            assert repo.try_consume(user)
+        table = repo._table
+        overflowed = [user for user in users if table.get(user, date.today().toordinal()) is None]
+        assert overflowed
+
+        user = overflowed[0]
+        assert repo.try_consume(user) and repo.try_consume(user)
+        assert not repo.try_consume(user)
+        assert repo.get_usage(user) == 3
+        repo.release(user)
+        assert repo.remaining_quota(user) == 1
+        assert table.get(user, date.today().toordinal()) is None
+        repo.flush()
+    finally:
+        repo.shutdown()
+
+    assert UsageRepository(str(tmp_path / "usage.db"), 3).get_usage(user) == 2
+
+
+def _charge(tmp_path: str, limit: int, attempts: int, results: "multiprocessing.Queue[int]") -> None:
+    repo = _repository(Path(tmp_path), limit)
+    admitted = sum(repo.try_consume("shared-user") for _ in range(attempts))
+    repo.shutdown()
+    results.put(admitted)
+
+
+def test_processes_share_one_limit(tmp_path: Path) -> None:
+    limit, workers, attempts = 150, 4, 60
+    _repository(tmp_path, limit).shutdown()
+    results: "multiprocessing.Queue[int]" = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_charge, args=(str(tmp_path), limit, attempts, results)) for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    admitted = [results.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+
+    assert sum(admitted) == limit
+    reopened = _repository(tmp_path, limit)
+    try:
+        assert reopened.get_usage("shared-user") == limit
+        assert not reopened.try_consume("shared-user")
+    finally:
+        reopened.shutdown()
+    assert UsageRepository(str(tmp_path / "usage.db"), limit).get_usage("shared-user") == limit
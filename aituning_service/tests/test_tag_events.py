@@ -0,0 +1,102 @@
+"""TagParser and TagEventScanner find the same tags however the text and the stream are split."""
+
+from __future__ import annotations
+
+import json
+import random
+import re
+from typing import Any, List, Sequence, Tuple
+
+import pytest
+
+from ..benchmarks.fakes import dify_sse_events
+from ..benchmarks.tag_events import build_answer
+from ..streaming import TAG_EVENT_PREFIX, TagEventScanner
+from ..tags import TagParser
+
+# The micro-app's regexes (llmParser.ts).
+MANIPULATION_TAG = re.compile(r"<freq_manipulation>([\s\S]*?)</freq_manipulation>")
+SEGMENT_COVER_TAG = re.compile(r"<segment_cover>([\s\S]*?)</segment_cover>")
+
+
+def regex_tags(text: str) -> List[Tuple[str, Any]]:
+    found = [(m.start(), "freq_manipulation", json.loads(m.group(1))) for m in MANIPULATION_TAG.finditer(text)]
+    found += [(m.start(), "segment_cover", json.loads(m.group(1))) for m in SEGMENT_COVER_TAG.finditer(text)]
+    return [(name, body) for _, name, body in sorted(found, key=lambda item: item[0])]
+
+
+def split(data: bytes, cuts: Sequence[int]) -> List[bytes]:
+    edges = [0, *sorted(cuts), len(data)]
+    return [data[a:b] for a, b in zip(edges, edges[1:])]
+
+
+def relay(chunks: Sequence[bytes]) -> Tuple[bytes, List[Tuple[str, Any]]]:
+    """Scan ``chunks``; return the upstream bytes left once the added events are taken out, and those events."""
+    scanner = TagEventScanner()
+    out = b"".join(scanner.scan(chunk) for chunk in chunks)
+    upstream, added = [], []
+    for event in (event + b"\n\n" for event in out.split(b"\n\n") if event):
+        payload = json.loads(event[6:])
+        if str(payload.get("event", "")).startswith(TAG_EVENT_PREFIX):
+            added.append((payload["event"][len(TAG_EVENT_PREFIX):], payload["data"]))
+        else:
+            upstream.append(event)
+    assert scanner.tags == len(added)
+    return b"".join(upstream), added
+
+
+@pytest.fixture(scope="module")
+def short_answer() -> List[str]:
+    return build_answer(9, 1, random.Random(15))
+
+
+def test_parser_any_text_split(short_answer: List[str]) -> None:
+    text = "".join(short_answer)
+    expected = regex_tags(text)
+    assert len(expected) == 4
+    for cut in range(len(text) + 1):
+        parser = TagParser()
+        assert parser.feed(text[:cut]) + parser.feed(text[cut:]) == expected, cut
+
+
+def test_parser_character_by_character(short_answer: List[str]) -> None:
+    text = "".join(short_answer)
+    parser = TagParser()
+    assert [tag for char in text for tag in parser.feed(char)] == regex_tags(text)
+
+
+def test_scanner_any_byte_split(short_answer: List[str]) -> None:
+    text = "".join(short_answer)
+    # Longer deltas keep the stream, and so the number of cuts, small; tags still span events.
+    deltas = [text[start:start + 40] for start in range(0, len(text), 40)]
+    stream = b"".join(dify_sse_events(len(deltas), answers=deltas))
+    expected = regex_tags(text)
+    for cut in range(len(stream) + 1):
+        upstream, added = relay(split(stream, [cut]))
+        assert upstream == stream, cut
+        assert added == expected, cut
+
+
+def test_scanner_random_splits() -> None:
+    rng = random.Random(15)
+    deltas = build_answer(2000, 20, rng)
+    stream = b"".join(dify_sse_events(len(deltas), answers=deltas))
+    expected = regex_tags("".join(deltas))
+    for _ in range(10):
+        cuts = rng.sample(range(1, len(stream)), rng.randint(1, 2000))
+        upstream, added = relay(split(stream, cuts))
+        assert upstream == stream
+        assert added == expected
+
+
+def test_event_names_do_not_collide_with_micro_app_events(short_answer: List[str]) -> None:
+    stream = b"".join(dify_sse_events(len(short_answer), answers=short_answer))
+    out = TagEventScanner().scan(stream)
+    assert b'"event": "tag_segment_cover"' in out and b'"event": "tag_freq_manipulation"' in out
+    assert b'"event": "segment_cover"' not in out
+
+
+def test_invalid_tag_body_is_skipped() -> None:
+    parser = TagParser()
+    assert parser.feed("<segment_cover>{not json</segment_cover>") == []
+    assert parser.feed('<segment_cover>{"a": 1}</segment_cover>') == [("segment_cover", {"a": 1})]
@@ -0,0 +1,80 @@
+"""
+Crash/restart of the write-behind quota backend.
+
+A child process charges quota through ``WriteBehindUsageRepository`` and
+dies with ``os._exit``, skipping the shutdown flush as a SIGKILL or OOM
+kill would. The charges since the last flush are lost, at most
+``flush_threshold`` of them, and the reopened database enforces the daily
+limit again from the persisted count.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from ..storage import UsageRepository, WriteBehindUsageRepository
+
+TOKEN = "crash-test-user"
+# Only the threshold triggers a flush before the crash.
+FLUSH_INTERVAL = 30.0
+
+
+def _charge_then_crash(database_path: str, limit: int, charges: int, threshold: int) -> None:
+    repo = WriteBehindUsageRepository(database_path, limit, flush_interval=FLUSH_INTERVAL, flush_threshold=threshold)
+    repo.init_database()
+    for charged in range(1, charges + 1):
+        repo.try_consume(TOKEN)
+        if charged % threshold == 0:
+            # Let the flusher react to the threshold as it would under real traffic.
+            time.sleep(0.05)
+    os._exit(0)
+
+
+def _crash(database_path: str, limit: int, charges: int, threshold: int) -> int:
+    """Run the crashing child; return the count it left in the database."""
+    UsageRepository(database_path, limit).init_database()
+    child = multiprocessing.Process(target=_charge_then_crash, args=(database_path, limit, charges, threshold))
+    child.start()
+    child.join(timeout=30)
+    assert child.exitcode == 0
+    return UsageRepository(database_path, limit).get_usage(TOKEN)
+
+
+@pytest.mark.parametrize(
+    "limit, charges, threshold",
+    [
+        (1000, 730, 100),
+        (1000, 999, 100),
+        (50, 50, 10),
+        (50, 47, 10),
+    ],
+)
+def test_crash_loses_at_most_the_flush_threshold(tmp_path: Path, limit: int, charges: int, threshold: int) -> None:
+    database_path = str(tmp_path / "usage.db")
+    persisted = _crash(database_path, limit, charges, threshold)
+
+    lost = charges - persisted
+    assert 0 <= lost <= threshold
+
+    restarted = WriteBehindUsageRepository(database_path, limit, flush_interval=FLUSH_INTERVAL, flush_threshold=threshold)
+    restarted.init_database()
+    try:
+        assert restarted.get_usage(TOKEN) == persisted
+        admitted = 0
+        while admitted <= limit and restarted.try_consume(TOKEN):
+            admitted += 1
+        # The limit holds from the persisted count: overall it is exceeded by the lost charges only.
+        assert admitted == limit - persisted
+        assert not restarted.try_consume(TOKEN)
+        assert restarted.remaining_quota(TOKEN) == 0
+    finally:
+        restarted.shutdown()
+
+    reopened = UsageRepository(database_path, limit)
+    assert reopened.get_usage(TOKEN) == limit
+    assert not reopened.try_consume(TOKEN)